@@ -0,0 +1,96 @@
+"""
+bench_cold_start.py
+───────────────────
+Mide el costo de arranque de cada subcomando de etl_cli.py, que en las
+ejecuciones programadas cortas es una parte grande del total:
+
+  cli     : `python etl_cli.py <subcomando> --help` (intérprete + CLI +
+            lo que importe el subcomando para armar su ayuda)
+  import  : `python -c "import <módulo>"` (lo que paga el job antes de
+            empezar a trabajar)
+  heaviest: los paquetes con mayor tiempo de import acumulado
+            (python -X importtime) para ese job
+
+Cada medición corre en un proceso nuevo (`-X importtime` aparte, porque
+agrega overhead) y se informa la mediana de --repeat corridas. `python
+-c pass` da la base del intérprete. El caché de bytecode ya está
+caliente tras la primera corrida, igual que en una imagen con los .pyc
+precompilados (ver Dockerfile).
+
+Uso:
+    python src/benchmarks/bench_cold_start.py [--repeat 5] [--only refresh,merge]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+JOBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jobs")
+sys.path.insert(0, JOBS_DIR)
+
+from etl_cli import COMMANDS  # noqa: E402  (solo stdlib)
+
+
+def _wall(argv) -> float:
+    start = time.perf_counter()
+    subprocess.run(argv, cwd=JOBS_DIR, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def median_seconds(argv, repeat: int) -> float:
+    _wall(argv)  # bytecode y caché de archivos del SO calientes
+    return round(statistics.median(_wall(argv) for _ in range(repeat)), 3)
+
+
+def heaviest_imports(module: str, top: int = 5) -> dict:
+    """{paquete: ms acumulados (máximo entre sus módulos)}, de mayor a menor."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=JOBS_DIR, check=True, capture_output=True, text=True)
+    totals = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not cumulative.isdigit():
+            continue
+        package = name.split(".")[0]
+        if package in (module, "site", "encodings") or package.startswith("_"):
+            continue
+        totals[package] = max(totals.get(package, 0), int(cumulative))
+    ranked = sorted(totals.items(), key=lambda kv: -kv[1])[:top]
+    return {package: round(us / 1000, 1) for package, us in ranked}
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Benchmark de arranque por subcomando de etl_cli.py")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--only", default=None, help="Subcomandos separados por coma")
+    args = p.parse_args()
+    only = [c.strip() for c in args.only.split(",")] if args.only else list(COMMANDS)
+
+    python = sys.executable
+    baseline = median_seconds([python, "-c", "pass"], args.repeat)
+    results = []
+    for command in only:
+        module, _ = COMMANDS[command]
+        results.append({
+            "command":   command,
+            "module":    module,
+            "cli_s":     median_seconds([python, "etl_cli.py", command, "--help"], args.repeat),
+            "import_s":  median_seconds([python, "-c", f"import {module}"], args.repeat),
+            "heaviest_ms": heaviest_imports(module),
+        })
+
+    print(json.dumps({"python_s": baseline, "commands": results}, indent=2))
+    for r in results:
+        print(f"{r['command']:<13} cli {r['cli_s']:.3f}s | import {r['import_s']:.3f}s "
+              f"({r['import_s'] - baseline:+.3f}s sobre el intérprete)")
+
+
+if __name__ == "__main__":
+    main()
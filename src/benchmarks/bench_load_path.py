@@ -0,0 +1,92 @@
+"""
+bench_load_path.py
+──────────────────
+Compara el costo de preparar la carga de staging en run_merge.py:
+
+  legacy : Arrow → pandas (Decimal de Python) → Arrow → Parquet
+           (lo que hacía load_table_from_dataframe con autodetect)
+  arrow  : Arrow → cast al schema de staging → Parquet en memoria
+           (run_merge.load_arrow_chunk)
+
+No llama a BigQuery: mide solo la conversión local, que es la parte
+que cambia entre ambos caminos. Cada camino corre en un proceso
+aparte para que el pico de RSS sea comparable.
+
+Uso:
+    python src/benchmarks/bench_load_path.py [--rows 1000000]
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import sys
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jobs"))
+
+from synthetic import synthetic_transactions  # noqa: E402
+
+
+def legacy_path(table: pa.Table) -> int:
+    df = table.to_pandas()
+    sink = pa.BufferOutputStream()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), sink,
+                   compression="snappy")
+    return sink.getvalue().size
+
+
+def arrow_path(table: pa.Table) -> int:
+    from run_merge import staging_arrow_schema
+    sink = pa.BufferOutputStream()
+    pq.write_table(table.cast(staging_arrow_schema(table.schema)), sink,
+                   compression="snappy")
+    return sink.getvalue().size
+
+
+PATHS = {"legacy": legacy_path, "arrow": arrow_path}
+
+
+def _run(name: str, rows: int, queue) -> None:
+    table = synthetic_transactions(rows)
+    baseline_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    payload_bytes = PATHS[name](table)
+    elapsed = time.perf_counter() - start
+    queue.put({
+        "path":          name,
+        "rows":          rows,
+        "seconds":       round(elapsed, 3),
+        "rows_per_s":    round(rows / elapsed),
+        "parquet_mb":    round(payload_bytes / 1024 / 1024, 1),
+        "peak_rss_mb":   round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "input_rss_mb":  round(baseline_mb, 1),
+    })
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Benchmark carga staging: pandas vs Arrow/Parquet")
+    p.add_argument("--rows", type=int, default=1_000_000)
+    args = p.parse_args()
+
+    ctx = mp.get_context("spawn")
+    results = []
+    for name in PATHS:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run, args=(name, args.rows, queue))
+        proc.start()
+        results.append(queue.get())
+        proc.join()
+
+    print(json.dumps(results, indent=2))
+    legacy, arrow = results
+    print(f"speedup: {legacy['seconds'] / arrow['seconds']:.1f}x | "
+          f"RSS pico: {legacy['peak_rss_mb']} MB → {arrow['peak_rss_mb']} MB")
+
+
+if __name__ == "__main__":
+    main()
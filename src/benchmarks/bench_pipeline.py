@@ -0,0 +1,333 @@
+"""
+bench_pipeline.py
+─────────────────
+Benchmark del pipeline completo a escala sintética, sin nube:
+
+  create_delta          versión 0 de una tabla Delta local (--rows filas)
+  snapshot_full         create_delta_data.write_parquet_snapshot_to_gcs (completo)
+  append_delta          versión 1: --incremental-rows filas, --update-ratio de ellas
+                        reutilizan transaction_id existentes
+  snapshot_incremental  mismo snapshot, solo particiones cambiadas
+  refresh               refresh_biglake: última versión, replay del _delta_log,
+                        manifiesto y DDL de la tabla externa
+  merge_full            run_merge: ETL Bridge Delta → staging + MERGE
+  merge_incremental     run_merge con since_version=0 (solo archivos nuevos)
+
+GCS y BigQuery se sustituyen por local_clients.py (directorio local y un
+cliente que decodifica las cargas Parquet); el MERGE no se ejecuta, solo se
+registra. Cada etapa corre en un proceso aparte para que el pico de RSS
+sea de esa etapa.
+
+Por etapa se reporta tiempo, filas/s, MB/s y RSS pico; el resultado se
+guarda en JSON (con el commit de git) y --compare lo contrasta con un
+resultado anterior.
+
+Uso:
+    python src/benchmarks/bench_pipeline.py --rows 10000000 \
+        [--incremental-rows 1000000 --update-ratio 0.3 --key-skew 0.5] \
+        [--partition-by-date] [--memory-limit-mb 256] [--write-streams 4] \
+        [--output bench.json] [--compare bench_base.json]
+
+Con --rows del orden de 100M usar --memory-limit-mb: sin él merge_full
+lee la tabla completa en memoria, igual que run_merge.py sin --stream.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+JOBS_DIR = os.path.join(BENCH_DIR, "..", "jobs")
+sys.path.insert(0, JOBS_DIR)
+
+BUCKET = "bench-bucket"
+DELTA_PATH = "delta/transactions"
+PARQUET_PATH = "parquet/transactions"
+PROJECT = "bench-project"
+DATASET = "bench_dataset"
+
+
+def _delta_uri(cfg: dict) -> str:
+    return os.path.join(cfg["workdir"], BUCKET, DELTA_PATH)
+
+
+def _dir_bytes(path: str, marker: str = "") -> int:
+    total = 0
+    for directory, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(directory, f))
+                     for f in files if marker in f)
+    return total
+
+
+def _added_bytes(dt) -> int:
+    actions = dt.get_add_actions(flatten=True).to_pydict()
+    return sum(actions["size_bytes"])
+
+
+# ── Etapas ─────────────────────────────────────────────────────────────────────
+def _write_delta(cfg: dict, rows: int, mode: str, **generator) -> dict:
+    import pyarrow as pa
+    from deltalake import DeltaTable, write_deltalake
+    from synthetic import iter_synthetic_batches, synthetic_schema
+
+    uri = _delta_uri(cfg)
+    before = _added_bytes(DeltaTable(uri)) if mode == "append" else 0
+    reader = pa.RecordBatchReader.from_batches(
+        synthetic_schema(),
+        iter_synthetic_batches(rows, cfg["chunk_rows"], key_skew=cfg["key_skew"], **generator),
+    )
+    write_deltalake(uri, reader, mode=mode,
+                    partition_by=["transaction_date"] if cfg["partition_by_date"] else None)
+    dt = DeltaTable(uri)
+    return {"rows": rows, "bytes": _added_bytes(dt) - before,
+            "delta_version": dt.version(), "files": len(dt.files())}
+
+
+def stage_create_delta(cfg: dict) -> dict:
+    return _write_delta(cfg, cfg["rows"], "overwrite", seed=cfg["seed"])
+
+
+def stage_append_delta(cfg: dict) -> dict:
+    return _write_delta(cfg, cfg["incremental_rows"], "append", seed=cfg["seed"] + 1_000_003,
+                        id_start=cfg["rows"], existing_keys=cfg["rows"],
+                        update_ratio=cfg["update_ratio"])
+
+
+def _snapshot(cfg: dict) -> dict:
+    from deltalake import DeltaTable
+    from pyarrow import fs as pafs
+    from create_delta_data import write_parquet_snapshot_to_gcs
+
+    dt = DeltaTable(_delta_uri(cfg))
+    base_dir = os.path.join(cfg["workdir"], BUCKET, PARQUET_PATH)
+    write_parquet_snapshot_to_gcs(dt, {}, filesystem=pafs.LocalFileSystem(), base_dir=base_dir)
+    actions = dt.get_add_actions(flatten=True).to_pydict()
+    return {"rows": sum(actions["num_records"]),
+            "bytes": _dir_bytes(base_dir, marker=f"part-{dt.version():020d}-"),
+            "delta_version": dt.version()}
+
+
+def stage_snapshot_full(cfg: dict) -> dict:
+    return _snapshot(cfg)
+
+
+def stage_snapshot_incremental(cfg: dict) -> dict:
+    return _snapshot(cfg)
+
+
+def stage_refresh(cfg: dict) -> dict:
+    import refresh_biglake as rb
+    from local_clients import LocalBigQueryClient, LocalStorageClient
+
+    gcs = LocalStorageClient(cfg["workdir"])
+    bq = LocalBigQueryClient(PROJECT)
+    version = rb.get_latest_delta_version(gcs, BUCKET, DELTA_PATH)
+    files = rb.active_delta_files(gcs, BUCKET, DELTA_PATH, version)
+    uris = rb.delta_file_uris(BUCKET, DELTA_PATH, files)
+    manifest = rb.publish_manifest(gcs, BUCKET, DELTA_PATH, version, uris)
+    rb.upsert_biglake_table(bq, PROJECT, DATASET, "transactions_federated", BUCKET,
+                            PARQUET_PATH, version, uris=[manifest], manifest=True)
+    return {"rows": len(files), "bytes": gcs.bytes_downloaded, "delta_version": version,
+            "list_calls": gcs.list_calls, "objects_listed": gcs.objects_listed}
+
+
+def _merge(cfg: dict, since_version) -> dict:
+    import run_merge as rm
+    from deltalake import DeltaTable
+    from local_clients import LocalBigQueryClient, LocalWriteApi
+
+    bq = LocalBigQueryClient(PROJECT)
+    write_api = writer = None
+    if cfg["write_streams"]:
+        write_api = LocalWriteApi(bq)
+        writer = rm.StreamWriter(write_api, cfg["write_streams"])
+    version, loaded = rm.etl_bridge_adls_to_bq(
+        bq, PROJECT, DATASET, "bench", "bench", DELTA_PATH, "bench",
+        since_version=since_version, memory_limit_mb=cfg["memory_limit_mb"],
+        delta_table=DeltaTable(_delta_uri(cfg)), writer=writer,
+    )
+    rm.setup_tables(bq, PROJECT, DATASET, "bench")
+    if loaded or since_version is None:
+        rm.run_merge(bq, PROJECT, DATASET)
+    result = {"rows": loaded, "bytes": bq.bytes_loaded, "delta_version": version,
+              "load_jobs": bq.load_jobs, "statements": len(bq.queries)}
+    if write_api is not None:
+        result.update(bytes=write_api.bytes_appended, appends=write_api.appends)
+    return result
+
+
+def stage_merge_full(cfg: dict) -> dict:
+    return _merge(cfg, None)
+
+
+def stage_merge_incremental(cfg: dict) -> dict:
+    return _merge(cfg, 0)
+
+
+STAGES = {
+    "create_delta":         stage_create_delta,
+    "snapshot_full":        stage_snapshot_full,
+    "append_delta":         stage_append_delta,
+    "snapshot_incremental": stage_snapshot_incremental,
+    "refresh":              stage_refresh,
+    "merge_full":           stage_merge_full,
+    "merge_incremental":    stage_merge_incremental,
+}
+
+
+# ── Ejecución ──────────────────────────────────────────────────────────────────
+def _run(name: str, cfg: dict, queue) -> None:
+    sys.path.insert(0, BENCH_DIR)
+    logging.basicConfig(level=logging.INFO if cfg["verbose"] else logging.WARNING,
+                        format="%(asctime)s [%(levelname)s] %(message)s")
+    # Los jobs configuran logging a INFO al importarse
+    import create_delta_data, refresh_biglake, run_merge  # noqa: E401,F401
+    logging.getLogger().setLevel(logging.INFO if cfg["verbose"] else logging.WARNING)
+
+    baseline_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    metrics = STAGES[name](cfg)
+    elapsed = time.perf_counter() - start
+    queue.put({
+        "stage":        name,
+        "seconds":      round(elapsed, 3),
+        "rows_per_s":   round(metrics["rows"] / elapsed) if elapsed else None,
+        "mb_per_s":     round(metrics["bytes"] / 1024 / 1024 / elapsed, 1) if elapsed else None,
+        "mb":           round(metrics["bytes"] / 1024 / 1024, 1),
+        "peak_rss_mb":  round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "import_rss_mb": round(baseline_mb, 1),
+        **metrics,
+    })
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Imprime la variación de tiempo por etapa; False si alguna empeora > tolerance."""
+    previous = {s["stage"]: s for s in baseline["stages"]}
+    ok = True
+    print(f"\nvs {baseline.get('commit')} ({baseline.get('created_at')}):")
+    if baseline.get("params") != results["params"]:
+        print("  ⚠ parámetros distintos — la comparación no es directa")
+    for stage in results["stages"]:
+        before = previous.get(stage["stage"])
+        if not before or not before["seconds"]:
+            continue
+        ratio = stage["seconds"] / before["seconds"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  ← regresión"
+            ok = False
+        print(f"  {stage['stage']:<22} {before['seconds']:>9.2f}s → {stage['seconds']:>9.2f}s "
+              f"({ratio:.2f}x) | RSS {before['peak_rss_mb']} → {stage['peak_rss_mb']} MB{flag}")
+    return ok
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Benchmark del pipeline Delta → staging → MERGE")
+    p.add_argument("--rows", type=int, default=1_000_000,
+                   help="Filas de la versión 0 (hasta ~100M)")
+    p.add_argument("--incremental-rows", type=int, default=None,
+                   help="Filas de la versión 1 (default: 10%% de --rows)")
+    p.add_argument("--update-ratio", type=float, default=0.3,
+                   help="Fracción de la versión 1 que actualiza claves existentes")
+    p.add_argument("--key-skew", type=float, default=0.0,
+                   help="0 = uniforme; > 0 = Zipf (claves calientes)")
+    p.add_argument("--chunk-rows", type=int, default=1_000_000,
+                   help="Filas por bloque del generador")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--partition-by-date", action="store_true",
+                   help="Tabla Delta particionada por transaction_date")
+    p.add_argument("--memory-limit-mb", type=int, default=None,
+                   help="merge_* en modo streaming con este límite")
+    p.add_argument("--write-streams", type=int, default=0,
+                   help="merge_* carga staging con la Storage Write API (sustituto local) "
+                        "en N streams en lugar de load jobs")
+    p.add_argument("--stages", default=",".join(STAGES),
+                   help="Etapas a correr, en orden (default: todas)")
+    p.add_argument("--workdir", default=None,
+                   help="Directorio de trabajo (default: temporal, se borra al final)")
+    p.add_argument("--output", default=None,
+                   help="JSON de resultados (default: bench_pipeline_<commit>.json)")
+    p.add_argument("--compare", default=None, help="JSON de una corrida anterior")
+    p.add_argument("--tolerance", type=float, default=0.10,
+                   help="Empeoramiento tolerado por --compare (default: 0.10)")
+    p.add_argument("--verbose", action="store_true", help="Logs INFO de los jobs")
+    args = p.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        p.error(f"Etapas desconocidas: {', '.join(sorted(unknown))}")
+    if not 0 <= args.update_ratio <= 1:
+        p.error("--update-ratio debe estar entre 0 y 1")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    cfg = {
+        "workdir":           workdir,
+        "rows":              args.rows,
+        "incremental_rows":  (args.incremental_rows if args.incremental_rows is not None
+                              else max(args.rows // 10, 1)),
+        "update_ratio":      args.update_ratio,
+        "key_skew":          args.key_skew,
+        "chunk_rows":        args.chunk_rows,
+        "seed":              args.seed,
+        "partition_by_date": args.partition_by_date,
+        "memory_limit_mb":   args.memory_limit_mb,
+        "write_streams":     args.write_streams,
+        "verbose":           args.verbose,
+    }
+
+    ctx = mp.get_context("spawn")
+    results = []
+    try:
+        for name in stages:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_run, args=(name, cfg, queue))
+            proc.start()
+            proc.join()
+            if proc.exitcode != 0:
+                sys.exit(f"La etapa {name} falló (exit {proc.exitcode})")
+            result = queue.get()
+            results.append(result)
+            print(f"{name:<22} {result['seconds']:>9.2f}s | {result['rows_per_s']:>12,} filas/s | "
+                  f"{result['mb_per_s']:>8} MB/s | RSS pico {result['peak_rss_mb']} MB")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        "commit":     commit,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "params":     {k: v for k, v in cfg.items() if k not in ("workdir", "verbose")},
+        "stages":     results,
+    }
+    output = args.output or f"bench_pipeline_{commit}.json"
+    with open(output, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"Resultados: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            if not compare(report, json.load(fh), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+local_clients.py
+────────────────
+Sustitutos locales de google.cloud.bigquery.Client y
+google.cloud.storage.Client para benchmarks, con la superficie mínima que
+usan run_merge.py y refresh_biglake.py.
+
+  LocalStorageClient   "buckets" = subdirectorios de `root`; cuenta
+                       listados, objetos y bytes descargados/subidos.
+  LocalBigQueryClient  las cargas (load_table_from_file) se decodifican
+                       como Parquet para contar filas; las queries solo se
+                       registran (el MERGE corre en BigQuery, no aquí),
+                       salvo CREATE TABLE IF NOT EXISTS, que crea la tabla
+                       vacía (con su PARTITION BY). Los dry runs se
+                       registran aparte (dry_runs) y estiman 0 bytes.
+  LocalWriteApi        el protocolo de la Storage Write API que usa
+                       bq_write_stream.py (streams, append con offset,
+                       finalize, batch commit) con filas Arrow en memoria.
+
+No pretenden emular la semántica de los servicios: sirven para medir el
+trabajo del lado del job sin red ni credenciales. La excepción es
+LocalWriteApi, que sí aplica las reglas de offsets y de visibilidad de
+la Write API (es lo que se quiere probar) y puede simular respuestas
+perdidas.
+"""
+
+import itertools
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.api_core import exceptions as api_exceptions
+from google.cloud.exceptions import NotFound
+
+
+# ── GCS ────────────────────────────────────────────────────────────────────────
+class LocalBlob:
+    def __init__(self, bucket: "LocalBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def _path(self) -> str:
+        return os.path.join(self.bucket.root, self.name)
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self._path)
+
+    @property
+    def generation(self) -> int:
+        return os.stat(self._path).st_mtime_ns
+
+    def exists(self) -> bool:
+        return os.path.isfile(self._path)
+
+    def download_as_bytes(self, **kwargs) -> bytes:
+        if not self.exists():
+            raise NotFound(self.name)
+        with open(self._path, "rb") as fh:
+            data = fh.read()
+        self.bucket.client.bytes_downloaded += len(data)
+        return data
+
+    def download_as_text(self, **kwargs) -> str:
+        return self.download_as_bytes().decode("utf-8")
+
+    def upload_from_string(self, data, content_type=None) -> None:
+        payload = data.encode("utf-8") if isinstance(data, str) else data
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with open(self._path, "wb") as fh:
+            fh.write(payload)
+        self.bucket.client.bytes_uploaded += len(payload)
+
+
+class LocalBucket:
+    def __init__(self, client: "LocalStorageClient", name: str):
+        self.client = client
+        self.name = name
+        self.root = os.path.join(client.root, name)
+
+    def blob(self, name: str) -> LocalBlob:
+        return LocalBlob(self, name)
+
+    def list_blobs(self, prefix: str = "", start_offset: str = None,
+                   end_offset: str = None, **kwargs) -> List[LocalBlob]:
+        self.client.list_calls += 1
+        # Recorre solo el directorio del prefijo, como haría GCS con el índice
+        base = os.path.join(self.root, os.path.dirname(prefix))
+        names = []
+        for directory, _, files in os.walk(base):
+            for file_name in files:
+                name = os.path.relpath(os.path.join(directory, file_name), self.root)
+                name = name.replace(os.sep, "/")
+                if (name.startswith(prefix)
+                        and (start_offset is None or name >= start_offset)
+                        and (end_offset is None or name < end_offset)):
+                    names.append(name)
+        names.sort()
+        self.client.objects_listed += len(names)
+        return [LocalBlob(self, n) for n in names]
+
+
+class LocalStorageClient:
+    def __init__(self, root: str, project: str = None):
+        self.root = root
+        self.list_calls = 0
+        self.objects_listed = 0
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+
+    def bucket(self, name: str) -> LocalBucket:
+        return LocalBucket(self, name)
+
+    def list_blobs(self, bucket, prefix: str = "", **kwargs) -> List[LocalBlob]:
+        if isinstance(bucket, str):
+            bucket = self.bucket(bucket)
+        return bucket.list_blobs(prefix=prefix, **kwargs)
+
+
+# ── BigQuery ───────────────────────────────────────────────────────────────────
+_CREATE_TABLE_RE = re.compile(r"^\s*CREATE TABLE IF NOT EXISTS `([^`]+)`")
+_PARTITION_BY_RE = re.compile(r"^PARTITION BY (\w+)$", re.MULTILINE)
+
+
+class LocalJob:
+    def __init__(self, output_rows: int = 0, num_dml_affected_rows: int = None):
+        self.output_rows = output_rows
+        self.num_dml_affected_rows = num_dml_affected_rows
+        self.total_bytes_processed = 0
+
+    def result(self) -> "LocalJob":
+        return self
+
+    def __iter__(self):
+        # Las queries no devuelven filas
+        return iter(())
+
+
+class LocalTable:
+    def __init__(self, table_ref: str, table_type: str = "TABLE"):
+        self.table_ref = table_ref
+        self.table_type = table_type
+        self.num_rows = 0
+        self.labels: Dict[str, str] = {}
+        self.time_partitioning = None
+        self.schema: list = []
+        self.modified = datetime.now(timezone.utc)
+
+
+class LocalBigQueryClient:
+    def __init__(self, project: str = None):
+        self.project = project
+        self.tables: Dict[str, LocalTable] = {}
+        self.queries: List[str] = []
+        self.dry_runs: List[str] = []
+        self.load_jobs = 0
+        self.bytes_loaded = 0
+
+    def load_table_from_file(self, file_obj, destination, size=None,
+                             job_config=None, **kwargs) -> LocalJob:
+        payload = file_obj.read()
+        rows = pq.read_metadata(pa.BufferReader(payload)).num_rows
+        table = self.tables.setdefault(str(destination), LocalTable(str(destination)))
+        if getattr(job_config, "write_disposition", None) == "WRITE_TRUNCATE":
+            table.num_rows = 0
+            table.schema = list(getattr(job_config, "schema", None) or table.schema)
+        table.num_rows += rows
+        table.modified = datetime.now(timezone.utc)
+        self.load_jobs += 1
+        self.bytes_loaded += len(payload)
+        return LocalJob(output_rows=rows)
+
+    def query(self, sql: str, location: str = None, job_config=None, **kwargs) -> LocalJob:
+        if getattr(job_config, "dry_run", False):
+            self.dry_runs.append(sql)
+            return LocalJob()
+        self.queries.append(sql)
+        if sql.startswith("TRUNCATE TABLE"):
+            table = self.tables.get(sql.split("`")[1])
+            if table is not None:
+                table.num_rows = 0
+                table.modified = datetime.now(timezone.utc)
+        created = _CREATE_TABLE_RE.match(sql)
+        if created and created.group(1) not in self.tables:
+            table = self.tables[created.group(1)] = LocalTable(created.group(1))
+            partition = _PARTITION_BY_RE.search(sql)
+            if partition:
+                table.time_partitioning = SimpleNamespace(field=partition.group(1))
+        return LocalJob()
+
+    def create_table(self, table, exists_ok: bool = False) -> LocalTable:
+        table_ref = str(getattr(table, "reference", table))
+        if table_ref in self.tables and not exists_ok:
+            raise api_exceptions.Conflict(table_ref)
+        if table_ref not in self.tables:
+            self.tables[table_ref] = LocalTable(table_ref)
+            self.tables[table_ref].schema = list(getattr(table, "schema", None) or [])
+        return self.tables[table_ref]
+
+    def get_table(self, table_ref) -> LocalTable:
+        try:
+            return self.tables[str(table_ref)]
+        except KeyError:
+            raise NotFound(str(table_ref))
+
+    def update_table(self, table: LocalTable, fields) -> LocalTable:
+        return table
+
+    def delete_table(self, table_ref, not_found_ok: bool = False) -> None:
+        if self.tables.pop(str(table_ref), None) is None and not not_found_ok:
+            raise NotFound(str(table_ref))
+
+
+# ── BigQuery Storage Write API ─────────────────────────────────────────────────
+class LocalWriteStream:
+    def __init__(self, name: str, parent: str, stream_type: str):
+        self.name = name
+        self.parent = parent
+        self.type = stream_type
+        self.batches: List[pa.RecordBatch] = []
+        self.rows = 0
+        self.finalized = False
+
+
+class LocalWriteApi:
+    """
+    Reglas de la Write API: un append con offset distinto de las filas
+    ya escritas en el stream falla con ALREADY_EXISTS (menor) u
+    OUT_OF_RANGE (mayor); las filas de un stream committed son visibles
+    al confirmarse el append, las de uno pending solo tras finalizarlo y
+    confirmarlo con batch_commit_write_streams.
+
+    `lose_every` = n > 0 descarta la respuesta de cada n-ésimo append (que
+    sí se aplica) con ServiceUnavailable, como una conexión que se corta
+    antes del ack. Con `bq`, las filas visibles se suman al num_rows de la
+    tabla en ese LocalBigQueryClient.
+    """
+
+    def __init__(self, bq: LocalBigQueryClient = None, lose_every: int = 0):
+        self.bq = bq
+        self.lose_every = lose_every
+        self.streams: Dict[str, LocalWriteStream] = {}
+        self.visible: Dict[str, List[pa.RecordBatch]] = {}
+        self.appends = 0
+        self.bytes_appended = 0
+        self.lost_acks = 0
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _publish(self, parent: str, batches: List[pa.RecordBatch]) -> None:
+        self.visible.setdefault(parent, []).extend(batches)
+        if self.bq is not None:
+            _, project, _, dataset, _, table = parent.split("/")
+            ref = f"{project}.{dataset}.{table}"
+            self.bq.tables.setdefault(ref, LocalTable(ref)).num_rows += sum(
+                b.num_rows for b in batches)
+
+    def create_write_stream(self, parent: str, stream_type: str) -> str:
+        with self._lock:
+            name = f"{parent}/streams/local{next(self._ids)}"
+            self.streams[name] = LocalWriteStream(name, parent, stream_type)
+        return name
+
+    def append_rows(self, stream: str, serialized_schema: bytes,
+                    serialized_batch: bytes, offset: int) -> None:
+        with self._lock:
+            state = self.streams[stream]
+            if state.finalized:
+                raise api_exceptions.FailedPrecondition(f"{stream} ya finalizado")
+            if offset < state.rows:
+                raise api_exceptions.AlreadyExists(f"offset {offset} < {state.rows} en {stream}")
+            if offset > state.rows:
+                raise api_exceptions.OutOfRange(f"offset {offset} > {state.rows} en {stream}")
+            schema = pa.ipc.read_schema(pa.py_buffer(serialized_schema))
+            batch = pa.ipc.read_record_batch(pa.py_buffer(serialized_batch), schema)
+            state.batches.append(batch)
+            state.rows += batch.num_rows
+            if state.type == "committed":
+                self._publish(state.parent, [batch])
+            self.appends += 1
+            self.bytes_appended += len(serialized_batch)
+            if self.lose_every and self.appends % self.lose_every == 0:
+                self.lost_acks += 1
+                raise api_exceptions.ServiceUnavailable(f"ack perdido ({stream})")
+
+    def finalize_write_stream(self, stream: str) -> int:
+        with self._lock:
+            state = self.streams[stream]
+            state.finalized = True
+            return state.rows
+
+    def batch_commit_write_streams(self, parent: str, streams: List[str]) -> None:
+        with self._lock:
+            states = [self.streams[name] for name in streams]
+            for state in states:
+                if state.type != "pending" or not state.finalized or state.parent != parent:
+                    raise api_exceptions.FailedPrecondition(
+                        f"{state.name} no es un stream pending finalizado de {parent}")
+            for state in states:
+                self._publish(parent, state.batches)
+                state.type = "committed"
+
+    def close(self) -> None:
+        pass
+
+    def rows(self, parent: str) -> List[pa.RecordBatch]:
+        """Batches visibles en `parent` (projects/p/datasets/d/tables/t)."""
+        return list(self.visible.get(parent, []))
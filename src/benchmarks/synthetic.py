@@ -0,0 +1,97 @@
+"""
+synthetic.py
+────────────
+Generador vectorizado de transacciones sintéticas con el schema Delta de
+create_delta_data.py (transaction_id, customer_id, amount, transaction_date,
+status), para benchmarks a escala (hasta ~100M filas, por bloques).
+
+Perillas:
+  key_skew      0 = claves uniformes; > 0 = Zipf con exponente 1 + key_skew
+                (pocas claves "calientes" concentran clientes y updates)
+  update_ratio  fracción de filas de un lote que reutiliza transaction_id
+                ya existentes (simula updates para el MERGE)
+
+Con key_skew > 0 un mismo transaction_id puede repetirse dentro de un lote
+de updates, igual que en una fuente real con reprocesos.
+"""
+
+from typing import Iterator
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+DEFAULT_CUSTOMERS = 10_000
+DEFAULT_DAYS = 365
+STATUSES = ["completed", "pending", "refunded"]
+
+
+def _prefixed(prefix: str, values: np.ndarray) -> pa.Array:
+    return pc.binary_join_element_wise(prefix, pa.array(values).cast(pa.string()), "")
+
+
+def _draw_keys(rng: np.random.Generator, key_space: int, size: int,
+               key_skew: float) -> np.ndarray:
+    """`size` claves en [0, key_space), uniformes o Zipf según `key_skew`."""
+    if key_skew <= 0:
+        return rng.integers(0, key_space, size, dtype=np.int64)
+    return (rng.zipf(1.0 + key_skew, size).astype(np.int64) - 1) % key_space
+
+
+def synthetic_transactions(rows: int, seed: int = 42, id_start: int = 0,
+                           existing_keys: int = 0, update_ratio: float = 0.0,
+                           key_skew: float = 0.0,
+                           customers: int = DEFAULT_CUSTOMERS) -> pa.Table:
+    """
+    Tabla de `rows` transacciones generada sin bucles de Python.
+
+    Las filas nuevas toman ids consecutivos desde `id_start`; una fracción
+    `update_ratio` toma ids de [0, existing_keys).
+    """
+    rng = np.random.default_rng(seed)
+
+    updates = int(rows * update_ratio) if existing_keys else 0
+    ids = np.empty(rows, dtype=np.int64)
+    ids[:updates] = _draw_keys(rng, existing_keys, updates, key_skew)
+    ids[updates:] = np.arange(id_start, id_start + rows - updates, dtype=np.int64)
+
+    cents = rng.integers(0, 10_000_000, rows, dtype=np.int64)
+    # decimal128 little-endian: 64 bits bajos + 64 bits altos (0 para positivos)
+    words = np.column_stack([cents, np.zeros(rows, dtype=np.int64)])
+    amount = pa.Array.from_buffers(pa.decimal128(18, 2), rows,
+                                   [None, pa.py_buffer(words.tobytes())])
+    start = np.datetime64("2024-01-01", "D").astype(np.int32)
+    days = pa.array(start + rng.integers(0, DEFAULT_DAYS, rows, dtype=np.int32), pa.date32())
+    statuses = pa.array(STATUSES).take(pa.array(rng.integers(0, len(STATUSES), rows)))
+    return pa.table({
+        "transaction_id":   _prefixed("TXN-", ids),
+        "customer_id":      _prefixed("CUST-", _draw_keys(rng, customers, rows, key_skew)),
+        "amount":           amount,
+        "transaction_date": days.cast(pa.string()),
+        "status":           statuses,
+    })
+
+
+def iter_synthetic_batches(rows: int, chunk_rows: int, seed: int = 42, id_start: int = 0,
+                           existing_keys: int = 0, update_ratio: float = 0.0,
+                           key_skew: float = 0.0) -> Iterator[pa.RecordBatch]:
+    """
+    `rows` transacciones en bloques de hasta `chunk_rows`, con memoria acotada
+    al tamaño del bloque. Los ids nuevos son únicos entre bloques.
+    """
+    next_id = id_start
+    produced = 0
+    chunk = 0
+    while produced < rows:
+        size = min(chunk_rows, rows - produced)
+        table = synthetic_transactions(size, seed=seed + chunk, id_start=next_id,
+                                       existing_keys=existing_keys,
+                                       update_ratio=update_ratio, key_skew=key_skew)
+        next_id += size - (int(size * update_ratio) if existing_keys else 0)
+        produced += size
+        chunk += 1
+        yield from table.to_batches()
+
+
+def synthetic_schema() -> pa.Schema:
+    return synthetic_transactions(0).schema
@@ -72,6 +72,8 @@ INSERT INTO `dw_dev.customers` VALUES
 
 
 -- Tabla destino del MERGE con labels Dataplex
+-- Particionada por fecha y clusterizada: el MERGE solo lee las particiones
+-- del rango de fechas de staging (ver predicado en el ON más abajo)
 CREATE TABLE IF NOT EXISTS `dw_dev.final_table` (
   transaction_id   STRING  NOT NULL,
   customer_id      STRING,
@@ -83,6 +85,8 @@ CREATE TABLE IF NOT EXISTS `dw_dev.final_table` (
   last_updated     TIMESTAMP,
   PRIMARY KEY (transaction_id) NOT ENFORCED
 )
+PARTITION BY transaction_date
+CLUSTER BY customer_id, transaction_id
 OPTIONS (
   labels = [
     ('environment',    'dev'),
@@ -100,6 +104,16 @@ OPTIONS (
 -- Maestro: dw_dev.customers
 -- Destino: dw_dev.final_table
 -- Todo en dw_dev (US) — sin restricciones cross-region
+--
+-- El ON no limita las fechas de final_table: un rango fijo haría que
+-- una fila de staging cuya fila destino cae fuera de él pase a NOT
+-- MATCHED y se inserte duplicando el transaction_id. Para podar
+-- particiones, el rango debe ser constante y cubrir todo staging;
+-- run_merge.py lo calcula antes de cada MERGE:
+--   SELECT MIN(DATE(transaction_date)), MAX(DATE(transaction_date))
+--   FROM `dw_dev.transactions_staging`
+-- y lo agrega al ON (plantilla, con esos valores):
+--   AND target.transaction_date BETWEEN DATE '<min_date>' AND DATE '<max_date>'
 -- ================================================================
 
 MERGE `dw_dev.final_table` AS target
@@ -0,0 +1,320 @@
+"""
+bq_write_stream.py
+──────────────────
+Carga de record batches Arrow en una tabla BigQuery con la Storage Write
+API (AppendRows con filas Arrow), como alternativa a los load jobs:
+sin costo fijo ni cuota por job, y en streams COMMITTED las filas quedan
+visibles a medida que se confirma cada append.
+
+Exactamente una vez:
+  Cada append lleva el offset (filas ya escritas en ese stream). Si un
+  append falla sin respuesta (red, UNAVAILABLE) se reenvía con el mismo
+  offset; BigQuery responde ALREADY_EXISTS si esas filas ya habían
+  entrado, y eso cuenta como éxito. Un OUT_OF_RANGE indica que el stream
+  y el job perdieron la cuenta y detiene la carga. Al final se verifica
+  que cada stream tenga exactamente las filas enviadas.
+
+Paralelismo:
+  `streams` hilos, cada uno con su propio write stream, toman bloques de
+  una cola acotada (el productor se frena si los appends no dan abasto).
+  Cada hilo castea y serializa (Arrow IPC) sus bloques y los parte en
+  requests de como mucho `max_request_bytes` (AppendRows acepta hasta
+  10 MB).
+
+Tipos de stream:
+  committed  filas visibles tras cada append confirmado.
+  pending    nada es visible hasta el final: se finalizan todos los
+             streams y se confirman juntos (BatchCommitWriteStreams), así
+             que la tabla recibe la carga completa o nada.
+
+El protocolo (crear stream, append con offset, finalizar, commit) está
+detrás de BigQueryWriteApi; benchmarks/local_clients.py tiene un
+sustituto local (LocalWriteApi) con la misma semántica de offsets para
+probar la carga sin red.
+
+Uso:
+    writer = StreamWriter(BigQueryWriteApi(), streams=4, stream_type="committed")
+    rows = writer.append(table_path("p.dw_dev.transactions_staging"), tables, schema)
+
+Limitaciones:
+  - Requiere google-cloud-bigquery-storage con soporte de filas Arrow en
+    AppendRows; se importa solo al crear BigQueryWriteApi.
+  - El schema Arrow debe corresponder al de la tabla (decimal128(38, 9)
+    para NUMERIC, date32 para DATE, timestamp UTC para TIMESTAMP).
+  - No hay orden entre streams: sirve para tablas sin semántica de orden
+    (staging, ya deduplicado).
+"""
+
+import logging
+import queue
+import threading
+import time
+from contextvars import copy_context
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+from google.api_core import exceptions as api_exceptions
+
+from run_report import count, span
+
+log = logging.getLogger(__name__)
+
+STREAM_TYPES = ("committed", "pending")
+DEFAULT_STREAMS = 4
+DEFAULT_MAX_REQUEST_BYTES = 8 * 1024 * 1024   # margen bajo el límite de 10 MB por request
+APPEND_ATTEMPTS = 5
+RETRY_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 10.0
+
+# Errores tras los cuales el append se reintenta con el mismo offset
+RETRYABLE = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.InternalServerError,
+    api_exceptions.Aborted,
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    ConnectionError,
+)
+
+_DONE = object()
+
+
+def table_path(table_ref: str) -> str:
+    """`proyecto.dataset.tabla` → `projects/p/datasets/d/tables/t` (parent de la Write API)."""
+    project, dataset, table = table_ref.split(".")
+    return f"projects/{project}/datasets/{dataset}/tables/{table}"
+
+
+class BigQueryWriteApi:
+    """
+    El protocolo de la Storage Write API sobre BigQueryWriteClient. Cada
+    write stream mantiene una conexión AppendRows abierta; si un append
+    falla por la conexión se descarta y el siguiente intento abre otra.
+    """
+
+    def __init__(self, client=None):
+        from google.cloud import bigquery_storage_v1
+        from google.cloud.bigquery_storage_v1 import types, writer
+        self._types = types
+        self._writer = writer
+        self.client = client or bigquery_storage_v1.BigQueryWriteClient()
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def create_write_stream(self, parent: str, stream_type: str) -> str:
+        stream = self._types.WriteStream(type_=self._types.WriteStream.Type[stream_type.upper()])
+        return self.client.create_write_stream(parent=parent, write_stream=stream).name
+
+    def _connection(self, stream: str, serialized_schema: bytes):
+        with self._lock:
+            connection = self._connections.get(stream)
+            if connection is None:
+                template = self._types.AppendRowsRequest(
+                    write_stream=stream,
+                    arrow_rows=self._types.AppendRowsRequest.ArrowData(
+                        writer_schema=self._types.ArrowSchema(serialized_schema=serialized_schema)),
+                )
+                connection = self._writer.AppendRowsStream(self.client, template)
+                self._connections[stream] = connection
+            return connection
+
+    def _disconnect(self, stream: str) -> None:
+        with self._lock:
+            connection = self._connections.pop(stream, None)
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def append_rows(self, stream: str, serialized_schema: bytes,
+                    serialized_batch: bytes, offset: int) -> None:
+        request = self._types.AppendRowsRequest(
+            offset=offset,
+            arrow_rows=self._types.AppendRowsRequest.ArrowData(
+                rows=self._types.ArrowRecordBatch(serialized_record_batch=serialized_batch)),
+        )
+        try:
+            self._connection(stream, serialized_schema).send(request).result()
+        except (api_exceptions.AlreadyExists, api_exceptions.OutOfRange):
+            raise
+        except Exception:
+            self._disconnect(stream)
+            raise
+
+    def finalize_write_stream(self, stream: str) -> int:
+        self._disconnect(stream)
+        return self.client.finalize_write_stream(name=stream).row_count
+
+    def batch_commit_write_streams(self, parent: str, streams: List[str]) -> None:
+        response = self.client.batch_commit_write_streams(
+            self._types.BatchCommitWriteStreamsRequest(parent=parent, write_streams=streams))
+        if response.stream_errors:
+            raise RuntimeError("BatchCommitWriteStreams rechazado: " + "; ".join(
+                f"{e.entity}: {e.error_message}" for e in response.stream_errors))
+
+    def close(self) -> None:
+        for stream in list(self._connections):
+            self._disconnect(stream)
+
+
+def request_payloads(table: pa.Table, max_request_bytes: int) -> Iterator[Tuple[int, bytes]]:
+    """(filas, record batch IPC) de `table`, partidos hasta no superar `max_request_bytes`."""
+    for batch in table.to_batches():
+        pending = [batch]
+        while pending:
+            part = pending.pop()
+            payload = part.serialize()
+            if part.num_rows > 1 and payload.size > max_request_bytes:
+                half = part.num_rows // 2
+                pending += [part.slice(half), part.slice(0, half)]
+                continue
+            yield part.num_rows, payload.to_pybytes()
+
+
+def split_table(table: pa.Table, target_bytes: int) -> Iterator[pa.Table]:
+    """Cortes sin copia de `table` de ~`target_bytes` cada uno (para repartir entre streams)."""
+    if table.num_rows == 0:
+        return
+    rows = max(1, int(table.num_rows * target_bytes / max(table.nbytes, 1)))
+    for start in range(0, table.num_rows, rows):
+        yield table.slice(start, rows)
+
+
+class _Stream:
+    """Un write stream y las filas ya confirmadas en él (= offset del próximo append)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.offset = 0
+
+
+class StreamWriter:
+    """Appends en paralelo a una tabla con `streams` write streams (ver el docstring del módulo)."""
+
+    def __init__(self, api, streams: int = DEFAULT_STREAMS, stream_type: str = "committed",
+                 max_request_bytes: int = DEFAULT_MAX_REQUEST_BYTES):
+        if stream_type not in STREAM_TYPES:
+            raise ValueError(f"Tipo de write stream no soportado: {stream_type}")
+        self.api = api
+        self.streams = max(1, streams)
+        self.stream_type = stream_type
+        self.max_request_bytes = max_request_bytes
+
+    def _append(self, stream: _Stream, serialized_schema: bytes, rows: int, payload: bytes) -> None:
+        for attempt in range(1, APPEND_ATTEMPTS + 1):
+            try:
+                with span("append") as s:
+                    self.api.append_rows(stream.name, serialized_schema, payload, stream.offset)
+                    s["rows"] = rows
+                break
+            except api_exceptions.AlreadyExists:
+                # Un intento anterior sí llegó: las filas ya están en el stream
+                count("write_api_duplicate_appends")
+                break
+            except api_exceptions.OutOfRange as exc:
+                raise RuntimeError(f"Offset {stream.offset} fuera de rango en {stream.name}: "
+                                   f"{exc}") from exc
+            except RETRYABLE as exc:
+                if attempt == APPEND_ATTEMPTS:
+                    raise
+                delay = min(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1), MAX_BACKOFF_SECONDS)
+                log.warning("  Append en %s (offset %d) falló: %s — reintento %d/%d en %.1fs",
+                            stream.name, stream.offset, exc, attempt, APPEND_ATTEMPTS - 1, delay)
+                count("write_api_retries")
+                time.sleep(delay)
+        stream.offset += rows
+        count("write_api_appends")
+        count("write_api_bytes", len(payload))
+
+    def append(self, parent: str, tables: Iterable[pa.Table], schema: pa.Schema) -> int:
+        """
+        Agrega las filas de `tables` (casteadas a `schema`) a la tabla
+        `parent` (ver table_path). Devuelve las filas escritas. Con
+        streams pending, nada queda visible si falla antes del commit.
+        """
+        serialized_schema = schema.serialize().to_pybytes()
+        pending: queue.Queue = queue.Queue(maxsize=2 * self.streams)
+        stop = threading.Event()
+        opened: List[_Stream] = []
+        failures: List[BaseException] = []
+        lock = threading.Lock()
+
+        def work() -> None:
+            stream: Optional[_Stream] = None
+            try:
+                while not stop.is_set():
+                    try:
+                        table = pending.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if table is _DONE:
+                        return
+                    if stream is None:
+                        # Se abre al primer bloque: cargas chicas no crean streams vacíos
+                        stream = _Stream(self.api.create_write_stream(parent, self.stream_type))
+                        with lock:
+                            opened.append(stream)
+                    with span("convert"):
+                        # Un solo batch por bloque: requests grandes y no uno por batch chico
+                        table = table.cast(schema).combine_chunks()
+                        payloads = list(request_payloads(table, self.max_request_bytes))
+                    for rows, payload in payloads:
+                        self._append(stream, serialized_schema, rows, payload)
+            except BaseException as exc:
+                with lock:
+                    failures.append(exc)
+                stop.set()
+
+        # copy_context: los hilos registran en el mismo reporte de ejecución
+        workers = [threading.Thread(target=copy_context().run, args=(work,), daemon=True,
+                                    name=f"{threading.current_thread().name}-write{n}")
+                   for n in range(self.streams)]
+        for worker in workers:
+            worker.start()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    pending.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for table in tables:
+                for part in split_table(table, self.max_request_bytes):
+                    if not put(part):
+                        break
+                if stop.is_set():
+                    break
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            for _ in workers:
+                put(_DONE)
+            for worker in workers:
+                worker.join()
+            if stop.is_set():
+                # Sin esperar a nadie: drena lo que quedó para liberar memoria
+                while not pending.empty():
+                    pending.get_nowait()
+        if failures:
+            raise failures[0]
+
+        with span("finalize"):
+            for stream in opened:
+                written = self.api.finalize_write_stream(stream.name)
+                if written != stream.offset:
+                    raise RuntimeError(f"{stream.name}: {written} filas en el stream, "
+                                       f"se enviaron {stream.offset}")
+            if self.stream_type == "pending" and opened:
+                self.api.batch_commit_write_streams(parent, [s.name for s in opened])
+        rows = sum(stream.offset for stream in opened)
+        count("write_api_streams", len(opened))
+        log.info("  Storage Write API: %d filas en %d stream(s) %s", rows, len(opened),
+                 self.stream_type)
+        return rows
@@ -0,0 +1,362 @@
+"""
+change_index.py
+───────────────
+Índice local clave → hash de fila de lo que ya se mergeó en final_table,
+para cargar en staging solo inserts y updates reales.
+
+Formato: un .npy uint64 de forma (2, N), fila 0 = hash de la clave
+ordenado, fila 1 = hash del resto de columnas de staging. Se abre con
+memory map, así que buscar un lote de claves (np.searchsorted) no carga
+el índice completo en memoria. La ubicación es una ruta local o una URI
+gs:// (se descarga a un directorio temporal al abrir y se sube al
+confirmar).
+
+Ciclo por ejecución:
+  1. ChangeIndex.open(uri)       índice del último MERGE exitoso
+  2. ChangeFilter.filter(table)   por cada bloque: descarta filas sin
+                                  cambios y recuerda las que pasan (en
+                                  tramos ordenados en disco, no en memoria)
+  3. ChangeFilter.commit()        tras el MERGE: escribe el índice nuevo
+                                  (merge ordenado, por tramos)
+
+Si el job se reintenta después de cargar staging, las claves cargadas
+se recuperan con save_pending()/load_pending() en lugar de recalcularse.
+
+Limitaciones:
+  - El índice refleja lo que este job escribió. Si final_table se modifica
+    por otra vía, hay que reconstruirlo (run_merge.py --rebuild-change-index).
+  - El MERGE también compara customer_name (de customers): un cambio solo
+    en el maestro de clientes no se propaga a filas de staging sin cambios.
+  - Las colisiones de hash de 64 bits harían omitir una fila; con 10⁹
+    claves la probabilidad es ~3·10⁻². Tras reconstruir el índice la fila
+    vuelve a cargarse.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+
+from key_dedup import key_hash64, mix64
+
+log = logging.getLogger(__name__)
+
+INDEX_DTYPE = np.uint64
+MERGE_CHUNK_ENTRIES = 2 * 1024 * 1024
+# Claves cargadas en memoria antes de escribir un tramo ordenado a disco (16 MB)
+PENDING_BUFFER_ENTRIES = 1024 * 1024
+
+_ROW_PRIME = np.uint64(0x100000001B3)
+
+
+def row_hash64(table: pa.Table, columns: List[str]) -> np.ndarray:
+    """Hash uint64 de la combinación de `columns` en cada fila."""
+    hashes = np.full(table.num_rows, np.uint64(len(columns)), dtype=np.uint64)
+    for name in columns:
+        column = table.column(name)
+        t = column.type
+        if pa.types.is_decimal(t) or pa.types.is_floating(t) or pa.types.is_boolean(t):
+            column = column.cast(pa.string())
+        hashes = mix64(hashes * _ROW_PRIME ^ key_hash64(column))
+    return hashes
+
+
+def _latest_sorted(key_hashes: np.ndarray, row_hashes: np.ndarray):
+    """Entradas ordenadas por clave, con la última ocurrencia de cada una."""
+    order = np.argsort(key_hashes, kind="stable")
+    keys = key_hashes[order]
+    rows = row_hashes[order]
+    del order
+    last = np.append(keys[1:] != keys[:-1], True)[:len(keys)]
+    if last.all():
+        return keys, rows
+    return keys[last], rows[last]
+
+
+def _save_entries(path: str, key_hashes: np.ndarray, row_hashes: np.ndarray) -> None:
+    """Guarda (2, N) en `path` copiando por tramos desde memory maps."""
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=INDEX_DTYPE,
+                                    shape=(2, len(key_hashes)))
+    for start in range(0, len(key_hashes), MERGE_CHUNK_ENTRIES):
+        end = start + MERGE_CHUNK_ENTRIES
+        out[0, start:end] = key_hashes[start:end]
+        out[1, start:end] = row_hashes[start:end]
+    out.flush()
+    del out
+
+
+def _split_gcs_uri(uri: str):
+    bucket, _, blob_name = uri[len("gs://"):].partition("/")
+    if not bucket or not blob_name:
+        raise ValueError(f"URI de índice GCS inválida: {uri}")
+    return bucket, blob_name
+
+
+class ChangeIndex:
+    """Vista (memory map) de un índice de cambios; vacío si no existe."""
+
+    def __init__(self, uri: str, keys: np.ndarray, rows: np.ndarray,
+                 workdir: Optional[str] = None):
+        self.uri = uri
+        self.keys = keys
+        self.rows = rows
+        self._workdir = workdir
+
+    @classmethod
+    def open(cls, uri: str, rebuild: bool = False,
+             workdir_parent: Optional[str] = None) -> "ChangeIndex":
+        """`workdir_parent`: dónde crear el directorio de trabajo (default: temporal del sistema)."""
+        workdir = tempfile.mkdtemp(prefix="change_index_", dir=workdir_parent)
+        empty = np.empty(0, dtype=INDEX_DTYPE)
+        if rebuild:
+            log.info("Índice de cambios %s se reconstruye desde cero.", uri)
+            return cls(uri, empty, empty, workdir)
+
+        path = uri
+        if uri.startswith("gs://"):
+            from google.cloud import storage
+            bucket_name, blob_name = _split_gcs_uri(uri)
+            blob = storage.Client().bucket(bucket_name).blob(blob_name)
+            if not blob.exists():
+                log.info("Índice de cambios %s no existe aún — se cargan todas las filas.", uri)
+                return cls(uri, empty, empty, workdir)
+            path = os.path.join(workdir, "current.npy")
+            blob.download_to_filename(path)
+        elif not os.path.exists(uri):
+            log.info("Índice de cambios %s no existe aún — se cargan todas las filas.", uri)
+            return cls(uri, empty, empty, workdir)
+
+        data = np.load(path, mmap_mode="r")
+        if data.ndim != 2 or data.shape[0] != 2 or data.dtype != INDEX_DTYPE:
+            raise ValueError(f"Índice de cambios con formato inesperado: {uri}")
+        log.info("Índice de cambios %s: %d claves", uri, data.shape[1])
+        return cls(uri, data[0], data[1], workdir)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lookup(self, key_hashes: np.ndarray):
+        """(encontrada, hash de fila guardado) para cada clave."""
+        if not len(self.keys):
+            return np.zeros(len(key_hashes), dtype=bool), np.zeros(len(key_hashes), INDEX_DTYPE)
+        pos = np.searchsorted(self.keys, key_hashes)
+        pos_clipped = np.minimum(pos, len(self.keys) - 1)
+        found = (pos < len(self.keys)) & (self.keys[pos_clipped] == key_hashes)
+        return found, np.where(found, self.rows[pos_clipped], 0)
+
+    def write_merged(self, key_hashes: np.ndarray, row_hashes: np.ndarray, path: str) -> int:
+        """
+        Escribe en `path` el índice actual con las entradas nuevas aplicadas.
+        `key_hashes` debe venir ordenado y sin repetidos (ver
+        ChangeFilter.pending); puede ser un memory map. Devuelve el total de claves.
+        """
+        n, m = len(self.keys), len(key_hashes)
+        new_keys = 0
+        for start in range(0, m, MERGE_CHUNK_ENTRIES):
+            found, _ = self.lookup(np.asarray(key_hashes[start:start + MERGE_CHUNK_ENTRIES]))
+            new_keys += int((~found).sum())
+        total = n + new_keys
+
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=INDEX_DTYPE, shape=(2, total))
+        # Merge ordenado por tramos de ambos lados: cada tramo termina en la
+        # menor de las claves situadas MERGE_CHUNK_ENTRIES más adelante en el
+        # índice actual o en las entradas nuevas, así la memoria queda acotada
+        i = j = written = 0
+        while i < n or j < m:
+            bounds = []
+            if i + MERGE_CHUNK_ENTRIES < n:
+                bounds.append(self.keys[i + MERGE_CHUNK_ENTRIES])
+            if j + MERGE_CHUNK_ENTRIES < m:
+                bounds.append(key_hashes[j + MERGE_CHUNK_ENTRIES])
+            if bounds:
+                bound = min(bounds)
+                i_end = int(np.searchsorted(self.keys, bound))
+                j_end = int(np.searchsorted(key_hashes, bound))
+            else:
+                i_end, j_end = n, m
+            keys, rows = np.asarray(self.keys[i:i_end]), np.array(self.rows[i:i_end])
+            add_keys = np.asarray(key_hashes[j:j_end])
+            add_rows = np.asarray(row_hashes[j:j_end])
+            pos = np.searchsorted(keys, add_keys)
+            found = pos < len(keys)
+            found[found] = keys[pos[found]] == add_keys[found]
+            # Claves existentes con hash de fila nuevo; el resto se inserta en orden
+            rows[pos[found]] = add_rows[found]
+            chunk_keys = np.insert(keys, pos[~found], add_keys[~found])
+            chunk_rows = np.insert(rows, pos[~found], add_rows[~found])
+            out[0, written:written + len(chunk_keys)] = chunk_keys
+            out[1, written:written + len(chunk_rows)] = chunk_rows
+            written += len(chunk_keys)
+            i, j = i_end, j_end
+        out.flush()
+        del out
+        return total
+
+    def close(self) -> None:
+        self.keys = self.rows = None
+        if self._workdir:
+            shutil.rmtree(self._workdir, ignore_errors=True)
+            self._workdir = None
+
+
+class ChangeFilter:
+    """
+    Filtra bloques de staging contra un ChangeIndex y acumula las claves
+    cargadas para actualizar el índice tras el MERGE.
+
+    Las claves cargadas no se guardan todas en memoria: cada
+    `buffer_entries` se ordenan (última ocurrencia de cada clave) y se
+    escriben como un tramo .npy en el directorio del índice. pending()
+    los mezcla por tramos de clave, como write_merged con el índice.
+    """
+
+    def __init__(self, index: ChangeIndex, key: str,
+                 buffer_entries: int = PENDING_BUFFER_ENTRIES):
+        self.index = index
+        self.key = key
+        self.buffer_entries = buffer_entries
+        self.inserts = 0
+        self.updates = 0
+        self.unchanged = 0
+        self._keys: List[np.ndarray] = []
+        self._rows: List[np.ndarray] = []
+        self._buffered = 0
+        # (ruta .npy, entradas): el último merge puede ocupar menos que su capacidad
+        self._runs: List[Tuple[str, int]] = []
+
+    def filter(self, table: pa.Table) -> pa.Table:
+        if table.num_rows == 0:
+            return table
+        columns = [c for c in table.column_names if c != self.key]
+        key_hashes = key_hash64(table.column(self.key))
+        row_hashes = row_hash64(table, columns)
+        found, stored = self.index.lookup(key_hashes)
+        changed = ~found | (stored != row_hashes)
+        self.inserts += int((~found).sum())
+        self.updates += int((found & changed).sum())
+        self.unchanged += int((~changed).sum())
+        self._append(key_hashes[changed], row_hashes[changed])
+        if changed.all():
+            return table
+        return table.filter(pa.array(changed))
+
+    def _append(self, key_hashes: np.ndarray, row_hashes: np.ndarray) -> None:
+        self._keys.append(key_hashes)
+        self._rows.append(row_hashes)
+        self._buffered += len(key_hashes)
+        if self._buffered >= self.buffer_entries:
+            self._write_run()
+
+    def _write_run(self) -> None:
+        """Escribe el buffer como tramo ordenado, sin claves repetidas."""
+        if not self._buffered:
+            return
+        keys, rows = np.concatenate(self._keys), np.concatenate(self._rows)
+        self._keys, self._rows, self._buffered = [], [], 0
+        keys, rows = _latest_sorted(keys, rows)
+        path = os.path.join(self.index._workdir, f"pending-{len(self._runs):05d}.npy")
+        _save_entries(path, keys, rows)
+        self._runs.append((path, len(keys)))
+
+    def pending(self):
+        """
+        (claves, hashes de fila) cargadas, ordenadas y sin repetidos (el
+        tramo más reciente gana), como memory map en el directorio del índice.
+        """
+        self._write_run()
+        if not self._runs:
+            empty = np.empty(0, dtype=INDEX_DTYPE)
+            return empty, empty
+        if len(self._runs) == 1:
+            path, entries = self._runs[0]
+            run = np.load(path, mmap_mode="r")
+            return run[0, :entries], run[1, :entries]
+
+        runs = [np.load(path, mmap_mode="r")[:, :entries] for path, entries in self._runs]
+        capacity = sum(run.shape[1] for run in runs)
+        path = os.path.join(self.index._workdir, f"pending-merged-{len(self._runs):05d}.npy")
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=INDEX_DTYPE,
+                                        shape=(2, capacity))
+        # Tramos de clave acotados: cada tramo aporta como mucho `step` entradas
+        step = max(MERGE_CHUNK_ENTRIES // len(runs), 1)
+        positions = [0] * len(runs)
+        written = 0
+        while any(pos < run.shape[1] for pos, run in zip(positions, runs)):
+            bounds = [run[0, pos + step] for pos, run in zip(positions, runs)
+                      if pos + step < run.shape[1]]
+            ends = [int(np.searchsorted(run[0], min(bounds))) if bounds else run.shape[1]
+                    for run in runs]
+            # En orden de tramo: _latest_sorted conserva la última ocurrencia
+            keys, rows = _latest_sorted(
+                np.concatenate([run[0, pos:end] for pos, end, run in zip(positions, ends, runs)]),
+                np.concatenate([run[1, pos:end] for pos, end, run in zip(positions, ends, runs)]))
+            out[0, written:written + len(keys)] = keys
+            out[1, written:written + len(rows)] = rows
+            written += len(keys)
+            positions = ends
+        out.flush()
+        del out, runs
+        for run_path, _ in self._runs:
+            os.remove(run_path)
+        self._runs = [(path, written)]
+        merged = np.load(path, mmap_mode="r")
+        return merged[0, :written], merged[1, :written]
+
+    def save_pending(self, uri: str) -> None:
+        """
+        Guarda en `uri` (.npy local o gs://) las claves cargadas en staging,
+        para que un reintento que no recarga staging pueda hacer commit().
+        """
+        keys, rows = self.pending()
+        if uri.startswith("gs://"):
+            from google.cloud import storage
+            path = os.path.join(self.index._workdir, "pending.npy")
+            _save_entries(path, keys, rows)
+            bucket_name, blob_name = _split_gcs_uri(uri)
+            storage.Client().bucket(bucket_name).blob(blob_name).upload_from_filename(path)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(uri)), exist_ok=True)
+            _save_entries(f"{uri}.tmp.npy", keys, rows)
+            os.replace(f"{uri}.tmp.npy", uri)
+
+    def load_pending(self, uri: str) -> None:
+        """Recupera las claves guardadas con save_pending()."""
+        path = uri
+        if uri.startswith("gs://"):
+            from google.cloud import storage
+            path = os.path.join(self.index._workdir, "pending.npy")
+            bucket_name, blob_name = _split_gcs_uri(uri)
+            storage.Client().bucket(bucket_name).blob(blob_name).download_to_filename(path)
+        pending = np.load(path, mmap_mode="r")
+        if pending.ndim != 2 or pending.shape[0] != 2 or pending.dtype != INDEX_DTYPE:
+            raise ValueError(f"Claves pendientes con formato inesperado: {uri}")
+        # Por tramos: acepta también archivos sin ordenar de versiones anteriores
+        for start in range(0, pending.shape[1], self.buffer_entries):
+            end = start + self.buffer_entries
+            self._append(np.array(pending[0, start:end]), np.array(pending[1, start:end]))
+
+    def commit(self) -> int:
+        """Escribe el índice con las filas cargadas (solo tras un MERGE exitoso)."""
+        keys, rows = self.pending()
+        uri = self.index.uri
+        if not len(keys) and len(self.index):
+            log.info("Índice de cambios %s sin cambios: %d claves", uri, len(self.index))
+            return len(self.index)
+        if uri.startswith("gs://"):
+            from google.cloud import storage
+            path = os.path.join(self.index._workdir, "next.npy")
+            total = self.index.write_merged(keys, rows, path)
+            bucket_name, blob_name = _split_gcs_uri(uri)
+            storage.Client().bucket(bucket_name).blob(blob_name).upload_from_filename(path)
+        else:
+            # Junto al destino: os.replace es atómico solo dentro del mismo filesystem
+            os.makedirs(os.path.dirname(os.path.abspath(uri)), exist_ok=True)
+            path = f"{uri}.tmp.npy"
+            total = self.index.write_merged(keys, rows, path)
+            os.replace(path, uri)
+        log.info("Índice de cambios guardado en %s: %d claves", uri, total)
+        return total
@@ -12,6 +12,16 @@ Escribe datos de transacciones en dos destinos:
     1. Tabla Delta Lake en GCS
     2. Snapshot Parquet en GCS para tabla externa PARQUET en BigQuery
 
+  Con DELTA_WRITE_MODE=upsert, las cargas incrementales reemplazan por
+  transaction_id las filas existentes en lugar de agregarlas como
+  duplicados (ver delta_upsert.py).
+
+  MODO INGESTA (si INGEST_INPUT está definido):
+    Carga archivos CSV, JSONL o Parquet en la tabla Delta del modo
+    activo (ADLS o GCS) en lugar de los datos de muestra. Pensado para
+    backfills de historia completa: memoria constante, sin verify ni
+    snapshot (ver "Ingesta" más abajo).
+
 Variables de entorno:
   ADLS_ACCOUNT_NAME   Cuenta de Azure Storage (ej: jaredpruebadelta)
   ADLS_ACCESS_KEY     Clave de acceso de Azure Storage
@@ -20,18 +30,96 @@ Variables de entorno:
   GCS_BUCKET          Bucket GCS para snapshot Parquet
   GOOGLE_APPLICATION_CREDENTIALS  SA key JSON para GCS
 
+  DELTA_PARTITION_BY  Columna(s) de partición de la tabla Delta, separadas por coma
+                      (ej: transaction_date). Vacío = tabla sin particionar.
+                      Cambiar el particionado de una tabla existente requiere
+                      borrarla antes: delta-rs no reparticiona con overwrite.
+
+  DELTA_WRITE_MODE    append | upsert (default: append). upsert: la versión 1 y
+                      los commits de la ingesta (salvo el primero con
+                      INGEST_MODE=overwrite) hacen upsert por transaction_id
+                      y reescriben solo los archivos que contienen esas claves
+
+  SNAPSHOT_TARGET_FILE_MB   Tamaño objetivo de cada archivo del snapshot (default: 256)
+  SNAPSHOT_ROW_GROUP_ROWS   Filas máximas por row group del snapshot (default: 262144)
+  SNAPSHOT_UPLOAD_THREADS   Subidas concurrentes a GCS (default: 8)
+
+  DELTA_CACHE_DIR     Caché local de archivos de datos Delta (ver delta_cache.py):
+                      la verificación los descarga una vez y el snapshot los
+                      lee del caché. Vacío = sin caché.
+  DELTA_CACHE_MAX_MB  Tamaño máximo del caché, LRU (default: 10240)
+
+  INGEST_INPUT        Directorio o glob de archivos de entrada (ej: /data/txn/*.csv.gz)
+  INGEST_FORMAT       csv | jsonl | parquet (default: según la extensión)
+  INGEST_MODE         append | overwrite (default: append)
+  INGEST_WORKERS      Procesos que parsean archivos en paralelo (default: núcleos)
+  INGEST_BATCH_ROWS   Filas por batch (default: 131072)
+  INGEST_BATCHES_PER_COMMIT  Batches por commit Delta (default: 64)
+  INGEST_UPSERT_COMMIT_MB    Con DELTA_WRITE_MODE=upsert, MB en memoria de
+                             cada commit en lugar de un número de batches
+                             (default: 256)
+  INGEST_TARGET_FILE_MB      Tamaño objetivo de los archivos Delta (default: 256)
+  INGEST_SPOOL_DIR    Directorio de trabajo de los procesos (default: temporal)
+
+  RUN_REPORT_URI      Reporte JSON de la ejecución (local o gs://): tiempo de
+                      write_v0, write_v1, verify y snapshot (ver run_report.py)
+  RUN_PROFILE         cprofile | tracemalloc — profiling incluido en el reporte
+
+Snapshot Parquet:
+  Se escribe particionado por transaction_date (hive: transaction_date=YYYY-MM-DD/)
+  directamente en GCS con pyarrow (sin archivo temporal local), en streaming
+  por batches y con subidas en paralelo. La versión Delta exportada queda en
+  _snapshot_version.json; en la siguiente exportación solo se reescriben las
+  particiones tocadas por los commits posteriores a esa versión. Los
+  archivos nuevos se escriben antes de borrar los que reemplazan: la tabla
+  externa nunca queda vacía a mitad de la exportación.
+
+Ingesta:
+  Cada archivo de entrada se parsea en un proceso del pool, en streaming,
+  con el esquema de transacciones (TRANSACTIONS_SCHEMA: columnas
+  faltantes, valores no convertibles o nulos en INGEST_REQUIRED_COLUMNS
+  hacen fallar el job indicando el archivo y la fila), y se vuelca a un archivo Arrow IPC en INGEST_SPOOL_DIR. El
+  proceso principal lee esos archivos con memory map, en el orden de
+  entrada, y escribe commits de como mucho INGEST_BATCHES_PER_COMMIT
+  batches con archivos de ~INGEST_TARGET_FILE_MB. Como máximo hay
+  2 × INGEST_WORKERS archivos en vuelo, así que memoria y disco de
+  trabajo no dependen del volumen total. El orden de los commits sigue
+  el de los archivos (orden alfabético), que es el que usa la dedup
+  "última fila gana" de run_merge.py.
+  Con DELTA_WRITE_MODE=upsert cada commit se arma en memoria, cortado
+  por tamaño (~INGEST_UPSERT_COMMIT_MB de batches Arrow, no por número
+  de batches) y dentro de él también gana la última fila de cada clave;
+  los archivos Delta se escriben en streaming (ver delta_upsert.py).
+  Un error en un archivo detiene la ingesta con los commits anteriores
+  ya escritos: el log indica hasta qué archivo se llegó.
+
 Nota IA: Generado con asistencia de Claude (Anthropic).
 """
 
+import glob
+import itertools
+import json
 import logging
 import os
+import shutil
 import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 from decimal import Decimal
+from typing import Iterator, List, Optional, Set, Tuple
 
 import pyarrow as pa
-import pyarrow.parquet as pq
+import pyarrow.compute as pc
+import pyarrow.dataset as pads
 from deltalake import DeltaTable, write_deltalake
 
+from delta_cache import DEFAULT_CACHE_MB, DeltaFileCache, open_cache, report_cache
+from delta_fs import delta_filesystem
+from delta_upsert import DEFAULT_MAX_ROWS_PER_FILE, upsert
+from run_report import count, reporting, set_value, span
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 log = logging.getLogger(__name__)
 
@@ -43,6 +131,12 @@ ADLS_PATH      = os.environ.get("ADLS_DELTA_PATH",   "transactions_uniform")
 
 ADLS_URI = f"abfss://{ADLS_CONTAINER}@{ADLS_ACCOUNT}.dfs.core.windows.net/{ADLS_PATH}"
 
+# ── Particionado de la tabla Delta (ADLS y GCS) ────────────────────────────────
+# Con transaction_date, los lectores que filtran por fecha (run_merge.py
+# --since-date/--until-date) descartan archivos completos por valor de partición.
+DELTA_PARTITION_BY = [c.strip() for c in os.environ.get("DELTA_PARTITION_BY", "").split(",")
+                      if c.strip()] or None
+
 # ── Configuración GCS (snapshot Parquet para BigQuery) ─────────────────────────
 GCS_BUCKET    = os.environ.get("GCS_BUCKET",  "raw-dev-michaelpage-prueba")
 GCS_DELTA_PATH  = os.environ.get("GCS_DELTA_PATH",   "delta/transactions")
@@ -50,8 +144,57 @@ GCS_PARQUET_PATH = "parquet/transactions"
 GCS_DELTA_URI   = f"gs://{GCS_BUCKET}/{GCS_DELTA_PATH}"
 SA_KEY_PATH     = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "")
 
+# ── Configuración del snapshot Parquet ─────────────────────────────────────────
+SNAPSHOT_TARGET_FILE_MB   = int(os.environ.get("SNAPSHOT_TARGET_FILE_MB", "256"))
+SNAPSHOT_ROW_GROUP_ROWS   = int(os.environ.get("SNAPSHOT_ROW_GROUP_ROWS", "262144"))
+SNAPSHOT_UPLOAD_THREADS   = int(os.environ.get("SNAPSHOT_UPLOAD_THREADS", "8"))
+SNAPSHOT_PARTITION_COLUMN = "transaction_date"
+SNAPSHOT_MARKER           = "_snapshot_version.json"
+
+# ── Modo de escritura de las cargas incrementales ──────────────────────────────
+DELTA_WRITE_MODE = os.environ.get("DELTA_WRITE_MODE", "append")
+DELTA_WRITE_MODES = ("append", "upsert")
+
+# ── Modo ingesta ───────────────────────────────────────────────────────────────
+INGEST_INPUT              = os.environ.get("INGEST_INPUT") or None
+INGEST_FORMAT             = os.environ.get("INGEST_FORMAT") or None
+INGEST_MODE               = os.environ.get("INGEST_MODE", "append")
+INGEST_WORKERS            = int(os.environ.get("INGEST_WORKERS", os.cpu_count() or 1))
+INGEST_BATCH_ROWS         = int(os.environ.get("INGEST_BATCH_ROWS", "131072"))
+INGEST_BATCHES_PER_COMMIT = int(os.environ.get("INGEST_BATCHES_PER_COMMIT", "64"))
+INGEST_UPSERT_COMMIT_MB   = int(os.environ.get("INGEST_UPSERT_COMMIT_MB", "256"))
+INGEST_TARGET_FILE_MB     = int(os.environ.get("INGEST_TARGET_FILE_MB", "256"))
+INGEST_SPOOL_DIR          = os.environ.get("INGEST_SPOOL_DIR") or None
+# Sin nulos en ninguna fila: clave del upsert y del MERGE, y partición del snapshot
+INGEST_REQUIRED_COLUMNS   = ["transaction_id", "transaction_date"]
+INGEST_BLOCK_BYTES        = 16 * 1024 * 1024   # bloque de parseo CSV/JSONL
+
+# Propiedades UniForm: BigQuery Omni lee la tabla con format='ICEBERG' y WITH CONNECTION
+UNIFORM_CONFIGURATION = {
+    "delta.universalFormat.enabledFormats": "iceberg",
+    "delta.enableIcebergCompatV2":          "true",
+}
+
+# ── Caché local (ver delta_cache.py) ───────────────────────────────────────────
+# Se abre en main(): importar el módulo no crea directorios ni recorre el caché
+DELTA_CACHE_DIR    = os.environ.get("DELTA_CACHE_DIR") or None
+DELTA_CACHE_MAX_MB = int(os.environ.get("DELTA_CACHE_MAX_MB", DEFAULT_CACHE_MB))
+
+# ── Reporte de ejecución (ver run_report.py) ───────────────────────────────────
+RUN_REPORT_URI = os.environ.get("RUN_REPORT_URI") or None
+RUN_PROFILE    = os.environ.get("RUN_PROFILE") or None
+
 
 # ── Datos de muestra ───────────────────────────────────────────────────────────
+TRANSACTIONS_SCHEMA = pa.schema([
+    ("transaction_id",   pa.string()),
+    ("customer_id",      pa.string()),
+    ("amount",           pa.decimal128(18, 2)),
+    ("transaction_date", pa.string()),
+    ("status",           pa.string()),
+])
+
+
 def build_sample_data() -> pa.Table:
     """Datos iniciales — 5 transacciones (versión 0 del Delta)."""
     return pa.table({
@@ -82,6 +225,30 @@ def build_incremental_data() -> pa.Table:
 
 
 # ── MODO ADLS Gen2 (principal) ─────────────────────────────────────────────────
+def delta_dataset(dt: DeltaTable, storage_options: dict,
+                  cache: Optional[DeltaFileCache] = None) -> pads.Dataset:
+    """Dataset Arrow de `dt`, leído a través de `cache` si se indica."""
+    if cache is None:
+        return dt.to_pyarrow_dataset()
+    return dt.to_pyarrow_dataset(
+        filesystem=delta_filesystem(dt, storage_options, cache=cache))
+
+
+def write_incremental(table_uri: str, data: pa.Table, storage_options: dict,
+                      configuration: Optional[dict] = None,
+                      max_rows_per_file: int = DEFAULT_MAX_ROWS_PER_FILE,
+                      cache: Optional[DeltaFileCache] = None) -> None:
+    """Carga incremental según DELTA_WRITE_MODE: append o upsert por transaction_id."""
+    if DELTA_WRITE_MODE == "upsert":
+        upsert(table_uri, storage_options, data, partition_by=DELTA_PARTITION_BY,
+               configuration=configuration, cache=cache,
+               max_rows_per_file=max_rows_per_file)
+    else:
+        write_deltalake(table_uri, data, mode="append", partition_by=DELTA_PARTITION_BY,
+                        storage_options=storage_options, configuration=configuration,
+                        max_rows_per_file=max_rows_per_file)
+
+
 def get_adls_storage_options() -> dict:
     """
     Opciones de autenticación para delta-rs con ADLS Gen2.
@@ -98,7 +265,7 @@ def get_adls_storage_options() -> dict:
     }
 
 
-def write_delta_to_adls() -> pa.Table:
+def write_delta_to_adls(cache: Optional[DeltaFileCache] = None) -> pa.Table:
     """
     Escribe tabla Delta Lake en ADLS Gen2 con UniForm habilitado.
 
@@ -115,33 +282,33 @@ def write_delta_to_adls() -> pa.Table:
 
     # Versión 0 — datos iniciales
     initial_data = build_sample_data()
-    write_deltalake(
-        table_or_uri    = ADLS_URI,
-        data            = initial_data,
-        mode            = "overwrite",
-        storage_options = storage_opts,
-        # UniForm: genera metadatos Iceberg en cada commit
-        # BigQuery Omni los lee con format='ICEBERG' y WITH CONNECTION
-        configuration   = {
-            "delta.universalFormat.enabledFormats": "iceberg",
-            "delta.enableIcebergCompatV2":          "true",
-        },
-    )
+    with span("write_v0") as s:
+        write_deltalake(
+            table_or_uri    = ADLS_URI,
+            data            = initial_data,
+            mode            = "overwrite",
+            partition_by    = DELTA_PARTITION_BY,
+            storage_options = storage_opts,
+            # UniForm: genera metadatos Iceberg en cada commit
+            configuration   = UNIFORM_CONFIGURATION,
+        )
+        s["rows"] = initial_data.num_rows
     log.info("✅ Versión 0 Delta en ADLS — %d filas", initial_data.num_rows)
 
     # Versión 1 — datos incrementales
     incremental_data = build_incremental_data()
-    write_deltalake(
-        table_or_uri    = ADLS_URI,
-        data            = incremental_data,
-        mode            = "append",
-        storage_options = storage_opts,
-    )
-    log.info("✅ Versión 1 Delta en ADLS — %d filas adicionales", incremental_data.num_rows)
+    with span("write_v1") as s:
+        write_incremental(ADLS_URI, incremental_data, storage_opts, cache=cache)
+        s["rows"] = incremental_data.num_rows
+    log.info("✅ Versión 1 Delta en ADLS — %d filas (%s)", incremental_data.num_rows,
+             DELTA_WRITE_MODE)
 
     # Verificar estado final
-    dt = DeltaTable(ADLS_URI, storage_options=storage_opts)
-    full_table = dt.to_pyarrow_table()
+    with span("verify") as s:
+        dt = DeltaTable(ADLS_URI, storage_options=storage_opts)
+        full_table = delta_dataset(dt, storage_opts, cache).to_table()
+        s["rows"] = full_table.num_rows
+    set_value("delta_version", dt.version())
     log.info("📊 Delta verificada — versión: %d | archivos: %d | filas totales: %d",
              dt.version(), len(dt.files()), full_table.num_rows)
 
@@ -157,7 +324,8 @@ def write_delta_to_adls() -> pa.Table:
     # Exportar snapshot Parquet a GCS para que refresh_biglake.py
     # pueda crear la tabla externa de respaldo en dw_dev
     log.info("📤 Exportando snapshot Parquet a GCS (tabla BigLake de respaldo en dw_dev)...")
-    write_parquet_snapshot_to_gcs(full_table)
+    with span("snapshot"):
+        write_parquet_snapshot_to_gcs(dt, storage_opts, cache=cache)
 
     return full_table
 
@@ -169,66 +337,520 @@ def get_gcs_storage_options() -> dict:
     return {"google_service_account": SA_KEY_PATH}
 
 
-def write_parquet_snapshot_to_gcs(table: pa.Table) -> None:
-    """Escribe snapshot Parquet en GCS para tabla externa PARQUET en BigQuery."""
-    import tempfile
-    from google.cloud import storage as gcs
+def _parquet_bytes_per_row(dt: DeltaTable) -> float:
+    """Bytes Parquet por fila según las estadísticas de los add actions."""
+    actions = dt.get_add_actions(flatten=True)
+    rows = pc.sum(actions.column("num_records")).as_py() or 0
+    size = pc.sum(actions.column("size_bytes")).as_py() or 0
+    return size / rows if rows else 0.0
+
+
+def _read_snapshot_marker(fs, base_dir: str) -> dict:
+    try:
+        with fs.open_input_stream(f"{base_dir}/{SNAPSHOT_MARKER}") as fh:
+            return json.loads(fh.read())
+    except (FileNotFoundError, OSError):
+        return {}
+
+
+def _partition_values(dt: DeltaTable, paths: Set[str], storage_options: dict,
+                      cache: Optional[DeltaFileCache] = None) -> set:
+    """Valores distintos de la columna de partición en los archivos `paths`."""
+    if not paths:
+        return set()
+    source = delta_dataset(dt, storage_options, cache)
+    fragments = [f for f in source.get_fragments() if f.path in paths]
+    subset = pads.FileSystemDataset(fragments, source.schema, source.format, source.filesystem)
+    column = subset.to_table(columns=[SNAPSHOT_PARTITION_COLUMN]).column(SNAPSHOT_PARTITION_COLUMN)
+    return {v for v in pc.unique(column).to_pylist() if v is not None}
+
+
+def _delete_stale_snapshot_files(fs, base_dir: str, keep: Set[str],
+                                 partitions: Optional[set] = None) -> int:
+    """
+    Borra los archivos del snapshot que no están en `keep` (los escritos en
+    esta pasada): todos los de `base_dir` salvo el marcador o, con
+    `partitions`, solo los de esas particiones. Devuelve cuántos borró.
+    """
+    from pyarrow import fs as pafs
+
+    if partitions is None:
+        dirs = [base_dir]
+    else:
+        dirs = [f"{base_dir}/{SNAPSHOT_PARTITION_COLUMN}={value}" for value in sorted(partitions)]
+    stale = [info.path for d in dirs
+             for info in fs.get_file_info(pafs.FileSelector(d, allow_not_found=True,
+                                                            recursive=True))
+             if info.type == pafs.FileType.File and info.path not in keep
+             and info.base_name != SNAPSHOT_MARKER]
+    for path in stale:
+        fs.delete_file(path)
+    return len(stale)
+
+
+def _changed_partitions(dt: DeltaTable, exported_version: int, storage_options: dict,
+                        cache: Optional[DeltaFileCache] = None) -> Optional[set]:
+    """
+    Particiones tocadas por los commits posteriores a `exported_version`
+    (filas añadidas o eliminadas). None si hay que reescribir todo.
+    """
+    if exported_version > dt.version():
+        return None
+    try:
+        previous = DeltaTable(dt.table_uri, version=exported_version,
+                              storage_options=storage_options)
+        current_files, previous_files = set(dt.files()), set(previous.files())
+        return (_partition_values(dt, current_files - previous_files, storage_options, cache)
+                | _partition_values(previous, previous_files - current_files, storage_options,
+                                    cache))
+    except Exception as exc:
+        log.warning("No se pudo comparar con la versión %d (%s) — snapshot completo.",
+                    exported_version, exc)
+        return None
+
+
+def write_parquet_snapshot_to_gcs(dt: DeltaTable, storage_options: dict,
+                                  filesystem=None, base_dir: Optional[str] = None,
+                                  cache: Optional[DeltaFileCache] = None) -> None:
+    """
+    Escribe snapshot Parquet en GCS para tabla externa PARQUET en BigQuery.
+
+    Particionado por transaction_date, con archivos de ~SNAPSHOT_TARGET_FILE_MB
+    y row groups de hasta SNAPSHOT_ROW_GROUP_ROWS filas. Si el snapshot ya
+    existe, solo se reescriben las particiones que cambiaron desde la
+    versión Delta exportada la última vez.
+
+    No se fija un mínimo de filas por row group: write_dataset retendría
+    cada partición más chica que ese mínimo hasta cerrar el writer (con
+    particiones diarias, casi todo el snapshot en memoria). Los row groups
+    siguen a los batches que llegan, así que con una tabla Delta sin
+    particionar por fecha cada uno lleva solo las filas de su fecha en ese
+    batch.
+    """
+    from pyarrow import fs as pafs
+
+    pa.set_io_thread_count(SNAPSHOT_UPLOAD_THREADS)
+    fs = filesystem or pafs.GcsFileSystem()
+    base_dir = base_dir or f"{GCS_BUCKET}/{GCS_PARQUET_PATH}"
+    version = dt.version()
+
+    marker = _read_snapshot_marker(fs, base_dir)
+    changed = None
+    if marker.get("partition_by") == [SNAPSHOT_PARTITION_COLUMN] and "delta_version" in marker:
+        changed = _changed_partitions(dt, marker["delta_version"], storage_options, cache)
+
+    source = delta_dataset(dt, storage_options, cache)
+    if changed is None:
+        log.info("📤 Snapshot completo de la versión Delta %d → %s", version, base_dir)
+        scanner = source.scanner(batch_size=SNAPSHOT_ROW_GROUP_ROWS)
+    else:
+        log.info("📤 Snapshot incremental %d → %d: %d partición(es) cambiada(s)",
+                 marker["delta_version"], version, len(changed))
+        scanner = source.scanner(
+            batch_size=SNAPSHOT_ROW_GROUP_ROWS,
+            filter=pc.field(SNAPSHOT_PARTITION_COLUMN).isin(sorted(changed)),
+        )
 
-    gcs_client = gcs.Client()
-    bucket = gcs_client.bucket(GCS_BUCKET)
+    bytes_per_row = _parquet_bytes_per_row(dt)
+    max_rows_per_file = (max(int(SNAPSHOT_TARGET_FILE_MB * 1024 * 1024 / bytes_per_row),
+                             SNAPSHOT_ROW_GROUP_ROWS)
+                         if bytes_per_row else None)
+
+    written = []
+    if changed is None or changed:
+        pads.write_dataset(
+            scanner,
+            base_dir,
+            format="parquet",
+            filesystem=fs,
+            partitioning=pads.partitioning(
+                pa.schema([source.schema.field(SNAPSHOT_PARTITION_COLUMN)]), flavor="hive"),
+            basename_template=f"part-{version:020d}-{{i}}.parquet",
+            max_rows_per_file=max_rows_per_file,
+            max_rows_per_group=SNAPSHOT_ROW_GROUP_ROWS,
+            # Los archivos viejos se borran después, cuando los nuevos ya están
+            existing_data_behavior="overwrite_or_ignore",
+            file_visitor=lambda f: written.append(f.path),
+        )
 
-    with tempfile.NamedTemporaryFile(suffix=".parquet", delete=False) as tmp:
-        tmp_path = tmp.name
+    # Lo que no se reescribió en esta pasada: archivos de la exportación
+    # anterior (incluido el transactions.parquet plano de las más antiguas)
+    # o, en incremental, de particiones cambiadas o que quedaron sin filas
+    if changed is None or changed:
+        deleted = _delete_stale_snapshot_files(
+            fs, base_dir, set(written), None if changed is None else {str(v) for v in changed})
+        count("snapshot_files_deleted", deleted)
 
-    pq.write_table(table, tmp_path)
-    blob = bucket.blob(f"{GCS_PARQUET_PATH}/transactions.parquet")
-    blob.upload_from_filename(tmp_path)
-    os.unlink(tmp_path)
+    with fs.open_output_stream(f"{base_dir}/{SNAPSHOT_MARKER}") as fh:
+        fh.write(json.dumps({
+            "delta_version": version,
+            "partition_by":  [SNAPSHOT_PARTITION_COLUMN],
+            "updated_at":    datetime.now(timezone.utc).isoformat(),
+        }).encode())
 
-    log.info("✅ Snapshot Parquet en GCS: gs://%s/%s/transactions.parquet",
-             GCS_BUCKET, GCS_PARQUET_PATH)
+    count("snapshot_files", len(written))
+    count("snapshot_partitions_changed", len(changed) if changed is not None else 0)
+    log.info("✅ Snapshot Parquet en GCS: gs://%s/ — %d archivo(s) escrito(s) (versión Delta %d)",
+             base_dir, len(written), version)
 
 
-def write_delta_to_gcs() -> pa.Table:
+def write_delta_to_gcs(cache: Optional[DeltaFileCache] = None) -> pa.Table:
     """Fallback: escribe Delta en GCS cuando no hay credenciales Azure."""
     storage_opts = get_gcs_storage_options()
 
     log.info("📂 Destino GCS (fallback): %s", GCS_DELTA_URI)
 
     initial_data = build_sample_data()
-    write_deltalake(GCS_DELTA_URI, initial_data, mode="overwrite",
-                    storage_options=storage_opts)
+    with span("write_v0") as s:
+        write_deltalake(GCS_DELTA_URI, initial_data, mode="overwrite",
+                        partition_by=DELTA_PARTITION_BY, storage_options=storage_opts)
+        s["rows"] = initial_data.num_rows
     log.info("✅ Versión 0 Delta en GCS — %d filas", initial_data.num_rows)
 
     incremental_data = build_incremental_data()
-    write_deltalake(GCS_DELTA_URI, incremental_data, mode="append",
-                    storage_options=storage_opts)
-    log.info("✅ Versión 1 Delta en GCS — %d filas adicionales", incremental_data.num_rows)
-
-    dt = DeltaTable(GCS_DELTA_URI, storage_options=storage_opts)
-    full_table = dt.to_pyarrow_table()
+    with span("write_v1") as s:
+        write_incremental(GCS_DELTA_URI, incremental_data, storage_opts, cache=cache)
+        s["rows"] = incremental_data.num_rows
+    log.info("✅ Versión 1 Delta en GCS — %d filas (%s)", incremental_data.num_rows,
+             DELTA_WRITE_MODE)
+
+    with span("verify") as s:
+        dt = DeltaTable(GCS_DELTA_URI, storage_options=storage_opts)
+        full_table = delta_dataset(dt, storage_opts, cache).to_table()
+        s["rows"] = full_table.num_rows
+    set_value("delta_version", dt.version())
     log.info("📊 Delta verificada — versión: %d | archivos: %d",
              dt.version(), len(dt.files()))
 
-    write_parquet_snapshot_to_gcs(full_table)
+    with span("snapshot"):
+        write_parquet_snapshot_to_gcs(dt, storage_opts, cache=cache)
     return full_table
 
 
+# ── MODO INGESTA ───────────────────────────────────────────────────────────────
+INGEST_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".json": "jsonl", ".ndjson": "jsonl",
+                  ".parquet": "parquet"}
+
+
+def ingest_input_files(pattern: str) -> List[str]:
+    """Archivos de `pattern` (directorio o glob), en orden alfabético."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "**", "*")
+    files = sorted(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+    if not files:
+        raise FileNotFoundError(f"Sin archivos de entrada en {pattern}")
+    return files
+
+
+def _input_format(path: str) -> str:
+    if INGEST_FORMAT:
+        return INGEST_FORMAT
+    name = path[:-3] if path.endswith(".gz") else path
+    fmt = INGEST_FORMATS.get(os.path.splitext(name)[1].lower())
+    if fmt is None:
+        raise ValueError(f"Formato de entrada desconocido: {path} (definir INGEST_FORMAT)")
+    return fmt
+
+
+def _jsonl_blocks(path: str) -> Iterator[bytes]:
+    """Bloques de ~INGEST_BLOCK_BYTES cortados en fin de línea."""
+    from pyarrow import CompressedInputStream
+    raw = pa.OSFile(path)
+    source = CompressedInputStream(raw, "gzip") if path.endswith(".gz") else raw
+    with source:
+        pending = b""
+        while True:
+            chunk = source.read(INGEST_BLOCK_BYTES)
+            if not chunk:
+                break
+            block, _, pending = (pending + chunk).rpartition(b"\n")
+            if block:
+                yield block + b"\n"
+        if pending.strip():
+            yield pending
+
+
+def check_required(table: pa.Table, first_row: int) -> None:
+    """
+    Falla si alguna columna de INGEST_REQUIRED_COLUMNS tiene nulos (o, en
+    texto, vacíos: así llegan las celdas vacías de un CSV) en `table`
+    (filas `first_row`... del archivo).
+    """
+    for name in INGEST_REQUIRED_COLUMNS:
+        if name not in table.column_names:
+            continue
+        column = table.column(name)
+        missing = (pc.fill_null(pc.equal(column, ""), True) if pa.types.is_string(column.type)
+                   else pc.is_null(column))
+        count_missing = pc.sum(missing).as_py() or 0
+        if count_missing:
+            first = pc.index(missing, True).as_py()
+            raise ValueError(f"{count_missing} fila(s) sin {name} "
+                             f"(la primera es la fila {first_row + first + 1})")
+
+
+def read_input_batches(path: str, schema: pa.Schema = TRANSACTIONS_SCHEMA
+                       ) -> Iterator[pa.RecordBatch]:
+    """
+    Batches de `path` con el esquema `schema`, sin cargar el archivo completo.
+
+    Cada bloque se valida al parsearlo: columnas faltantes (en JSONL, las
+    que no aparecen con valor en ninguna línea del archivo, porque el
+    lector rellena con nulos los campos ausentes) y nulos en
+    INGEST_REQUIRED_COLUMNS.
+    """
+    import pyarrow.csv as pcsv
+    import pyarrow.json as pjson
+    import pyarrow.parquet as pq
+
+    fmt = _input_format(path)
+    rows = 0
+    if fmt == "csv":
+        reader = pcsv.open_csv(
+            path,
+            read_options=pcsv.ReadOptions(block_size=INGEST_BLOCK_BYTES),
+            convert_options=pcsv.ConvertOptions(column_types=schema,
+                                                include_columns=schema.names),
+        )
+        for batch in reader:
+            table = pa.Table.from_batches([batch]).cast(schema)
+            check_required(table, rows)
+            rows += table.num_rows
+            yield from table.to_batches(INGEST_BATCH_ROWS)
+    elif fmt == "jsonl":
+        options = pjson.ParseOptions(explicit_schema=schema, unexpected_field_behavior="ignore")
+        absent = set(schema.names)
+        for block in _jsonl_blocks(path):
+            table = pjson.read_json(pa.BufferReader(block), parse_options=options)
+            table = table.select(schema.names).cast(schema)
+            check_required(table, rows)
+            rows += table.num_rows
+            absent = {name for name in absent if table.column(name).null_count == table.num_rows}
+            yield from table.to_batches(INGEST_BATCH_ROWS)
+        if absent and rows:
+            raise ValueError(f"Columnas faltantes (sin valor en ninguna línea): {sorted(absent)}")
+    elif fmt == "parquet":
+        parquet = pq.ParquetFile(path)
+        missing = set(schema.names) - set(parquet.schema_arrow.names)
+        if missing:
+            raise ValueError(f"Columnas faltantes: {sorted(missing)}")
+        for batch in parquet.iter_batches(batch_size=INGEST_BATCH_ROWS, columns=schema.names):
+            table = pa.Table.from_batches([batch]).select(schema.names).cast(schema)
+            check_required(table, rows)
+            rows += table.num_rows
+            yield table.to_batches()[0]
+    else:
+        raise ValueError(f"INGEST_FORMAT desconocido: {fmt}")
+
+
+def spool_input_file(path: str, spool_dir: str) -> Tuple[str, str, int]:
+    """
+    Worker del pool: parsea `path` y lo escribe como Arrow IPC en `spool_dir`.
+    Devuelve (archivo de entrada, archivo IPC, filas).
+    """
+    fd, spool_path = tempfile.mkstemp(dir=spool_dir, suffix=".arrow")
+    os.close(fd)
+    rows = 0
+    try:
+        # Comprimido: al leer, cada buffer se descomprime en memoria alineada.
+        # delta-rs exige 16 bytes para decimal128 y un IPC sin comprimir
+        # leído con memory map solo garantiza 8
+        options = pa.ipc.IpcWriteOptions(compression="lz4")
+        with pa.OSFile(spool_path, "wb") as sink, \
+                pa.ipc.new_file(sink, TRANSACTIONS_SCHEMA, options=options) as writer:
+            for batch in read_input_batches(path):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    except Exception as exc:
+        os.remove(spool_path)
+        # Las excepciones de Arrow no siempre se pueden enviar entre procesos
+        raise ValueError(f"{path}: {type(exc).__name__}: {exc}") from None
+    return path, spool_path, rows
+
+
+def spooled_batches(files: List[str], workers: int, spool_dir: str,
+                    stats: dict) -> Iterator[pa.RecordBatch]:
+    """
+    Batches de todos los archivos, en orden, parseados en `workers`
+    procesos con como mucho 2 × workers archivos en vuelo. Acumula en
+    `stats` archivos y bytes de entrada leídos (write_deltalake consume
+    el iterador desde hilos de Arrow, fuera del reporte activo).
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        remaining = iter(files)
+        try:
+            for path in itertools.islice(remaining, 2 * workers):
+                pending.append(pool.submit(spool_input_file, path, spool_dir))
+            while pending:
+                path, spool_path, rows = pending.popleft().result()
+                next_path = next(remaining, None)
+                if next_path is not None:
+                    pending.append(pool.submit(spool_input_file, next_path, spool_dir))
+                stats["files"] += 1
+                stats["input_bytes"] += os.path.getsize(path)
+                log.info("  %s: %d filas", path, rows)
+                with pa.memory_map(spool_path) as source:
+                    reader = pa.ipc.open_file(source)
+                    for i in range(reader.num_record_batches):
+                        yield reader.get_batch(i)
+                os.remove(spool_path)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _bytes_per_row(batch: pa.RecordBatch) -> float:
+    """Bytes Parquet por fila de `batch` (para dimensionar los archivos Delta)."""
+    import pyarrow.parquet as pq
+    sink = pa.BufferOutputStream()
+    pq.write_table(pa.Table.from_batches([batch]), sink)
+    return sink.getvalue().size / max(batch.num_rows, 1)
+
+
+def _take_bytes(batches: Iterator[pa.RecordBatch], max_bytes: int) -> Iterator[pa.RecordBatch]:
+    """Batches de `batches` hasta sumar `max_bytes` en memoria (el último puede pasarse)."""
+    total = 0
+    for batch in batches:
+        yield batch
+        total += batch.nbytes
+        if total >= max_bytes:
+            return
+
+
+def ingest_files(table_uri: str, storage_options: dict, files: List[str],
+                 configuration: Optional[dict] = None,
+                 cache: Optional[DeltaFileCache] = None) -> int:
+    """
+    Escribe `files` en la tabla Delta `table_uri`, un commit cada
+    INGEST_BATCHES_PER_COMMIT batches (en upsert, cada
+    INGEST_UPSERT_COMMIT_MB). Devuelve las filas escritas.
+    """
+    spool_dir = tempfile.mkdtemp(prefix="ingest_", dir=INGEST_SPOOL_DIR)
+    rows = commits = 0
+    mode = INGEST_MODE
+    stats = {"files": 0, "input_bytes": 0}
+    try:
+        batches = spooled_batches(files, max(INGEST_WORKERS, 1), spool_dir, stats)
+        first = next(batches, None)
+        if first is None:
+            log.warning("Los archivos de entrada no tienen filas — nada que escribir.")
+            return 0
+        bytes_per_row = _bytes_per_row(first)
+        max_rows_per_file = max(int(INGEST_TARGET_FILE_MB * 1024 * 1024 / bytes_per_row),
+                                INGEST_BATCH_ROWS)
+        log.info("  ~%.0f bytes/fila → hasta %d filas por archivo Delta",
+                 bytes_per_row, max_rows_per_file)
+
+        batches = itertools.chain([first], batches)
+        while True:
+            streamed = mode == "overwrite" or DELTA_WRITE_MODE == "append"
+            if streamed:
+                group = itertools.islice(batches, INGEST_BATCHES_PER_COMMIT)
+            else:
+                # El upsert necesita el commit entero en memoria: se corta por bytes
+                group = _take_bytes(batches, INGEST_UPSERT_COMMIT_MB * 1024 * 1024)
+            head = next(group, None)
+            if head is None:
+                break
+            written = []
+
+            def counted(group=group, head=head):
+                for batch in itertools.chain([head], group):
+                    written.append(batch.num_rows)
+                    yield batch
+
+            with span("ingest_commit") as s:
+                if streamed:
+                    write_deltalake(
+                        table_uri,
+                        pa.RecordBatchReader.from_batches(TRANSACTIONS_SCHEMA, counted()),
+                        mode=mode,
+                        partition_by=DELTA_PARTITION_BY,
+                        storage_options=storage_options,
+                        configuration=configuration,
+                        max_rows_per_file=max_rows_per_file,
+                        min_rows_per_group=min(INGEST_BATCH_ROWS, max_rows_per_file),
+                        max_rows_per_group=min(INGEST_BATCH_ROWS, max_rows_per_file),
+                    )
+                else:
+                    write_incremental(table_uri,
+                                      pa.Table.from_batches(list(counted()), TRANSACTIONS_SCHEMA),
+                                      storage_options, configuration,
+                                      max_rows_per_file=max_rows_per_file, cache=cache)
+                s["rows"] = sum(written)
+            mode = "append"   # overwrite solo en el primer commit
+            rows += sum(written)
+            commits += 1
+            count("ingest_rows", sum(written))
+            count("ingest_commits")
+            log.info("✅ Commit %d: %d filas (%d en total)", commits, sum(written), rows)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        count("ingest_files", stats["files"])
+        count("ingest_input_bytes", stats["input_bytes"])
+    return rows
+
+
+def ingest_to_delta(table_uri: str, storage_options: dict,
+                    configuration: Optional[dict] = None,
+                    cache: Optional[DeltaFileCache] = None) -> None:
+    """Modo ingesta: INGEST_INPUT → tabla Delta `table_uri`."""
+    if INGEST_MODE not in ("append", "overwrite"):
+        raise ValueError(f"INGEST_MODE debe ser append u overwrite: {INGEST_MODE}")
+    files = ingest_input_files(INGEST_INPUT)
+    log.info("📥 Ingesta de %d archivo(s) de %s → %s (%s, %s, %d procesos)",
+             len(files), INGEST_INPUT, table_uri, INGEST_MODE, DELTA_WRITE_MODE, INGEST_WORKERS)
+    with span("ingest") as s:
+        rows = ingest_files(table_uri, storage_options, files, configuration, cache)
+        s["rows"] = rows
+    dt = DeltaTable(table_uri, storage_options=storage_options)
+    set_value("delta_version", dt.version())
+    log.info("📊 Ingesta terminada — %d filas | versión Delta: %d | archivos: %d",
+             rows, dt.version(), len(dt.files()))
+
+
 # ── Entry point ────────────────────────────────────────────────────────────────
 def main() -> None:
+    with reporting("create_delta_data", RUN_REPORT_URI, RUN_PROFILE,
+                   params={"adls": bool(ADLS_KEY), "partition_by": DELTA_PARTITION_BY,
+                           "cache_dir": DELTA_CACHE_DIR, "ingest_input": INGEST_INPUT,
+                           "write_mode": DELTA_WRITE_MODE}):
+        cache = open_cache(DELTA_CACHE_DIR, DELTA_CACHE_MAX_MB)
+        _write(cache)
+        if cache is not None:
+            report_cache(cache)
+
+
+def _write(cache: Optional[DeltaFileCache] = None) -> None:
     use_adls = bool(ADLS_KEY)
+    if DELTA_WRITE_MODE not in DELTA_WRITE_MODES:
+        log.error("❌ DELTA_WRITE_MODE debe ser append o upsert: %s", DELTA_WRITE_MODE)
+        sys.exit(1)
+
+    if INGEST_INPUT:
+        try:
+            if use_adls:
+                ingest_to_delta(ADLS_URI, get_adls_storage_options(), UNIFORM_CONFIGURATION,
+                                cache)
+            else:
+                ingest_to_delta(GCS_DELTA_URI, get_gcs_storage_options(), cache=cache)
+        except Exception as exc:
+            log.error("❌ Error en la ingesta: %s", exc)
+            sys.exit(1)
+        return
 
     if use_adls:
         log.info("🚀 Modo ADLS Gen2 — escritura Delta con UniForm/Iceberg en Azure")
         try:
-            write_delta_to_adls()
+            write_delta_to_adls(cache)
         except Exception as exc:
             log.error("❌ Error escribiendo en ADLS Gen2: %s", exc)
             sys.exit(1)
     else:
         log.info("🚀 Modo GCS (fallback) — ADLS_ACCESS_KEY no definida")
         try:
-            write_delta_to_gcs()
+            write_delta_to_gcs(cache)
         except Exception as exc:
             log.error("❌ Error escribiendo en GCS: %s", exc)
             sys.exit(1)
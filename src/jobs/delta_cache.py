@@ -0,0 +1,238 @@
+"""
+delta_cache.py
+──────────────
+Caché local en disco para archivos inmutables de tablas Delta: archivos
+de datos (part-*.parquet), commits JSON y checkpoints del _delta_log.
+
+Cada entrada se guarda bajo el sha256 de (ruta del objeto, etiqueta), donde
+la etiqueta identifica el contenido: tamaño y modificationTime del add
+action para los archivos de datos (delta_fs.content_tags; el tamaño solo
+no basta si un archivo se reescribe con el mismo nombre), tamaño y fecha
+de modificación para el _delta_log, o generation/etag para los objetos
+GCS. Si la tabla se recrea, la etiqueta cambia y la entrada vieja
+simplemente deja de usarse hasta que el LRU la expulse.
+
+El directorio puede estar en un volumen montado y compartido entre
+ejecuciones y procesos: las escrituras son atómicas (archivo temporal +
+os.replace) y una entrada que otro proceso expulsa entre la consulta y la
+apertura cuenta como fallo y se vuelve a descargar. El LRU usa el mtime
+de cada entrada (se actualiza en cada acierto) y se aplica al superar
+`max_bytes`, hasta bajar al 90 %.
+
+En un fallo el objeto se copia al disco por bloques de COPY_CHUNK_BYTES y
+se sirve como memory map: nunca está entero en el heap, así que leer a
+través del caché no suma al límite de memoria de los jobs. Un objeto más
+grande que lo que el caché puede retener se lee directo, sin guardarlo.
+
+No guardar aquí objetos mutables como `_delta_log/_last_checkpoint`.
+
+Uso:
+    cache = DeltaFileCache("/mnt/delta-cache", max_bytes=10 * 1024**3)
+    source = cache.open(path, tag, lambda: fs.open_input_file(path), size=size)
+    data = cache.read(uri, blob.generation, blob.download_as_bytes)
+    report_cache(cache)   # log + contadores cache_* del reporte de ejecución
+"""
+
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+from run_report import count, set_value
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_MB = 10_240
+EVICT_TO_FRACTION = 0.9
+COPY_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+class CacheStats:
+    """Aciertos, fallos y bytes servidos/descargados, seguros entre hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_hit = 0
+        self.bytes_fetched = 0
+        self.evictions = 0
+        self.bytes_evicted = 0
+
+    def add_hit(self, nbytes: int) -> None:
+        with self._lock:
+            self.hits += 1
+            self.bytes_hit += nbytes
+
+    def add_miss(self, nbytes: int) -> None:
+        with self._lock:
+            self.misses += 1
+            self.bytes_fetched += nbytes
+
+    def add_eviction(self, nbytes: int) -> None:
+        with self._lock:
+            self.evictions += 1
+            self.bytes_evicted += nbytes
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.hits} acierto(s), {self.misses} fallo(s) "
+                f"({self.hit_rate:.0%}) — {self.bytes_hit / 1024 / 1024:.1f} MB desde caché, "
+                f"{self.bytes_fetched / 1024 / 1024:.1f} MB descargados, "
+                f"{self.evictions} expulsión(es)")
+
+
+class DeltaFileCache:
+    """Caché LRU en disco de objetos inmutables, acotada por `max_bytes`."""
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_CACHE_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+        if self._size > max_bytes:   # p. ej. si se bajó el límite
+            self._evict()
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def _entry_path(self, key: str, tag) -> str:
+        digest = hashlib.sha256(f"{key}\0{tag}".encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _entries(self):
+        """(ruta, mtime, tamaño) de cada entrada."""
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, st.st_mtime, st.st_size
+
+    def _touch(self, path: str) -> Optional[int]:
+        """Marca la entrada como usada; None si no existe."""
+        try:
+            os.utime(path)
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+
+    def _store(self, path: str, source) -> int:
+        """Copia `source` (un archivo con read(n)) a la entrada, por bloques; devuelve los bytes."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        written = 0
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                while True:
+                    chunk = source.read(COPY_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    fh.write(chunk)
+                    written += len(chunk)
+            with self._lock:
+                # Otro hilo pudo guardar la misma entrada: se reemplaza, no se suma
+                replaced = os.path.exists(path)
+                os.replace(tmp_path, path)
+                if not replaced:
+                    self._size += written
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return written
+
+    def _over_budget(self) -> bool:
+        with self._lock:
+            return self._size > self.max_bytes
+
+    def _evict(self) -> None:
+        with self._lock:
+            # Recalcula el tamaño real: otros procesos pueden compartir el directorio
+            entries = sorted(self._entries(), key=lambda e: e[1])
+            size = sum(e[2] for e in entries)
+            target = self.max_bytes * EVICT_TO_FRACTION
+            for path, _, entry_size in entries:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+                self.stats.add_eviction(entry_size)
+            self._size = size
+
+    def open(self, key: str, tag, open_source: Callable[[], "pa.NativeFile"],
+             size: Optional[int] = None) -> "pa.NativeFile":
+        """
+        Archivo (memory map) con el contenido de `key`. Si no está, se copia
+        desde `open_source()`; con un `size` que el caché no puede retener
+        se devuelve `open_source()` tal cual.
+        """
+        import pyarrow as pa
+        path = self._entry_path(key, tag)
+        cached_size = self._touch(path)
+        if cached_size is not None:
+            try:
+                source = pa.memory_map(path)
+                self.stats.add_hit(cached_size)
+                return source
+            except FileNotFoundError:
+                pass  # expulsada por otro proceso entre medio
+        if size is not None and size > self.max_bytes * EVICT_TO_FRACTION:
+            # Solo se leen los rangos pedidos: los bytes los cuenta quien lee
+            self.stats.add_miss(0)
+            return open_source()
+        with open_source() as source:
+            written = self._store(path, source)
+        self.stats.add_miss(written)
+        # Abierto antes de expulsar: el mapa sigue válido aunque otro borre la entrada
+        mapped = pa.memory_map(path)
+        if self._over_budget():
+            self._evict()
+        return mapped
+
+    def read(self, key: str, tag, fetch: Callable[[], bytes]) -> bytes:
+        """Contenido de `key` como bytes; `fetch` si no está."""
+        with self.open(key, tag, lambda: io.BytesIO(fetch())) as source:
+            return source.read()
+
+
+def open_cache(cache_dir: Optional[str], max_mb: int = DEFAULT_CACHE_MB) -> Optional[DeltaFileCache]:
+    """DeltaFileCache en `cache_dir`, o None si no se configuró."""
+    if not cache_dir:
+        return None
+    cache = DeltaFileCache(cache_dir, max_mb * 1024 * 1024)
+    log.info("Caché Delta en %s: %.1f / %d MB", cache_dir, cache.size_bytes / 1024 / 1024, max_mb)
+    return cache
+
+
+def report_cache(cache: DeltaFileCache) -> None:
+    """Loguea y acumula en el reporte de ejecución las estadísticas del caché."""
+    stats = cache.stats
+    log.info("Caché Delta: %s", stats.summary())
+    count("cache_hits", stats.hits)
+    count("cache_misses", stats.misses)
+    count("cache_bytes_hit", stats.bytes_hit)
+    count("cache_bytes_fetched", stats.bytes_fetched)
+    count("cache_evictions", stats.evictions)
+    set_value("cache_hit_rate", round(stats.hit_rate, 4))
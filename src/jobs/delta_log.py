@@ -0,0 +1,207 @@
+"""
+delta_log.py
+────────────
+Replay del _delta_log de una tabla Delta (ADLS, GCS o local) para saber
+en qué commit entró cada archivo activo: delta-rs no lo expone (el
+snapshot y los checkpoints guardan las add actions sin su versión).
+
+La versión "efectiva" de un archivo es la de su commit, salvo que su add
+action lleve la etiqueta SOURCE_VERSION_TAG: los archivos que reescribe
+maintain_delta.py juntan filas de varios commits, en el orden de esos
+commits, y guardan ahí la versión del más reciente. Así la dedup "última
+fila gana" de run_merge.py ordena igual antes y después del
+mantenimiento.
+
+Solo se resuelven los archivos pedidos (`paths`, p. ej. los añadidos
+desde el watermark) y se lee lo mínimo para ubicarlos, en READ_THREADS
+hilos y, con una DeltaFileCache, sin descargar lo que ya está en caché:
+
+  1. Los commits posteriores al último checkpoint (según
+     _last_checkpoint; sin listar el _delta_log).
+  2. Si falta alguno: el checkpoint, donde los archivos reescritos por
+     maintain_delta.py ya traen su versión en la etiqueta.
+  3. Si aún falta alguno: los commits retenidos anteriores al
+     checkpoint, del más reciente hacia atrás, hasta ubicarlos a todos.
+     Los que no aparecen (commit expirado con maintain_delta.py
+     --cleanup-log) quedan con versión -1: anteriores a todo commit
+     retenido.
+
+Una carga incremental cuesta así O(commits desde el checkpoint o desde
+el watermark) y no O(historial completo); solo una carga completa de
+una tabla con archivos anteriores al checkpoint recorre el historial.
+
+Uso:
+    versions = file_versions(dt, storage_options, cache, paths)
+    # {"part-00000-....parquet": 12, ...} para `paths` (o dt.files())
+"""
+
+import io
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote
+
+import pyarrow.parquet as pq
+from deltalake import DeltaTable
+from deltalake.fs import DeltaStorageHandler
+from pyarrow import fs as pafs
+
+from delta_cache import DeltaFileCache
+
+log = logging.getLogger(__name__)
+
+LOG_DIR = "_delta_log"
+LAST_CHECKPOINT = "_last_checkpoint"
+SOURCE_VERSION_TAG = "etl.sourceVersion"
+READ_THREADS = 16
+
+_COMMIT_RE = re.compile(r"^(\d{20})\.json$")
+_CHECKPOINT_RE = re.compile(r"^(\d{20})\.checkpoint(\.\d{10}\.\d{10})?\.parquet$")
+
+
+def _effective(version: int, tags) -> int:
+    """Versión de la etiqueta SOURCE_VERSION_TAG si la hay, si no `version`."""
+    if tags:
+        value = dict(tags).get(SOURCE_VERSION_TAG)
+        if value is not None:
+            return int(value)
+    return version
+
+
+class _LogReader:
+    """Objetos del _delta_log de una tabla, a través de `cache` si se indica."""
+
+    def __init__(self, dt: DeltaTable, storage_options: dict,
+                 cache: Optional[DeltaFileCache] = None):
+        self.table_uri = dt.table_uri
+        self.handler = DeltaStorageHandler(dt.table_uri, storage_options)
+        self.cache = cache
+        self._listing: Optional[dict] = None
+
+    @property
+    def listing(self) -> dict:
+        """nombre → FileInfo de los objetos del _delta_log (se lista una vez, al usarlo)."""
+        if self._listing is None:
+            self._listing = {info.path.rsplit("/", 1)[-1]: info for info in
+                             self.handler.get_file_info_selector(pafs.FileSelector(LOG_DIR))}
+        return self._listing
+
+    def _fetch(self, name: str) -> bytes:
+        with self.handler.open_input_stream(f"{LOG_DIR}/{name}") as fh:
+            return fh.read()
+
+    def read(self, name: str) -> bytes:
+        if self.cache is None:
+            return self._fetch(name)
+        info = (self._listing or {}).get(name)
+        if info is None:
+            info, = self.handler.get_file_info([f"{LOG_DIR}/{name}"])
+        # La fecha de modificación distingue un log recreado con los mismos nombres
+        return self.cache.read(f"{self.table_uri}/{LOG_DIR}/{name}",
+                               f"{info.size}:{info.mtime_ns}", lambda: self._fetch(name))
+
+    def last_checkpoint(self) -> Optional[dict]:
+        """Contenido de _last_checkpoint (mutable: nunca desde el caché), o None."""
+        try:
+            return json.loads(self._fetch(LAST_CHECKPOINT))
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+
+    def commits(self, max_version: int) -> List[int]:
+        versions = (int(m.group(1)) for m in map(_COMMIT_RE.match, self.listing) if m)
+        return sorted(v for v in versions if v <= max_version)
+
+    def checkpoint_parts(self, max_version: int) -> List[str]:
+        """Partes del checkpoint más reciente <= `max_version` ([] si no hay)."""
+        parts: Dict[int, List[str]] = {}
+        for name in self.listing:
+            match = _CHECKPOINT_RE.match(name)
+            if match and int(match.group(1)) <= max_version:
+                parts.setdefault(int(match.group(1)), []).append(name)
+        return sorted(parts[max(parts)]) if parts else []
+
+
+def _checkpoint_part_names(checkpoint: dict) -> List[str]:
+    version, parts = checkpoint["version"], checkpoint.get("parts")
+    if not parts:
+        return [f"{version:020d}.checkpoint.parquet"]
+    return [f"{version:020d}.checkpoint.{i:010d}.{parts:010d}.parquet"
+            for i in range(1, parts + 1)]
+
+
+def _commit_adds(payload: bytes) -> Iterator[Tuple[str, Optional[dict]]]:
+    """(path, tags) de cada add action de un commit JSON."""
+    for line in payload.decode("utf-8").splitlines():
+        if line.strip():
+            action = json.loads(line)
+            if "add" in action:
+                yield unquote(action["add"]["path"]), action["add"].get("tags")
+
+
+def _read_commits(reader: _LogReader, pool: ThreadPoolExecutor,
+                  commits: List[int]) -> Iterator[Tuple[int, bytes]]:
+    names = [f"{v:020d}.json" for v in commits]
+    return zip(commits, pool.map(reader.read, names))
+
+
+def file_versions(dt: DeltaTable, storage_options: dict,
+                  cache: Optional[DeltaFileCache] = None,
+                  paths: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    """Versión efectiva (ver módulo) de cada archivo de `paths` (default: dt.files())."""
+    version = dt.version()
+    wanted = set(dt.files()) if paths is None else set(paths)
+    reader = _LogReader(dt, storage_options, cache)
+
+    checkpoint = reader.last_checkpoint()
+    if checkpoint is not None and checkpoint["version"] <= version:
+        parts = _checkpoint_part_names(checkpoint)
+    else:
+        # Sin _last_checkpoint, o posterior a `dt` (time travel): se lista el log
+        parts = reader.checkpoint_parts(version)
+    first = int(parts[0][:20]) + 1 if parts else 0
+
+    versions: Dict[str, int] = {}
+    read_commits = 0
+    with ThreadPoolExecutor(max_workers=READ_THREADS) as pool:
+        # 1. Commits posteriores al checkpoint: el último add de cada archivo gana
+        after = list(range(first, version + 1))
+        for commit, payload in _read_commits(reader, pool, after):
+            for path, tags in _commit_adds(payload):
+                if path in wanted:
+                    versions[path] = _effective(commit, tags)
+        read_commits += len(after)
+
+        # 2. Checkpoint: archivos con la versión en su etiqueta
+        missing = wanted - versions.keys()
+        if missing and parts:
+            for name in parts:
+                adds = pq.read_table(io.BytesIO(reader.read(name)), columns=["add"]).column("add")
+                for add in adds.to_pylist():
+                    if add and add.get("tags") and unquote(add["path"]) in missing:
+                        versions[unquote(add["path"])] = _effective(-1, add["tags"])
+            missing -= versions.keys()
+
+        # 3. Commits anteriores al checkpoint, del más reciente hacia atrás
+        earlier = reader.commits(first - 1)[::-1] if missing else []
+        for start in range(0, len(earlier), READ_THREADS):
+            chunk = earlier[start:start + READ_THREADS]
+            for commit, payload in _read_commits(reader, pool, chunk):
+                for path, tags in _commit_adds(payload):
+                    if path in missing:
+                        versions[path] = _effective(commit, tags)
+                        missing.discard(path)
+            read_commits += len(chunk)
+            if not missing:
+                break
+
+    if missing:
+        log.info("  Versiones de archivo: %d archivo(s) de commits expirados (%s)",
+                 len(missing), parts[0] if parts else "sin checkpoint")
+    log.info("  Versiones de archivo: %d archivo(s), %d commit(s) leídos desde la versión %d",
+             len(wanted), read_commits, first)
+    # Sin commit legible: anteriores a todo lo conocido
+    for path in missing:
+        versions[path] = -1
+    return versions
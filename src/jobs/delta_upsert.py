@@ -0,0 +1,635 @@
+"""
+delta_upsert.py
+───────────────
+Upsert por clave (transaction_id) en una tabla Delta: las filas entrantes
+reemplazan a las existentes con la misma clave y el resto se insertan,
+en un solo commit. Solo se leen y reescriben los archivos que pueden
+contener alguna clave entrante, así que el costo depende del tamaño del
+lote y no del de la tabla.
+
+Selección de archivos:
+  1. Rango min/max de la clave en las estadísticas de cada archivo (add
+     actions del _delta_log): descarta los archivos cuyo rango no
+     contiene ninguna clave entrante.
+  2. Índice por archivo: un filtro de Bloom de los hashes de clave
+     (key_dedup.key_hash64) guardado junto a la tabla en
+     _key_index/<sha256 del path>.bloom. Descarta el resto salvo falsos
+     positivos (~1 % por clave buscada, que solo cuestan leer la columna
+     clave del archivo).
+  3. De los que quedan se lee la columna clave; los que sí contienen
+     alguna clave entrante se leen completos y se reescriben sin esas
+     filas.
+
+Los archivos nuevos (las filas sobrevivientes de cada archivo reescrito,
+por separado, y el lote) se escriben con su índice y el commit (remove de los reescritos + add de los nuevos) se
+publica con escritura condicional del siguiente _delta_log/N.json
+(ver object_writer). Si
+otro escritor publicó esa versión antes, se descartan los archivos
+escritos y se reintenta sobre la versión nueva. Las sobrevivientes se
+leen batch a batch y cada archivo nuevo se escribe en streaming a un
+temporal local antes de subirlo (ver write_data_files): la memoria
+depende del lote, no del tamaño de los archivos reescritos.
+
+Los archivos escritos por otros caminos (write_deltalake, OPTIMIZE de
+delta-rs) no tienen índice (los que compacta maintain_delta.py sí): se
+construye la primera vez que son candidatos leyendo solo la columna
+clave. Con una clave sin orden (rangos min/max que se
+solapan), el primer upsert indexa así toda la tabla.
+
+Uso:
+    result = upsert(table_uri, storage_options, table, key="transaction_id")
+    # {"rows_updated": ..., "rows_inserted": ..., "files_rewritten": ..., ...}
+
+Limitaciones:
+  - Solo tablas con protocolo lector 1 / escritor 2 (las que crea
+    write_deltalake): sin deletion vectors ni column mapping.
+  - Los índices de archivos eliminados por OPTIMIZE de delta-rs o VACUUM
+    no se borran solos; los de archivos reescritos por un upsert o por
+    maintain_delta.py sí.
+  - Cada archivo nuevo pasa por el directorio temporal local (TMPDIR)
+    hasta subirse: hace falta disco para un archivo por partición
+    abierta.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as pads
+import pyarrow.parquet as pq
+from deltalake import DeltaTable, write_deltalake
+from deltalake.exceptions import TableNotFoundError
+from deltalake.fs import DeltaStorageHandler
+from deltalake.writer import (DeltaJSONEncoder, get_file_stats_from_metadata,
+                              get_partitions_from_path)
+from pyarrow import fs as pafs
+
+from delta_cache import DeltaFileCache
+from delta_fs import content_tags, delta_filesystem
+from key_dedup import SEQ_COLUMN, key_hash64, latest_rows, mix64, sequence_array
+from run_report import count, span
+
+log = logging.getLogger(__name__)
+
+DEFAULT_KEY = "transaction_id"
+DEFAULT_MAX_ROWS_PER_FILE = 10 * 1024 * 1024
+COMMIT_RETRIES = 3
+KEY_INDEX_DIR = "_key_index"
+
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+BLOOM_CHUNK_KEYS = 256 * 1024
+_BLOOM_MAGIC = np.uint64(0x4B4559424C4F4F4D)   # "KEYBLOOM"
+_BLOOM_SALT = np.uint64(0x5BD1E9955BD1E995)
+_BLOOM_HEADER = 4                              # magic, bits, hashes, claves
+
+Payload = Union[bytes, BinaryIO]
+PutObject = Callable[..., None]                # ver object_writer
+
+
+class CommitConflict(RuntimeError):
+    """Otro escritor publicó la versión que intentábamos escribir."""
+
+
+# ──────────────────────────────────────────────────────────────
+# Filtro de Bloom por archivo
+# ──────────────────────────────────────────────────────────────
+def _bloom_positions(key_hashes: np.ndarray, num_bits: int, num_hashes: int) -> np.ndarray:
+    """Posiciones (num_hashes × claves) por doble hashing."""
+    step = mix64(key_hashes ^ _BLOOM_SALT) | np.uint64(1)
+    rounds = np.arange(num_hashes, dtype=np.uint64)[:, None]
+    return (key_hashes[None, :] + rounds * step[None, :]) % np.uint64(num_bits)
+
+
+def bloom_filter(key_hashes: np.ndarray) -> np.ndarray:
+    """Filtro serializable (uint64: cabecera + palabras de bits) de `key_hashes`."""
+    num_bits = max(64, -(-len(key_hashes) * BLOOM_BITS_PER_KEY // 64) * 64)
+    words = np.zeros(num_bits // 64, dtype=np.uint64)
+    # Por tramos: las posiciones ocupan BLOOM_HASHES × 8 bytes por clave
+    for start in range(0, len(key_hashes), BLOOM_CHUNK_KEYS):
+        chunk = key_hashes[start:start + BLOOM_CHUNK_KEYS]
+        positions = _bloom_positions(chunk, num_bits, BLOOM_HASHES).ravel()
+        np.bitwise_or.at(words, positions >> np.uint64(6),
+                         np.left_shift(np.uint64(1), positions & np.uint64(63)))
+    header = np.array([_BLOOM_MAGIC, num_bits, BLOOM_HASHES, len(key_hashes)], dtype=np.uint64)
+    return np.concatenate([header, words])
+
+
+def bloom_contains(bloom: np.ndarray, key_hashes: np.ndarray) -> np.ndarray:
+    """Para cada clave: False si seguro no está, True si puede estar."""
+    if len(bloom) < _BLOOM_HEADER or bloom[0] != _BLOOM_MAGIC:
+        raise ValueError("Índice de claves con formato inesperado")
+    num_bits, num_hashes = int(bloom[1]), int(bloom[2])
+    words = bloom[_BLOOM_HEADER:]
+    positions = _bloom_positions(key_hashes, num_bits, num_hashes)
+    bits = (words[positions >> np.uint64(6)] >> (positions & np.uint64(63))) & np.uint64(1)
+    return bits.all(axis=0)
+
+
+class KeyIndexStore:
+    """Filtros de Bloom por archivo de datos, en _key_index/ de la tabla."""
+
+    def __init__(self, fs: pafs.FileSystem, put: PutObject, table_uri: str,
+                 cache: Optional[DeltaFileCache] = None):
+        self.fs = fs
+        self.put = put
+        self.table_uri = table_uri
+        self.cache = cache
+
+    @staticmethod
+    def index_path(data_path: str) -> str:
+        digest = hashlib.sha256(data_path.encode()).hexdigest()[:32]
+        return f"{KEY_INDEX_DIR}/{digest}.bloom"
+
+    def _fetch(self, data_path: str) -> bytes:
+        with self.fs.open_input_stream(self.index_path(data_path)) as fh:
+            return fh.read()
+
+    def load(self, data_path: str, tag: str) -> Optional[np.ndarray]:
+        """
+        Filtro del archivo, o None si no tiene índice (o está incompleto).
+        `tag` es la etiqueta de caché del archivo de datos (ver
+        delta_fs.content_tags).
+        """
+        try:
+            if self.cache is not None:
+                payload = self.cache.read(f"{self.table_uri}/{self.index_path(data_path)}",
+                                          tag, lambda: self._fetch(data_path))
+            else:
+                payload = self._fetch(data_path)
+        except (FileNotFoundError, OSError):
+            return None
+        if len(payload) < _BLOOM_HEADER * 8 or len(payload) % 8:
+            return None
+        bloom = np.frombuffer(payload, dtype=np.uint64)
+        return bloom if bloom[0] == _BLOOM_MAGIC else None
+
+    def save(self, data_path: str, key_hashes: np.ndarray) -> np.ndarray:
+        bloom = bloom_filter(key_hashes)
+        self.put(self.index_path(data_path), bloom.tobytes())
+        return bloom
+
+    def delete(self, data_path: str) -> None:
+        try:
+            self.fs.delete_file(self.index_path(data_path))
+        except (FileNotFoundError, OSError):
+            pass
+
+
+# ──────────────────────────────────────────────────────────────
+# Selección de archivos
+# ──────────────────────────────────────────────────────────────
+def range_candidates(actions: pa.Table, key: str, keys: pa.Array) -> List[int]:
+    """Índices de los archivos cuyo rango min/max de `key` contiene alguna clave."""
+    if f"min.{key}" not in actions.column_names:
+        return list(range(actions.num_rows))
+    sorted_keys = np.array(pc.unique(keys.drop_null()).sort().to_pylist(), dtype=object)
+    if not len(sorted_keys):
+        return []
+    candidates = []
+    mins = actions.column(f"min.{key}").to_pylist()
+    maxs = actions.column(f"max.{key}").to_pylist()
+    for i, (low, high) in enumerate(zip(mins, maxs)):
+        if low is None or high is None:
+            candidates.append(i)     # sin estadísticas: hay que mirar el archivo
+            continue
+        start = np.searchsorted(sorted_keys, low, side="left")
+        end = np.searchsorted(sorted_keys, high, side="right")
+        if end > start:
+            candidates.append(i)
+    return candidates
+
+
+def _latest_per_key(data: pa.Table, key: str) -> pa.Table:
+    """Última fila de cada clave del lote (el lote puede traer repetidas)."""
+    with_seq = data.append_column(SEQ_COLUMN, sequence_array(0, 0, data.num_rows))
+    return latest_rows(with_seq, key).drop_columns([SEQ_COLUMN])
+
+
+# ──────────────────────────────────────────────────────────────
+# Escritura de archivos y commit
+# ──────────────────────────────────────────────────────────────
+def log_path(path: str) -> str:
+    """Path tal como va en el _delta_log (URI-encoded, '/' y '=' literales)."""
+    return quote(path, safe="/=")
+
+
+def _partition_dir(values: Dict[str, Optional[str]]) -> str:
+    return "/".join(f"{name}={quote(value, safe='') if value is not None else '__HIVE_DEFAULT_PARTITION__'}"
+                    for name, value in values.items())
+
+
+def _partition_groups(table: pa.Table, partition_columns: List[str]
+                      ) -> Iterator[Tuple[Dict[str, Optional[str]], pa.Table]]:
+    """(valores de partición, filas sin las columnas de partición) por partición."""
+    if not partition_columns:
+        yield {}, table
+        return
+    for values in table.select(partition_columns).group_by(partition_columns).aggregate([]).to_pylist():
+        mask = None
+        for name, value in values.items():
+            column = table.column(name)
+            part = pc.is_null(column) if value is None else pc.equal(column, value)
+            mask = part if mask is None else pc.and_(mask, part)
+        yield ({name: None if value is None else str(value) for name, value in values.items()},
+               table.filter(mask).drop_columns(partition_columns))
+
+
+class _DataFile:
+    """Archivo de datos en escritura: Parquet en un temporal local + hashes de clave."""
+
+    def __init__(self, path: str, values: Dict[str, Optional[str]], schema: pa.Schema):
+        fd, self.local = tempfile.mkstemp(suffix=".parquet")
+        os.close(fd)
+        self.path = path
+        self.values = values
+        self.rows = 0
+        self.key_hashes: List[np.ndarray] = []
+        self.writer = pq.ParquetWriter(self.local, schema)
+
+    def write(self, rows: pa.Table, key: Optional[str]) -> None:
+        self.writer.write_table(rows)
+        self.rows += rows.num_rows
+        if key is not None:
+            self.key_hashes.append(key_hash64(rows.column(key)))
+
+    def finish(self, put: PutObject, store: KeyIndexStore, num_indexed_cols: int) -> dict:
+        """Cierra el archivo, lo sube con su índice y devuelve la add action."""
+        self.writer.close()
+        try:
+            metadata = pq.read_metadata(self.local)
+            stats = get_file_stats_from_metadata(metadata, num_indexed_cols, None)
+            with open(self.local, "rb") as fh:
+                put(self.path, fh)
+            size = os.path.getsize(self.local)
+            if self.key_hashes:
+                store.save(self.path, np.concatenate(self.key_hashes))
+        finally:
+            os.remove(self.local)
+        return {
+            "path":             log_path(self.path),
+            "partitionValues":  self.values,
+            "size":             size,
+            "modificationTime": int(time.time() * 1000),
+            "dataChange":       True,
+            "stats":            json.dumps(stats, cls=DeltaJSONEncoder),
+        }
+
+    def discard(self) -> None:
+        try:
+            self.writer.close()
+        finally:
+            os.remove(self.local)
+
+
+def write_data_files(put: PutObject, store: KeyIndexStore, tables: Iterable[pa.Table],
+                     key: Optional[str],
+                     partition_columns: List[str], version: int, num_indexed_cols: int,
+                     max_rows_per_file: int) -> Iterator[dict]:
+    """
+    Escribe `tables` como archivos Parquet + índice; genera la add action
+    de cada archivo al subirlo.
+
+    Cada archivo se escribe en streaming con un ParquetWriter por
+    partición a un temporal local y se sube al cerrarse (al llegar a
+    `max_rows_per_file` filas o al terminar `tables`): en memoria quedan
+    la tabla en curso y los hashes de clave de los archivos abiertos (8
+    bytes por fila, para el índice), no el archivo completo. Con `key`
+    None los archivos se escriben sin índice.
+    """
+    prefix = f"{version}-{uuid.uuid4()}"
+    open_files: Dict[str, _DataFile] = {}
+    part = 0
+    try:
+        for table in tables:
+            for values, rows in _partition_groups(table, partition_columns):
+                directory = _partition_dir(values)
+                start = 0
+                while start < rows.num_rows:
+                    data_file = open_files.get(directory)
+                    if data_file is None:
+                        name = f"{prefix}-{part}.parquet"
+                        part += 1
+                        data_file = _DataFile(f"{directory}/{name}" if directory else name,
+                                              values, rows.schema)
+                        open_files[directory] = data_file
+                    chunk = rows.slice(start, max_rows_per_file - data_file.rows)
+                    data_file.write(chunk, key)
+                    start += chunk.num_rows
+                    if data_file.rows >= max_rows_per_file:
+                        del open_files[directory]
+                        yield data_file.finish(put, store, num_indexed_cols)
+        while open_files:
+            _, data_file = open_files.popitem()
+            yield data_file.finish(put, store, num_indexed_cols)
+    finally:
+        for data_file in open_files.values():
+            data_file.discard()
+
+
+def _option(storage_options: dict, *names: str) -> Optional[str]:
+    """Valor de la primera opción de `names` (sin distinguir mayúsculas)."""
+    lowered = {k.lower(): v for k, v in storage_options.items()}
+    for name in names:
+        if name in lowered:
+            return lowered[name]
+    return None
+
+
+def _split_bucket_uri(uri: str, scheme: str) -> Tuple[str, str]:
+    bucket, _, prefix = uri[len(scheme):].partition("/")
+    return bucket, prefix.strip("/")
+
+
+def object_writer(table_uri: str, storage_options: dict) -> PutObject:
+    """
+    put(path, payload, if_absent=False) para archivos relativos a la tabla;
+    `payload` son bytes o un archivo abierto en modo binario (se sube sin
+    cargarlo entero en memoria).
+
+    DeltaStorageHandler (deltalake 0.17) no escribe con pyarrow 14, así
+    que se usa el cliente nativo de cada almacenamiento. Con if_absent,
+    CommitConflict si el objeto ya existe (local: O_EXCL, GCS:
+    if_generation_match=0, ADLS: overwrite=False).
+    """
+    if table_uri.startswith("gs://"):
+        from google.api_core.exceptions import PreconditionFailed
+        from google.cloud import storage
+        bucket_name, prefix = _split_bucket_uri(table_uri, "gs://")
+        sa_key = _option(storage_options, "google_service_account",
+                         "google_service_account_path")
+        client = storage.Client.from_service_account_json(sa_key) if sa_key else storage.Client()
+        bucket = client.bucket(bucket_name)
+
+        def put(path: str, payload: Payload, if_absent: bool = False) -> None:
+            blob = bucket.blob(f"{prefix}/{path}" if prefix else path)
+            generation = 0 if if_absent else None
+            try:
+                if isinstance(payload, bytes):
+                    blob.upload_from_string(payload, if_generation_match=generation)
+                else:
+                    blob.upload_from_file(payload, if_generation_match=generation)
+            except PreconditionFailed:
+                raise CommitConflict(path) from None
+        return put
+
+    if table_uri.startswith(("az://", "abfss://")):
+        from azure.core.exceptions import ResourceExistsError
+        from azure.storage.blob import BlobServiceClient
+        if table_uri.startswith("abfss://"):
+            container, prefix = _split_bucket_uri(table_uri, "abfss://")
+            container = container.split("@")[0]
+        else:
+            container, prefix = _split_bucket_uri(table_uri, "az://")
+        account = _option(storage_options, "account_name", "azure_storage_account_name")
+        service = BlobServiceClient(f"https://{account}.blob.core.windows.net",
+                                    credential=_option(storage_options, "account_key",
+                                                       "access_key", "azure_storage_account_key"))
+        client = service.get_container_client(container)
+
+        def put(path: str, payload: Payload, if_absent: bool = False) -> None:
+            try:
+                client.upload_blob(f"{prefix}/{path}" if prefix else path, payload,
+                                   overwrite=not if_absent)
+            except ResourceExistsError:
+                raise CommitConflict(path) from None
+        return put
+
+    if "://" not in table_uri or table_uri.startswith("file://"):
+        root = table_uri[len("file://"):] if table_uri.startswith("file://") else table_uri
+
+        def put(path: str, payload: Payload, if_absent: bool = False) -> None:
+            target = os.path.join(root, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            flags = os.O_WRONLY | os.O_CREAT | (os.O_EXCL if if_absent else os.O_TRUNC)
+            try:
+                fd = os.open(target, flags, 0o644)
+            except FileExistsError:
+                raise CommitConflict(path) from None
+            with os.fdopen(fd, "wb") as fh:
+                if isinstance(payload, bytes):
+                    fh.write(payload)
+                else:
+                    shutil.copyfileobj(payload, fh)
+        return put
+
+    raise ValueError(f"Esquema de URI no soportado para upsert: {table_uri}")
+
+
+def commit(put: PutObject, read_version: int, adds: List[dict], removes: List[dict], metrics: dict, key: str) -> int:
+    """Publica un commit MERGE con `removes` + `adds`; devuelve la versión nueva."""
+    return publish(put, read_version, "MERGE",
+                   {"predicate": f"target.{key} = source.{key}"}, metrics, adds, removes)
+
+
+def publish(put: PutObject, read_version: int, operation: str, parameters: dict, metrics: dict,
+            adds: List[dict], removes: List[dict], data_change: bool = True) -> int:
+    """
+    Publica el commit `read_version` + 1 (`removes` + `adds`, con
+    escritura condicional: CommitConflict si ya existe) y devuelve su
+    versión. Sin `data_change` (reescrituras que no cambian filas, como
+    la compactación) los removes van con dataChange false; las adds
+    llevan el suyo.
+    """
+    now = int(time.time() * 1000)
+    actions = [{"commitInfo": {
+        "timestamp":           now,
+        "operation":           operation,
+        "operationParameters": parameters,
+        "operationMetrics":    metrics,
+        "readVersion":         read_version,
+        "isBlindAppend":       not removes,
+        "clientVersion":       "delta_upsert",
+    }}]
+    actions += [{"remove": {
+        "path":                 action["path"],
+        "deletionTimestamp":    now,
+        "dataChange":           data_change,
+        "extendedFileMetadata": True,
+        "partitionValues":      action["partitionValues"],
+        "size":                 action["size"],
+    }} for action in removes]
+    actions += [{"add": action} for action in adds]
+    version = read_version + 1
+    payload = "\n".join(json.dumps(a) for a in actions).encode() + b"\n"
+    put(f"_delta_log/{version:020d}.json", payload, if_absent=True)
+    return version
+
+
+# ──────────────────────────────────────────────────────────────
+# Upsert
+# ──────────────────────────────────────────────────────────────
+def _upsert_once(dt: DeltaTable, storage_options: dict, data: pa.Table, key: str,
+                 cache: Optional[DeltaFileCache], max_rows_per_file: int) -> dict:
+    protocol = dt.protocol()
+    if protocol.min_reader_version > 1 or protocol.min_writer_version > 2:
+        raise ValueError(f"Protocolo Delta no soportado para upsert: {protocol}")
+
+    version = dt.version()
+    schema = dt.schema().to_pyarrow()
+    partition_columns = list(dt.metadata().partition_columns)
+    num_indexed_cols = int(dt.metadata().configuration.get(
+        "delta.dataSkippingNumIndexedCols") or 32)
+    data = data.select(schema.names).cast(schema)
+    keys = data.column(key).combine_chunks().drop_null()
+    key_hashes = key_hash64(keys)
+
+    handler_fs = pafs.PyFileSystem(DeltaStorageHandler(dt.table_uri, storage_options))
+    put = object_writer(dt.table_uri, storage_options)
+    store = KeyIndexStore(handler_fs, put, dt.table_uri, cache)
+    actions = dt.get_add_actions(flatten=True)
+    paths = actions.column("path").to_pylist()
+    sizes = actions.column("size_bytes").to_pylist()
+    tags = content_tags(actions)
+
+    result = {"files": len(paths), "files_in_range": 0, "files_bloom": 0,
+              "files_rewritten": 0, "bloom_false_positives": 0, "key_index_built": 0,
+              "rows_updated": 0, "rows_inserted": 0, "rows_rewritten": 0}
+
+    with span("upsert_select") as s:
+        in_range = range_candidates(actions, key, keys)
+        result["files_in_range"] = len(in_range)
+        source = dt.to_pyarrow_dataset(
+            filesystem=delta_filesystem(dt, storage_options, cache=cache))
+        fragments = {f.path: f for f in source.get_fragments()}
+
+        def file_dataset(path: str) -> pads.FileSystemDataset:
+            return pads.FileSystemDataset([fragments[path]], source.schema, source.format,
+                                          source.filesystem)
+
+        maybe = []
+        for i in in_range:
+            path = paths[i]
+            bloom = store.load(path, tags[path])
+            if bloom is None:
+                column = file_dataset(path).to_table(columns=[key]).column(key)
+                bloom = store.save(path, key_hash64(column))
+                result["key_index_built"] += 1
+            if bloom_contains(bloom, key_hashes).any():
+                maybe.append(i)
+        result["files_bloom"] = len(maybe)
+        s["files"] = len(maybe)
+
+    rewrite, removes, matched = [], [], []
+    with span("upsert_read") as s:
+        for i in maybe:
+            path = paths[i]
+            # Primero solo la clave: con lotes grandes casi todo archivo da
+            # positivo en el filtro y la mayoría son falsos positivos
+            file_keys = file_dataset(path).to_table(columns=[key]).column(key)
+            hit = pc.is_in(file_keys, value_set=keys)
+            if not pc.any(hit).as_py():
+                result["bloom_false_positives"] += 1
+                continue
+            matched.append(file_keys.filter(hit))
+            rewrite.append(path)
+            removes.append({"path": log_path(path), "size": sizes[i],
+                            "partitionValues": get_partitions_from_path(path)[1]})
+        s["files"] = len(removes)
+    result["files_rewritten"] = len(removes)
+    if matched:
+        found = pc.is_in(keys, value_set=pa.chunked_array(matched).combine_chunks())
+        result["rows_updated"] = pc.sum(found).as_py() or 0
+    result["rows_inserted"] = data.num_rows - result["rows_updated"]
+
+    def survivors(path: str) -> Iterator[pa.Table]:
+        """Filas de `path` sin las claves entrantes, batch a batch."""
+        constants = pads.get_partition_keys(fragments[path].partition_expression)
+        # ParquetFile y no el scanner del dataset: el scanner sigue leyendo
+        # por adelantado mientras se escribe y junta buena parte del archivo
+        with source.filesystem.open_input_file(path) as fh:
+            for batch in pq.ParquetFile(fh).iter_batches():
+                kept = batch.filter(pc.invert(pc.is_in(batch.column(key), value_set=keys)))
+                result["rows_rewritten"] += kept.num_rows
+                if not kept.num_rows:
+                    continue
+                kept = pa.Table.from_batches([kept])
+                for field in schema:
+                    # Columnas de partición (van en el path) o ausentes en el archivo
+                    if field.name not in kept.column_names:
+                        value = pa.scalar(constants.get(field.name)).cast(field.type)
+                        kept = kept.append_column(field.name, pa.repeat(value, kept.num_rows))
+                yield kept.select(schema.names).cast(schema)
+
+    adds = []
+    try:
+        with span("upsert_write") as s:
+            # Las sobrevivientes de cada archivo van a su propio archivo: así se
+            # conserva la agrupación (y los rangos min/max) de la tabla y el
+            # próximo upsert sigue tocando pocos archivos
+            for tables in [survivors(path) for path in rewrite] + [[data]]:
+                for action in write_data_files(put, store, tables, key, partition_columns,
+                                               version + 1, num_indexed_cols, max_rows_per_file):
+                    adds.append(action)
+            s["files"] = len(adds)
+
+        metrics = {
+            "numTargetRowsUpdated":  result["rows_updated"],
+            "numTargetRowsInserted": result["rows_inserted"],
+            "numTargetRowsCopied":   result["rows_rewritten"],
+            "numTargetFilesRemoved": len(removes),
+            "numTargetFilesAdded":   len(adds),
+        }
+        with span("upsert_commit"):
+            result["version"] = commit(put, version, adds, removes, metrics, key)
+    except BaseException:
+        # Archivos sin commit: nadie los referencia
+        for action in adds:
+            path = unquote(action["path"])
+            store.delete(path)
+            try:
+                handler_fs.delete_file(path)
+            except (FileNotFoundError, OSError):
+                pass
+        raise
+    for action in removes:
+        store.delete(unquote(action["path"]))
+    return result
+
+
+def upsert(table_uri: str, storage_options: dict, data: pa.Table, key: str = DEFAULT_KEY,
+           partition_by: Optional[List[str]] = None, configuration: Optional[dict] = None,
+           cache: Optional[DeltaFileCache] = None,
+           max_rows_per_file: int = DEFAULT_MAX_ROWS_PER_FILE) -> dict:
+    """
+    Upsert de `data` por `key` en la tabla Delta `table_uri` (la crea si
+    no existe, con `partition_by` y `configuration`). Devuelve métricas.
+    """
+    data = _latest_per_key(data, key)
+    for attempt in range(1, COMMIT_RETRIES + 1):
+        try:
+            dt = DeltaTable(table_uri, storage_options=storage_options)
+        except TableNotFoundError:
+            write_deltalake(table_uri, data, mode="append", partition_by=partition_by,
+                            storage_options=storage_options, configuration=configuration)
+            log.info("  Upsert: tabla nueva con %d filas", data.num_rows)
+            count("upsert_rows_inserted", data.num_rows)
+            return {"rows_updated": 0, "rows_inserted": data.num_rows, "files_rewritten": 0}
+        try:
+            result = _upsert_once(dt, storage_options, data, key, cache, max_rows_per_file)
+        except CommitConflict:
+            log.warning("  Upsert: la versión %d ya existe (escritor concurrente) — reintento %d/%d",
+                        dt.version() + 1, attempt, COMMIT_RETRIES)
+            continue
+        log.info("  Upsert v%d: %d actualizadas, %d insertadas | archivos: %d → %d por rango, "
+                 "%d por índice, %d reescritos (%d falsos positivos, %d índices creados)",
+                 result["version"], result["rows_updated"], result["rows_inserted"],
+                 result["files"], result["files_in_range"], result["files_bloom"],
+                 result["files_rewritten"], result["bloom_false_positives"],
+                 result["key_index_built"])
+        for name in ("rows_updated", "rows_inserted", "rows_rewritten", "files_in_range",
+                     "files_bloom", "files_rewritten", "bloom_false_positives",
+                     "key_index_built"):
+            count(f"upsert_{name}", result[name])
+        return result
+    raise CommitConflict(f"Upsert sin éxito tras {COMMIT_RETRIES} intentos en {table_uri}")
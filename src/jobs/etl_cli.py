@@ -0,0 +1,108 @@
+"""
+etl_cli.py
+──────────
+Punto de entrada único de la imagen: un subcomando por job.
+
+    create-delta → create_delta_data.py   (variables de entorno)
+    refresh      → refresh_biglake.py
+    omni         → create_biglake_omni.py (variables de entorno)
+    merge        → run_merge.py
+    maintain     → maintain_delta.py
+    watch        → watch_delta.py
+    pipelines    → run_pipelines.py
+
+El CLI solo importa la biblioteca estándar: el módulo del subcomando (y
+con él pyarrow, deltalake o google-cloud-*) se carga recién al ejecutarlo,
+así que cada job paga el arranque de sus propias dependencias y no el de
+todas. El subcomando corre como si fuera `python <script>.py ...`, con el
+mismo manejo de errores y código de salida.
+
+Uso:
+    python etl_cli.py refresh --gcs-bucket ... --delta-path ... [...]
+    python etl_cli.py merge --help
+    python etl_cli.py create-delta --help   # docstring, sin importar el job
+
+Sin subcomando (o si el primer argumento es una opción) se usa
+ETL_COMMAND, por defecto "refresh": los Cloud Run Jobs existentes que
+pasan solo los argumentos de refresh_biglake.py siguen funcionando.
+
+Tiempos de import y de arranque por subcomando:
+    python src/benchmarks/bench_cold_start.py
+
+Limitaciones:
+  - create-delta y omni se configuran solo por variables de entorno; no
+    aceptan argumentos (salvo --help).
+"""
+
+import ast
+import os
+import runpy
+import sys
+from typing import List, Optional
+
+# subcomando → (módulo, configurado por variables de entorno)
+COMMANDS = {
+    "create-delta": ("create_delta_data", True),
+    "refresh":      ("refresh_biglake", False),
+    "omni":         ("create_biglake_omni", True),
+    "merge":        ("run_merge", False),
+    "maintain":     ("maintain_delta", False),
+    "watch":        ("watch_delta", False),
+    "pipelines":    ("run_pipelines", False),
+}
+DEFAULT_COMMAND = "refresh"
+HELP_FLAGS = ("-h", "--help")
+
+JOBS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def usage() -> str:
+    width = max(len(name) for name in COMMANDS)
+    lines = [f"uso: {os.path.basename(sys.argv[0])} <subcomando> [args...]", "", "subcomandos:"]
+    lines += [f"  {name:<{width}}  {module}.py" for name, (module, _) in COMMANDS.items()]
+    lines += ["", f"Sin subcomando se usa ETL_COMMAND (default: {DEFAULT_COMMAND})."]
+    return "\n".join(lines)
+
+
+def module_doc(module: str) -> str:
+    """Docstring del script sin importarlo (ni sus dependencias)."""
+    with open(os.path.join(JOBS_DIR, f"{module}.py"), encoding="utf-8") as fh:
+        return ast.get_docstring(ast.parse(fh.read())) or ""
+
+
+def resolve(argv: List[str]):
+    """(subcomando, argumentos restantes) para `argv` (sin el nombre del programa)."""
+    if argv and not argv[0].startswith("-"):
+        return argv[0], argv[1:]
+    if argv and argv[0] in HELP_FLAGS:
+        return None, argv
+    return os.environ.get("ETL_COMMAND") or DEFAULT_COMMAND, argv
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    command, rest = resolve(argv)
+    if command is None:
+        print(usage())
+        return
+    if command not in COMMANDS:
+        sys.exit(f"Subcomando desconocido: {command}\n\n{usage()}")
+
+    module, env_driven = COMMANDS[command]
+    if env_driven and rest:
+        if rest[0] in HELP_FLAGS:
+            print(module_doc(module))
+            return
+        sys.exit(f"{command} se configura con variables de entorno y no acepta "
+                 f"argumentos: {' '.join(rest)}")
+
+    if JOBS_DIR not in sys.path:
+        sys.path.insert(0, JOBS_DIR)
+    # alter_sys: el job queda como __main__ igual que al correr su script
+    # (ProcessPoolExecutor de create_delta_data resuelve funciones por ahí)
+    sys.argv = [sys.argv[0], *rest]
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+
+
+if __name__ == "__main__":
+    main()
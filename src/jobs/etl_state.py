@@ -0,0 +1,142 @@
+"""
+etl_state.py
+────────────
+Estado persistente mínimo entre ejecuciones de los jobs (watermark de la
+última versión Delta procesada, etc.), guardado como un documento JSON.
+
+La ubicación se indica con una URI:
+
+  gs://<bucket>/<ruta>.json   → blob en GCS (Cloud Run no tiene disco persistente)
+  /ruta/local/<archivo>.json  → archivo local (desarrollo, volúmenes montados)
+
+Un estado inexistente se trata como vacío ({}): la primera ejecución
+siempre hace una carga completa.
+
+RunCheckpoint guarda además las etapas ya terminadas de una ejecución
+(identificada por su run id, p. ej. CLOUD_RUN_EXECUTION, que se conserva
+entre reintentos de la misma tarea): un reintento retoma en la primera
+etapa sin terminar con los valores que dejaron las anteriores. Al
+terminar la ejecución el registro se marca como cerrado (finish): otra
+ejecución con el mismo run id (watch_delta.py corre run_merge.run en
+cada versión nueva dentro de la misma ejecución de Cloud Run) empieza de
+cero en vez de dar todo por hecho.
+"""
+
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timezone
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+
+def _split_gcs_uri(uri: str):
+    bucket, _, blob_name = uri[len("gs://"):].partition("/")
+    if not bucket or not blob_name:
+        raise ValueError(f"URI de estado GCS inválida: {uri}")
+    return bucket, blob_name
+
+
+def read_state(uri: str) -> dict:
+    """Devuelve el estado guardado en `uri`, o {} si todavía no existe."""
+    if uri.startswith("gs://"):
+        from google.cloud import storage
+        bucket_name, blob_name = _split_gcs_uri(uri)
+        blob = storage.Client().bucket(bucket_name).blob(blob_name)
+        if not blob.exists():
+            log.info("Estado %s no existe aún — se parte de cero.", uri)
+            return {}
+        return json.loads(blob.download_as_text())
+
+    if not os.path.exists(uri):
+        log.info("Estado %s no existe aún — se parte de cero.", uri)
+        return {}
+    with open(uri, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def write_json(uri: str, payload: dict) -> None:
+    """Escribe `payload` como JSON en `uri` (gs:// o local) reemplazando el anterior."""
+    text = json.dumps(payload, indent=2, sort_keys=True, default=str)
+
+    if uri.startswith("gs://"):
+        from google.cloud import storage
+        bucket_name, blob_name = _split_gcs_uri(uri)
+        blob = storage.Client().bucket(bucket_name).blob(blob_name)
+        blob.upload_from_string(text, content_type="application/json")
+    else:
+        # Escritura atómica: un fallo a mitad no deja un JSON truncado
+        directory = os.path.dirname(os.path.abspath(uri))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(text)
+        os.replace(tmp_path, uri)
+
+
+def write_state(uri: str, state: dict) -> None:
+    """Guarda `state` en `uri` reemplazando el documento anterior."""
+    write_json(uri, state)
+    log.info("Estado guardado en %s", uri)
+
+
+def default_run_id() -> Optional[str]:
+    """Id de la ejecución de Cloud Run (igual en todos los reintentos de una tarea)."""
+    execution = os.environ.get("CLOUD_RUN_EXECUTION")
+    if not execution:
+        return None
+    task = os.environ.get("CLOUD_RUN_TASK_INDEX", "0")
+    return execution if task == "0" else f"{execution}/{task}"
+
+
+class RunCheckpoint:
+    """
+    Etapas terminadas de una ejecución, en `uri`. El registro vale solo
+    para el mismo `run_id` y la misma `key` (tabla, destino, parámetros
+    que cambian el resultado); si no coinciden se empieza de cero. Sin
+    `uri` o sin `run_id` no guarda nada y ninguna etapa cuenta como hecha.
+    """
+
+    def __init__(self, uri: Optional[str], run_id: Optional[str], key: dict):
+        if uri and not run_id:
+            log.warning("Sin id de ejecución (CLOUD_RUN_EXECUTION / --run-id): "
+                        "no se guardan las etapas terminadas en %s", uri)
+        self.uri = uri if run_id else None
+        self.run_id = run_id
+        self.key = key
+        record = read_state(self.uri) if self.uri else {}
+        self.resumed = (record.get("run_id") == run_id
+                        and record.get("key") == json.loads(json.dumps(key, default=str))
+                        and bool(record.get("stages"))
+                        and not record.get("finished_at"))
+        if self.resumed:
+            self.record = record
+            log.info("Reintento de la ejecución %s — etapas ya terminadas: %s",
+                     run_id, ", ".join(record["stages"]))
+        else:
+            self.record = {"run_id": run_id, "key": key, "stages": {}}
+
+    def done(self, stage: str) -> Optional[dict]:
+        """Valores guardados por `stage` si ya terminó, o None."""
+        return self.record["stages"].get(stage)
+
+    def complete(self, stage: str, **values) -> None:
+        if not self.uri:
+            return
+        values["completed_at"] = datetime.now(timezone.utc).isoformat()
+        self.record["stages"][stage] = values
+        write_json(self.uri, self.record)
+
+    def finish(self) -> None:
+        """Cierra el registro: ya no hay nada que retomar con este run id."""
+        if not self.uri:
+            return
+        self.record["finished_at"] = datetime.now(timezone.utc).isoformat()
+        write_json(self.uri, self.record)
+
+    def discard(self, *stages: str) -> None:
+        """Olvida `stages` (p. ej. si lo que produjeron ya no es válido)."""
+        for stage in stages:
+            self.record["stages"].pop(stage, None)
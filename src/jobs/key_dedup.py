@@ -0,0 +1,225 @@
+"""
+key_dedup.py
+────────────
+Deduplicación "la última fila gana" por clave, vectorizada con Arrow.
+
+Cada fila lleva una secuencia uint64 (columna SEQ_COLUMN) que ordena las
+versiones de una misma clave: (rango del archivo << ROW_BITS) | fila dentro
+del archivo. Para una tabla Delta el rango del archivo sale de la versión
+del commit que lo agregó (ver file_sequence en run_merge.py y
+delta_log.py), no de su fecha de modificación, así que la fila de un commit
+posterior reemplaza a la de uno anterior y, dentro de un archivo, la
+última fila escrita gana.
+
+Si las filas no caben en el presupuesto de memoria, se reparten por hash
+de la clave en particiones que se escriben en disco como archivos Arrow
+IPC; cada partición contiene todas las versiones de sus claves, así que
+se deduplica por separado leyéndola con memory map.
+
+Las filas con clave nula no se deduplican (el MERGE nunca las empareja).
+"""
+
+import logging
+import math
+import os
+import shutil
+import tempfile
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+
+log = logging.getLogger(__name__)
+
+SEQ_COLUMN = "_seq"
+ROW_BITS = 40
+DEFAULT_PARTITIONS = 64
+MAX_PARTITIONS = 1024
+
+_HASH_PRIME = np.uint64(0x100000001B3)
+_HASH_SEED = np.uint64(0xCBF29CE484222325)
+_NULL_HASH = np.uint64(0x9E3779B97F4A7C15)
+
+
+def mix64(x: np.ndarray) -> np.ndarray:
+    """Finalizador splitmix64: difunde todos los bits de entrada."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _hash_binary(array: pa.Array) -> np.ndarray:
+    """Hash polinómico de cada string, sin bucles por fila."""
+    n = len(array)
+    offset_type = np.int64 if pa.types.is_large_string(array.type) or \
+        pa.types.is_large_binary(array.type) else np.int32
+    _, offsets_buf, data_buf = array.buffers()
+    offsets = np.frombuffer(offsets_buf, dtype=offset_type, count=n + 1,
+                            offset=array.offset * np.dtype(offset_type).itemsize).astype(np.int64)
+    first, last = int(offsets[0]), int(offsets[-1])
+    lengths = np.diff(offsets)
+    hashes = lengths.astype(np.uint64) * _HASH_PRIME + _HASH_SEED
+    if last > first:
+        data = np.frombuffer(data_buf, dtype=np.uint8)[first:last].astype(np.uint64)
+        starts = offsets[:-1] - first
+        position = np.arange(last - first) - np.repeat(starts, lengths)
+        powers = np.cumprod(np.full(int(lengths.max()), _HASH_PRIME, dtype=np.uint64))
+        contrib = data * powers[position]
+        non_empty = lengths > 0
+        hashes[non_empty] += np.add.reduceat(contrib, starts[non_empty])
+    return hashes
+
+
+def key_hash64(values) -> np.ndarray:
+    """Hash uint64 estable (entre procesos y ejecuciones) de cada valor."""
+    if isinstance(values, pa.ChunkedArray):
+        if values.num_chunks == 0:
+            return np.empty(0, dtype=np.uint64)
+        return np.concatenate([key_hash64(chunk) for chunk in values.chunks])
+
+    t = values.type
+    if pa.types.is_integer(t) or pa.types.is_temporal(t):
+        raw = np.asarray(values.cast(pa.int64()).fill_null(0)).view(np.uint64)
+    else:
+        if not (pa.types.is_string(t) or pa.types.is_large_string(t)
+                or pa.types.is_binary(t) or pa.types.is_large_binary(t)):
+            values = values.cast(pa.string())
+        raw = _hash_binary(values)
+    hashes = mix64(raw)
+    if values.null_count:
+        hashes[np.asarray(values.is_null())] = _NULL_HASH
+    return hashes
+
+
+def sequence_array(file_rank: int, first_row: int, num_rows: int) -> pa.Array:
+    """Secuencias de `num_rows` filas consecutivas de un archivo."""
+    base = (file_rank << ROW_BITS) + first_row
+    return pa.array(np.arange(base, base + num_rows, dtype=np.uint64))
+
+
+def latest_rows(table: pa.Table, key: str, seq_column: str = SEQ_COLUMN) -> pa.Table:
+    """Filas con la secuencia máxima de su clave (orden original conservado)."""
+    if table.num_rows == 0:
+        return table
+    winners = table.group_by(key).aggregate([(seq_column, "max")]).column(f"{seq_column}_max")
+    keep = pc.is_in(table.column(seq_column), value_set=winners.combine_chunks())
+    return table.filter(pc.or_(keep, pc.is_null(table.column(key))))
+
+
+class LatestRowDeduplicator:
+    """
+    Acumula batches con SEQ_COLUMN y devuelve las filas ganadoras por `key`.
+
+    Con `memory_budget_bytes`, al superarlo pasa a particionar por hash de la
+    clave en archivos IPC bajo `spill_dir` (default: directorio temporal del
+    sistema). `expected_rows` (filas totales estimadas) dimensiona el número
+    de particiones para que cada una quepa en el presupuesto.
+    """
+
+    def __init__(self, key: str, memory_budget_bytes: Optional[int] = None,
+                 spill_dir: Optional[str] = None, expected_rows: Optional[int] = None):
+        self.key = key
+        self.memory_budget_bytes = memory_budget_bytes
+        self.spill_dir = spill_dir
+        self.expected_rows = expected_rows
+        self.rows_in = 0
+        self.rows_out = 0
+        self.spilled_bytes = 0
+        self.partitions = 0
+        self._buffer: List[pa.RecordBatch] = []
+        self._buffered_bytes = 0
+        self._schema: Optional[pa.Schema] = None
+        self._dir: Optional[str] = None
+        self._writers: List[Optional[ipc.RecordBatchFileWriter]] = []
+
+    @property
+    def spilled(self) -> bool:
+        return self._dir is not None
+
+    def add(self, batch: pa.RecordBatch) -> None:
+        if batch.num_rows == 0:
+            return
+        self._schema = self._schema or batch.schema
+        self.rows_in += batch.num_rows
+        if self.spilled:
+            self._write_partitioned(batch)
+            return
+        self._buffer.append(batch)
+        self._buffered_bytes += batch.nbytes
+        if self.memory_budget_bytes and self._buffered_bytes > self.memory_budget_bytes:
+            self._spill()
+
+    def _partition_count(self) -> int:
+        if not self.expected_rows:
+            return DEFAULT_PARTITIONS
+        buffered_rows = sum(b.num_rows for b in self._buffer)
+        expected_bytes = self.expected_rows * self._buffered_bytes / buffered_rows
+        # Margen para la tabla deduplicada y el hash de agrupación
+        wanted = math.ceil(2 * expected_bytes / self.memory_budget_bytes)
+        return min(max(wanted, 2), MAX_PARTITIONS)
+
+    def _spill(self) -> None:
+        self.partitions = self._partition_count()
+        self._dir = tempfile.mkdtemp(prefix="dedup_", dir=self.spill_dir)
+        self._writers = [None] * self.partitions
+        log.info("  Dedup: %.1f MB superan el presupuesto — %d particiones en %s",
+                 self._buffered_bytes / 1024 / 1024, self.partitions, self._dir)
+        buffer, self._buffer, self._buffered_bytes = self._buffer, [], 0
+        for batch in buffer:
+            self._write_partitioned(batch)
+
+    def _partition_path(self, partition: int) -> str:
+        return os.path.join(self._dir, f"part-{partition:04d}.arrow")
+
+    def _write_partitioned(self, batch: pa.RecordBatch) -> None:
+        partition_of = key_hash64(batch.column(self.key)) % np.uint64(self.partitions)
+        order = np.argsort(partition_of, kind="stable")
+        bounds = np.searchsorted(partition_of[order], np.arange(self.partitions + 1))
+        ordered = batch.take(pa.array(order))
+        for partition in np.flatnonzero(np.diff(bounds)):
+            start, end = bounds[partition], bounds[partition + 1]
+            writer = self._writers[partition]
+            if writer is None:
+                writer = self._writers[partition] = ipc.new_file(
+                    self._partition_path(partition), self._schema)
+            piece = ordered.slice(start, end - start)
+            writer.write_batch(piece)
+            self.spilled_bytes += piece.nbytes
+
+    def results(self) -> Iterator[pa.Table]:
+        """Tablas deduplicadas: una en memoria, o una por partición en disco."""
+        try:
+            if not self.spilled:
+                if self._buffer:
+                    table = latest_rows(pa.Table.from_batches(self._buffer), self.key)
+                    self._buffer, self._buffered_bytes = [], 0
+                    self.rows_out += table.num_rows
+                    yield table
+                return
+
+            for writer in self._writers:
+                if writer is not None:
+                    writer.close()
+            for partition, writer in enumerate(self._writers):
+                if writer is None:
+                    continue
+                path = self._partition_path(partition)
+                with pa.memory_map(path) as source:
+                    table = latest_rows(ipc.open_file(source).read_all(), self.key)
+                os.remove(path)
+                self.rows_out += table.num_rows
+                yield table
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        for writer in self._writers:
+            if writer is not None:
+                writer.close()
+        self._writers = []
+        if self._dir:
+            shutil.rmtree(self._dir, ignore_errors=True)
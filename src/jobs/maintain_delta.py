@@ -0,0 +1,619 @@
+"""
+maintain_delta.py
+─────────────────
+Mantenimiento de la tabla Delta que escriben create_delta_data.py y los
+jobs de ingesta: cada append de write_deltalake deja uno o pocos
+archivos pequeños y el _delta_log crece un commit por escritura. Con el
+tiempo las lecturas de run_merge.py y la tabla externa Omni
+(create_biglake_omni.py) pagan una petición por archivo y un replay de
+log cada vez más largo.
+
+Pasos, en orden:
+  1. compact     bin-packing de archivos pequeños hasta --target-file-mb
+                 (los archivos ya grandes no se tocan). Cada archivo nuevo
+                 junta archivos consecutivos en orden de commit de una
+                 partición, con sus filas en ese orden (ver "Orden de
+                 commit")
+  2. z-order     opcional (--z-order customer_id,transaction_date), en
+                 lugar de compact: reescribe todos los archivos de cada
+                 partición, ya con el tamaño objetivo, ordenados por la
+                 curva Z de esas columnas, así las estadísticas min/max de
+                 cada archivo descartan más archivos al filtrar por
+                 cliente o fecha. Las columnas de partición se ignoran (ya
+                 podan por ruta). Las particiones con varias filas por
+                 --dedup-key se compactan en su lugar
+  3. checkpoint  escribe un checkpoint Parquet si hay --checkpoint-interval
+                 commits o más desde el último; con --cleanup-log además
+                 borra los commits JSON anteriores al checkpoint que
+                 delta-rs considera expirados (en 0.17 no respeta siempre
+                 delta.logRetentionDuration: se pierde el time travel a
+                 esas versiones). Si el checkpoint falla, el job falla
+  4. vacuum      borra los archivos ya no referenciados con más de
+                 --retention-hours (default: delta.deletedFileRetentionDuration
+                 de la tabla, 7 días). Menos de 168 h exige
+                 --allow-short-retention (delta-rs lo rechaza si no)
+
+Compact y z-order no usan el OPTIMIZE de delta-rs: en 0.17 escribe las
+estadísticas min/max de las columnas decimales (amount) como número en
+lugar de texto y ningún checkpoint posterior puede leerlas ("expected
+decimal got 45.75"). Los archivos se escriben con el mismo camino que
+delta_upsert.py (write_data_files: estadísticas desde los metadatos
+Parquet, índice Bloom de --dedup-key) y se publican en un solo commit
+OPTIMIZE con escritura condicional; si otro escritor publicó antes esa
+versión, se descartan y se reintenta sobre la nueva.
+
+Orden de commit:
+  La dedup "última fila gana" de run_merge.py ordena las versiones de una
+  clave por la versión del commit de cada archivo (delta_log.py) y,
+  dentro de un archivo, por fila. Un archivo compactado lleva en la
+  etiqueta etl.sourceVersion de su add action la versión de su archivo
+  fuente más reciente y, como modificationTime, el de ese archivo; sus
+  filas van en orden de commit y solo junta archivos consecutivos de su
+  partición (ningún archivo que queda fuera tiene una versión intermedia),
+  así que para cada clave gana la misma fila que antes. Z-order reordena
+  las filas: solo se aplica en particiones con una fila por clave.
+
+Antes y después se reportan archivos activos, bytes, archivos pequeños y
+commits desde el último checkpoint (log + reporte de ejecución). Con
+--dry-run solo se reportan el estado y lo que borraría el vacuum.
+
+La configuración de la tabla (delta.universalFormat.enabledFormats,
+delta.enableIcebergCompatV2, ...) no se modifica: compact, z-order y
+VACUUM solo añaden commits de datos. Al terminar se comprueba que sigue
+igual y el job falla si no.
+
+Limitaciones:
+  - Los archivos compactados son "nuevos" para run_merge.py --incremental:
+    la siguiente ejecución vuelve a cargar sus filas. El MERGE es
+    idempotente; con --change-index-uri solo llegan a staging los cambios
+    reales.
+  - El orden de commit se conserva por partición: se asume, como en
+    create_delta_data.py, que una clave no cambia de partición
+    (transaction_date) entre versiones.
+  - Z-order lee cada partición completa en memoria para ordenarla.
+  - Solo tablas con protocolo lector 1 / escritor 2 (las de
+    write_deltalake); en otras, compact y z-order se omiten
+    (optimize_skipped en el reporte).
+  - delta-rs 0.17 no permite cambiar propiedades de una tabla existente:
+    el intervalo de checkpoints lo aplica este job, no los escritores.
+  - El vacuum rompe el time travel a versiones anteriores a la retención
+    (p. ej. un watermark de run_merge.py más viejo que eso → carga completa).
+
+Uso:
+    python maintain_delta.py \
+        --adls-account jaredpruebadelta --adls-container datalake \
+        --adls-path transactions_uniform \
+        [--target-file-mb 256] [--z-order customer_id,transaction_date] \
+        [--checkpoint-interval 10] [--cleanup-log] \
+        [--retention-hours 168 | --no-vacuum] [--dry-run] \
+        [--report-uri gs://raw-dev-michaelpage-prueba/reports/maintain_delta.json]
+
+    python maintain_delta.py --table-uri gs://raw-dev-michaelpage-prueba/delta/transactions
+
+Variables de entorno:
+    ADLS_ACCESS_KEY                — clave de acceso ADLS Gen2 (tablas az://)
+    GOOGLE_APPLICATION_CREDENTIALS — SA key JSON (tablas gs://)
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from deltalake import DeltaTable
+from deltalake.fs import DeltaStorageHandler
+from deltalake.writer import get_partitions_from_path
+from pyarrow import fs as pafs
+
+from delta_log import SOURCE_VERSION_TAG, file_versions
+from delta_upsert import (COMMIT_RETRIES, CommitConflict, KeyIndexStore, log_path, object_writer,
+                          publish, write_data_files)
+from run_report import PROFILE_MODES, count, reporting, set_value, span
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+log = logging.getLogger(__name__)
+
+DEFAULT_TARGET_FILE_MB = 256
+DEFAULT_CHECKPOINT_INTERVAL = 10
+# Clave de la dedup "última fila gana" de run_merge.py (DEDUP_KEY)
+DEFAULT_DEDUP_KEY = "transaction_id"
+# Bits por columna de la curva Z (3 columnas caben en 64 bits)
+Z_ORDER_BITS = 21
+# Filas que se juntan antes de escribirlas: cada escritura es un row group
+REWRITE_CHUNK_BYTES = 64 * 1024 * 1024
+# Mínimo de retención que delta-rs acepta sin desactivar su comprobación
+MIN_RETENTION_HOURS = 168
+# Archivos por debajo de esta fracción del tamaño objetivo cuentan como pequeños
+SMALL_FILE_FRACTION = 0.5
+
+
+# ──────────────────────────────────────────────────────────────
+# Estado de la tabla
+# ──────────────────────────────────────────────────────────────
+def storage_options_for(table_uri: str, adls_account: Optional[str]) -> dict:
+    """Credenciales de deltalake según el esquema de la URI."""
+    if table_uri.startswith(("az://", "abfss://")):
+        adls_key = os.environ.get("ADLS_ACCESS_KEY")
+        if not adls_key:
+            log.error("Variable de entorno ADLS_ACCESS_KEY no definida.")
+            sys.exit(1)
+        return {"account_name": adls_account, "account_key": adls_key}
+    sa_key = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+    if table_uri.startswith("gs://") and sa_key:
+        return {"google_service_account": sa_key}
+    return {}
+
+
+def last_checkpoint_version(dt: DeltaTable, storage_options: dict) -> Optional[int]:
+    """Versión de `_delta_log/_last_checkpoint`, o None si no hay checkpoint."""
+    handler = DeltaStorageHandler(dt.table_uri, storage_options)
+    try:
+        with handler.open_input_stream("_delta_log/_last_checkpoint") as fh:
+            return int(json.loads(fh.read())["version"])
+    except (FileNotFoundError, OSError):
+        return None
+    except (ValueError, KeyError, TypeError) as exc:
+        log.warning("_last_checkpoint ilegible (%s) — se ignora.", exc)
+        return None
+
+
+def table_stats(dt: DeltaTable, storage_options: dict, target_bytes: int) -> dict:
+    """Archivos, bytes y commits pendientes de checkpoint de la versión cargada."""
+    actions = dt.get_add_actions(flatten=True)
+    sizes = actions.column("size_bytes")
+    checkpoint = last_checkpoint_version(dt, storage_options)
+    return {
+        "version":           dt.version(),
+        "files":             actions.num_rows,
+        "bytes":             pc.sum(sizes).as_py() or 0,
+        "small_files":       pc.sum(pc.less(sizes, int(target_bytes * SMALL_FILE_FRACTION)))
+                             .as_py() or 0,
+        "checkpoint_version": checkpoint,
+        "commits_since_checkpoint": dt.version() - (checkpoint if checkpoint is not None else -1),
+    }
+
+
+def log_stats(label: str, stats: dict) -> None:
+    mean_mb = stats["bytes"] / stats["files"] / 1024 / 1024 if stats["files"] else 0.0
+    log.info("%s: versión %d | %d archivos (%d pequeños) | %.1f MB (media %.1f MB) | "
+             "%d commits desde el último checkpoint (%s)",
+             label, stats["version"], stats["files"], stats["small_files"],
+             stats["bytes"] / 1024 / 1024, mean_mb, stats["commits_since_checkpoint"],
+             stats["checkpoint_version"] if stats["checkpoint_version"] is not None else "ninguno")
+
+
+def z_order_columns(dt: DeltaTable, columns: List[str]) -> List[str]:
+    """Columnas de z-order válidas: existentes y que no sean de partición."""
+    partition_columns = set(dt.metadata().partition_columns)
+    schema_columns = {field.name for field in dt.schema().fields}
+    missing = [c for c in columns if c not in schema_columns]
+    if missing:
+        raise ValueError(f"Columnas de z-order inexistentes en la tabla: {missing}")
+    skipped = [c for c in columns if c in partition_columns]
+    if skipped:
+        log.info("  Z-order: se omiten las columnas de partición %s", skipped)
+    return [c for c in columns if c not in partition_columns]
+
+
+# ──────────────────────────────────────────────────────────────
+# Reescritura (compact y z-order)
+# ──────────────────────────────────────────────────────────────
+def data_files(dt: DeltaTable, storage_options: dict) -> List[dict]:
+    """
+    Archivos activos en orden de commit (versión efectiva, modificationTime,
+    ruta: el mismo que file_sequence en run_merge.py).
+    """
+    versions = file_versions(dt, storage_options)
+    actions = dt.get_add_actions(flatten=True)
+    files = [{"path": path, "size": size, "rows": rows or 0, "version": versions[path],
+              "modified": modified}
+             for path, size, rows, modified in zip(
+                 actions.column("path").to_pylist(), actions.column("size_bytes").to_pylist(),
+                 actions.column("num_records").to_pylist(),
+                 actions.column("modification_time").cast(pa.int64()).to_pylist())]
+    return sorted(files, key=lambda f: (f["version"], f["modified"], f["path"]))
+
+
+def by_partition(files: List[dict]) -> Dict[str, List[dict]]:
+    """Archivos agrupados por directorio de partición, en el orden recibido."""
+    groups: Dict[str, List[dict]] = {}
+    for f in files:
+        groups.setdefault(f["path"].rpartition("/")[0], []).append(f)
+    return groups
+
+
+def compaction_bins(files: List[dict], target_bytes: int) -> List[List[dict]]:
+    """
+    Tramos de archivos pequeños (< `target_bytes`) consecutivos en `files`
+    (una partición, en orden de commit) de hasta `target_bytes` en total.
+    Un archivo grande corta el tramo: compactar por encima de él pondría
+    filas más viejas por delante de las suyas. Los tramos de un solo
+    archivo no se reescriben.
+    """
+    bins, current, current_bytes = [], [], 0
+    for f in files:
+        small = f["size"] < target_bytes
+        if not small or current_bytes + f["size"] > target_bytes:
+            if len(current) > 1:
+                bins.append(current)
+            current, current_bytes = [], 0
+        if small:
+            current.append(f)
+            current_bytes += f["size"]
+    if len(current) > 1:
+        bins.append(current)
+    return bins
+
+
+def unique_keys(table: pa.Table, key: Optional[str]) -> bool:
+    """¿Como mucho una fila por valor no nulo de `key`? (sin `key`, sí)."""
+    if key is None:
+        return True
+    column = table.column(key)
+    return pc.count_distinct(column, mode="only_valid").as_py() == pc.count(column).as_py()
+
+
+def z_values(table: pa.Table, columns: List[str]) -> np.ndarray:
+    """
+    Posición de cada fila en la curva Z de `columns`: el rango denso de
+    cada columna, escalado a Z_ORDER_BITS bits, con los bits intercalados.
+    """
+    bits = min(64 // len(columns), Z_ORDER_BITS)
+    scaled = []
+    for name in columns:
+        rank = pc.rank(table.column(name).combine_chunks(), sort_keys="ascending",
+                       null_placement="at_end", tiebreaker="dense").to_numpy().astype(np.uint64)
+        top = max(int(rank.max()) - 1, 1) if len(rank) else 1
+        scaled.append((rank - np.uint64(1)) * np.uint64((1 << bits) - 1) // np.uint64(top))
+    z = np.zeros(table.num_rows, dtype=np.uint64)
+    for bit in range(bits - 1, -1, -1):
+        for values in scaled:
+            z = (z << np.uint64(1)) | ((values >> np.uint64(bit)) & np.uint64(1))
+    return z
+
+
+def chunked(tables: Iterable[pa.Table], chunk_bytes: int) -> Iterator[pa.Table]:
+    """Junta tablas consecutivas en bloques de ~`chunk_bytes` (en orden)."""
+    pending, pending_bytes = [], 0
+    for table in tables:
+        pending.append(table)
+        pending_bytes += table.nbytes
+        if pending_bytes >= chunk_bytes:
+            yield pa.concat_tables(pending)
+            pending, pending_bytes = [], 0
+    if pending:
+        yield pa.concat_tables(pending)
+
+
+class _Rewrite:
+    """Reescritura de archivos de una versión de la tabla, sin commit."""
+
+    def __init__(self, dt: DeltaTable, storage_options: dict, dedup_key: Optional[str],
+                 target_bytes: int):
+        self.version = dt.version()
+        self.schema = dt.schema().to_pyarrow()
+        self.partition_columns = list(dt.metadata().partition_columns)
+        self.num_indexed_cols = int(dt.metadata().configuration.get(
+            "delta.dataSkippingNumIndexedCols") or 32)
+        self.key = dedup_key if dedup_key in self.schema.names else None
+        self.target_bytes = target_bytes
+        self.fs = pafs.PyFileSystem(DeltaStorageHandler(dt.table_uri, storage_options))
+        self.put = object_writer(dt.table_uri, storage_options)
+        self.store = KeyIndexStore(self.fs, self.put, dt.table_uri)
+        # Se llena desde varios hilos (list.append es atómico)
+        self.adds: List[dict] = []
+
+    def rows(self, path: str) -> Iterator[pa.Table]:
+        """Filas de `path` en su orden, con las columnas de partición, batch a batch."""
+        constants = get_partitions_from_path(path)[1]
+        with self.fs.open_input_file(path) as fh:
+            for batch in pq.ParquetFile(fh).iter_batches():
+                table = pa.Table.from_batches([batch])
+                for field in self.schema:
+                    # Columnas de partición (van en el path) o ausentes en el archivo
+                    if field.name not in table.column_names:
+                        value = pa.scalar(constants.get(field.name)).cast(field.type)
+                        table = table.append_column(field.name, pa.repeat(value, table.num_rows))
+                yield table.select(self.schema.names).cast(self.schema)
+
+    def write(self, files: List[dict], tables: Iterable[pa.Table]) -> int:
+        """
+        Escribe `tables` (las filas de `files`) en archivos de ~target_bytes
+        con la versión y el modificationTime del más reciente de `files`.
+        Devuelve los archivos escritos.
+        """
+        total_bytes = sum(f["size"] for f in files)
+        total_rows = sum(f["rows"] for f in files)
+        max_rows = max(1, total_rows * self.target_bytes // max(total_bytes, 1))
+        newest = max(files, key=lambda f: (f["version"], f["modified"]))
+        written = 0
+        for action in write_data_files(self.put, self.store, tables, self.key,
+                                       self.partition_columns, self.version + 1,
+                                       self.num_indexed_cols, max_rows):
+            action["dataChange"] = False
+            action["modificationTime"] = newest["modified"]
+            action["tags"] = {SOURCE_VERSION_TAG: str(newest["version"])}
+            self.adds.append(action)
+            written += 1
+        return written
+
+    def compact(self, files: List[dict]) -> int:
+        tables = (table for f in files for table in self.rows(f["path"]))
+        return self.write(files, chunked(tables, REWRITE_CHUNK_BYTES))
+
+    def z_order(self, files: List[dict], columns: List[str]) -> Optional[int]:
+        """Reescribe `files` ordenados por curva Z; None si hay claves repetidas."""
+        tables = [table for f in files for table in self.rows(f["path"])]
+        table = pa.concat_tables(tables) if tables else self.schema.empty_table()
+        if not unique_keys(table, self.key):
+            return None
+        order = np.argsort(z_values(table, columns), kind="stable")
+        return self.write(files, [table.take(pa.array(order))])
+
+    def discard(self) -> None:
+        """Borra los archivos escritos (sin commit nadie los referencia)."""
+        for action in self.adds:
+            path = unquote(action["path"])
+            self.store.delete(path)
+            try:
+                self.fs.delete_file(path)
+            except (FileNotFoundError, OSError):
+                pass
+
+
+def optimize_blockers(dt: DeltaTable) -> List[str]:
+    """Motivos por los que compact/z-order no pueden reescribir `dt` (vacío si pueden)."""
+    protocol = dt.protocol()
+    if protocol.min_reader_version > 1 or protocol.min_writer_version > 2:
+        return [f"protocolo Delta no soportado para reescribir archivos: {protocol}"]
+    return []
+
+
+# ──────────────────────────────────────────────────────────────
+# Pasos
+# ──────────────────────────────────────────────────────────────
+def _report_optimize(step: str, metrics: dict) -> None:
+    added, removed = metrics.get("numFilesAdded", 0), metrics.get("numFilesRemoved", 0)
+    log.info("✅ %s: %d archivos → %d (%d particiones, %d archivos sin tocar)",
+             step, removed, added, metrics.get("partitionsOptimized", 0),
+             metrics.get("totalFilesSkipped", 0))
+    count(f"{step}_files_removed", removed)
+    count(f"{step}_files_added", added)
+
+
+def _optimize_once(dt: DeltaTable, storage_options: dict, dedup_key: Optional[str],
+                   target_bytes: int, columns: List[str],
+                   max_concurrent_tasks: Optional[int]) -> dict:
+    files = data_files(dt, storage_options)
+    partitions = by_partition(files)
+    rewrite = _Rewrite(dt, storage_options, dedup_key, target_bytes)
+
+    def task(group: List[dict]) -> Tuple[List[dict], int]:
+        if columns:
+            written = rewrite.z_order(group, columns)
+            if written is not None:
+                return group, written
+            log.warning("⚠️  Z-order: partición %r con varias filas por %s — se compacta",
+                        group[0]["path"].rpartition("/")[0], rewrite.key)
+            count("z_order_partitions_compacted")
+            done, written = [], 0
+            for bin_files in compaction_bins(group, target_bytes):
+                done += bin_files
+                written += rewrite.compact(bin_files)
+            return done, written
+        return group, rewrite.compact(group)
+
+    groups = list(partitions.values()) if columns else \
+        [b for group in partitions.values() for b in compaction_bins(group, target_bytes)]
+    removed: List[dict] = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrent_tasks or os.cpu_count()) as pool:
+            for done, _ in pool.map(task, groups):
+                removed += done
+        metrics = {
+            "numFilesAdded":       len(rewrite.adds),
+            "numFilesRemoved":     len(removed),
+            "partitionsOptimized": len({f["path"].rpartition("/")[0] for f in removed}),
+            "totalFilesSkipped":   len(files) - len(removed),
+        }
+        if removed:
+            parameters = {"targetSize": str(target_bytes)}
+            if columns:
+                parameters["zOrderBy"] = json.dumps(columns)
+            publish(rewrite.put, rewrite.version, "OPTIMIZE", parameters, metrics, rewrite.adds,
+                    [{"path": log_path(f["path"]), "size": f["size"],
+                      "partitionValues": get_partitions_from_path(f["path"])[1]}
+                     for f in removed],
+                    data_change=False)
+    except BaseException:
+        rewrite.discard()
+        raise
+    for f in removed:
+        rewrite.store.delete(f["path"])
+    return metrics
+
+
+def optimize(table_uri: str, storage_options: dict, dedup_key: Optional[str], target_bytes: int,
+             columns: List[str], max_concurrent_tasks: Optional[int]) -> dict:
+    """Compact (sin `columns`) o z-order; reintenta si otro escritor publica antes."""
+    step = "z_order" if columns else "compact"
+    for attempt in range(1, COMMIT_RETRIES + 1):
+        dt = DeltaTable(table_uri, storage_options=storage_options)
+        try:
+            with span(step) as s:
+                metrics = _optimize_once(dt, storage_options, dedup_key, target_bytes, columns,
+                                         max_concurrent_tasks)
+                s["files_removed"] = metrics["numFilesRemoved"]
+        except CommitConflict:
+            log.warning("  %s: la versión %d ya existe (escritor concurrente) — reintento %d/%d",
+                        step, dt.version() + 1, attempt, COMMIT_RETRIES)
+            continue
+        _report_optimize(step, metrics)
+        return metrics
+    raise RuntimeError(f"{step}: {COMMIT_RETRIES} conflictos de commit seguidos")
+
+
+def checkpoint(dt: DeltaTable, storage_options: dict, interval: int, cleanup_log: bool) -> bool:
+    """Escribe un checkpoint si hay `interval` commits o más desde el último."""
+    previous = last_checkpoint_version(dt, storage_options)
+    pending = dt.version() - (previous if previous is not None else -1)
+    if pending < interval:
+        log.info("Checkpoint: %d commit(s) desde el último (intervalo %d) — no hace falta.",
+                 pending, interval)
+        return False
+    with span("checkpoint"):
+        try:
+            dt.create_checkpoint()
+        except Exception as exc:
+            count("checkpoint_errors")
+            set_value("outcome", "checkpoint_failed")
+            raise RuntimeError(f"No se pudo escribir el checkpoint en la versión "
+                               f"{dt.version()}: {exc}") from exc
+        if cleanup_log:
+            dt.cleanup_metadata()
+    log.info("✅ Checkpoint escrito en la versión %d%s", dt.version(),
+             " (commits expirados eliminados)" if cleanup_log else "")
+    count("checkpoints_written")
+    return True
+
+
+def vacuum(dt: DeltaTable, retention_hours: Optional[int], dry_run: bool,
+           allow_short_retention: bool = False) -> List[str]:
+    with span("vacuum") as s:
+        removed = dt.vacuum(retention_hours=retention_hours, dry_run=dry_run,
+                            enforce_retention_duration=not allow_short_retention)
+        s["files"] = len(removed)
+    log.info("%s Vacuum: %d archivo(s) %s", "🔎" if dry_run else "✅", len(removed),
+             "por eliminar (dry run)" if dry_run else "eliminados")
+    count("vacuum_files", len(removed))
+    return removed
+
+
+# ──────────────────────────────────────────────────────────────
+# Main
+# ──────────────────────────────────────────────────────────────
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        description="Compactación, z-order, checkpoints y vacuum de una tabla Delta"
+    )
+    p.add_argument("--table-uri",        default=None,
+                   help="URI de la tabla (gs://, az://, local); alternativa a --adls-*")
+    p.add_argument("--adls-account",     default=None, help="Storage account ADLS, ej: jaredpruebadelta")
+    p.add_argument("--adls-container",   default=None, help="Contenedor ADLS, ej: datalake")
+    p.add_argument("--adls-path",        default=None, help="Path Delta en el contenedor, ej: transactions_uniform")
+    p.add_argument("--target-file-mb",   type=int, default=DEFAULT_TARGET_FILE_MB,
+                   help=f"Tamaño objetivo de los archivos compactados (default: {DEFAULT_TARGET_FILE_MB})")
+    p.add_argument("--compact",          action=argparse.BooleanOptionalAction, default=True,
+                   help="Compactar archivos pequeños (default: sí)")
+    p.add_argument("--z-order",          default=None,
+                   help="Columnas de z-order separadas por coma, ej: customer_id,transaction_date")
+    p.add_argument("--dedup-key",        default=DEFAULT_DEDUP_KEY,
+                   help="Clave de la dedup de run_merge.py: índice Bloom de los archivos nuevos; "
+                        "z-order solo en particiones con una fila por clave "
+                        f"(default: {DEFAULT_DEDUP_KEY})")
+    p.add_argument("--max-concurrent-tasks", type=int, default=None,
+                   help="Tramos o particiones reescritos en paralelo (default: núcleos)")
+    p.add_argument("--checkpoint-interval", type=int, default=DEFAULT_CHECKPOINT_INTERVAL,
+                   help="Escribir checkpoint con al menos N commits desde el último, 0 = nunca "
+                        f"(default: {DEFAULT_CHECKPOINT_INTERVAL})")
+    p.add_argument("--cleanup-log",      action="store_true",
+                   help="Tras el checkpoint, borrar los commits expirados anteriores (sin time travel a ellos)")
+    p.add_argument("--vacuum",           action=argparse.BooleanOptionalAction, default=True,
+                   help="Borrar archivos no referenciados fuera de la retención (default: sí)")
+    p.add_argument("--retention-hours",  type=int, default=None,
+                   help="Retención del vacuum (default: delta.deletedFileRetentionDuration)")
+    p.add_argument("--allow-short-retention", action="store_true",
+                   help=f"Permitir --retention-hours menor que {MIN_RETENTION_HOURS} "
+                        "(rompe lectores y time travel en curso)")
+    p.add_argument("--dry-run",          action="store_true",
+                   help="Solo reportar el estado y lo que borraría el vacuum")
+    p.add_argument("--report-uri",       default=os.environ.get("RUN_REPORT_URI"),
+                   help="Reporte JSON de la ejecución (local o gs://) con tiempos por etapa")
+    p.add_argument("--profile",          choices=PROFILE_MODES,
+                   default=os.environ.get("RUN_PROFILE") or None,
+                   help="Profiling opcional incluido en el reporte")
+    args = p.parse_args(argv)
+    if not args.table_uri and not (args.adls_account and args.adls_container and args.adls_path):
+        p.error("indicar --table-uri o --adls-account, --adls-container y --adls-path")
+    if args.target_file_mb <= 0:
+        p.error("--target-file-mb debe ser positivo")
+    if args.checkpoint_interval < 0:
+        p.error("--checkpoint-interval no puede ser negativo")
+    if args.retention_hours is not None:
+        if args.retention_hours < 0:
+            p.error("--retention-hours no puede ser negativo")
+        if args.retention_hours < MIN_RETENTION_HOURS and not args.allow_short_retention:
+            p.error(f"--retention-hours menor que {MIN_RETENTION_HOURS} requiere "
+                    "--allow-short-retention")
+    return args
+
+
+def main() -> None:
+    args = parse_args()
+    with reporting("maintain_delta", args.report_uri, args.profile, params=vars(args)):
+        run(args)
+
+
+def run(args: argparse.Namespace) -> None:
+    table_uri = args.table_uri or f"az://{args.adls_container}/{args.adls_path}"
+    storage_options = storage_options_for(table_uri, args.adls_account)
+    target_bytes = args.target_file_mb * 1024 * 1024
+
+    log.info("=== Mantenimiento Delta: %s ===", table_uri)
+    dt = DeltaTable(table_uri, storage_options=storage_options)
+    configuration = dict(dt.metadata().configuration)
+    before = table_stats(dt, storage_options, target_bytes)
+    log_stats("Antes", before)
+    set_value("before", before)
+
+    if args.dry_run:
+        if args.vacuum:
+            vacuum(dt, args.retention_hours, dry_run=True,
+                   allow_short_retention=args.allow_short_retention)
+        set_value("outcome", "dry_run")
+        return
+
+    columns = []
+    if args.z_order:
+        columns = z_order_columns(dt, [c.strip() for c in args.z_order.split(",") if c.strip()])
+    blocked = optimize_blockers(dt) if columns or args.compact else []
+    # Z-order ya reescribe en archivos de --target-file-mb: compactar antes duplicaría el trabajo
+    if blocked:
+        for reason in blocked:
+            log.warning("⚠️  Compact/z-order omitidos: %s", reason)
+        set_value("optimize_skipped", blocked)
+    elif columns or args.compact:
+        optimize(table_uri, storage_options, args.dedup_key, target_bytes, columns,
+                 args.max_concurrent_tasks)
+        dt = DeltaTable(table_uri, storage_options=storage_options)
+    if args.checkpoint_interval:
+        checkpoint(dt, storage_options, args.checkpoint_interval, args.cleanup_log)
+    if args.vacuum:
+        vacuum(dt, args.retention_hours, dry_run=False,
+               allow_short_retention=args.allow_short_retention)
+
+    dt = DeltaTable(table_uri, storage_options=storage_options)
+    after = table_stats(dt, storage_options, target_bytes)
+    log_stats("Después", after)
+    set_value("after", after)
+    set_value("outcome", "maintained")
+
+    if dict(dt.metadata().configuration) != configuration:
+        raise RuntimeError(f"La configuración de la tabla cambió durante el mantenimiento: "
+                           f"{configuration} → {dt.metadata().configuration}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as exc:
+        log.error("Error fatal: %s", exc, exc_info=True)
+        sys.exit(1)
@@ -3,7 +3,11 @@ refresh_biglake.py
 ──────────────────
 Job que detecta la última versión de la tabla Delta en GCS,
 lee el snapshot Parquet exportado y crea/actualiza la tabla
-externa en BigQuery con format=PARQUET.
+externa en BigQuery con format=PARQUET. Si el snapshot está
+particionado (transaction_date=YYYY-MM-DD/), la tabla externa
+usa hive partitioning para que BigQuery pode por fecha: el DDL
+declara las columnas con WITH PARTITION COLUMNS (transaction_date
+DATE, ver HIVE_PARTITION_TYPES) y apunta a prefijo/transaction_date=*.
 
 Uso:
     python refresh_biglake.py \
@@ -12,38 +16,276 @@ Uso:
         --parquet-path parquet/transactions \
         --gcp-project  michaelpage-prueba \
         --bq-dataset   dw_dev \
-        --bq-table     transactions_federated
+        --bq-table     transactions_federated \
+        [--state-uri gs://raw-dev-michaelpage-prueba/state/refresh_biglake.json \
+         --skip-unchanged [--fingerprint] [--reuse-cached-version]] \
+        [--uri-mode manifest]
+
+Con --skip-unchanged el job guarda en --state-uri la versión Delta (y,
+con --fingerprint, un hash de los objetos Parquet del snapshot) de la
+última actualización, y termina sin tocar BigQuery si no cambió nada.
+
+Con --uri-mode files|manifest la tabla externa deja de apuntar al
+wildcard del snapshot y se publica el conjunto exacto de archivos Parquet
+activos de la versión detectada (replay del _delta_log en GCS): como
+lista de URIs o como manifiesto (NEW_LINE_DELIMITED_MANIFEST). BigQuery
+no tiene que listar el prefijo en cada query ni lee archivos huérfanos.
+Con files, si la lista no cabe en el DDL (más de 10.000 URIs o de
+MAX_INLINE_URI_CHARS caracteres de texto) se publica un manifiesto. Si la
+tabla Delta está particionada (col=valor/ en los paths del log), el DDL
+es el mismo que el del snapshot particionado: WITH PARTITION COLUMNS con
+las columnas de esos directorios y la raíz de la tabla como prefijo hive.
+
+La detección de la última versión lee `_delta_log/_last_checkpoint` y
+lista solo los commits posteriores al checkpoint, así que su costo es
+O(commits desde el último checkpoint) y no O(historial completo). Con
+--reuse-cached-version la versión guardada en el estado sirve además
+como punto de partida del listado.
+
+Con --cache-dir (o DELTA_CACHE_DIR) los commits y checkpoints del
+_delta_log que lee --uri-mode files|manifest se guardan en un caché local
+(delta_cache.py): las ejecuciones siguientes solo descargan los commits
+nuevos. _last_checkpoint, que es mutable, siempre se lee de GCS.
+
+Con --report-uri (o RUN_REPORT_URI) se guarda un reporte JSON con el
+tiempo de cada etapa (discover_version, active_files, fingerprint,
+manifest, ddl) y las estadísticas del job DDL (ver run_report.py).
 
 Nota IA: Generado con asistencia de Claude (Anthropic).
 """
 
 import argparse
+import hashlib
+import json
 import logging
+import os
 import re
 import sys
+from datetime import datetime, timezone
 
-from google.cloud import bigquery, storage
+from delta_cache import DEFAULT_CACHE_MB, open_cache, report_cache
+from etl_state import read_state, write_state
+from run_report import PROFILE_MODES, count, record_job, reporting, set_value, span
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 log = logging.getLogger(__name__)
 
+# Límite de BigQuery de URIs por definición de tabla externa
+MAX_EXTERNAL_TABLE_URIS = 10_000
+# Las URIs van en el texto del DDL y BigQuery limita una query a 1024K
+# caracteres; el margen cubre el resto de la sentencia
+MAX_INLINE_URI_CHARS = 900_000
+# Tipo BigQuery de las columnas de partición hive conocidas (las demás
+# se declaran STRING): sin WITH PARTITION COLUMNS BigQuery no las expone
+HIVE_PARTITION_TYPES = {"transaction_date": "DATE"}
 
-def get_latest_delta_version(gcs_client, bucket_name, delta_path) -> int:
-    log_prefix = f"{delta_path.strip('/')}/_delta_log/"
-    bucket = gcs_client.bucket(bucket_name)
+
+def read_last_checkpoint(bucket, log_prefix):
+    """Contenido de `_delta_log/_last_checkpoint` ({"version", "parts"?, ...}) o None."""
+    from google.cloud.exceptions import NotFound
+    try:
+        payload = bucket.blob(f"{log_prefix}_last_checkpoint").download_as_text()
+    except NotFound:
+        return None
+    try:
+        checkpoint = json.loads(payload)
+        checkpoint["version"] = int(checkpoint["version"])
+        return checkpoint
+    except (ValueError, KeyError, TypeError) as exc:
+        log.warning("_last_checkpoint ilegible (%s) — se ignora.", exc)
+        return None
+
+
+def list_commit_versions(bucket, log_prefix, start_version=0):
+    """
+    Versiones de los commits JSON >= start_version.
+
+    Los nombres de commit tienen 20 dígitos con ceros a la izquierda, así
+    que el orden lexicográfico de GCS coincide con el numérico: start_offset
+    salta todo el historial anterior y end_offset corta antes de
+    `_last_checkpoint` y demás entradas que no empiezan por dígito.
+    """
     versions = []
-    for blob in bucket.list_blobs(prefix=log_prefix):
+    for blob in bucket.list_blobs(prefix=log_prefix,
+                                  start_offset=f"{log_prefix}{start_version:020d}",
+                                  end_offset=f"{log_prefix}:"):
         name = blob.name.split("/")[-1]
         match = re.match(r"^(\d{20})\.json$", name)
         if match:
             versions.append(int(match.group(1)))
+    return versions
+
+
+def get_latest_delta_version(gcs_client, bucket_name, delta_path, min_version=None) -> int:
+    """
+    Última versión Delta, listando solo los commits posteriores al último
+    checkpoint (o a `min_version`, una versión ya conocida de una ejecución
+    previa). Si a partir de ese punto no aparece ningún commit, se vuelve a
+    listar el log completo.
+    """
+    log_prefix = f"{delta_path.strip('/')}/_delta_log/"
+    bucket = gcs_client.bucket(bucket_name)
+
+    checkpoint = read_last_checkpoint(bucket, log_prefix)
+    start = max(checkpoint["version"] if checkpoint else 0, min_version or 0)
+    versions = list_commit_versions(bucket, log_prefix, start)
+    if not versions and start > 0:
+        log.warning("Sin commits desde la versión %d (¿tabla recreada?) — listando el log completo.",
+                    start)
+        start = 0
+        versions = list_commit_versions(bucket, log_prefix)
     if not versions:
         raise RuntimeError(f"No se encontraron commits Delta en gs://{bucket_name}/{log_prefix}")
     latest = max(versions)
-    log.info("Última versión Delta detectada: %d", latest)
+    log.info("Última versión Delta detectada: %d (listado desde la versión %d)", latest, start)
     return latest
 
 
+def _checkpoint_blob_names(log_prefix, checkpoint):
+    version = checkpoint["version"]
+    parts = checkpoint.get("parts")
+    if not parts:
+        return [f"{log_prefix}{version:020d}.checkpoint.parquet"]
+    return [f"{log_prefix}{version:020d}.checkpoint.{i:010d}.{parts:010d}.parquet"
+            for i in range(1, parts + 1)]
+
+
+def _log_object_reader(bucket, log_prefix, start_version, cache):
+    """
+    Función nombre → bytes para los objetos inmutables del _delta_log
+    (commits y checkpoints). Con `cache`, un solo listado desde
+    `start_version` da la generación de cada objeto, y solo se descargan
+    los que no están en el caché.
+    """
+    if cache is None:
+        return lambda name: bucket.blob(name).download_as_bytes()
+
+    listed = {blob.name: blob for blob in bucket.list_blobs(
+        prefix=log_prefix, start_offset=f"{log_prefix}{start_version:020d}",
+        end_offset=f"{log_prefix}:")}
+
+    def read(name):
+        blob = listed.get(name)
+        if blob is None:
+            return bucket.blob(name).download_as_bytes()
+        return cache.read(f"gs://{bucket.name}/{name}", f"{blob.generation}:{blob.size}",
+                          blob.download_as_bytes)
+    return read
+
+
+def active_delta_files(gcs_client, bucket_name, delta_path, version, cache=None):
+    """
+    Reproduce el _delta_log hasta `version` y devuelve los archivos Parquet
+    activos (paths relativos a la raíz de la tabla, ordenados).
+
+    Parte del último checkpoint (si es <= version) y aplica encima las
+    acciones add/remove de los commits JSON siguientes, en orden. Con
+    `cache` (DeltaFileCache), commits y checkpoints ya leídos en
+    ejecuciones anteriores no se vuelven a descargar.
+    """
+    import io
+    import pyarrow.parquet as pq
+    from urllib.parse import unquote
+
+    log_prefix = f"{delta_path.strip('/')}/_delta_log/"
+    bucket = gcs_client.bucket(bucket_name)
+
+    active = set()
+    checkpoint = read_last_checkpoint(bucket, log_prefix)
+    use_checkpoint = checkpoint is not None and checkpoint["version"] <= version
+    read_log_object = _log_object_reader(bucket, log_prefix,
+                                         checkpoint["version"] if use_checkpoint else 0, cache)
+    first_commit = 0
+    if use_checkpoint:
+        for name in _checkpoint_blob_names(log_prefix, checkpoint):
+            data = pq.read_table(io.BytesIO(read_log_object(name)), columns=["add"])
+            adds = data.column("add").combine_chunks()
+            paths = adds.filter(adds.is_valid()).field("path")
+            active.update(p for p in paths.to_pylist() if p)
+        first_commit = checkpoint["version"] + 1
+
+    for v in range(first_commit, version + 1):
+        payload = read_log_object(f"{log_prefix}{v:020d}.json").decode("utf-8")
+        for line in payload.splitlines():
+            if not line.strip():
+                continue
+            action = json.loads(line)
+            if "add" in action:
+                active.add(action["add"]["path"])
+            elif "remove" in action:
+                active.discard(action["remove"]["path"])
+
+    log.info("Archivos activos en la versión Delta %d: %d (replay desde la versión %d)",
+             version, len(active), first_commit)
+    # Los paths del log vienen URL-encoded (RFC 2396)
+    return sorted(unquote(p) for p in active)
+
+
+def hive_partition_columns(relative_paths):
+    """
+    Columnas de partición de una tabla Delta según los directorios col=valor
+    de sus archivos activos ([] si no está particionada).
+    """
+    for path in relative_paths:
+        if "://" in path or "/" not in path:
+            continue
+        directories = path.split("/")[:-1]
+        if all("=" in d for d in directories):
+            return [d.split("=", 1)[0] for d in directories]
+    return []
+
+
+def delta_file_uris(gcs_bucket, delta_path, relative_paths):
+    base = f"gs://{gcs_bucket}/{delta_path.strip('/')}"
+    return [p if "://" in p else f"{base}/{p}" for p in relative_paths]
+
+
+def publish_manifest(gcs_client, gcs_bucket, delta_path, version, file_uris) -> str:
+    """
+    Escribe un manifiesto (una URI gs:// por línea) con los archivos activos
+    de `version`. Cada versión tiene su propio manifiesto, así la tabla
+    externa nunca apunta a un archivo que se está reescribiendo.
+    """
+    blob_name = f"{delta_path.strip('/')}/_manifests/{version:020d}.manifest"
+    gcs_client.bucket(gcs_bucket).blob(blob_name).upload_from_string(
+        "\n".join(file_uris) + "\n", content_type="text/plain")
+    manifest_uri = f"gs://{gcs_bucket}/{blob_name}"
+    log.info("Manifiesto publicado: %s (%d archivos)", manifest_uri, len(file_uris))
+    return manifest_uri
+
+
+def files_fingerprint(file_uris) -> str:
+    """Hash de la lista exacta de archivos activos."""
+    return hashlib.sha256("\n".join(sorted(file_uris)).encode()).hexdigest()
+
+
+def snapshot_partition_columns(gcs_client, bucket_name, parquet_path):
+    """
+    Columnas de partición hive del snapshot Parquet según el marcador que
+    escribe create_delta_data.py ([] para el snapshot plano antiguo).
+    """
+    from google.cloud.exceptions import NotFound
+    blob = gcs_client.bucket(bucket_name).blob(f"{parquet_path.strip('/')}/_snapshot_version.json")
+    try:
+        return json.loads(blob.download_as_text()).get("partition_by") or []
+    except NotFound:
+        return []
+
+
+def snapshot_fingerprint(gcs_client, bucket_name, parquet_path) -> str:
+    """
+    Hash de los objetos del snapshot Parquet (nombre + generación + tamaño).
+    Cambia si el snapshot se reescribe aunque la versión Delta sea la misma.
+    """
+    prefix = f"{parquet_path.strip('/')}/"
+    digest = hashlib.sha256()
+    blobs = sorted(gcs_client.bucket(bucket_name).list_blobs(prefix=prefix),
+                   key=lambda b: b.name)
+    for blob in blobs:
+        digest.update(f"{blob.name}:{blob.generation}:{blob.size}\n".encode())
+    return digest.hexdigest()
+
+
 def drop_if_native_table(bq_client, project, dataset, table):
     """
     Si la tabla existe como tabla NATIVA (no externa), la elimina.
@@ -66,31 +308,103 @@ def drop_if_native_table(bq_client, project, dataset, table):
         log.info("La tabla %s no existe aún — se creará desde cero.", table_ref)
 
 
-def upsert_biglake_table(bq_client, project, dataset, table, gcs_bucket, parquet_path, delta_version):
-    table_ref = f"`{project}.{dataset}.{table}`"
-    parquet_uri = f"gs://{gcs_bucket}/{parquet_path.strip('/')}/*.parquet"
+def sql_uri_list(uris) -> str:
+    """Las URIs como elementos de un array literal del DDL."""
+    return ",\n                ".join(f"'{u}'" for u in uris)
 
-    # Asegurar que no exista una tabla nativa con el mismo nombre
-    drop_if_native_table(bq_client, project, dataset, table)
 
-    sql = f"""
-    CREATE OR REPLACE EXTERNAL TABLE {table_ref}
+def fits_inline(uris) -> bool:
+    """True si `uris` cabe como lista en el DDL (cantidad y largo del texto)."""
+    return (len(uris) <= MAX_EXTERNAL_TABLE_URIS
+            and len(sql_uri_list(uris)) <= MAX_INLINE_URI_CHARS)
+
+
+def partition_columns_clause(partition_columns) -> str:
+    """
+    WITH PARTITION COLUMNS del DDL: con nombres, cada columna con su tipo
+    (HIVE_PARTITION_TYPES, STRING por defecto); con [] o None, sin lista
+    (BigQuery infiere columnas y tipos de los directorios).
+    """
+    if not partition_columns:
+        return "WITH PARTITION COLUMNS"
+    columns = ", ".join(f"{name} {HIVE_PARTITION_TYPES.get(name, 'STRING')}"
+                        for name in partition_columns)
+    return f"WITH PARTITION COLUMNS ({columns})"
+
+
+def external_table_ddl(table_ref, uris, manifest=False, hive_prefix=None,
+                       partition_columns=None) -> str:
+    """
+    CREATE OR REPLACE EXTERNAL TABLE PARQUET sobre `uris` (o el manifiesto
+    `uris[0]`). Con `hive_prefix`, las columnas `partition_columns` se leen
+    de los directorios col=valor bajo ese prefijo.
+    """
+    extra_options = ""
+    if manifest:
+        extra_options += ",\n      file_set_spec_type = 'NEW_LINE_DELIMITED_MANIFEST'"
+    partitions = ""
+    if hive_prefix:
+        partitions = f"\n    {partition_columns_clause(partition_columns)}"
+        extra_options += (f",\n      hive_partition_uri_prefix = '{hive_prefix}'"
+                          ",\n      require_hive_partition_filter = false")
+    return f"""
+    CREATE OR REPLACE EXTERNAL TABLE {table_ref}{partitions}
     OPTIONS (
       format = 'PARQUET',
-      uris   = ['{parquet_uri}']
+      uris   = [{sql_uri_list(uris)}]{extra_options}
     )
     """
 
+
+def snapshot_uri(gcs_bucket, parquet_path, hive_prefix=None, partition_columns=None) -> str:
+    """
+    Wildcard del snapshot Parquet. Particionado, todo lo que cuelga de los
+    directorios de la primera columna (`prefix/col=*`): así también los
+    archivos de col=valor/ y no el marcador _snapshot_version.json de la
+    raíz.
+    """
+    if hive_prefix:
+        return f"{hive_prefix}/{partition_columns[0]}=*" if partition_columns \
+            else f"{hive_prefix}/*"
+    return f"gs://{gcs_bucket}/{parquet_path.strip('/')}/*.parquet"
+
+
+def upsert_biglake_table(bq_client, project, dataset, table, gcs_bucket, parquet_path, delta_version,
+                         uris=None, manifest=False, hive_prefix=None, partition_columns=None):
+    """
+    Crea/reemplaza la tabla externa PARQUET.
+
+    Por defecto apunta al wildcard del snapshot Parquet (snapshot_uri). Con
+    `uris` apunta a esa lista exacta de archivos; con `manifest=True`,
+    `uris` contiene un único manifiesto con una URI por línea. Con
+    `hive_prefix`, las columnas de partición `partition_columns` se leen
+    de los directorios col=valor bajo ese prefijo (ver external_table_ddl).
+    """
+    table_ref = f"`{project}.{dataset}.{table}`"
+    if uris is None:
+        uris = [snapshot_uri(gcs_bucket, parquet_path, hive_prefix, partition_columns)]
+
+    # Asegurar que no exista una tabla nativa con el mismo nombre
+    drop_if_native_table(bq_client, project, dataset, table)
+
+    sql = external_table_ddl(table_ref, uris, manifest, hive_prefix, partition_columns)
+
     log.info("Creando tabla externa BigQuery (PARQUET): %s.%s.%s", project, dataset, table)
-    log.info("URI Parquet: %s (snapshot de versión Delta %d)", parquet_uri, delta_version)
+    if manifest:
+        log.info("Manifiesto: %s (versión Delta %d)", uris[0], delta_version)
+    elif len(uris) == 1:
+        log.info("URI Parquet: %s (snapshot de versión Delta %d)", uris[0], delta_version)
+    else:
+        log.info("URIs Parquet: %d archivos activos de la versión Delta %d", len(uris), delta_version)
 
     query_job = bq_client.query(sql)
     query_job.result()
+    record_job(query_job, "ddl")
 
     log.info("✅ Tabla BigLake creada/actualizada: %s.%s.%s", project, dataset, table)
 
 
-def parse_args():
+def parse_args(argv=None):
     p = argparse.ArgumentParser()
     p.add_argument("--gcs-bucket",   required=True)
     p.add_argument("--delta-path",   required=True)
@@ -98,25 +412,151 @@ def parse_args():
     p.add_argument("--gcp-project",  required=True)
     p.add_argument("--bq-dataset",   required=True)
     p.add_argument("--bq-table",     required=True)
-    return p.parse_args()
+    p.add_argument("--uri-mode",     choices=["wildcard", "files", "manifest"], default="wildcard",
+                   help="wildcard: snapshot parquet-path/*.parquet | files: lista exacta de archivos "
+                        "Delta activos | manifest: manifiesto con esa lista")
+    p.add_argument("--state-uri",    default=None,
+                   help="Archivo JSON de estado (local o gs://) con la última versión publicada")
+    p.add_argument("--skip-unchanged", action="store_true",
+                   help="No hacer nada si la versión Delta no cambió (requiere --state-uri)")
+    p.add_argument("--fingerprint",  action="store_true",
+                   help="Comparar también el hash de los archivos publicados (snapshot o archivos activos)")
+    p.add_argument("--reuse-cached-version", action="store_true",
+                   help="Listar el _delta_log desde la versión guardada en el estado (requiere --state-uri)")
+    p.add_argument("--cache-dir",    default=os.environ.get("DELTA_CACHE_DIR") or None,
+                   help="Caché local de commits/checkpoints del _delta_log para --uri-mode "
+                        "files|manifest (ej. volumen montado); también DELTA_CACHE_DIR")
+    p.add_argument("--cache-max-mb", type=int,
+                   default=int(os.environ.get("DELTA_CACHE_MAX_MB", DEFAULT_CACHE_MB)),
+                   help=f"Tamaño máximo del caché, LRU (default: {DEFAULT_CACHE_MB})")
+    p.add_argument("--report-uri",   default=os.environ.get("RUN_REPORT_URI"),
+                   help="Reporte JSON de la ejecución (local o gs://) con tiempos por etapa")
+    p.add_argument("--profile",      choices=PROFILE_MODES,
+                   default=os.environ.get("RUN_PROFILE") or None,
+                   help="Profiling opcional incluido en el reporte")
+    args = p.parse_args(argv)
+    if args.skip_unchanged and not args.state_uri:
+        p.error("--skip-unchanged requiere --state-uri")
+    if args.reuse_cached_version and not args.state_uri:
+        p.error("--reuse-cached-version requiere --state-uri")
+    return args
 
 
 def main():
     args = parse_args()
-    gcs_client = storage.Client(project=args.gcp_project)
-    bq_client  = bigquery.Client(project=args.gcp_project)
-
-    latest_version = get_latest_delta_version(gcs_client, args.gcs_bucket, args.delta_path)
-
-    upsert_biglake_table(
-        bq_client,
-        project       = args.gcp_project,
-        dataset       = args.bq_dataset,
-        table         = args.bq_table,
-        gcs_bucket    = args.gcs_bucket,
-        parquet_path  = args.parquet_path,
-        delta_version = latest_version,
-    )
+    with reporting("refresh_biglake", args.report_uri, args.profile, params=vars(args)):
+        run(args)
+
+
+def run(args, gcs_client=None, bq_client=None):
+    """
+    Un refresh. Los clientes se pueden reutilizar entre ejecuciones (watch_delta.py).
+
+    google-cloud-bigquery se importa recién al publicar el DDL (~0.4 s de
+    arranque): una ejecución con --skip-unchanged sin cambios no lo carga.
+    """
+    if gcs_client is None:
+        from google.cloud import storage
+        gcs_client = storage.Client(project=args.gcp_project)
+
+    target = f"{args.gcp_project}.{args.bq_dataset}.{args.bq_table}"
+    delta_uri = f"gs://{args.gcs_bucket}/{args.delta_path.strip('/')}"
+    state = read_state(args.state_uri) if args.state_uri else {}
+    same_source = state.get("table") == target and state.get("delta_uri") == delta_uri
+
+    cached_version = None
+    if args.reuse_cached_version and same_source:
+        cached_version = state.get("delta_version")
+    with span("discover_version"):
+        latest_version = get_latest_delta_version(gcs_client, args.gcs_bucket, args.delta_path,
+                                                  min_version=cached_version)
+    set_value("delta_version", latest_version)
+    version_unchanged = (args.skip_unchanged
+                         and same_source
+                         and state.get("delta_version") == latest_version
+                         and state.get("uri_mode", "wildcard") == args.uri_mode)
+    if version_unchanged and not args.fingerprint:
+        log.info("Versión Delta %d ya publicada en %s — nada que hacer.", latest_version, target)
+        set_value("outcome", "unchanged")
+        return
+
+    file_uris = None
+    if args.uri_mode != "wildcard":
+        cache = open_cache(args.cache_dir, args.cache_max_mb)
+        with span("active_files") as s:
+            active = active_delta_files(gcs_client, args.gcs_bucket, args.delta_path,
+                                        latest_version, cache)
+            file_uris = delta_file_uris(args.gcs_bucket, args.delta_path, active)
+            s["files"] = len(file_uris)
+        if cache is not None:
+            report_cache(cache)
+
+    fingerprint = None
+    if args.fingerprint:
+        with span("fingerprint"):
+            fingerprint = (files_fingerprint(file_uris) if file_uris is not None
+                           else snapshot_fingerprint(gcs_client, args.gcs_bucket, args.parquet_path))
+        if version_unchanged and state.get("fingerprint") == fingerprint:
+            log.info("Versión Delta %d ya publicada en %s — nada que hacer.", latest_version, target)
+            set_value("outcome", "unchanged")
+            return
+
+    uris, manifest, hive_prefix, partition_columns = None, False, None, None
+    if file_uris is None:
+        partition_columns = snapshot_partition_columns(gcs_client, args.gcs_bucket,
+                                                       args.parquet_path)
+        if partition_columns:
+            hive_prefix = f"gs://{args.gcs_bucket}/{args.parquet_path.strip('/')}"
+    else:
+        if not file_uris:
+            raise RuntimeError(f"La versión Delta {latest_version} no tiene archivos activos")
+        # Tabla Delta particionada: delta-rs escribe col=valor/part-*.parquet
+        # y la columna de partición no está dentro de los archivos.
+        partition_columns = hive_partition_columns(active)
+        if partition_columns:
+            hive_prefix = delta_uri
+        use_manifest = args.uri_mode == "manifest" or not fits_inline(file_uris)
+        if use_manifest and args.uri_mode == "files":
+            log.warning("%d archivos no caben en el DDL (límite de %d URIs y de %d caracteres) — "
+                        "se publica un manifiesto.", len(file_uris), MAX_EXTERNAL_TABLE_URIS,
+                        MAX_INLINE_URI_CHARS)
+        if use_manifest:
+            with span("manifest"):
+                uris = [publish_manifest(gcs_client, args.gcs_bucket, args.delta_path,
+                                         latest_version, file_uris)]
+            manifest = True
+        else:
+            uris = file_uris
+
+    if bq_client is None:
+        from google.cloud import bigquery
+        bq_client = bigquery.Client(project=args.gcp_project)
+    with span("ddl"):
+        upsert_biglake_table(
+            bq_client,
+            project           = args.gcp_project,
+            dataset           = args.bq_dataset,
+            table             = args.bq_table,
+            gcs_bucket        = args.gcs_bucket,
+            parquet_path      = args.parquet_path,
+            delta_version     = latest_version,
+            uris              = uris,
+            manifest          = manifest,
+            hive_prefix       = hive_prefix,
+            partition_columns = partition_columns,
+        )
+    count("published_uris", len(file_uris) if file_uris is not None else 1)
+    set_value("outcome", "published")
+
+    if args.state_uri:
+        write_state(args.state_uri, {
+            "table":         target,
+            "delta_uri":     delta_uri,
+            "delta_version": latest_version,
+            "uri_mode":      args.uri_mode,
+            "fingerprint":   fingerprint,
+            "updated_at":    datetime.now(timezone.utc).isoformat(),
+        })
 
     log.info("🎉 Federación BigLake actualizada correctamente.")
 
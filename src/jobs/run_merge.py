@@ -9,7 +9,7 @@ Orquesta el flujo completo de la Parte 4 usando Python ETL Bridge:
        ▼
   PyArrow Table en memoria
        │
-       │  google-cloud-bigquery  — load_table_from_dataframe
+       │  google-cloud-bigquery  — load_table_from_file (Parquet, schema explícito)
        ▼
   dw_{env}.transactions_staging  (BigQuery US, tabla nativa)
        │
@@ -23,6 +23,140 @@ Ventajas frente a BigQuery Omni Export → GCS:
   - Un solo salto: ADLS Gen2 → BigQuery (sin GCS intermedio).
   - Totalmente idempotente (WRITE_TRUNCATE en staging).
 
+Modo incremental (--incremental --state-uri ...):
+  Guarda la última versión Delta mergeada (watermark) en un archivo de
+  estado JSON (local o gs://). En la siguiente ejecución solo se cargan
+  en staging los archivos Parquet añadidos por los commits posteriores
+  a esa versión, y el MERGE procesa únicamente esas filas. Sin estado
+  previo (o si la versión guardada ya no es legible) se hace carga completa.
+
+Lectura (--read-threads N):
+  Solo se descargan las columnas que usa el MERGE (derivadas de
+  MERGE_SQL), con N row groups en paralelo y lecturas de rangos
+  coalescidas (pre_buffer). Al final se reportan los bytes
+  transferidos desde ADLS y el throughput obtenido.
+
+Filtro por fecha (--since-date / --until-date, inclusivos):
+  Solo se leen las filas con transaction_date en el rango. El filtro se
+  empuja al dataset Delta: si la tabla está particionada por
+  transaction_date se descartan archivos por valor de partición, y en
+  cualquier caso por las estadísticas min/max de cada archivo (Delta log)
+  y de cada row group (Parquet). No se combina con --incremental: el
+  watermark avanzaría hasta la versión leída y las filas de esos commits
+  fuera del rango no se cargarían nunca. Por lo mismo, una ejecución con
+  filtro por fecha no mueve el watermark del estado.
+
+Ejecución no-op (--skip-unchanged [--fingerprint] --state-uri ...):
+  Si la versión Delta actual (y opcionalmente el fingerprint del conjunto
+  de archivos activos) coincide con la del último MERGE guardado en el
+  estado, el job termina sin lanzar ningún job de BigQuery.
+
+Modo streaming (--stream --memory-limit-mb N):
+  En lugar de materializar la tabla completa (Arrow + su copia serializada ≈ 2×
+  el tamaño de la tabla), recorre el dataset Delta batch a batch y
+  carga en staging bloques de tamaño fijo (WRITE_TRUNCATE el primero,
+  WRITE_APPEND el resto). El pico de memoria queda acotado por N,
+  independientemente del tamaño de la tabla. Lectura, serialización a
+  Parquet y carga corren en hilos separados unidos por colas acotadas
+  (--pipeline-depth, 0 = secuencial): mientras BigQuery recibe un bloque
+  se serializa el siguiente y se descarga el posterior.
+  tests/test_stream_memory.py verifica el pico de RSS contra una tabla
+  Delta local de varios millones de filas.
+
+Reporte de ejecución (--report-uri, o RUN_REPORT_URI):
+  JSON con el tiempo de cada etapa (check_unchanged, open, read, convert,
+  load, setup, merge, labels), bytes leídos de ADLS, bytes y filas
+  cargadas, y slot-ms / bytes procesados y facturados / filas DML de cada
+  job de BigQuery. --profile cprofile|tracemalloc añade un perfil al
+  reporte (ver run_report.py).
+
+Deduplicación (activa por defecto, --no-dedup para desactivarla):
+  Una transacción puede reescribirse en commits posteriores (TXN-003 está
+  en las versiones 0 y 1). Antes de cargar staging se conserva solo la
+  fila más reciente de cada transaction_id (versión del commit, según el
+  replay del _delta_log, y dentro de un archivo la última fila), así el
+  MERGE no recibe varias filas de origen para la misma fila destino. En
+  --stream, si las claves no caben en memoria, se particionan por hash en
+  archivos Arrow IPC (--spill-dir) y cada partición se deduplica por
+  separado (ver key_dedup.py y delta_log.py).
+
+Solo cambios (--change-index-uri ... --state-uri ...):
+  Guarda un índice transaction_id → hash de fila de lo ya mergeado
+  (memory map de hashes de 64 bits ordenados, ver change_index.py). Antes
+  de cargar staging se descartan las filas idénticas a las del índice, así
+  el MERGE escanea y actualiza solo inserts y updates reales. Las claves
+  cargadas se acumulan en tramos ordenados en disco (--spill-dir), no en
+  memoria. El índice se actualiza después de un MERGE exitoso;
+  --rebuild-change-index lo reconstruye (ej. si final_table se modificó
+  por otra vía).
+
+Particionado de final_table:
+  final_table se crea particionada por transaction_date y clusterizada por
+  customer_id, transaction_id. Antes del MERGE se consulta el rango de
+  fechas de staging y se añade al ON un predicado constante sobre
+  target.transaction_date, así BigQuery solo lee las particiones
+  afectadas (--no-merge-date-pruning lo desactiva). Supone que una
+  transacción no cambia de transaction_date entre versiones: si lo hiciera
+  fuera del rango, el MERGE la insertaría de nuevo en lugar de
+  actualizarla. Una final_table existente sin particionar se migra con
+  --migrate-final-table (copia + intercambio de nombres, deja respaldo).
+  --merge-dry-run carga staging y reporta los bytes que escanearía el
+  MERGE con y sin la poda, sin ejecutarlo ni avanzar el estado.
+
+Varias tablas:
+  --staging-table / --target-table cambian los nombres de staging y
+  destino; run_pipelines.py ejecuta este pipeline para muchas tablas a la
+  vez con clientes y límites de concurrencia compartidos.
+
+Caché local (--cache-dir, o DELTA_CACHE_DIR):
+  Los archivos de datos Delta son inmutables: se guardan en un caché en
+  disco (LRU acotado por --cache-max-mb, puede ser un volumen montado) y
+  los reintentos y ejecuciones siguientes solo descargan los archivos
+  nuevos. El reporte incluye aciertos, fallos y bytes (ver delta_cache.py).
+
+Reintentos (--run-state-uri ..., o RUN_STATE_URI):
+  Registra en un JSON (local o gs://) cada etapa terminada (staging,
+  setup, merge, commit del watermark/índice, labels) con la versión Delta
+  y las filas cargadas, asociado al id de la ejecución (--run-id, por
+  defecto CLOUD_RUN_EXECUTION, que Cloud Run conserva entre reintentos
+  de una tarea). Si el MERGE o los labels fallan, el reintento no vuelve
+  a leer ADLS ni a cargar staging: retoma en la primera etapa sin
+  terminar. Staging solo se reutiliza si nadie lo modificó entre medio
+  (misma fecha de última modificación); con --change-index-uri las
+  claves cargadas se guardan junto al registro (<uri>.pending.npy). Otra
+  ejecución u otros parámetros empiezan de cero, y también una nueva
+  llamada con el mismo id después de una ejecución completa (el registro
+  se cierra al terminar; p. ej. watch_delta.py en cada versión nueva).
+
+Backfill (--backfill-from V|instante [--backfill-to V|instante]):
+  Para reconstruir final_table o reaplicar versiones: carga en staging
+  el estado neto de cada transaction_id tras los commits del rango
+  (los archivos vigentes en la versión final que no lo estaban antes del
+  rango, vía time travel) y lo aplica con un solo MERGE en lugar de uno
+  por versión. El rango se parte en tramos de --backfill-step versiones
+  que --backfill-workers hilos leen en paralelo; la deduplicación
+  ordena por versión de commit, así que gana la fila más reciente. No mueve
+  el watermark de --state-uri. Con --stream la deduplicación se
+  particiona en disco como en la carga normal.
+  Como el MERGE es un upsert, las filas borradas dentro del rango no se
+  borran de final_table. Si hubo un compact de maintain_delta.py dentro
+  del rango, sus archivos reescritos entran completos (también las filas
+  de commits anteriores al rango que juntaron).
+
+Storage Write API (--staging-sink write-api, o STAGING_SINK):
+  En lugar de load jobs, staging se vacía (TRUNCATE) y los bloques Arrow
+  se agregan con AppendRows en --write-streams streams paralelos, con
+  offsets por stream para que un reintento no duplique filas (ver
+  bq_write_stream.py). Sin costo fijo ni cuota por job; con
+  --write-stream-type committed las filas se ven en staging a medida que
+  llegan, con pending aparecen todas juntas al final.
+
+Formato de carga:
+  Los bloques Arrow se serializan a Parquet en memoria y se cargan con
+  un schema BigQuery explícito derivado del schema Delta (amount →
+  NUMERIC, transaction_date → DATE). No hay conversión a pandas ni
+  objetos Decimal de Python en el camino crítico, ni autodetect.
+
 Uso:
     python run_merge.py \
         --project        michaelpage-prueba  \
@@ -30,7 +164,17 @@ Uso:
         --env            dev                 \
         --adls-account   jaredpruebadelta    \
         --adls-container datalake            \
-        --adls-path      transactions_uniform
+        --adls-path      transactions_uniform \
+        [--incremental --state-uri gs://raw-dev-michaelpage-prueba/state/run_merge.json] \
+        [--skip-unchanged --fingerprint] \
+        [--since-date 2024-01-01 --until-date 2024-01-31] \
+        [--stream --memory-limit-mb 256] \
+        [--staging-sink write-api --write-streams 4] \
+        [--backfill-from 120 --backfill-to 480 --backfill-workers 8] \
+        [--migrate-final-table] [--merge-dry-run] \
+        [--staging-table transactions_staging --target-table final_table] \
+        [--run-state-uri gs://raw-dev-michaelpage-prueba/state/run_merge_run.json] \
+        [--report-uri gs://raw-dev-michaelpage-prueba/reports/run_merge.json [--profile cprofile]]
 
 Variables de entorno requeridas:
     ADLS_ACCESS_KEY                — clave de acceso ADLS Gen2
@@ -40,15 +184,39 @@ Nota IA: Refactorizado con asistencia de Claude (Anthropic).
 """
 
 import argparse
+import hashlib
+import itertools
 import logging
 import os
+import queue
+import re
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import pyarrow as pa
-import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.dataset as pads
+import pyarrow.parquet as pq
 from deltalake import DeltaTable
 from google.cloud import bigquery
 
+from bq_write_stream import (DEFAULT_STREAMS, STREAM_TYPES, BigQueryWriteApi, StreamWriter,
+                             table_path)
+from change_index import ChangeFilter, ChangeIndex
+from delta_cache import DEFAULT_CACHE_MB, DeltaFileCache, open_cache, report_cache
+from delta_fs import ReadStats, delta_filesystem
+from delta_log import file_versions
+from etl_state import RunCheckpoint, default_run_id, read_state, write_state
+from key_dedup import SEQ_COLUMN, LatestRowDeduplicator, sequence_array
+from run_report import PROFILE_MODES, count, record_job, reporting, set_value, span
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
@@ -95,8 +263,13 @@ WHERE NOT EXISTS (
 # ──────────────────────────────────────────────────────────────
 # DDL: tabla destino del MERGE en US
 # ──────────────────────────────────────────────────────────────
+STAGING_TABLE = "transactions_staging"
+FINAL_TABLE = "final_table"
+FINAL_PARTITION_COLUMN = "transaction_date"
+FINAL_CLUSTER_COLUMNS = ["customer_id", "transaction_id"]
+
 CREATE_FINAL_TABLE_SQL = """
-CREATE TABLE IF NOT EXISTS `{project}.{dataset}.final_table` (
+CREATE TABLE IF NOT EXISTS `{project}.{dataset}.{table}` (
   transaction_id   STRING  NOT NULL,
   customer_id      STRING,
   customer_name    STRING,
@@ -107,6 +280,8 @@ CREATE TABLE IF NOT EXISTS `{project}.{dataset}.final_table` (
   last_updated     TIMESTAMP,
   PRIMARY KEY (transaction_id) NOT ENFORCED
 )
+PARTITION BY transaction_date
+CLUSTER BY customer_id, transaction_id
 OPTIONS (
   labels = [
     ('environment',    '{env}'),
@@ -121,7 +296,7 @@ OPTIONS (
 # MERGE: transactions_staging + customers → final_table (US)
 # ──────────────────────────────────────────────────────────────
 MERGE_SQL = """
-MERGE `{project}.{dataset}.final_table` AS target
+MERGE `{project}.{dataset}.{target_table}` AS target
 USING (
   SELECT
     t.transaction_id,
@@ -132,11 +307,11 @@ USING (
     DATE(t.transaction_date)   AS transaction_date,
     t.status,
     CURRENT_TIMESTAMP()        AS last_updated
-  FROM `{project}.{dataset}.transactions_staging` AS t
-  LEFT JOIN `{project}.{dataset}.customers`        AS c
+  FROM `{project}.{dataset}.{staging_table}` AS t
+  LEFT JOIN `{project}.{dataset}.customers` AS c
     ON t.customer_id = c.customer_id
 ) AS source
-ON target.transaction_id = source.transaction_id
+ON target.transaction_id = source.transaction_id{target_date_filter}
 
 WHEN MATCHED AND (
   target.status        != source.status        OR
@@ -158,15 +333,79 @@ WHEN NOT MATCHED BY TARGET THEN INSERT (
 )
 """
 
+# Predicado constante sobre el destino: BigQuery solo lee las particiones
+# del rango de fechas presente en staging
+MERGE_DATE_FILTER_SQL = """
+  AND target.transaction_date BETWEEN DATE '{min_date}' AND DATE '{max_date}'"""
+
+STAGING_DATE_RANGE_SQL = """
+SELECT
+  MIN(DATE(transaction_date)) AS min_date,
+  MAX(DATE(transaction_date)) AS max_date
+FROM `{project}.{dataset}.{staging_table}`
+"""
+
+# ──────────────────────────────────────────────────────────────
+# Migración: final_table sin particionar → particionada y clusterizada
+# ──────────────────────────────────────────────────────────────
+# La tabla nueva se crea con CREATE_FINAL_TABLE_SQL (mismo schema y
+# PRIMARY KEY), se copia y se intercambia por nombre. La original queda
+# como respaldo ({backup}) hasta que se borre a mano.
+COPY_FINAL_TABLE_SQL = """
+INSERT INTO `{project}.{dataset}.{table}`
+  (transaction_id, customer_id, customer_name, country,
+   amount, transaction_date, status, last_updated)
+SELECT
+  transaction_id, customer_id, customer_name, country,
+  amount, transaction_date, status, last_updated
+FROM `{project}.{dataset}.{target_table}`
+"""
+
+RENAME_TABLE_SQL = """
+ALTER TABLE `{project}.{dataset}.{table}` RENAME TO `{new_name}`
+"""
+
+
+# ──────────────────────────────────────────────────────────────
+# Límites de concurrencia compartidos entre tablas (run_pipelines.py)
+# ──────────────────────────────────────────────────────────────
+# Sin configurar, no limitan nada: una ejecución de una sola tabla no cambia.
+_concurrency: Dict[str, threading.BoundedSemaphore] = {}
+
+
+def set_concurrency_limits(adls_reads: Optional[int] = None,
+                           bigquery_jobs: Optional[int] = None) -> None:
+    """Máximo de lecturas ADLS y de jobs BigQuery simultáneos en el proceso."""
+    _concurrency.clear()
+    if adls_reads:
+        _concurrency["adls"] = threading.BoundedSemaphore(adls_reads)
+    if bigquery_jobs:
+        _concurrency["bigquery"] = threading.BoundedSemaphore(bigquery_jobs)
+
+
+@contextmanager
+def concurrency_slot(resource: str) -> Iterator[None]:
+    """Ocupa un cupo de `resource` ("adls" o "bigquery") durante el bloque."""
+    semaphore = _concurrency.get(resource)
+    if semaphore is None:
+        yield
+        return
+    started = time.perf_counter()
+    with semaphore:
+        count(f"{resource}_wait_seconds", round(time.perf_counter() - started, 3))
+        yield
+
 
 # ──────────────────────────────────────────────────────────────
 # Helper: ejecutar SQL en BigQuery
 # ──────────────────────────────────────────────────────────────
 def execute(client: bigquery.Client, sql: str, description: str,
-            location: str = "US") -> bigquery.QueryJob:
+            location: str = "US", step: Optional[str] = None) -> bigquery.QueryJob:
     log.info("%s ...", description)
-    job = client.query(sql, location=location)
-    job.result()
+    with concurrency_slot("bigquery"):
+        job = client.query(sql, location=location)
+        job.result()
+    record_job(job, step or description)
     affected = getattr(job, "num_dml_affected_rows", None)
     if affected is not None:
         log.info("  Filas afectadas: %d", affected or 0)
@@ -174,12 +413,577 @@ def execute(client: bigquery.Client, sql: str, description: str,
     return job
 
 
+# ──────────────────────────────────────────────────────────────
+# Conexión a la tabla Delta en ADLS Gen2
+# ──────────────────────────────────────────────────────────────
+def adls_storage_options(adls_account: str, adls_key: str) -> dict:
+    """Opciones de autenticación para deltalake → ADLS Gen2."""
+    return {
+        "account_name": adls_account,
+        "account_key":  adls_key,
+    }
+
+
+def active_files_fingerprint(dt: DeltaTable) -> str:
+    """
+    Hash del conjunto de archivos activos (path + tamaño) de la versión
+    cargada. Detecta tablas recreadas que reutilizan números de versión.
+    """
+    actions = dt.get_add_actions(flatten=True).to_pydict()
+    digest = hashlib.sha256()
+    for path, size in sorted(zip(actions["path"], actions["size_bytes"])):
+        digest.update(f"{path}:{size}\n".encode())
+    return digest.hexdigest()
+
+
+# ──────────────────────────────────────────────────────────────
+# Modo incremental: archivos añadidos desde el último watermark
+#
+# Delta es append-only a nivel de archivo: un commit añade y/o
+# elimina archivos Parquet, nunca los modifica. Los archivos activos
+# hoy que no estaban activos en la versión del watermark contienen
+# exactamente las filas nuevas o reescritas desde entonces.
+# ──────────────────────────────────────────────────────────────
+def files_added_since(dt: DeltaTable, since_version: int,
+                      storage_options: dict) -> Optional[Set[str]]:
+    """
+    Devuelve los paths (relativos a la tabla) de los archivos activos en
+    la versión actual que no lo estaban en `since_version`.
+    None indica que no es posible calcularlo y hay que hacer carga completa.
+    """
+    if since_version > dt.version():
+        log.warning("  Watermark %d posterior a la versión actual %d "
+                    "(¿tabla recreada?) — carga completa.",
+                    since_version, dt.version())
+        return None
+    try:
+        previous = DeltaTable(dt.table_uri, version=since_version,
+                              storage_options=storage_options)
+    except Exception as exc:
+        log.warning("  No se pudo leer la versión %d (%s) — carga completa.",
+                    since_version, exc)
+        return None
+    return set(dt.files()) - set(previous.files())
+
+
+def select_files(dataset: pads.FileSystemDataset,
+                 paths: Set[str]) -> pads.FileSystemDataset:
+    """Restringe un dataset de deltalake a los fragmentos de `paths`."""
+    fragments = [f for f in dataset.get_fragments() if f.path in paths]
+    return pads.FileSystemDataset(fragments, dataset.schema,
+                                  dataset.format, dataset.filesystem)
+
+
+# ──────────────────────────────────────────────────────────────
+# Filtro por rango de fechas (predicate pushdown)
+# ──────────────────────────────────────────────────────────────
+DATE_COLUMN = "transaction_date"
+
+
+def _date_literal(arrow_type: pa.DataType, value: date):
+    # En el Delta de transacciones la fecha es string ISO: el orden
+    # lexicográfico de YYYY-MM-DD coincide con el cronológico.
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return value.isoformat()
+    return value
+
+
+def date_range_filter(schema: pa.Schema, since: Optional[date],
+                      until: Optional[date]) -> Optional[pads.Expression]:
+    """Expresión Arrow `since <= transaction_date <= until` (extremos opcionales)."""
+    arrow_type = schema.field(DATE_COLUMN).type
+    expr = None
+    if since is not None:
+        expr = pc.field(DATE_COLUMN) >= _date_literal(arrow_type, since)
+    if until is not None:
+        upper = pc.field(DATE_COLUMN) <= _date_literal(arrow_type, until)
+        expr = upper if expr is None else expr & upper
+    return expr
+
+
+def date_partition_filters(dt: DeltaTable, since: Optional[date],
+                           until: Optional[date]) -> Optional[list]:
+    """
+    Filtros de partición para to_pyarrow_dataset(): deltalake descarta los
+    archivos fuera de rango antes de construir el dataset. None si la tabla
+    no está particionada por transaction_date.
+    """
+    if DATE_COLUMN not in dt.metadata().partition_columns:
+        return None
+    filters = []
+    if since is not None:
+        filters.append((DATE_COLUMN, ">=", since.isoformat()))
+    if until is not None:
+        filters.append((DATE_COLUMN, "<=", until.isoformat()))
+    return filters or None
+
+
+# ──────────────────────────────────────────────────────────────
+# Proyección de columnas y opciones de lectura
+#
+# Solo se transfieren desde ADLS las columnas de staging que usa el
+# MERGE (referencias t.<columna> en MERGE_SQL). Los row groups se leen
+# en paralelo (scan_batches, o fragment_readahead en la lectura
+# completa sin dedup) y con pre_buffer, que coalesce los rangos de
+# column chunks de cada row group en pocas lecturas grandes.
+# ──────────────────────────────────────────────────────────────
+DEFAULT_READ_THREADS = 8
+
+PARQUET_SCAN_OPTIONS = pads.ParquetFragmentScanOptions(pre_buffer=True)
+
+
+def merge_source_columns(schema: pa.Schema, merge_sql: str = MERGE_SQL) -> List[str]:
+    """Columnas de staging referenciadas por el MERGE, en el orden del schema."""
+    referenced = set(re.findall(r"\bt\.(\w+)", merge_sql))
+    missing = referenced - set(schema.names)
+    if missing:
+        raise ValueError(f"El MERGE usa columnas que no existen en la tabla Delta: {sorted(missing)}")
+    return [name for name in schema.names if name in referenced]
+
+
+def project_schema(schema: pa.Schema, columns: List[str]) -> pa.Schema:
+    return pa.schema([schema.field(name) for name in columns])
+
+
+# ──────────────────────────────────────────────────────────────
+# Schema de staging: Delta (Arrow) → BigQuery
+#
+# El schema Delta guarda transaction_date como string ISO
+# (YYYY-MM-DD); en staging se carga como DATE nativo.
+# ──────────────────────────────────────────────────────────────
+STAGING_TYPE_OVERRIDES = {
+    "transaction_date": pa.date32(),
+}
+
+
+def staging_arrow_schema(delta_schema: pa.Schema) -> pa.Schema:
+    """Schema Arrow con el que se escribe el Parquet de staging."""
+    fields = []
+    for field in delta_schema:
+        override = STAGING_TYPE_OVERRIDES.get(field.name)
+        fields.append(field.with_type(override) if override is not None else field)
+    return pa.schema(fields)
+
+
+def bq_type_for_arrow(arrow_type: pa.DataType) -> str:
+    if pa.types.is_decimal(arrow_type):
+        # NUMERIC: precisión 38, escala 9 (29 dígitos enteros)
+        integer_digits = arrow_type.precision - arrow_type.scale
+        if arrow_type.scale <= 9 and integer_digits <= 29:
+            return "NUMERIC"
+        return "BIGNUMERIC"
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return "STRING"
+    if pa.types.is_date(arrow_type):
+        return "DATE"
+    if pa.types.is_timestamp(arrow_type):
+        return "TIMESTAMP"
+    if pa.types.is_integer(arrow_type):
+        return "INT64"
+    if pa.types.is_floating(arrow_type):
+        return "FLOAT64"
+    if pa.types.is_boolean(arrow_type):
+        return "BOOL"
+    if pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        return "BYTES"
+    raise TypeError(f"Tipo Arrow sin equivalente BigQuery en staging: {arrow_type}")
+
+
+def write_api_arrow_schema(schema: pa.Schema) -> pa.Schema:
+    """
+    Schema de staging con los tipos que la Write API espera para cada tipo
+    BigQuery: NUMERIC = decimal128(38, 9), BIGNUMERIC = decimal256(76, 38),
+    TIMESTAMP = timestamp[us, UTC]. Mismo schema BigQuery que el original.
+    """
+    fields = []
+    for field in schema:
+        arrow_type = field.type
+        if pa.types.is_decimal(arrow_type):
+            arrow_type = (pa.decimal128(38, 9) if bq_type_for_arrow(arrow_type) == "NUMERIC"
+                          else pa.decimal256(76, 38))
+        elif pa.types.is_timestamp(arrow_type):
+            arrow_type = pa.timestamp("us", tz="UTC")
+        fields.append(field.with_type(arrow_type))
+    return pa.schema(fields)
+
+
+def bq_schema_from_arrow(schema: pa.Schema) -> List[bigquery.SchemaField]:
+    return [
+        bigquery.SchemaField(field.name, bq_type_for_arrow(field.type),
+                             mode="NULLABLE" if field.nullable else "REQUIRED")
+        for field in schema
+    ]
+
+
+# La API devuelve los nombres legacy de los tipos (INTEGER, no INT64)
+_LEGACY_BQ_TYPES = {"INTEGER": "INT64", "FLOAT": "FLOAT64", "BOOLEAN": "BOOL",
+                    "BIGDECIMAL": "BIGNUMERIC"}
+
+
+def _schema_signature(fields: Iterable[bigquery.SchemaField]) -> List[Tuple[str, str, str]]:
+    return [(f.name, _LEGACY_BQ_TYPES.get(f.field_type.upper(), f.field_type.upper()),
+             (f.mode or "NULLABLE").upper()) for f in fields]
+
+
+def ensure_staging_table(bq_client: bigquery.Client, staging_table: str,
+                         schema: pa.Schema) -> None:
+    """
+    Crea staging con el schema de `schema`, o la recrea si existe con otro
+    (ej. transaction_date STRING de una versión anterior): TRUNCATE
+    conserva el schema y la Write API rechazaría las filas.
+    """
+    from google.cloud.exceptions import NotFound
+    expected = bq_schema_from_arrow(schema)
+    try:
+        existing = bq_client.get_table(staging_table)
+    except NotFound:
+        existing = None
+    if existing is not None and _schema_signature(existing.schema) != _schema_signature(expected):
+        log.warning("Schema de %s distinto del esperado: se recrea la tabla", staging_table)
+        bq_client.delete_table(staging_table, not_found_ok=True)
+        existing = None
+    if existing is None:
+        bq_client.create_table(bigquery.Table(staging_table, schema=expected), exists_ok=True)
+
+
+# ──────────────────────────────────────────────────────────────
+# Carga de bloques Arrow en staging
+# ──────────────────────────────────────────────────────────────
+def encode_chunk(chunk: pa.Table, schema: pa.Schema) -> Tuple[pa.Buffer, int]:
+    """Serializa un bloque Arrow a Parquet en memoria: (payload, filas)."""
+    with span("convert") as s:
+        buffer = pa.BufferOutputStream()
+        pq.write_table(chunk.cast(schema), buffer, compression="snappy")
+        payload = buffer.getvalue()
+        s["rows"] = chunk.num_rows
+        s["bytes"] = payload.size
+    return payload, chunk.num_rows
+
+
+def load_arrow_chunk(bq_client: bigquery.Client, staging_table: str,
+                     chunk: pa.Table, write_disposition: str,
+                     schema: pa.Schema) -> None:
+    """
+    Carga un bloque Arrow en staging como Parquet en memoria.
+    `schema` es el schema Arrow de staging (ver staging_arrow_schema).
+    """
+    payload, rows = encode_chunk(chunk, schema)
+    load_payload(bq_client, staging_table, payload, rows, write_disposition, schema)
+
+
+def load_payload(bq_client: bigquery.Client, staging_table: str, payload: pa.Buffer,
+                 rows: int, write_disposition: str, schema: pa.Schema) -> None:
+    """Carga en staging un bloque ya serializado por encode_chunk."""
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=write_disposition,
+        create_disposition=bigquery.CreateDisposition.CREATE_IF_NEEDED,
+        schema=bq_schema_from_arrow(schema),
+    )
+
+    with concurrency_slot("bigquery"), span("load") as s:
+        load_job = bq_client.load_table_from_file(
+            pa.BufferReader(payload),
+            staging_table,
+            size=payload.size,
+            job_config=job_config,
+        )
+        load_job.result()
+        s["rows"] = rows
+    record_job(load_job, "load")
+    count("load_jobs")
+    count("load_bytes", payload.size)
+    count("staged_rows", rows)
+
+
+# ──────────────────────────────────────────────────────────────
+# Modo streaming: memoria acotada
+#
+# Cada bloque ocupa como máximo chunk_bytes en Arrow, más su copia
+# casteada y el Parquet serializado durante la carga, más los
+# row groups en lectura anticipada (como mucho --read-threads, ver
+# scan_batches).
+# Con chunk_bytes = límite / 4 el pico queda por debajo del límite.
+#
+# Con pipeline_depth = d > 0, lectura, serialización y carga corren
+# en hilos distintos unidos por colas de d bloques: mientras se sube
+# un bloque se serializa el siguiente y se descarga el posterior. Hay
+# hasta ~4·(1 + d) bloques en vuelo, así que chunk_bytes se reduce a
+# límite / (4·(1 + d)).
+# ──────────────────────────────────────────────────────────────
+STREAM_BATCH_ROWS = 65_536
+DEFAULT_PIPELINE_DEPTH = 1
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+def prefetch(items: Iterable, depth: int, name: str) -> Iterator:
+    """
+    Consume `items` en un hilo aparte, como mucho `depth` elementos por
+    delante del consumidor: la cola acotada frena al productor
+    (backpressure). Las excepciones del productor se relanzan aquí; si el
+    consumidor abandona, el productor se detiene en el siguiente elemento.
+    """
+    pending: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as exc:
+            put(_Failure(exc))
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    # copy_context: el hilo registra en el mismo reporte de ejecución
+    thread = threading.Thread(target=copy_context().run, args=(produce,), daemon=True,
+                              name=f"{threading.current_thread().name}-{name}")
+    thread.start()
+    try:
+        while True:
+            item = pending.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def scan_batches(source: pads.Dataset, columns: List[str], read_threads: int,
+                 stats: ReadStats,
+                 sequence: Optional[Dict[str, int]] = None,
+                 row_filter: Optional[pc.Expression] = None) -> Iterator[pa.RecordBatch]:
+    """
+    Record batches de `source` (filtrados por `row_filter`) en orden de
+    archivo y de row group. Con `sequence` (ruta → rango, ver
+    file_sequence) se añade SEQ_COLUMN a cada batch.
+
+    Se leen como mucho `read_threads` row groups a la vez, cada uno con
+    pre_buffer. No se usa el scanner del dataset: con un consumidor más
+    lento que la lectura (dedup, cargas) sigue leyendo por adelantado y
+    llega a acumular archivos enteros en memoria, fuera del límite de
+    --memory-limit-mb.
+    """
+    def row_groups() -> Iterator[pads.ParquetFileFragment]:
+        for fragment in source.get_fragments(filter=row_filter):
+            yield from fragment.split_by_row_group(row_filter, schema=source.schema)
+
+    def read(row_group: pads.ParquetFileFragment) -> pa.Table:
+        return row_group.to_table(schema=source.schema, columns=columns, filter=row_filter,
+                                  batch_size=STREAM_BATCH_ROWS, use_threads=False,
+                                  fragment_scan_options=PARQUET_SCAN_OPTIONS)
+
+    rows_seen: Dict[str, int] = {}
+    window: deque = deque()
+    pending = row_groups()
+    with ThreadPoolExecutor(max_workers=max(1, read_threads),
+                            thread_name_prefix=f"{threading.current_thread().name}-read"
+                            ) as pool:
+        try:
+            while True:
+                # copy_context: los hilos registran en el mismo reporte de ejecución
+                for row_group in itertools.islice(pending, max(1, read_threads) - len(window)):
+                    window.append((row_group.path,
+                                   pool.submit(copy_context().run, read, row_group)))
+                if not window:
+                    break
+                path, future = window.popleft()
+                # Solo cuenta como tiempo de lectura la espera por el siguiente row group
+                started = time.perf_counter()
+                with span("read"):
+                    table = future.result()
+                stats.add_wall(time.perf_counter() - started)
+                for batch in table.to_batches(max_chunksize=STREAM_BATCH_ROWS):
+                    if batch.num_rows == 0:
+                        continue
+                    if sequence is not None:
+                        first_row = rows_seen.get(path, 0)
+                        rows_seen[path] = first_row + batch.num_rows
+                        seq = sequence_array(sequence[path], first_row, batch.num_rows)
+                        batch = pa.RecordBatch.from_arrays(
+                            batch.columns + [seq], names=batch.schema.names + [SEQ_COLUMN])
+                    yield batch
+                del table
+        finally:
+            for _, future in window:
+                future.cancel()
+
+
+def iter_chunks(parts: Iterable, chunk_bytes: int) -> Iterator[pa.Table]:
+    """Agrupa record batches (o tablas) en bloques de ~chunk_bytes."""
+    pending, pending_bytes = [], 0
+    for part in parts:
+        for batch in (part.to_batches() if isinstance(part, pa.Table) else [part]):
+            if batch.num_rows == 0:
+                continue
+            pending.append(batch)
+            pending_bytes += batch.nbytes
+            if pending_bytes >= chunk_bytes:
+                yield pa.Table.from_batches(pending)
+                pending, pending_bytes = [], 0
+    if pending:
+        yield pa.Table.from_batches(pending)
+
+
+def stream_to_staging(bq_client: bigquery.Client, staging_table: str,
+                      chunks: Iterable[pa.Table], schema: pa.Schema,
+                      pipeline_depth: int = 0) -> int:
+    """
+    Carga los bloques en staging. Devuelve las filas cargadas.
+    Con `pipeline_depth` > 0, lectura y serialización corren en segundo
+    plano mientras este hilo espera cada carga (en orden: la primera es
+    WRITE_TRUNCATE).
+    """
+    if pipeline_depth:
+        chunks = prefetch(chunks, pipeline_depth, "read")
+    encoded = (encode_chunk(chunk, schema) for chunk in chunks)
+    if pipeline_depth:
+        encoded = prefetch(encoded, pipeline_depth, "encode")
+
+    total_rows = 0
+    disposition = bigquery.WriteDisposition.WRITE_TRUNCATE
+    for n, (payload, rows) in enumerate(encoded, start=1):
+        load_payload(bq_client, staging_table, payload, rows, disposition, schema)
+        total_rows += rows
+        log.info("  Bloque %d cargado — %d filas (acumulado: %d)",
+                 n, rows, total_rows)
+        disposition = bigquery.WriteDisposition.WRITE_APPEND
+        del payload
+
+    if disposition == bigquery.WriteDisposition.WRITE_TRUNCATE:
+        # Dataset vacío: staging debe quedar vacío igual que en carga completa
+        load_arrow_chunk(bq_client, staging_table,
+                         schema.empty_table(), disposition, schema)
+    return total_rows
+
+
+def write_api_to_staging(bq_client: bigquery.Client, staging_table: str,
+                         chunks: Iterable[pa.Table], schema: pa.Schema,
+                         writer: StreamWriter, pipeline_depth: int = 0) -> int:
+    """
+    Alternativa a stream_to_staging con la Storage Write API: vacía
+    staging (TRUNCATE, la tabla se crea o recrea con el schema explícito,
+    ver ensure_staging_table) y agrega los bloques en paralelo (ver
+    bq_write_stream.py). Devuelve las filas cargadas.
+    """
+    ensure_staging_table(bq_client, staging_table, schema)
+    execute(bq_client, f"TRUNCATE TABLE `{staging_table}`",
+            f"Vaciando {staging_table}", step="truncate")
+    if pipeline_depth:
+        chunks = prefetch(chunks, pipeline_depth, "read")
+    with span("load") as s:
+        rows = writer.append(table_path(staging_table), chunks, write_api_arrow_schema(schema))
+        s["rows"] = rows
+    count("staged_rows", rows)
+    return rows
+
+
+def load_table(bq_client: bigquery.Client, staging_table: str, table: pa.Table,
+               schema: pa.Schema, writer: Optional[StreamWriter] = None) -> int:
+    """Reemplaza staging por `table` (load job, o Write API con `writer`)."""
+    if writer is not None:
+        return write_api_to_staging(bq_client, staging_table, [table], schema, writer)
+    load_arrow_chunk(bq_client, staging_table, table,
+                     bigquery.WriteDisposition.WRITE_TRUNCATE, schema)
+    return table.num_rows
+
+
+# ──────────────────────────────────────────────────────────────
+# Deduplicación por transaction_id (la última versión gana)
+#
+# Una misma transacción puede aparecer en varios commits (ej.
+# TXN-003 en las versiones 0 y 1). BigQuery rechaza un MERGE en el
+# que varias filas de origen coinciden con la misma fila destino, así
+# que staging recibe solo la fila más reciente de cada clave.
+# ──────────────────────────────────────────────────────────────
+DEDUP_KEY = "transaction_id"
+
+
+def file_sequence(dt: DeltaTable, storage_options: dict,
+                  cache: Optional[DeltaFileCache] = None,
+                  paths: Optional[Set[str]] = None) -> Dict[str, int]:
+    """
+    Rango de cada archivo activo (o solo de `paths`) en orden de commit:
+    versión efectiva del replay del _delta_log (ver delta_log.py), con
+    modificationTime y la ruta como desempate entre archivos de un mismo
+    commit. Los archivos que reescribe maintain_delta.py conservan la
+    versión de sus filas más recientes y, dentro, el orden de commit.
+    """
+    versions = file_versions(dt, storage_options, cache, paths)
+    actions = dt.get_add_actions(flatten=True).to_pydict()
+    ordered = sorted((versions[path], modified, path)
+                     for path, modified in zip(actions["path"], actions["modification_time"])
+                     if paths is None or path in paths)
+    return {path: rank for rank, (_, _, path) in enumerate(ordered)}
+
+
+def selected_rows(dt: DeltaTable, source: pads.FileSystemDataset) -> int:
+    """Filas de los archivos de `source` según las estadísticas del Delta log."""
+    actions = dt.get_add_actions(flatten=True).to_pydict()
+    rows = dict(zip(actions["path"], actions["num_records"]))
+    return sum(rows.get(path) or 0 for path in source.files)
+
+
+def deduplicated(batches: Iterable[pa.RecordBatch],
+                 deduper: LatestRowDeduplicator) -> Iterator[pa.Table]:
+    """Filas ganadoras de `batches` (sin SEQ_COLUMN), vía `deduper`."""
+    for batch in batches:
+        with span("dedup"):
+            deduper.add(batch)
+    results = deduper.results()
+    while True:
+        with span("dedup"):
+            table = next(results, None)
+        if table is None:
+            break
+        yield table.drop_columns([SEQ_COLUMN])
+    removed = deduper.rows_in - deduper.rows_out
+    log.info("  Dedup por %s: %d → %d filas (%d duplicada(s) descartada(s))%s",
+             deduper.key, deduper.rows_in, deduper.rows_out, removed,
+             f" | {deduper.partitions} particiones en disco, "
+             f"{deduper.spilled_bytes / 1024 / 1024:.1f} MB" if deduper.spilled else "")
+    count("dedup_rows_removed", removed)
+    count("dedup_spilled_bytes", deduper.spilled_bytes)
+
+
+def changed_only(parts: Iterable, changes: ChangeFilter) -> Iterator[pa.Table]:
+    """Solo las filas nuevas o modificadas según el índice de cambios."""
+    for part in parts:
+        table = pa.Table.from_batches([part]) if isinstance(part, pa.RecordBatch) else part
+        with span("change_filter"):
+            table = changes.filter(table)
+        if table.num_rows:
+            yield table
+
+
 # ──────────────────────────────────────────────────────────────
 # PASO 1+2: Python ETL Bridge  ADLS Gen2 → BigQuery
 #
 # Lee el Delta Lake directamente con la librería `deltalake`
 # (soporta ADLS Gen2 nativamente via azure-storage-blob).
-# Convierte PyArrow → pandas → carga en BigQuery.
+# Serializa PyArrow → Parquet en memoria → carga en BigQuery.
 #
 # Ventaja clave: no pasa por GCS ni depende de BigQuery Omni
 # para escribir — elimina el problema cross-cloud completamente.
@@ -192,97 +996,560 @@ def etl_bridge_adls_to_bq(
     adls_container: str,
     adls_path: str,
     adls_key: str,
-) -> None:
+    since_version: Optional[int] = None,
+    memory_limit_mb: Optional[int] = None,
+    delta_table: Optional[DeltaTable] = None,
+    since_date: Optional[date] = None,
+    until_date: Optional[date] = None,
+    read_threads: int = DEFAULT_READ_THREADS,
+    dedup: bool = True,
+    spill_dir: Optional[str] = None,
+    changes: Optional[ChangeFilter] = None,
+    staging_table: str = STAGING_TABLE,
+    pipeline_depth: int = DEFAULT_PIPELINE_DEPTH,
+    cache: Optional[DeltaFileCache] = None,
+    writer: Optional[StreamWriter] = None,
+) -> Tuple[int, int]:
     """
     Lee la última versión del Delta Lake desde ADLS Gen2 y carga
-    directamente en dw_{env}.transactions_staging (BigQuery US).
+    directamente en dw_{env}.<staging_table> (BigQuery US).
+
+    Si se indica `since_version`, solo se cargan las filas de los archivos
+    añadidos después de esa versión (modo incremental). Si se indica
+    `memory_limit_mb`, la carga se hace en streaming por bloques.
+    `delta_table` permite reutilizar una DeltaTable ya abierta.
+    `since_date`/`until_date` limitan las filas leídas por transaction_date.
+    `read_threads` es el número de archivos que se descargan en paralelo.
+    Con `dedup`, solo se carga la fila más reciente de cada transaction_id;
+    en streaming, lo que no cabe en memoria se particiona en `spill_dir`.
+    Con `changes`, solo se cargan las filas nuevas o modificadas respecto
+    del índice de cambios (ver change_index.py). En streaming,
+    `pipeline_depth` > 0 solapa lectura, serialización y carga. Con
+    `cache`, los archivos de datos se sirven desde el caché local. Con
+    `writer`, staging se carga con la Storage Write API en lugar de load
+    jobs.
+
+    Devuelve (versión Delta leída, filas cargadas en staging). Si no hay
+    filas nuevas, staging no se toca y se devuelven 0 filas.
     """
-    staging_table = f"{project}.{dataset}.transactions_staging"
+    staging_ref = f"{project}.{dataset}.{staging_table}"
     uri = f"az://{adls_container}/{adls_path}"
 
     log.info("ETL Bridge — Leyendo Delta Lake desde ADLS Gen2")
     log.info("  URI    : %s", uri)
     log.info("  Account: %s", adls_account)
 
-    # Opciones de autenticación para deltalake → ADLS Gen2
-    storage_options = {
-        "account_name": adls_account,
-        "account_key":  adls_key,
-    }
+    storage_options = adls_storage_options(adls_account, adls_key)
 
     # deltalake resuelve el _delta_log automáticamente y devuelve
     # siempre la última versión committed — sin necesidad de polling.
-    dt = DeltaTable(uri, storage_options=storage_options)
-    current_version = dt.version()
-    log.info("  Versión Delta actual: %d", current_version)
+    with concurrency_slot("adls"), span("open") as s:
+        dt = delta_table or DeltaTable(uri, storage_options=storage_options)
+        current_version = dt.version()
+        log.info("  Versión Delta actual: %d", current_version)
 
-    arrow_table: pa.Table = dt.to_pyarrow_dataset().to_table()
-    log.info("  Filas leídas: %d | Schema: %s",
-             arrow_table.num_rows,
-             [f.name for f in arrow_table.schema])
+        pa.set_io_thread_count(read_threads)
+        read_stats = ReadStats()
+        source = dt.to_pyarrow_dataset(
+            partitions=date_partition_filters(dt, since_date, until_date),
+            filesystem=delta_filesystem(dt, storage_options, read_stats, cache),
+        )
+        if since_version is not None:
+            new_files = files_added_since(dt, since_version, storage_options)
+            if new_files is not None:
+                log.info("  Modo incremental: %d archivo(s) nuevo(s) desde la versión %d",
+                         len(new_files), since_version)
+                if not new_files:
+                    log.info("  Sin cambios desde el último MERGE — staging no se recarga.")
+                    return current_version, 0
+                source = select_files(source, new_files)
+        s["files"] = len(source.files)
 
-    # PyArrow → pandas para load_table_from_dataframe
-    df = arrow_table.to_pandas()
+    row_filter = date_range_filter(source.schema, since_date, until_date)
+    if row_filter is not None:
+        log.info("  Filtro: %s", row_filter)
 
-    log.info("ETL Bridge — Cargando en BigQuery → %s", staging_table)
+    columns = merge_source_columns(source.schema)
+    log.info("  Columnas proyectadas: %s | lectura paralela: %d archivos",
+             columns, read_threads)
 
-    job_config = bigquery.LoadJobConfig(
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-        create_disposition=bigquery.CreateDisposition.CREATE_IF_NEEDED,
-        autodetect=True,
-    )
+    log.info("ETL Bridge — Cargando en BigQuery → %s", staging_ref)
 
-    load_job = bq_client.load_table_from_dataframe(
-        df,
-        staging_table,
-        job_config=job_config,
-    )
-    load_job.result()
+    # Solo los archivos que se leen (incremental: los añadidos desde el watermark)
+    sequence = file_sequence(dt, storage_options, cache, set(source.files)) if dedup else None
+    schema = staging_arrow_schema(project_schema(source.schema, columns))
 
-    dest = bq_client.get_table(staging_table)
+    if memory_limit_mb:
+        in_flight = 4 * (1 + pipeline_depth)
+        chunk_bytes = max(memory_limit_mb * 1024 * 1024 // in_flight, 1024 * 1024)
+        log.info("  Modo streaming: bloques de %.1f MB (límite %d MB, pipeline %s)",
+                 chunk_bytes / 1024 / 1024, memory_limit_mb,
+                 f"profundidad {pipeline_depth}" if pipeline_depth else "desactivado")
+        parts = scan_batches(source, columns, read_threads, read_stats, sequence, row_filter)
+        if dedup:
+            parts = deduplicated(parts, LatestRowDeduplicator(
+                DEDUP_KEY, memory_budget_bytes=chunk_bytes, spill_dir=spill_dir,
+                expected_rows=selected_rows(dt, source)))
+        if changes is not None:
+            parts = changed_only(parts, changes)
+        # La lectura avanza al ritmo de las cargas: el cupo ADLS cubre ambas
+        with concurrency_slot("adls"):
+            if writer is not None:
+                loaded_rows = write_api_to_staging(bq_client, staging_ref,
+                                                   iter_chunks(parts, chunk_bytes), schema,
+                                                   writer, pipeline_depth)
+            else:
+                loaded_rows = stream_to_staging(bq_client, staging_ref,
+                                                iter_chunks(parts, chunk_bytes), schema,
+                                                pipeline_depth)
+    elif dedup:
+        parts = deduplicated(scan_batches(source, columns, read_threads,
+                                          read_stats, sequence, row_filter),
+                             LatestRowDeduplicator(DEDUP_KEY))
+        if changes is not None:
+            parts = changed_only(parts, changes)
+        with concurrency_slot("adls"):
+            parts = list(parts)
+        arrow_table = pa.concat_tables(parts) if parts else project_schema(
+            source.schema, columns).empty_table()
+        log.info("  Filas a cargar: %d | Schema: %s",
+                 arrow_table.num_rows, [f.name for f in arrow_table.schema])
+        loaded_rows = load_table(bq_client, staging_ref, arrow_table, schema, writer)
+    else:
+        with concurrency_slot("adls"):
+            started = time.perf_counter()
+            with span("read") as s:
+                arrow_table: pa.Table = source.to_table(
+                    columns=columns,
+                    filter=row_filter,
+                    fragment_readahead=read_threads,
+                    fragment_scan_options=PARQUET_SCAN_OPTIONS,
+                )
+                s["rows"] = arrow_table.num_rows
+            read_stats.wall_seconds = time.perf_counter() - started
+        log.info("  Filas leídas: %d | Schema: %s",
+                 arrow_table.num_rows,
+                 [f.name for f in arrow_table.schema])
+        if changes is not None:
+            kept = list(changed_only([arrow_table], changes))
+            arrow_table = kept[0] if kept else arrow_table.schema.empty_table()
+        loaded_rows = load_table(bq_client, staging_ref, arrow_table, schema, writer)
+
+    log.info("  Lectura ADLS: %.1f MB en %d archivo(s), %d petición(es) — %.1f s, %.1f MB/s",
+             read_stats.bytes_read / 1024 / 1024, read_stats.files_opened,
+             read_stats.read_requests, read_stats.wall_seconds,
+             read_stats.throughput_mb_s)
+    count("adls_bytes_read", read_stats.bytes_read)
+    count("adls_files_opened", read_stats.files_opened)
+    count("adls_read_requests", read_stats.read_requests)
+    if cache is not None:
+        report_cache(cache)
+    if changes is not None:
+        log.info("  Cambios vs. índice: %d insert(s), %d update(s), %d fila(s) sin cambios omitida(s)",
+                 changes.inserts, changes.updates, changes.unchanged)
+        count("change_inserts", changes.inserts)
+        count("change_updates", changes.updates)
+        count("change_unchanged_skipped", changes.unchanged)
+
+    # Con la Write API, num_rows de la tabla no incluye aún lo que está en
+    # el buffer de streaming: se informan las filas confirmadas
+    staged = bq_client.get_table(staging_ref).num_rows if writer is None else loaded_rows
     log.info(
         "  Carga completada — %d filas en %s (versión Delta: %d)",
-        dest.num_rows, staging_table, current_version,
+        staged, staging_ref, current_version,
+    )
+    return current_version, loaded_rows
+
+
+# ──────────────────────────────────────────────────────────────
+# Backfill por rango de versiones (time travel)
+#
+# Los cambios netos entre la versión base (excluida) y la final son los
+# archivos activos en la final que no lo estaban en la base: lo que se
+# agregó y sigue vigente. El rango se parte en tramos de versiones; con
+# time travel se obtienen los archivos activos en cada límite (en
+# paralelo) y cada archivo queda asignado al primer tramo en cuyo límite
+# aparece. Cada tramo se lee en un hilo del pool y todas las filas pasan
+# por una sola deduplicación ordenada por (versión de commit, fila):
+# staging recibe el estado final de cada clave y se aplica con un
+# solo MERGE, en vez de uno por versión.
+# ──────────────────────────────────────────────────────────────
+DEFAULT_BACKFILL_WORKERS = 4
+BACKFILL_RANGES_PER_WORKER = 4
+
+
+def resolve_version(table_uri: str, storage_options: dict, spec: str) -> int:
+    """
+    Versión de la tabla indicada por `spec`: un número de versión o un
+    instante ISO 8601 (la versión vigente en ese instante; UTC si no
+    tiene zona). -1 si el instante es anterior al primer commit.
+    """
+    if spec.isdigit():
+        return int(spec)
+    moment = datetime.fromisoformat(spec)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    dt = DeltaTable(table_uri, storage_options=storage_options)
+    try:
+        dt.load_as_version(moment)
+    except Exception as exc:
+        first_commit_ms = min((c["timestamp"] for c in dt.history()), default=None)
+        if first_commit_ms is not None and moment.timestamp() * 1000 < first_commit_ms:
+            return -1
+        raise ValueError(f"No se pudo resolver la versión de {spec}: {exc}") from exc
+    return dt.version()
+
+
+def version_boundaries(base: int, final: int, step: int) -> List[int]:
+    """[base, base + step, ..., final]: límites de los tramos de versiones."""
+    return list(range(base, final, step)) + [final]
+
+
+def backfill_file_ranges(table_uri: str, storage_options: dict, boundaries: List[int],
+                         workers: int) -> List[Set[str]]:
+    """
+    Archivos de cada tramo: activos en su límite superior, no en la base
+    ni en un tramo anterior. Las versiones de los límites se leen con
+    time travel en `workers` hilos.
+    """
+    def active_files(version: int) -> Set[str]:
+        if version < 0:
+            return set()
+        try:
+            return set(DeltaTable(table_uri, version=version,
+                                  storage_options=storage_options).files())
+        except Exception as exc:
+            raise RuntimeError(f"La versión {version} no es legible con time travel "
+                               f"(¿log ya expirado?): {exc}") from exc
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        snapshots = list(pool.map(active_files, boundaries))
+    seen = set(snapshots[0])
+    ranges = []
+    for files in snapshots[1:]:
+        ranges.append((files & snapshots[-1]) - seen)
+        seen |= files
+    return ranges
+
+
+def parallel_batches(producers: List, workers: int, depth: int) -> Iterator[pa.RecordBatch]:
+    """
+    Batches de todos los `producers` (funciones sin argumentos que
+    devuelven un iterador), corridos en `workers` hilos, en el orden en que
+    llegan. Como mucho `depth` batches esperan al consumidor; la primera
+    excepción de un productor se relanza aquí y detiene al resto.
+    """
+    pending: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(producer) -> None:
+        try:
+            for batch in producer():
+                if not put(batch):
+                    return
+        except BaseException as exc:
+            put(_Failure(exc))
+
+    def produce_all() -> None:
+        # copy_context: los hilos registran en el mismo reporte de ejecución
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix=f"{threading.current_thread().name}-backfill"
+                                ) as pool:
+            for future in [pool.submit(copy_context().run, produce, producer)
+                           for producer in producers]:
+                future.result()
+        put(_DONE)
+
+    thread = threading.Thread(target=copy_context().run, args=(produce_all,), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = pending.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def actions_rows(actions: dict, files: Set[str]) -> int:
+    """Filas de `files` según las add actions (get_add_actions(flatten=True))."""
+    rows = dict(zip(actions["path"], actions["num_records"]))
+    return sum(rows.get(path) or 0 for path in files)
+
+
+def backfill_to_staging(
+    bq_client: bigquery.Client,
+    project: str,
+    dataset: str,
+    adls_account: str,
+    adls_container: str,
+    adls_path: str,
+    adls_key: str,
+    backfill_from: str,
+    backfill_to: Optional[str] = None,
+    workers: int = DEFAULT_BACKFILL_WORKERS,
+    step: Optional[int] = None,
+    memory_limit_mb: Optional[int] = None,
+    since_date: Optional[date] = None,
+    until_date: Optional[date] = None,
+    read_threads: int = DEFAULT_READ_THREADS,
+    spill_dir: Optional[str] = None,
+    staging_table: str = STAGING_TABLE,
+    pipeline_depth: int = DEFAULT_PIPELINE_DEPTH,
+    cache: Optional[DeltaFileCache] = None,
+    writer: Optional[StreamWriter] = None,
+) -> Tuple[int, int, int]:
+    """
+    Carga en staging el estado neto de cada transaction_id tras los
+    commits de `backfill_from` a `backfill_to` (versiones, inclusivas, o
+    instantes ISO 8601: los commits posteriores al primero hasta el
+    segundo; por defecto hasta la última versión). `step` es el número
+    de versiones por tramo (por defecto, el rango repartido en
+    BACKFILL_RANGES_PER_WORKER tramos por hilo). Con `memory_limit_mb` la
+    deduplicación se particiona en disco y staging se carga por bloques,
+    como en etl_bridge_adls_to_bq.
+
+    Devuelve (versión base excluida, versión final, filas cargadas).
+    """
+    staging_ref = f"{project}.{dataset}.{staging_table}"
+    uri = f"az://{adls_container}/{adls_path}"
+    storage_options = adls_storage_options(adls_account, adls_key)
+
+    with concurrency_slot("adls"), span("open") as s:
+        base = (int(backfill_from) - 1 if backfill_from.isdigit()
+                else resolve_version(uri, storage_options, backfill_from))
+        dt = DeltaTable(uri, storage_options=storage_options)
+        final = dt.version()
+        if backfill_to is not None:
+            final = resolve_version(uri, storage_options, backfill_to)
+            dt = DeltaTable(uri, version=final, storage_options=storage_options)
+        if base >= final:
+            raise ValueError(f"Rango de backfill vacío: versiones {base + 1}..{final}")
+        step = step or max(1, -(-(final - base) // (workers * BACKFILL_RANGES_PER_WORKER)))
+        boundaries = version_boundaries(base, final, step)
+        log.info("Backfill — versiones %d..%d en %d tramo(s) de hasta %d versión(es), "
+                 "%d hilo(s)", base + 1, final, len(boundaries) - 1, step, workers)
+        ranges = backfill_file_ranges(uri, storage_options, boundaries, workers)
+        s["files"] = sum(len(files) for files in ranges)
+        s["ranges"] = len(ranges)
+    log.info("  Archivos con cambios vigentes: %d", s["files"])
+
+    # Orden de las filas: versión de commit y fila, como en la carga normal
+    actions = dt.get_add_actions(flatten=True).to_pydict()
+    sequence = file_sequence(dt, storage_options, cache, set().union(*ranges))
+
+    pa.set_io_thread_count(read_threads)
+    read_stats = ReadStats()
+    source = dt.to_pyarrow_dataset(
+        partitions=date_partition_filters(dt, since_date, until_date),
+        filesystem=delta_filesystem(dt, storage_options, read_stats, cache),
     )
+    row_filter = date_range_filter(source.schema, since_date, until_date)
+    columns = merge_source_columns(source.schema)
+    schema = staging_arrow_schema(project_schema(source.schema, columns))
+
+    def reader(files: Set[str]):
+        selected = select_files(source, files)
+        return lambda: scan_batches(selected, columns, max(1, read_threads // workers),
+                                    read_stats, sequence, row_filter)
+
+    producers = [reader(files) for files in ranges if files]
+    budget = None
+    if memory_limit_mb:
+        budget = max(memory_limit_mb * 1024 * 1024 // (4 * (1 + pipeline_depth)), 1024 * 1024)
+    deduper = LatestRowDeduplicator(DEDUP_KEY, memory_budget_bytes=budget, spill_dir=spill_dir,
+                                    expected_rows=sum(actions_rows(actions, files)
+                                                      for files in ranges))
+
+    log.info("Backfill — Cargando en BigQuery → %s", staging_ref)
+    started = time.perf_counter()
+    with concurrency_slot("adls"):
+        parts = deduplicated(parallel_batches(producers, workers, 2 * workers), deduper)
+        if budget:
+            chunks = iter_chunks(parts, budget)
+            if writer is not None:
+                loaded_rows = write_api_to_staging(bq_client, staging_ref, chunks, schema,
+                                                   writer, pipeline_depth)
+            else:
+                loaded_rows = stream_to_staging(bq_client, staging_ref, chunks, schema,
+                                                pipeline_depth)
+        else:
+            parts = list(parts)
+            table = pa.concat_tables(parts) if parts else schema.empty_table()
+            loaded_rows = load_table(bq_client, staging_ref, table, schema, writer)
+    read_stats.wall_seconds = time.perf_counter() - started
+
+    log.info("  Lectura ADLS: %.1f MB en %d archivo(s), %d petición(es) — %.1f s",
+             read_stats.bytes_read / 1024 / 1024, read_stats.files_opened,
+             read_stats.read_requests, read_stats.wall_seconds)
+    count("adls_bytes_read", read_stats.bytes_read)
+    count("adls_files_opened", read_stats.files_opened)
+    count("adls_read_requests", read_stats.read_requests)
+    if cache is not None:
+        report_cache(cache)
+    log.info("  Backfill completado — %d filas en %s (versiones %d..%d)",
+             loaded_rows, staging_ref, base + 1, final)
+    return base, final, loaded_rows
 
 
 # ──────────────────────────────────────────────────────────────
 # PASO 3: Crear tablas maestro y destino si no existen
 # ──────────────────────────────────────────────────────────────
-def setup_tables(client: bigquery.Client, project: str,
-                 dataset: str, env: str) -> None:
+def setup_shared_tables(client: bigquery.Client, project: str, dataset: str, env: str) -> None:
+    """
+    Maestro de clientes del dataset, común a todas las tablas. El INSERT
+    ... WHERE NOT EXISTS no es atómico: dos ejecuciones simultáneas pueden
+    insertar ambas y duplicar customer_id (el MERGE falla luego con
+    "multiple source rows"). run_pipelines.py lo llama una vez, antes de
+    lanzar las tablas en paralelo.
+    """
     fmt = dict(project=project, dataset=dataset, env=env)
     execute(client, CREATE_CUSTOMERS_SQL.format(**fmt),
-            f"Creando {dataset}.customers (IF NOT EXISTS)")
+            f"Creando {dataset}.customers (IF NOT EXISTS)", step="create_customers")
     execute(client, INSERT_CUSTOMERS_SQL.format(**fmt),
-            f"Insertando clientes de ejemplo en {dataset}.customers (si vacía)")
-    execute(client, CREATE_FINAL_TABLE_SQL.format(**fmt),
-            f"Creando {dataset}.final_table (IF NOT EXISTS)")
+            f"Insertando clientes de ejemplo en {dataset}.customers (si vacía)",
+            step="insert_customers")
+
+
+def setup_tables(client: bigquery.Client, project: str, dataset: str, env: str,
+                 target_table: str = FINAL_TABLE, shared: bool = True) -> None:
+    """Tabla destino y, con `shared`, el maestro de clientes (ver setup_shared_tables)."""
+    fmt = dict(project=project, dataset=dataset, env=env)
+    if shared:
+        setup_shared_tables(client, project, dataset, env)
+    execute(client, CREATE_FINAL_TABLE_SQL.format(table=target_table, **fmt),
+            f"Creando {dataset}.{target_table} (IF NOT EXISTS)", step="create_final_table")
+
+
+def final_table_partitioned(client: bigquery.Client, project: str, dataset: str,
+                            target_table: str = FINAL_TABLE) -> bool:
+    """True si la tabla destino ya está particionada por transaction_date."""
+    table = client.get_table(f"{project}.{dataset}.{target_table}")
+    partitioning = getattr(table, "time_partitioning", None)
+    return partitioning is not None and partitioning.field == FINAL_PARTITION_COLUMN
+
+
+def migrate_final_table(client: bigquery.Client, project: str,
+                        dataset: str, env: str, target_table: str = FINAL_TABLE) -> bool:
+    """
+    Convierte una tabla destino sin particionar en particionada por
+    transaction_date y clusterizada. Devuelve False si ya lo estaba.
+    """
+    if final_table_partitioned(client, project, dataset, target_table):
+        log.info("%s.%s ya está particionada por %s — nada que migrar.",
+                 dataset, target_table, FINAL_PARTITION_COLUMN)
+        return False
+
+    migrating = f"{target_table}__migrating"
+    backup = f"{target_table}__unpartitioned_{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+    fmt = dict(project=project, dataset=dataset, env=env, target_table=target_table)
+    # Restos de una migración interrumpida
+    client.delete_table(f"{project}.{dataset}.{migrating}", not_found_ok=True)
+    execute(client, CREATE_FINAL_TABLE_SQL.format(table=migrating, **fmt),
+            f"Creando {dataset}.{migrating} (particionada y clusterizada)",
+            step="migrate_create")
+    execute(client, COPY_FINAL_TABLE_SQL.format(table=migrating, **fmt),
+            f"Copiando {dataset}.{target_table} → {dataset}.{migrating}",
+            step="migrate_copy")
+    execute(client, RENAME_TABLE_SQL.format(table=target_table, new_name=backup, **fmt),
+            f"Renombrando {dataset}.{target_table} → {backup}", step="migrate_rename")
+    execute(client, RENAME_TABLE_SQL.format(table=migrating, new_name=target_table, **fmt),
+            f"Renombrando {dataset}.{migrating} → {target_table}", step="migrate_rename")
+    log.info("Migración completada. Respaldo sin particionar: %s.%s (borrar tras validar).",
+             dataset, backup)
+    return True
 
 
 # ──────────────────────────────────────────────────────────────
 # PASO 4: MERGE
 # ──────────────────────────────────────────────────────────────
-def run_merge(client: bigquery.Client, project: str, dataset: str) -> None:
-    execute(
-        client,
-        MERGE_SQL.format(project=project, dataset=dataset),
-        f"Ejecutando MERGE → {dataset}.final_table",
-    )
+def staging_date_range(client: bigquery.Client, project: str, dataset: str,
+                       staging_table: str = STAGING_TABLE) -> Optional[Tuple[date, date]]:
+    """(mínima, máxima) transaction_date en staging; None si no hay fechas."""
+    job = execute(client, STAGING_DATE_RANGE_SQL.format(project=project, dataset=dataset,
+                                                        staging_table=staging_table),
+                  f"Rango de fechas en {dataset}.{staging_table}",
+                  step="staging_date_range")
+    rows = list(job.result())
+    if not rows or rows[0].min_date is None:
+        return None
+    return rows[0].min_date, rows[0].max_date
+
+
+def staging_modified(client: bigquery.Client, project: str, dataset: str,
+                     staging_table: str) -> Optional[str]:
+    """Última modificación de staging (ISO), o None si no existe."""
+    from google.cloud.exceptions import NotFound
+    try:
+        modified = client.get_table(f"{project}.{dataset}.{staging_table}").modified
+    except NotFound:
+        return None
+    return modified.isoformat() if modified else None
+
+
+def staging_intact(client: bigquery.Client, project: str, dataset: str,
+                   staging_table: str, expected: Optional[str]) -> bool:
+    """True si staging sigue como lo dejó el intento anterior (nadie lo recargó)."""
+    return staging_modified(client, project, dataset, staging_table) == expected
+
+
+def build_merge_sql(project: str, dataset: str,
+                    date_range: Optional[Tuple[date, date]] = None,
+                    staging_table: str = STAGING_TABLE,
+                    target_table: str = FINAL_TABLE) -> str:
+    target_date_filter = ""
+    if date_range is not None:
+        min_date, max_date = date_range
+        target_date_filter = MERGE_DATE_FILTER_SQL.format(
+            min_date=min_date.isoformat(), max_date=max_date.isoformat())
+    return MERGE_SQL.format(project=project, dataset=dataset,
+                            staging_table=staging_table, target_table=target_table,
+                            target_date_filter=target_date_filter)
+
+
+def dry_run_bytes(client: bigquery.Client, sql: str, location: str = "US") -> int:
+    """Bytes que procesaría la query según BigQuery (dry run, sin costo)."""
+    config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+    job = client.query(sql, location=location, job_config=config)
+    return job.total_bytes_processed or 0
+
+
+def run_merge(client: bigquery.Client, project: str, dataset: str,
+              date_range: Optional[Tuple[date, date]] = None,
+              staging_table: str = STAGING_TABLE, target_table: str = FINAL_TABLE) -> None:
+    description = f"Ejecutando MERGE → {dataset}.{target_table}"
+    if date_range is not None:
+        description += f" (particiones {date_range[0]} .. {date_range[1]})"
+    sql = build_merge_sql(project, dataset, date_range, staging_table, target_table)
+    execute(client, sql, description, step="merge")
 
 
 # ──────────────────────────────────────────────────────────────
 # PASO 5: Labels Dataplex
 # ──────────────────────────────────────────────────────────────
-def apply_dataplex_labels(client: bigquery.Client, project: str,
-                          dataset: str, env: str) -> None:
+def apply_dataplex_labels(client: bigquery.Client, project: str, dataset: str, env: str,
+                          staging_table: str = STAGING_TABLE,
+                          target_table: str = FINAL_TABLE) -> None:
     labels = {
         "environment":    env,
         "owner":          "data-team",
         "domain":         "commerce",
         "classification": "internal",
     }
-    for table_name in ["customers", "final_table", "transactions_staging"]:
+    for table_name in ["customers", target_table, staging_table]:
         table_ref = f"{project}.{dataset}.{table_name}"
         try:
             table = client.get_table(table_ref)
@@ -296,7 +1563,7 @@ def apply_dataplex_labels(client: bigquery.Client, project: str,
 # ──────────────────────────────────────────────────────────────
 # CLI
 # ──────────────────────────────────────────────────────────────
-def parse_args() -> argparse.Namespace:
+def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(
         description="Parte 4 — Python ETL Bridge: Delta Lake ADLS Gen2 → BigQuery + MERGE"
     )
@@ -306,19 +1573,159 @@ def parse_args() -> argparse.Namespace:
     p.add_argument("--adls-account",     required=True, help="Storage account ADLS, ej: jaredpruebadelta")
     p.add_argument("--adls-container",   required=True, help="Contenedor ADLS, ej: datalake")
     p.add_argument("--adls-path",        required=True, help="Path Delta en el contenedor, ej: transactions_uniform")
-    return p.parse_args()
+    p.add_argument("--staging-table",    default=STAGING_TABLE,
+                   help=f"Tabla staging en el dataset (default: {STAGING_TABLE})")
+    p.add_argument("--target-table",     default=FINAL_TABLE,
+                   help=f"Tabla destino del MERGE en el dataset (default: {FINAL_TABLE})")
+    p.add_argument("--state-uri",        default=None,
+                   help="Archivo JSON de estado (local o gs://) con el watermark Delta")
+    p.add_argument("--incremental",      action="store_true",
+                   help="Cargar solo los archivos añadidos desde el último MERGE (requiere --state-uri)")
+    p.add_argument("--skip-unchanged",   action="store_true",
+                   help="Terminar sin hacer nada si la versión Delta no cambió desde el último MERGE (requiere --state-uri)")
+    p.add_argument("--fingerprint",      action="store_true",
+                   help="Con --skip-unchanged, comparar también el hash del conjunto de archivos activos")
+    p.add_argument("--since-date",       type=date.fromisoformat, default=None,
+                   help="Solo filas con transaction_date >= esta fecha (YYYY-MM-DD)")
+    p.add_argument("--until-date",       type=date.fromisoformat, default=None,
+                   help="Solo filas con transaction_date <= esta fecha (YYYY-MM-DD)")
+    p.add_argument("--read-threads",     type=int, default=DEFAULT_READ_THREADS,
+                   help=f"Row groups descargados en paralelo (default: {DEFAULT_READ_THREADS})")
+    p.add_argument("--stream",           action="store_true",
+                   help="Cargar staging por bloques con memoria acotada")
+    p.add_argument("--memory-limit-mb",  type=int, default=256,
+                   help="Techo de memoria para los datos en vuelo en modo --stream (default: 256)")
+    p.add_argument("--pipeline-depth",   type=int, default=DEFAULT_PIPELINE_DEPTH,
+                   help="En --stream, bloques en cola entre lectura, serialización y carga "
+                        f"(0 = secuencial, default: {DEFAULT_PIPELINE_DEPTH})")
+    p.add_argument("--backfill-from",    default=None, metavar="VERSION|ISO8601",
+                   help="Backfill: reaplica los commits desde esta versión (inclusive) o "
+                        "posteriores a este instante, con un solo MERGE")
+    p.add_argument("--backfill-to",      default=None, metavar="VERSION|ISO8601",
+                   help="Última versión del backfill (inclusive) o instante (default: la última)")
+    p.add_argument("--backfill-workers", type=int, default=DEFAULT_BACKFILL_WORKERS,
+                   help=f"Hilos que leen tramos del backfill (default: {DEFAULT_BACKFILL_WORKERS})")
+    p.add_argument("--backfill-step",    type=int, default=None,
+                   help="Versiones por tramo del backfill (default: el rango repartido en "
+                        f"{BACKFILL_RANGES_PER_WORKER} tramos por hilo)")
+    p.add_argument("--staging-sink",     choices=["load", "write-api"],
+                   default=os.environ.get("STAGING_SINK") or "load",
+                   help="Carga de staging: load jobs Parquet o Storage Write API "
+                        "(también STAGING_SINK, default: load)")
+    p.add_argument("--write-streams",    type=int, default=DEFAULT_STREAMS,
+                   help="Con --staging-sink write-api, write streams en paralelo "
+                        f"(default: {DEFAULT_STREAMS}; cada uno retiene ~2 requests de 8 MB)")
+    p.add_argument("--write-stream-type", choices=STREAM_TYPES, default="committed",
+                   help="committed: filas visibles a medida que se confirman | pending: "
+                        "todas visibles juntas al final (default: committed)")
+    p.add_argument("--cache-dir",        default=os.environ.get("DELTA_CACHE_DIR") or None,
+                   help="Caché local de archivos Delta (ej. volumen montado); "
+                        "también DELTA_CACHE_DIR")
+    p.add_argument("--cache-max-mb",     type=int,
+                   default=int(os.environ.get("DELTA_CACHE_MAX_MB", DEFAULT_CACHE_MB)),
+                   help=f"Tamaño máximo del caché, LRU (default: {DEFAULT_CACHE_MB})")
+    p.add_argument("--dedup",            action=argparse.BooleanOptionalAction, default=True,
+                   help="Cargar solo la fila más reciente de cada transaction_id (default: sí)")
+    p.add_argument("--spill-dir",        default=None,
+                   help="Directorio para las particiones de la deduplicación en --stream y "
+                        "las claves pendientes del índice de cambios (default: temporal del "
+                        "sistema; en Cloud Run /tmp ocupa memoria)")
+    p.add_argument("--change-index-uri", default=None,
+                   help="Índice clave → hash de fila (.npy local o gs://): solo se cargan en "
+                        "staging inserts y updates reales (requiere --state-uri)")
+    p.add_argument("--rebuild-change-index", action="store_true",
+                   help="Ignorar el índice de cambios existente y reconstruirlo en esta ejecución")
+    p.add_argument("--merge-date-pruning", action=argparse.BooleanOptionalAction, default=True,
+                   help="Limitar el MERGE a las particiones de final_table con fechas "
+                        "presentes en staging (default: sí)")
+    p.add_argument("--migrate-final-table", action="store_true",
+                   help="Convertir una final_table sin particionar en particionada por "
+                        "transaction_date y clusterizada (conserva un respaldo)")
+    p.add_argument("--merge-dry-run",    action="store_true",
+                   help="Cargar staging y estimar los bytes que escanearía el MERGE con y "
+                        "sin poda de particiones, sin ejecutarlo")
+    p.add_argument("--run-state-uri",    default=os.environ.get("RUN_STATE_URI") or None,
+                   help="Registro JSON (local o gs://) de las etapas terminadas: un reintento "
+                        "de la misma ejecución retoma en la primera sin terminar")
+    p.add_argument("--run-id",           default=default_run_id(),
+                   help="Id de la ejecución para --run-state-uri (default: CLOUD_RUN_EXECUTION)")
+    p.add_argument("--report-uri",       default=os.environ.get("RUN_REPORT_URI"),
+                   help="Reporte JSON de la ejecución (local o gs://): tiempos por etapa, "
+                        "contadores y estadísticas de los jobs BigQuery")
+    p.add_argument("--profile",          choices=PROFILE_MODES,
+                   default=os.environ.get("RUN_PROFILE") or None,
+                   help="Profiling opcional incluido en el reporte")
+    return p
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = build_parser()
+    args = p.parse_args(argv)
+    if args.incremental and not args.state_uri:
+        p.error("--incremental requiere --state-uri")
+    if args.skip_unchanged and not args.state_uri:
+        p.error("--skip-unchanged requiere --state-uri")
+    if args.change_index_uri and not args.state_uri:
+        p.error("--change-index-uri requiere --state-uri")
+    if args.memory_limit_mb <= 0:
+        p.error("--memory-limit-mb debe ser positivo")
+    if args.cache_max_mb <= 0:
+        p.error("--cache-max-mb debe ser positivo")
+    if args.pipeline_depth < 0:
+        p.error("--pipeline-depth no puede ser negativo")
+    if args.read_threads <= 0:
+        p.error("--read-threads debe ser positivo")
+    if args.write_streams <= 0:
+        p.error("--write-streams debe ser positivo")
+    if args.backfill_to and not args.backfill_from:
+        p.error("--backfill-to requiere --backfill-from")
+    if args.backfill_from:
+        for flag, value in (("--backfill-from", args.backfill_from),
+                            ("--backfill-to", args.backfill_to)):
+            if value and not value.isdigit():
+                try:
+                    datetime.fromisoformat(value)
+                except ValueError:
+                    p.error(f"{flag} debe ser una versión o un instante ISO 8601: {value}")
+        for flag in ("incremental", "skip_unchanged", "change_index_uri"):
+            if getattr(args, flag):
+                p.error(f"--backfill-from no se combina con --{flag.replace('_', '-')}")
+        if not args.dedup:
+            p.error("--backfill-from requiere --dedup (el estado neto por clave)")
+    if args.backfill_workers <= 0:
+        p.error("--backfill-workers debe ser positivo")
+    if args.backfill_step is not None and args.backfill_step <= 0:
+        p.error("--backfill-step debe ser positivo")
+    if args.since_date and args.until_date and args.since_date > args.until_date:
+        p.error("--since-date no puede ser posterior a --until-date")
+    if args.incremental and (args.since_date or args.until_date):
+        p.error("--incremental no se combina con --since-date/--until-date: el watermark "
+                "saltaría las filas fuera del rango")
+    return args
 
 
 def main() -> None:
     args = parse_args()
+    with reporting("run_merge", args.report_uri, args.profile, params=vars(args)):
+        run(args)
+
 
+def run(args: argparse.Namespace, bq_client: Optional[bigquery.Client] = None,
+        adls_key: Optional[str] = None, write_api=None, setup_shared: bool = True) -> None:
+    """
+    Ejecuta el pipeline de una tabla. `bq_client` y `adls_key` permiten
+    compartir cliente y credenciales entre tablas (run_pipelines.py);
+    `write_api`, el cliente de la Storage Write API con --staging-sink
+    write-api (ver bq_write_stream.py). Con `setup_shared=False` el
+    maestro de clientes ya lo creó quien llama (ver setup_shared_tables).
+    """
     # La clave ADLS se lee desde variable de entorno (nunca como arg CLI)
-    adls_key = os.environ.get("ADLS_ACCESS_KEY")
+    adls_key = adls_key or os.environ.get("ADLS_ACCESS_KEY")
     if not adls_key:
         log.error("Variable de entorno ADLS_ACCESS_KEY no definida.")
         sys.exit(1)
 
-    bq_client = bigquery.Client(project=args.project)
+    bq_client = bq_client or bigquery.Client(project=args.project)
 
     log.info("=== Parte 4: Python ETL Bridge — Delta Lake → BigQuery ===")
     log.info("Proyecto: %s | Dataset: %s | Entorno: %s",
@@ -326,25 +1733,235 @@ def main() -> None:
     log.info("ADLS: %s / %s / %s",
              args.adls_account, args.adls_container, args.adls_path)
 
-    log.info("--- Paso 4.1-4.2: ETL Bridge ADLS Gen2 → transactions_staging (US) ---")
-    etl_bridge_adls_to_bq(
-        bq_client      = bq_client,
-        project        = args.project,
-        dataset        = args.dataset,
-        adls_account   = args.adls_account,
-        adls_container = args.adls_container,
-        adls_path      = args.adls_path,
-        adls_key       = adls_key,
-    )
+    # Watermark: solo es válido para la misma tabla Delta de origen
+    table_uri = f"az://{args.adls_container}/{args.adls_path}"
+    state = read_state(args.state_uri) if args.state_uri else {}
+    same_table = state.get("table_uri") == table_uri
+
+    # Etapas terminadas por un intento anterior de esta misma ejecución
+    checkpoint = RunCheckpoint(args.run_state_uri, args.run_id, {
+        "table_uri":        table_uri,
+        "project":          args.project,
+        "dataset":          args.dataset,
+        "staging_table":    args.staging_table,
+        "target_table":     args.target_table,
+        "incremental":      args.incremental,
+        "since_date":       args.since_date,
+        "until_date":       args.until_date,
+        "dedup":            args.dedup,
+        "change_index_uri": args.change_index_uri,
+        "backfill":         [args.backfill_from, args.backfill_to],
+    })
+    pending_uri = f"{args.run_state_uri}.pending.npy" if args.run_state_uri else None
+    staged = checkpoint.done("staging")
+    if (staged and not checkpoint.done("merge")
+            and not staging_intact(bq_client, args.project, args.dataset, args.staging_table,
+                                   staged["staging_modified"])):
+        log.warning("%s cambió desde el intento anterior — se vuelve a cargar.",
+                    args.staging_table)
+        checkpoint.discard("staging", "setup", "merge", "commit", "labels")
+        staged = None
+    set_value("resumed_stages", sorted(checkpoint.record["stages"]) if staged else [])
+
+    changes = None
+    if args.change_index_uri and not checkpoint.done("commit"):
+        # El índice solo vale si lo escribió un MERGE exitoso sobre esta misma tabla
+        index_valid = same_table and state.get("change_index_uri") == args.change_index_uri
+        with span("change_index_open"):
+            index = ChangeIndex.open(args.change_index_uri,
+                                     rebuild=args.rebuild_change_index or not index_valid,
+                                     workdir_parent=args.spill_dir)
+        changes = ChangeFilter(index, DEDUP_KEY)
+
+    if staged:
+        delta_version = staged["delta_version"]
+        since_version = staged["since_version"]
+        staged_rows = staged["staged_rows"]
+        fingerprint = staged["fingerprint"]
+        if changes is not None:
+            changes.load_pending(pending_uri)
+        log.info("--- Paso 4.1-4.2: staging ya cargado por el intento anterior "
+                 "(versión Delta %d, %d filas) — se reutiliza ---", delta_version, staged_rows)
+    else:
+        dt = None
+        fingerprint = None
+        if args.skip_unchanged:
+            with span("check_unchanged"):
+                dt = DeltaTable(table_uri,
+                                storage_options=adls_storage_options(args.adls_account, adls_key))
+                if args.fingerprint:
+                    fingerprint = active_files_fingerprint(dt)
+            if (same_table
+                    and state.get("last_merged_version") == dt.version()
+                    and (fingerprint is None or state.get("fingerprint") == fingerprint)):
+                log.info("Versión Delta %d sin cambios desde el último MERGE — nada que hacer.",
+                         dt.version())
+                set_value("outcome", "unchanged")
+                set_value("delta_version", dt.version())
+                return
+
+        since_version = None
+        if args.incremental:
+            if same_table:
+                since_version = state.get("last_merged_version")
+            log.info("Watermark Delta: %s",
+                     since_version if since_version is not None else "ninguno (carga completa)")
+
+        log.info("--- Paso 4.1-4.2: ETL Bridge ADLS Gen2 → transactions_staging (US) ---")
+        writer = None
+        if args.staging_sink == "write-api":
+            writer = StreamWriter(write_api or BigQueryWriteApi(),
+                                  args.write_streams, args.write_stream_type)
+        if args.backfill_from:
+            since_version, delta_version, staged_rows = backfill_to_staging(
+                bq_client, args.project, args.dataset,
+                args.adls_account, args.adls_container, args.adls_path, adls_key,
+                backfill_from   = args.backfill_from,
+                backfill_to     = args.backfill_to,
+                workers         = args.backfill_workers,
+                step            = args.backfill_step,
+                memory_limit_mb = args.memory_limit_mb if args.stream else None,
+                since_date      = args.since_date,
+                until_date      = args.until_date,
+                read_threads    = args.read_threads,
+                spill_dir       = args.spill_dir,
+                staging_table   = args.staging_table,
+                pipeline_depth  = args.pipeline_depth,
+                cache           = open_cache(args.cache_dir, args.cache_max_mb),
+                writer          = writer,
+            )
+        else:
+            delta_version, staged_rows = etl_bridge_adls_to_bq(
+                bq_client      = bq_client,
+                project        = args.project,
+                dataset        = args.dataset,
+                adls_account   = args.adls_account,
+                adls_container = args.adls_container,
+                adls_path      = args.adls_path,
+                adls_key       = adls_key,
+                since_version  = since_version,
+                memory_limit_mb = args.memory_limit_mb if args.stream else None,
+                delta_table    = dt,
+                since_date     = args.since_date,
+                until_date     = args.until_date,
+                read_threads   = args.read_threads,
+                dedup          = args.dedup,
+                spill_dir      = args.spill_dir,
+                changes        = changes,
+                staging_table  = args.staging_table,
+                pipeline_depth = args.pipeline_depth,
+                cache          = open_cache(args.cache_dir, args.cache_max_mb),
+                writer         = writer,
+            )
+        if checkpoint.uri:
+            if changes is not None:
+                changes.save_pending(pending_uri)
+            checkpoint.complete(
+                "staging", delta_version=delta_version, since_version=since_version,
+                staged_rows=staged_rows, fingerprint=fingerprint,
+                staging_modified=staging_modified(bq_client, args.project, args.dataset,
+                                                  args.staging_table))
+    set_value("delta_version", delta_version)
+    set_value("since_version", since_version)
 
     log.info("--- Paso 4.3: Crear tablas maestro y destino (US) ---")
-    setup_tables(bq_client, args.project, args.dataset, args.env)
+    setup = checkpoint.done("setup")
+    if setup:
+        partitioned = setup["partitioned"]
+        log.info("Tablas ya creadas por el intento anterior.")
+    else:
+        with span("setup"):
+            setup_tables(bq_client, args.project, args.dataset, args.env, args.target_table,
+                         shared=setup_shared)
+            if args.migrate_final_table:
+                with span("migrate"):
+                    migrate_final_table(bq_client, args.project, args.dataset, args.env,
+                                        args.target_table)
+            partitioned = final_table_partitioned(bq_client, args.project, args.dataset,
+                                                  args.target_table)
+        checkpoint.complete("setup", partitioned=partitioned)
+    if not partitioned:
+        log.warning("%s.%s no está particionada: el MERGE la escanea completa "
+                    "(migrar con --migrate-final-table).", args.dataset, args.target_table)
+
+    log.info("--- Paso 4.4: MERGE → %s ---", args.target_table)
+    merged = checkpoint.done("merge")
+    run_needed = not merged and (staged_rows or (since_version is None and changes is None))
+    date_range = None
+    if run_needed and partitioned and args.merge_date_pruning:
+        with span("staging_date_range"):
+            date_range = staging_date_range(bq_client, args.project, args.dataset,
+                                            args.staging_table)
+        set_value("merge_date_range", [d.isoformat() for d in date_range] if date_range else None)
+
+    if args.merge_dry_run:
+        with span("merge_dry_run"):
+            tables = dict(staging_table=args.staging_table, target_table=args.target_table)
+            full = dry_run_bytes(bq_client, build_merge_sql(args.project, args.dataset,
+                                                            **tables))
+            pruned = dry_run_bytes(bq_client, build_merge_sql(args.project, args.dataset,
+                                                              date_range, **tables))
+        log.info("MERGE dry-run: %.1f MB sin poda, %.1f MB con poda%s",
+                 full / 1024 / 1024, pruned / 1024 / 1024,
+                 f" ({date_range[0]} .. {date_range[1]})" if date_range else " (sin rango)")
+        set_value("merge_dry_run_bytes", {"unpruned": full, "pruned": pruned})
+        set_value("outcome", "dry_run")
+        # Sin MERGE: ni el índice de cambios ni el watermark avanzan
+        if changes is not None:
+            changes.index.close()
+        return
+
+    if merged:
+        log.info("MERGE ya ejecutado por el intento anterior.")
+        set_value("outcome", merged["outcome"])
+    else:
+        if run_needed:
+            with span("merge"):
+                run_merge(bq_client, args.project, args.dataset, date_range,
+                          args.staging_table, args.target_table)
+            set_value("outcome", "merged")
+        else:
+            log.info("Sin filas nuevas en staging — MERGE omitido.")
+            set_value("outcome", "no_new_rows")
+        checkpoint.complete("merge", outcome="merged" if run_needed else "no_new_rows")
+
+    if not checkpoint.done("commit"):
+        if changes is not None:
+            with span("change_index_commit"):
+                changes.commit()
+            changes.index.close()
 
-    log.info("--- Paso 4.4: MERGE → final_table ---")
-    run_merge(bq_client, args.project, args.dataset)
+        # El watermark solo avanza después de un MERGE exitoso. Un backfill
+        # reaplica un rango ya procesado y un filtro por fecha deja filas
+        # sin cargar en los commits leídos: ninguno de los dos lo mueve.
+        date_filtered = bool(args.since_date or args.until_date)
+        if args.state_uri and not args.backfill_from and not date_filtered:
+            state.update({
+                "table_uri":           table_uri,
+                "last_merged_version": delta_version,
+                "updated_at":          datetime.now(timezone.utc).isoformat(),
+            })
+            if fingerprint is not None:
+                state["fingerprint"] = fingerprint
+            else:
+                state.pop("fingerprint", None)
+            if changes is not None:
+                state["change_index_uri"] = args.change_index_uri
+            else:
+                # Un MERGE sin índice lo deja desactualizado
+                state.pop("change_index_uri", None)
+            write_state(args.state_uri, state)
+        checkpoint.complete("commit")
 
     log.info("--- Paso 4.5: Labels Dataplex ---")
-    apply_dataplex_labels(bq_client, args.project, args.dataset, args.env)
+    if checkpoint.done("labels"):
+        log.info("Labels ya aplicados por el intento anterior.")
+    else:
+        with span("labels"):
+            apply_dataplex_labels(bq_client, args.project, args.dataset, args.env,
+                                  args.staging_table, args.target_table)
+        checkpoint.complete("labels")
+    checkpoint.finish()
 
     log.info("=== Pipeline finalizado correctamente para entorno: %s ===", args.env)
 
@@ -0,0 +1,359 @@
+"""
+run_pipelines.py
+────────────────
+Ejecuta el pipeline de run_merge.py (Delta → staging → MERGE) para varias
+tablas a la vez, a partir de un archivo de configuración TOML:
+
+    [defaults]                   # opciones comunes a todas las tablas
+    project        = "michaelpage-prueba"
+    dataset        = "dw_dev"
+    env            = "dev"
+    adls_account   = "jaredpruebadelta"
+    adls_container = "datalake"
+    incremental    = true
+    state_uri      = "gs://raw-dev-michaelpage-prueba/state/{name}.json"
+
+    [limits]
+    tables        = 8            # tablas en paralelo
+    adls_reads    = 4            # lecturas Delta simultáneas
+    bigquery_jobs = 8            # jobs BigQuery (cargas y queries) simultáneos
+
+    [[tables]]
+    name          = "transactions"
+    adls_path     = "transactions_uniform"
+    staging_table = "transactions_staging"
+    target_table  = "final_table"
+
+Las claves de [defaults] y [[tables]] son los flags de run_merge.py con
+"_" en lugar de "-" (true/false para los flags booleanos) y se validan
+con su mismo parser antes de empezar. En los valores de texto, {name} se
+reemplaza por el nombre de la tabla.
+
+Antes de lanzar las tablas se crea, una vez por dataset y en serie, el
+maestro de clientes que todas comparten (run_merge.setup_shared_tables):
+en paralelo, el INSERT ... WHERE NOT EXISTS podría duplicarlo.
+
+memory_limit_mb es el techo de memoria del proceso, no de cada tabla: se
+reparte entre las tablas que corren a la vez (limits.tables).
+
+Cada tabla corre en su propio hilo con su propio reporte de ejecución
+(report_uri en la config, opcional). Las lecturas ADLS y los jobs de
+BigQuery se limitan por separado con semáforos compartidos (ver
+run_merge.set_concurrency_limits) y todas las tablas de un proyecto
+comparten un bigquery.Client con un pool HTTP del tamaño de
+bigquery_jobs. El trabajo pesado (lectura Parquet, serialización,
+espera de jobs) libera el GIL, así que el tiempo total se acerca al de
+la tabla más lenta y no a la suma.
+
+Un fallo en una tabla no detiene las demás: se registra en el resumen
+(--report-uri) y el proceso termina con código 1 si alguna falló.
+
+Limitaciones:
+  - El pool de I/O de Arrow es del proceso: read_threads aplica a todas
+    las tablas a la vez, no a cada una.
+  - deltalake no expone un cliente reutilizable: cada tabla abre su
+    propio DeltaTable (las credenciales ADLS sí se comparten).
+
+Uso:
+    python run_pipelines.py --config pipelines.toml \
+        [--only transactions,orders] \
+        [--report-uri gs://raw-dev-michaelpage-prueba/reports/run_pipelines.json]
+
+Variables de entorno requeridas:
+    ADLS_ACCESS_KEY                — clave de acceso ADLS Gen2
+    GOOGLE_APPLICATION_CREDENTIALS — path al JSON de la SA GCP
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import bigquery
+from requests.adapters import HTTPAdapter
+
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python 3.10 (agente self-hosted): pip install tomli
+    import tomli as tomllib
+
+import run_merge
+from etl_state import write_json
+from run_report import reporting
+
+# Igual que run_merge.py, con el nombre del hilo (= tabla) en cada línea
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] [%(threadName)s] %(message)s",
+    force=True,
+)
+log = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {"tables": 8, "adls_reads": 4, "bigquery_jobs": 8}
+
+# Valores del reporte de cada tabla que pasan al resumen
+SUMMARY_VALUES = ("outcome", "delta_version", "since_version")
+SUMMARY_COUNTERS = (
+    "staged_rows",
+    "adls_bytes_read",
+    "bq_total_bytes_processed",
+    "adls_wait_seconds",
+    "bigquery_wait_seconds",
+)
+
+
+# ──────────────────────────────────────────────────────────────
+# Configuración
+# ──────────────────────────────────────────────────────────────
+def table_argv(options: dict, parser: argparse.ArgumentParser) -> List[str]:
+    """Convierte las opciones de una tabla en argumentos para run_merge.py."""
+    argv = []
+    for key, value in options.items():
+        flag = "--" + key.replace("_", "-")
+        if value is True:
+            argv.append(flag)
+        elif value is False:
+            # Solo los flags activos por defecto (--dedup) tienen forma --no-
+            if parser.get_default(key) is True:
+                argv.append("--no-" + key.replace("_", "-"))
+        elif value is not None:
+            argv += [flag, str(value)]
+    return argv
+
+
+def load_config(path: str, only: Optional[List[str]] = None
+                ) -> Tuple[Dict[str, int], List[Tuple[str, argparse.Namespace]]]:
+    """Lee el TOML y devuelve (límites, [(nombre, args de run_merge)])."""
+    with open(path, "rb") as fh:
+        config = tomllib.load(fh)
+
+    unknown = set(config.get("limits", {})) - set(DEFAULT_LIMITS)
+    if unknown:
+        raise ValueError(f"Límites desconocidos en {path}: {sorted(unknown)}")
+    limits = {**DEFAULT_LIMITS, **config.get("limits", {})}
+    if any(not isinstance(v, int) or v <= 0 for v in limits.values()):
+        raise ValueError(f"Los límites deben ser enteros positivos: {limits}")
+
+    defaults = config.get("defaults", {})
+    parser = run_merge.build_parser()
+    tables, seen = [], set()
+    for entry in config.get("tables", []):
+        name = entry.get("name")
+        if not name:
+            raise ValueError(f"Tabla sin 'name' en {path}: {entry}")
+        if name in seen:
+            raise ValueError(f"Tabla repetida en {path}: {name}")
+        seen.add(name)
+        if only and name not in only:
+            continue
+
+        options = {**defaults, **entry}
+        del options["name"]
+        options = {k: v.format(name=name) if isinstance(v, str) else v
+                   for k, v in options.items()}
+        options.setdefault("report_uri", None)
+        options.setdefault("run_state_uri", None)
+        options.pop("profile", None)
+        try:
+            args = run_merge.parse_args(table_argv(options, parser))
+        except SystemExit:
+            raise ValueError(
+                f"Opciones inválidas para la tabla {name} (ver error anterior)") from None
+        # Sin report_uri/run_state_uri explícitos, no heredar RUN_REPORT_URI/
+        # RUN_STATE_URI/RUN_PROFILE (defaults del parser de run_merge): todas
+        # las tablas escribirían el mismo archivo, y con el registro de etapas
+        # compartido una tabla retomaría las etapas (y las claves pendientes
+        # del índice de cambios) de otra. table_argv omite los None, así que
+        # se fijan después de parsear.
+        args.report_uri = options["report_uri"]
+        args.run_state_uri = options["run_state_uri"]
+        args.profile = None
+        tables.append((name, args))
+
+    if only:
+        missing = set(only) - seen
+        if missing:
+            raise ValueError(f"Tablas no encontradas en {path}: {sorted(missing)}")
+    if not tables:
+        raise ValueError(f"Ninguna tabla para ejecutar en {path}")
+
+    # memory_limit_mb es del proceso: cada tabla recibe su parte
+    parallel = min(limits["tables"], len(tables))
+    for _, args in tables:
+        args.memory_limit_mb = max(args.memory_limit_mb // parallel, 1)
+    return limits, tables
+
+
+# ──────────────────────────────────────────────────────────────
+# Clientes compartidos
+# ──────────────────────────────────────────────────────────────
+class ClientPool:
+    """Un bigquery.Client por proyecto, compartido por todos los hilos."""
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self._clients: Dict[str, bigquery.Client] = {}
+        self._lock = threading.Lock()
+
+    def bigquery(self, project: str) -> bigquery.Client:
+        with self._lock:
+            client = self._clients.get(project)
+            if client is None:
+                credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+                # _http es un argumento del constructor de google-cloud-core
+                # (Client(_http=...)), no API pública: si una versión nueva de
+                # google-cloud-bigquery lo quita, el cliente vuelve al pool
+                # por defecto de requests (10 conexiones), que descarta
+                # conexiones con más jobs concurrentes.
+                client = bigquery.Client(project=project, credentials=credentials,
+                                         _http=self.session(credentials))
+                self._clients[project] = client
+            return client
+
+    def session(self, credentials) -> AuthorizedSession:
+        """Sesión HTTP autenticada con un pool del tamaño de bigquery_jobs."""
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=self.max_connections,
+                              pool_maxsize=self.max_connections)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self) -> None:
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+# ──────────────────────────────────────────────────────────────
+# Ejecución
+# ──────────────────────────────────────────────────────────────
+def run_table(name: str, args: argparse.Namespace, clients: ClientPool,
+              adls_key: str) -> dict:
+    """Corre run_merge.run para una tabla; nunca lanza excepciones."""
+    thread = threading.current_thread()
+    thread_name, thread.name = thread.name, name
+    result = {"table": name, "status": "error", "error": None}
+    report = None
+    started = time.perf_counter()
+    try:
+        with reporting(f"run_merge[{name}]", args.report_uri, None,
+                       params=vars(args)) as report:
+            run_merge.run(args, bq_client=clients.bigquery(args.project), adls_key=adls_key,
+                          setup_shared=False)
+        result["status"] = "ok"
+    except (Exception, SystemExit) as exc:
+        # SystemExit: run() aborta con sys.exit ante errores de configuración
+        log.error("Tabla %s falló: %s", name, exc, exc_info=not isinstance(exc, SystemExit))
+        result["error"] = f"{type(exc).__name__}: {exc}"
+    finally:
+        thread.name = thread_name
+
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    if report is not None:
+        for key in SUMMARY_VALUES:
+            result[key] = report.values.get(key)
+        for key in SUMMARY_COUNTERS:
+            result[key] = report.counters.get(key, 0)
+        result["stages"] = {k: round(v["seconds"], 3)
+                            for k, v in report.spans.items() if "/" not in k}
+    return result
+
+
+def setup_shared(tables: List[Tuple[str, argparse.Namespace]], clients: ClientPool) -> None:
+    """Tablas compartidas entre pipelines: una vez por dataset, antes del paralelo."""
+    done = set()
+    for _, args in tables:
+        target = (args.project, args.dataset, args.env)
+        if target not in done:
+            done.add(target)
+            run_merge.setup_shared_tables(clients.bigquery(args.project), *target)
+
+
+def run_all(tables: List[Tuple[str, argparse.Namespace]], limits: Dict[str, int],
+            adls_key: str) -> List[dict]:
+    run_merge.set_concurrency_limits(limits["adls_reads"], limits["bigquery_jobs"])
+    clients = ClientPool(max_connections=limits["bigquery_jobs"])
+    try:
+        setup_shared(tables, clients)
+        with ThreadPoolExecutor(max_workers=min(limits["tables"], len(tables)),
+                                thread_name_prefix="table") as pool:
+            futures = [pool.submit(run_table, name, args, clients, adls_key)
+                       for name, args in tables]
+            return [f.result() for f in futures]
+    finally:
+        clients.close()
+        run_merge.set_concurrency_limits()
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        description="Ejecuta run_merge.py para varias tablas Delta en paralelo"
+    )
+    p.add_argument("--config",     required=True, help="Archivo TOML con las tablas")
+    p.add_argument("--only",       default=None,
+                   help="Lista de tablas (separadas por coma) a ejecutar de la config")
+    p.add_argument("--report-uri", default=os.environ.get("RUN_REPORT_URI"),
+                   help="Resumen JSON por tabla (local o gs://)")
+    return p.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    only = [t.strip() for t in args.only.split(",") if t.strip()] if args.only else None
+    limits, tables = load_config(args.config, only)
+
+    # La clave ADLS se lee desde variable de entorno (nunca como arg CLI)
+    adls_key = os.environ.get("ADLS_ACCESS_KEY")
+    if not adls_key:
+        log.error("Variable de entorno ADLS_ACCESS_KEY no definida.")
+        sys.exit(1)
+
+    log.info("=== %d tabla(s) | paralelo: %d tablas, %d lecturas ADLS, %d jobs BigQuery ===",
+             len(tables), limits["tables"], limits["adls_reads"], limits["bigquery_jobs"])
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    results = run_all(tables, limits, adls_key)
+    seconds = time.perf_counter() - started
+
+    failed = [r for r in results if r["status"] != "ok"]
+    serial = sum(r["seconds"] for r in results)
+    log.info("=== Resumen ===")
+    for r in results:
+        log.info("  %-30s %-5s %8.1f s  %-12s %s", r["table"], r["status"], r["seconds"],
+                 r.get("outcome") or "—", r["error"] or "")
+    log.info("Total: %.1f s (suma por tabla %.1f s, tabla más lenta %.1f s) — %d ok, %d con error",
+             seconds, serial, max(r["seconds"] for r in results),
+             len(results) - len(failed), len(failed))
+
+    if args.report_uri:
+        try:
+            write_json(args.report_uri, {
+                "job":        "run_pipelines",
+                "status":     "error" if failed else "ok",
+                "started_at": started_at.isoformat(),
+                "seconds":    round(seconds, 3),
+                "limits":     limits,
+                "tables":     results,
+            })
+            log.info("Resumen guardado en %s", args.report_uri)
+        except Exception as exc:
+            log.warning("No se pudo guardar el resumen en %s: %s", args.report_uri, exc)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as exc:
+        log.error("Error fatal: %s", exc, exc_info=True)
+        sys.exit(1)
@@ -0,0 +1,281 @@
+"""
+run_report.py
+─────────────
+Instrumentación de los jobs: spans con tiempo por etapa, contadores y
+estadísticas de los jobs de BigQuery, volcados al final en un reporte
+JSON (local o gs://, ver etl_state.write_json).
+
+Uso en un job:
+
+    with run_report.reporting("run_merge", report_uri, profile, params):
+        with run_report.span("read") as s:
+            ...
+            s["rows"] = table.num_rows
+        run_report.count("bytes_loaded", payload.size)
+        run_report.record_job(query_job, "merge")
+
+Los spans con el mismo nombre se acumulan (calls, seconds), así el modo
+streaming no genera una entrada por bloque. Los spans anidados se
+nombran "padre/hijo". Sin un reporte activo, span/count/record_job no
+hacen nada: las funciones de los jobs se pueden llamar desde benchmarks
+o desde otros jobs sin configurar nada.
+
+El reporte activo es por contexto (contextvars): cada hilo que abre su
+propio reporting() —como los workers de run_pipelines.py, uno por tabla—
+registra solo en el suyo.
+
+Profiling (opcional, --profile):
+  cprofile     top de funciones por tiempo acumulado en el reporte, y el
+               .prof completo junto al reporte si es un archivo local
+  tracemalloc  pico y top de sitios de asignación de Python. Las
+               asignaciones de Arrow no pasan por tracemalloc: su pico
+               se reporta aparte (arrow_pool_peak_mb) siempre.
+"""
+
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+from etl_state import write_json
+
+log = logging.getLogger(__name__)
+
+PROFILE_MODES = ("cprofile", "tracemalloc")
+PROFILE_TOP = 25
+
+# Atributos de los jobs de BigQuery (QueryJob / LoadJob) que se acumulan
+JOB_STATS = (
+    "slot_millis",
+    "total_bytes_processed",
+    "total_bytes_billed",
+    "num_dml_affected_rows",
+    "output_rows",
+    "output_bytes",
+)
+
+
+class RunReport:
+    """Spans, contadores y jobs de BigQuery de una ejecución."""
+
+    def __init__(self, job: str, params: Optional[dict] = None):
+        self.job = job
+        self.params = params or {}
+        self.started_at = datetime.now(timezone.utc)
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.spans = {}
+        self.counters = {}
+        self.values = {}
+        self.bq_jobs = []
+        self.profile = None
+        self.status = "running"
+        self.error = None
+        self.seconds = None
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[dict]:
+        """Mide el bloque; las claves numéricas que se asignen se suman al span."""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        path = "/".join(stack + [name])
+        stack.append(name)
+        attrs = {}
+        started = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            with self._lock:
+                entry = self.spans.setdefault(path, {
+                    "calls": 0, "seconds": 0.0,
+                    "first_start_s": round(started - self._t0, 3),
+                })
+                entry["calls"] += 1
+                entry["seconds"] += elapsed
+                for key, value in attrs.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        entry[key] = entry.get(key, 0) + value
+                    else:
+                        entry[key] = value
+
+    def count(self, name: str, value=1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value) -> None:
+        with self._lock:
+            self.values[name] = value
+
+    def record_job(self, job, step: str) -> None:
+        """Guarda las estadísticas de un job de BigQuery ya terminado."""
+        entry = {"step": step, "job_id": getattr(job, "job_id", None)}
+        for attr in JOB_STATS:
+            value = getattr(job, attr, None)
+            if isinstance(value, (int, float)):
+                entry[attr] = value
+        with self._lock:
+            self.bq_jobs.append(entry)
+            for attr in JOB_STATS:
+                if attr in entry:
+                    key = f"bq_{attr}"
+                    self.counters[key] = self.counters.get(key, 0) + entry[attr]
+
+    def to_dict(self) -> dict:
+        # pyarrow solo si el job ya lo cargó: importarlo aquí encarece
+        # jobs que no lo usan (refresh sin checkpoint)
+        pa = sys.modules.get("pyarrow")
+        pool = pa.default_memory_pool() if pa else None
+        return {
+            "job":               self.job,
+            "status":            self.status,
+            "error":             self.error,
+            "started_at":        self.started_at.isoformat(),
+            "seconds":           self.seconds,
+            "params":            self.params,
+            "spans":             {k: {**v, "seconds": round(v["seconds"], 3)}
+                                  for k, v in self.spans.items()},
+            "counters":          self.counters,
+            "values":            self.values,
+            "bq_jobs":           self.bq_jobs,
+            "peak_rss_mb":       round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "arrow_pool_peak_mb": round(pool.max_memory() / 1024 / 1024, 1) if pool else 0.0,
+            "profile":           self.profile,
+            "python":            sys.version.split()[0],
+            "pyarrow":           pa.__version__ if pa else None,
+        }
+
+    def summary(self) -> str:
+        top = sorted(((k, v["seconds"]) for k, v in self.spans.items() if "/" not in k),
+                     key=lambda kv: -kv[1])
+        return " | ".join(f"{name} {seconds:.1f}s" for name, seconds in top)
+
+
+# ── Reporte activo del contexto ────────────────────────────────────────────────
+_active: ContextVar[Optional[RunReport]] = ContextVar("run_report", default=None)
+
+
+def current() -> Optional[RunReport]:
+    return _active.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[dict]:
+    report = _active.get()
+    if report is None:
+        yield {}
+        return
+    with report.span(name) as attrs:
+        yield attrs
+
+
+def count(name: str, value=1) -> None:
+    report = _active.get()
+    if report is not None:
+        report.count(name, value)
+
+
+def set_value(name: str, value) -> None:
+    report = _active.get()
+    if report is not None:
+        report.set(name, value)
+
+
+def record_job(job, step: str) -> None:
+    report = _active.get()
+    if report is not None:
+        report.record_job(job, step)
+
+
+# ── Profiling ──────────────────────────────────────────────────────────────────
+@contextmanager
+def _cprofile(report: RunReport, report_uri: Optional[str]):
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        rows = sorted(stats.stats.items(), key=lambda kv: -kv[1][3])[:PROFILE_TOP]
+        report.profile = {"mode": "cprofile", "top": [
+            {"function": f"{os.path.basename(file)}:{line}:{func}",
+             "calls": nc, "tottime_s": round(tt, 3), "cumtime_s": round(ct, 3)}
+            for (file, line, func), (_, nc, tt, ct, _) in rows
+        ]}
+        if report_uri and not report_uri.startswith("gs://"):
+            stats.dump_stats(f"{report_uri}.prof")
+            report.profile["stats_file"] = f"{report_uri}.prof"
+
+
+@contextmanager
+def _tracemalloc(report: RunReport):
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report.profile = {"mode": "tracemalloc", "python_peak_mb": round(peak / 1024 / 1024, 1),
+                          "top": [
+            {"location": str(stat.traceback), "size_mb": round(stat.size / 1024 / 1024, 2),
+             "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:PROFILE_TOP]
+        ]}
+
+
+@contextmanager
+def reporting(job: str, report_uri: Optional[str] = None, profile: Optional[str] = None,
+              params: Optional[dict] = None) -> Iterator[RunReport]:
+    """
+    Activa un RunReport durante el bloque y lo escribe en `report_uri` al
+    salir, también si el job falla (status="error").
+    """
+    report = RunReport(job, params)
+    token = _active.set(report)
+
+    profiler = None
+    if profile == "cprofile":
+        profiler = _cprofile(report, report_uri)
+    elif profile == "tracemalloc":
+        profiler = _tracemalloc(report)
+    elif profile:
+        raise ValueError(f"Modo de profiling desconocido: {profile}")
+
+    try:
+        if profiler:
+            with profiler:
+                yield report
+        else:
+            yield report
+        report.status = "ok"
+    except BaseException as exc:
+        report.status = "error"
+        report.error = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        _active.reset(token)
+        report.seconds = round(time.perf_counter() - report._t0, 3)
+        log.info("Tiempos por etapa: %s", report.summary() or "—")
+        if report_uri:
+            try:
+                write_json(report_uri, report.to_dict())
+                log.info("Reporte de ejecución guardado en %s", report_uri)
+            except Exception as exc:
+                # El reporte no debe ocultar el resultado del job
+                log.warning("No se pudo guardar el reporte en %s: %s", report_uri, exc)
@@ -0,0 +1,381 @@
+"""
+watch_delta.py
+──────────────
+Proceso de larga duración que vigila el _delta_log de una tabla Delta y
+ejecuta el refresh de la tabla externa (refresh_biglake.py), el pipeline
+de MERGE (run_merge.py) y/o un comando cuando aparece una versión nueva.
+Reemplaza el disparo horario de Cloud Scheduler (cloudrun-job.yaml): la
+latencia commit → consultable baja de hasta una hora a segundos, sin
+arranque en frío ni listado del _delta_log por ejecución.
+
+Detección:
+  Cada sondeo pide la metadata (HEAD) del commit actual y de los
+  --probe-ahead siguientes (_delta_log/N.json) al object store de la
+  tabla (DeltaStorageHandler: local, gs://, az://). No lista el log ni
+  lee commits. Sin cambios, el intervalo crece ×1.5 desde
+  --min-interval hasta --max-interval; con un commit nuevo vuelve al
+  mínimo.
+
+Agrupación:
+  Tras detectar una versión nueva espera --settle-seconds sin commits
+  nuevos (como mucho --max-settle-seconds desde el primero) y ejecuta
+  las acciones una sola vez con la última versión: una ráfaga de
+  appends (p. ej. la ingesta de create_delta_data.py) produce un solo
+  refresh. Los commits que llegan durante las acciones se agrupan en
+  el siguiente ciclo.
+
+Acciones, en orden (al menos una):
+  --refresh "ARGS"  refresh_biglake.run con esos argumentos
+  --merge "ARGS"    run_merge.run con esos argumentos
+  --exec "CMD"      comando de shell (sh -c) con DELTA_TABLE_URI y
+                    DELTA_VERSION en el entorno: $DELTA_VERSION se expande
+Los clientes de BigQuery y GCS se crean una vez y se reutilizan. Cada
+acción corre con su propio reporte (--report-uri en sus ARGS).
+
+Una acción que falla no avanza la versión procesada: se reintenta en el
+siguiente ciclo (con el intervalo de espera creciendo) y tras
+--max-failures fallos seguidos el proceso termina con código 1. Con
+--state-uri la versión procesada sobrevive a reinicios; sin él, al
+arrancar se ejecutan las acciones una vez con la versión actual.
+
+Despliegue: como Cloud Run Job con --max-runtime-seconds por debajo del
+timeout de la tarea y el Scheduler relanzándolo (el proceso termina
+limpio al cumplirse el tiempo o con SIGTERM), o como servicio en
+GKE/GCE sin límite.
+
+Uso:
+    python watch_delta.py \
+        --table-uri gs://raw-dev-michaelpage-prueba/delta/transactions \
+        --refresh "--gcs-bucket raw-dev-michaelpage-prueba --delta-path delta/transactions \
+                   --gcp-project michaelpage-prueba --bq-dataset dw_dev \
+                   --bq-table transactions_federated --uri-mode manifest" \
+        --state-uri gs://raw-dev-michaelpage-prueba/state/watch_delta.json \
+        [--min-interval 1] [--max-interval 30] [--settle-seconds 2] \
+        [--max-runtime-seconds 3300] [--report-uri ...]
+
+    # Local (pruebas)
+    python watch_delta.py --table-uri /tmp/delta/transactions --exec "echo v=\$DELTA_VERSION"
+
+Variables de entorno:
+    ADLS_ACCESS_KEY                — clave de acceso ADLS Gen2 (tablas az://, --merge)
+    GOOGLE_APPLICATION_CREDENTIALS — SA key JSON (tablas gs://, --refresh)
+"""
+
+import argparse
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+from deltalake import DeltaTable
+from deltalake.exceptions import TableNotFoundError
+from deltalake.fs import DeltaStorageHandler
+from pyarrow import fs as pafs
+
+from etl_state import read_state, write_state
+from maintain_delta import storage_options_for
+from run_report import PROFILE_MODES, count, reporting, set_value, span
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+log = logging.getLogger(__name__)
+
+DEFAULT_PROBE_AHEAD = 8
+BACKOFF_FACTOR = 1.5
+
+
+# ──────────────────────────────────────────────────────────────
+# Detección de commits
+# ──────────────────────────────────────────────────────────────
+class DeltaLogWatcher:
+    """Última versión de una tabla Delta por sondeo de los commits siguientes."""
+
+    def __init__(self, table_uri: str, storage_options: dict,
+                 probe_ahead: int = DEFAULT_PROBE_AHEAD):
+        self.table_uri = table_uri
+        self.storage_options = storage_options
+        self.probe_ahead = probe_ahead
+        self.fs = pafs.PyFileSystem(DeltaStorageHandler(table_uri, storage_options))
+        self.version = -1
+        self.committed_at: Optional[datetime] = None
+        self.recreated = False
+        self.reload()
+
+    def reload(self) -> int:
+        """Versión actual leyendo el log completo (arranque o tabla recreada)."""
+        dt = DeltaTable(self.table_uri, storage_options=self.storage_options)
+        self.version = dt.version()
+        info = self.fs.get_file_info(f"_delta_log/{self.version:020d}.json")
+        self.committed_at = info.mtime if info.type == pafs.FileType.File else None
+        return self.version
+
+    def poll(self) -> int:
+        """Versiones nuevas desde el último sondeo (0 si no hay)."""
+        start = self.version
+        while True:
+            paths = [f"_delta_log/{v:020d}.json"
+                     for v in range(self.version, self.version + self.probe_ahead + 1)]
+            infos = self.fs.get_file_info(paths)
+            if infos[0].type != pafs.FileType.File and infos[1].type != pafs.FileType.File:
+                # Ni el commit actual ni el siguiente: tabla recreada
+                log.warning("El commit %d ya no existe — releyendo la tabla.", self.version)
+                try:
+                    self.reload()
+                except TableNotFoundError:
+                    log.warning("La tabla %s no existe (¿se está recreando?).", self.table_uri)
+                    return 0
+                self.recreated = True
+                return max(self.version - start, 1)
+            found = [info for info in infos[1:] if info.type == pafs.FileType.File]
+            if not found:
+                break
+            self.version += len(found)
+            self.committed_at = found[-1].mtime
+            if len(found) < self.probe_ahead:
+                break
+        return self.version - start
+
+
+# ──────────────────────────────────────────────────────────────
+# Acciones
+# ──────────────────────────────────────────────────────────────
+Action = Tuple[str, Callable[[int], None]]
+
+
+def refresh_action(argv: List[str]) -> Action:
+    import refresh_biglake
+    from google.cloud import bigquery, storage
+
+    args = refresh_biglake.parse_args(argv)
+    gcs_client = storage.Client(project=args.gcp_project)
+    bq_client = bigquery.Client(project=args.gcp_project)
+
+    def run(version: int) -> None:
+        with reporting("refresh_biglake", args.report_uri, args.profile, params=vars(args)):
+            refresh_biglake.run(args, gcs_client=gcs_client, bq_client=bq_client)
+    return "refresh", run
+
+
+def merge_action(argv: List[str]) -> Action:
+    import run_merge
+    from google.cloud import bigquery
+
+    args = run_merge.parse_args(argv)
+    bq_client = bigquery.Client(project=args.project)
+
+    def run(version: int) -> None:
+        with reporting("run_merge", args.report_uri, args.profile, params=vars(args)):
+            run_merge.run(args, bq_client=bq_client)
+    return "merge", run
+
+
+def exec_action(command: str, table_uri: str) -> Action:
+    # Por sh -c, así $DELTA_VERSION en el comando se expande (ver Uso)
+    argv = ["sh", "-c", command]
+
+    def run(version: int) -> None:
+        env = {**os.environ, "DELTA_TABLE_URI": table_uri, "DELTA_VERSION": str(version)}
+        subprocess.run(argv, env=env, check=True)
+    return "exec", run
+
+
+def run_actions(actions: List[Action], version: int) -> bool:
+    """Ejecuta las acciones en orden; False si alguna falló (las siguientes no corren)."""
+    for name, action in actions:
+        try:
+            with span(f"action_{name}"):
+                action(version)
+        except (Exception, SystemExit) as exc:
+            # SystemExit: run_merge.run aborta con sys.exit ante errores de configuración
+            log.error("❌ Acción %s falló en la versión %d: %s", name, version, exc,
+                      exc_info=not isinstance(exc, (SystemExit, subprocess.CalledProcessError)))
+            count(f"watch_{name}_failures")
+            return False
+    return True
+
+
+# ──────────────────────────────────────────────────────────────
+# Bucle principal
+# ──────────────────────────────────────────────────────────────
+def watch(watcher: DeltaLogWatcher, actions: List[Action], args: argparse.Namespace,
+          stop: threading.Event) -> bool:
+    """Vigila hasta `stop` o --max-runtime-seconds; False si se agotaron los reintentos."""
+    state = read_state(args.state_uri) if args.state_uri else {}
+    processed = None
+    if state.get("table_uri") == watcher.table_uri:
+        processed = state.get("delta_version")
+    log.info("👀 Vigilando %s — versión actual %d, procesada %s",
+             watcher.table_uri, watcher.version, processed if processed is not None else "—")
+
+    deadline = time.monotonic() + args.max_runtime_seconds if args.max_runtime_seconds else None
+    interval = args.min_interval
+    failures = 0
+    latencies = []
+    while not stop.is_set():
+        if deadline is not None and time.monotonic() >= deadline:
+            log.info("Tiempo máximo de ejecución alcanzado (%d s).", args.max_runtime_seconds)
+            break
+
+        try:
+            with span("poll"):
+                new = watcher.poll()
+        except Exception as exc:
+            # Errores transitorios del object store: no detienen el proceso
+            log.warning("Sondeo fallido: %s", exc)
+            count("watch_poll_errors")
+            interval = min(interval * BACKOFF_FACTOR, args.max_interval)
+            stop.wait(interval)
+            continue
+        count("watch_polls")
+        if new:
+            count("watch_commits", new)
+            log.info("📥 %d commit(s) nuevo(s) — versión %d", new, watcher.version)
+            # Esperar a que termine la ráfaga
+            first_seen = time.monotonic()
+            while not stop.is_set():
+                remaining = args.max_settle_seconds - (time.monotonic() - first_seen)
+                if remaining <= 0 or stop.wait(min(args.settle_seconds, remaining)):
+                    break
+                try:
+                    more = watcher.poll()
+                except Exception as exc:
+                    log.warning("Sondeo fallido: %s", exc)
+                    count("watch_poll_errors")
+                    break
+                count("watch_polls")
+                if not more:
+                    break
+                count("watch_commits", more)
+                log.info("📥 %d commit(s) más — versión %d", more, watcher.version)
+
+        if watcher.recreated:
+            processed, watcher.recreated = None, False
+        if processed is not None and processed == watcher.version:
+            interval = min(interval * BACKOFF_FACTOR, args.max_interval)
+            stop.wait(interval)
+            continue
+
+        version, committed_at = watcher.version, watcher.committed_at
+        log.info("▶ Versión %d (%s)", version,
+                 f"{processed + 1}..{version}" if processed is not None and processed < version
+                 else "inicial")
+        if run_actions(actions, version):
+            processed = version
+            failures = 0
+            interval = args.min_interval
+            count("watch_events")
+            set_value("delta_version", version)
+            if committed_at is not None:
+                latency = (datetime.now(timezone.utc) - committed_at).total_seconds()
+                latencies.append(latency)
+                set_value("latency_max_s", round(max(latencies), 3))
+                set_value("latency_avg_s", round(sum(latencies) / len(latencies), 3))
+                log.info("✅ Versión %d publicada — %.1f s desde el commit", version, latency)
+            if args.state_uri:
+                write_state(args.state_uri, {
+                    "table_uri":     watcher.table_uri,
+                    "delta_version": version,
+                    "updated_at":    datetime.now(timezone.utc).isoformat(),
+                })
+        else:
+            failures += 1
+            count("watch_failures")
+            if failures >= args.max_failures:
+                log.error("❌ %d fallos seguidos — se detiene el proceso.", failures)
+                return False
+            interval = min(max(interval, args.min_interval) * BACKOFF_FACTOR ** failures,
+                           args.max_interval)
+            log.warning("Reintento en %.1f s (fallo %d/%d)", interval, failures, args.max_failures)
+            stop.wait(interval)
+    return True
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        description="Vigila el _delta_log y ejecuta refresh/merge con cada versión nueva"
+    )
+    p.add_argument("--table-uri",        required=True, help="URI de la tabla Delta (gs://, az://, local)")
+    p.add_argument("--adls-account",     default=None, help="Storage account ADLS (tablas az://)")
+    p.add_argument("--refresh",          default=None,
+                   help="Argumentos de refresh_biglake.py para cada versión nueva")
+    p.add_argument("--merge",            default=None,
+                   help="Argumentos de run_merge.py para cada versión nueva")
+    p.add_argument("--exec",             default=None, dest="exec_command",
+                   help="Comando de shell para cada versión nueva (DELTA_TABLE_URI, DELTA_VERSION "
+                        "en el entorno)")
+    p.add_argument("--state-uri",        default=None,
+                   help="Archivo JSON (local o gs://) con la última versión procesada")
+    p.add_argument("--min-interval",     type=float, default=1.0,
+                   help="Intervalo de sondeo tras un cambio, en segundos (default: 1)")
+    p.add_argument("--max-interval",     type=float, default=30.0,
+                   help="Intervalo de sondeo máximo sin cambios, en segundos (default: 30)")
+    p.add_argument("--settle-seconds",   type=float, default=2.0,
+                   help="Espera sin commits nuevos antes de ejecutar las acciones (default: 2)")
+    p.add_argument("--max-settle-seconds", type=float, default=10.0,
+                   help="Espera máxima para agrupar una ráfaga de commits (default: 10)")
+    p.add_argument("--probe-ahead",      type=int, default=DEFAULT_PROBE_AHEAD,
+                   help=f"Commits siguientes consultados por sondeo (default: {DEFAULT_PROBE_AHEAD})")
+    p.add_argument("--max-failures",     type=int, default=5,
+                   help="Fallos seguidos de las acciones antes de terminar con error (default: 5)")
+    p.add_argument("--max-runtime-seconds", type=int, default=0,
+                   help="Terminar limpio tras N segundos, 0 = sin límite (Cloud Run Jobs)")
+    p.add_argument("--report-uri",       default=None,
+                   help="Reporte JSON del proceso (local o gs://): sondeos, commits, latencias")
+    p.add_argument("--profile",          choices=PROFILE_MODES, default=None,
+                   help="Profiling opcional incluido en el reporte")
+    args = p.parse_args(argv)
+    if not (args.refresh or args.merge or args.exec_command):
+        p.error("indicar al menos una acción: --refresh, --merge o --exec")
+    if args.min_interval <= 0 or args.max_interval < args.min_interval:
+        p.error("se requiere 0 < --min-interval <= --max-interval")
+    if args.settle_seconds < 0 or args.max_settle_seconds < args.settle_seconds:
+        p.error("se requiere 0 <= --settle-seconds <= --max-settle-seconds")
+    if args.probe_ahead <= 0:
+        p.error("--probe-ahead debe ser positivo")
+    if args.max_failures <= 0:
+        p.error("--max-failures debe ser positivo")
+    return args
+
+
+def build_actions(args: argparse.Namespace) -> List[Action]:
+    actions = []
+    if args.refresh:
+        actions.append(refresh_action(shlex.split(args.refresh)))
+    if args.merge:
+        actions.append(merge_action(shlex.split(args.merge)))
+    if args.exec_command:
+        actions.append(exec_action(args.exec_command, args.table_uri))
+    return actions
+
+
+def main() -> None:
+    args = parse_args()
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        log.info("Señal %s recibida — terminando tras la acción en curso.",
+                 signal.Signals(signum).name)
+        stop.set()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    actions = build_actions(args)
+    watcher = DeltaLogWatcher(args.table_uri, storage_options_for(args.table_uri, args.adls_account),
+                              args.probe_ahead)
+    with reporting("watch_delta", args.report_uri, args.profile, params=vars(args)):
+        ok = watch(watcher, actions, args, stop)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as exc:
+        log.error("Error fatal: %s", exc, exc_info=True)
+        sys.exit(1)
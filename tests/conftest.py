@@ -0,0 +1,16 @@
+"""
+Los jobs y los benchmarks son scripts planos (sin paquete): los tests los
+importan igual que ellos se importan entre sí, con src/jobs y
+src/benchmarks en sys.path.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JOBS_DIR = os.path.join(ROOT, "src", "jobs")
+BENCH_DIR = os.path.join(ROOT, "src", "benchmarks")
+
+for path in (JOBS_DIR, BENCH_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,121 @@
+"""
+StreamWriter de bq_write_stream.py contra LocalWriteApi
+(benchmarks/local_clients.py), que aplica las reglas de offsets de la
+Storage Write API: con acks perdidos cada fila llega exactamente una vez
+(ALREADY_EXISTS cuenta como éxito), OUT_OF_RANGE y una cuenta distinta
+al finalizar detienen la carga, y en streams pending un fallo antes del
+commit no deja nada visible.
+"""
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+import bq_write_stream as bws
+from local_clients import LocalWriteApi
+from run_report import reporting
+
+PARENT = bws.table_path("test-project.test_dataset.transactions_staging")
+ROWS = 200_000
+SCHEMA = pa.schema([("transaction_id", pa.int64()), ("status", pa.string())])
+
+
+def blocks(rows: int = ROWS, block_rows: int = 10_000):
+    for start in range(0, rows, block_rows):
+        ids = np.arange(start, min(start + block_rows, rows))
+        yield pa.table({"transaction_id": ids, "status": pa.array(["ok"] * len(ids))})
+
+
+def visible_ids(api: LocalWriteApi) -> pa.ChunkedArray:
+    batches = api.rows(PARENT)
+    return pa.Table.from_batches(batches, SCHEMA).column("transaction_id") if batches \
+        else pa.chunked_array([], pa.int64())
+
+
+def writer(api, stream_type: str) -> bws.StreamWriter:
+    # Requests chicos: muchos appends por stream y varios acks perdidos
+    return bws.StreamWriter(api, streams=4, stream_type=stream_type, max_request_bytes=64 * 1024)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(bws, "RETRY_BACKOFF_SECONDS", 0.0)
+
+
+@pytest.mark.parametrize("stream_type", bws.STREAM_TYPES)
+def test_lost_acks_are_written_exactly_once(stream_type):
+    api = LocalWriteApi(lose_every=3)
+
+    with reporting("test") as report:
+        rows = writer(api, stream_type).append(PARENT, blocks(), SCHEMA)
+
+    ids = visible_ids(api)
+    assert rows == ROWS
+    assert len(ids) == ROWS
+    assert pc.count_distinct(ids).as_py() == ROWS
+    assert api.lost_acks > 0
+    # Cada ack perdido se reintenta con el mismo offset y vuelve ALREADY_EXISTS
+    assert report.counters["write_api_duplicate_appends"] == api.lost_acks
+
+
+class OutOfRangeApi(LocalWriteApi):
+    def append_rows(self, stream, serialized_schema, serialized_batch, offset):
+        raise api_exceptions.OutOfRange(f"offset {offset} fuera de rango en {stream}")
+
+
+def test_out_of_range_is_fatal():
+    api = OutOfRangeApi()
+
+    with reporting("test") as report:
+        with pytest.raises(RuntimeError, match="fuera de rango"):
+            writer(api, "committed").append(PARENT, blocks(), SCHEMA)
+
+    # Sin reintentos: el stream y el job perdieron la cuenta
+    assert "write_api_retries" not in report.counters
+    assert len(visible_ids(api)) == 0
+
+
+class ShortStreamApi(LocalWriteApi):
+    def finalize_write_stream(self, stream):
+        return super().finalize_write_stream(stream) - 1
+
+
+def test_row_count_is_checked_at_finalize():
+    api = ShortStreamApi()
+
+    with pytest.raises(RuntimeError, match="filas en el stream"):
+        writer(api, "pending").append(PARENT, blocks(), SCHEMA)
+
+    assert len(visible_ids(api)) == 0
+
+
+class FailingApi(LocalWriteApi):
+    """Rechaza (sin reintento posible) el append número `fail_at`."""
+
+    def __init__(self, fail_at: int):
+        super().__init__()
+        self.fail_at = fail_at
+        self.commits = 0
+
+    def append_rows(self, stream, serialized_schema, serialized_batch, offset):
+        if self.appends + 1 >= self.fail_at:
+            raise api_exceptions.PermissionDenied("sin permiso de escritura")
+        super().append_rows(stream, serialized_schema, serialized_batch, offset)
+
+    def batch_commit_write_streams(self, parent, streams):
+        self.commits += 1
+        super().batch_commit_write_streams(parent, streams)
+
+
+@pytest.mark.parametrize("stream_type, partial", [("pending", False), ("committed", True)])
+def test_failed_worker_before_commit(stream_type, partial):
+    api = FailingApi(fail_at=20)
+
+    with pytest.raises(api_exceptions.PermissionDenied):
+        writer(api, stream_type).append(PARENT, blocks(), SCHEMA)
+
+    # pending: todo o nada; committed: lo ya confirmado queda visible
+    assert api.commits == 0
+    assert (len(visible_ids(api)) > 0) is partial
@@ -0,0 +1,67 @@
+"""
+change_index.py con tramos pequeños (buffer de claves y merge por tramos
+de pocas entradas): el índice resultante debe ser el mismo que con todo
+en memoria, también a través de save_pending()/load_pending(), y las
+claves cargadas no se acumulan en memoria.
+"""
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+import change_index as ci
+
+KEY = "transaction_id"
+KEYS = 5_000
+
+
+def blocks(seed: int):
+    rng = np.random.default_rng(seed)
+    for _ in range(6):
+        n = int(rng.integers(0, 3_000))
+        yield pa.table({KEY: pa.array(rng.integers(0, KEYS, n)),
+                        "status": pa.array(rng.integers(0, 4, n))})
+
+
+def run_rounds(uri: str, buffer_entries: int, pending_uri=None) -> np.ndarray:
+    """Tres ejecuciones seguidas contra el índice `uri`; devuelve el índice final."""
+    for seed in range(3):
+        index = ci.ChangeIndex.open(uri)
+        changes = ci.ChangeFilter(index, KEY, buffer_entries=buffer_entries)
+        for table in blocks(seed):
+            changes.filter(table)
+        if pending_uri:
+            changes.save_pending(pending_uri)
+            changes = ci.ChangeFilter(index, KEY, buffer_entries=buffer_entries)
+            changes.load_pending(pending_uri)
+        changes.commit()
+        index.close()
+    return np.load(uri)
+
+
+@pytest.mark.parametrize("reload_pending", [False, True])
+def test_spilled_pending_keys_merge_like_in_memory(tmp_path, monkeypatch, reload_pending):
+    expected = run_rounds(str(tmp_path / "memory.npy"), buffer_entries=10 ** 9)
+
+    monkeypatch.setattr(ci, "MERGE_CHUNK_ENTRIES", 64)
+    pending_uri = str(tmp_path / "pending.npy") if reload_pending else None
+    stored = run_rounds(str(tmp_path / "spilled.npy"), buffer_entries=500,
+                        pending_uri=pending_uri)
+
+    assert np.all(stored[0, 1:] > stored[0, :-1])
+    np.testing.assert_array_equal(stored, expected)
+
+
+def test_pending_keys_spill_to_sorted_runs(tmp_path):
+    index = ci.ChangeIndex.open(str(tmp_path / "index.npy"))
+    changes = ci.ChangeFilter(index, KEY, buffer_entries=500)
+    table = pa.table({KEY: pa.array(np.arange(KEYS)), "status": pa.array(np.zeros(KEYS))})
+    for start in range(0, KEYS, 1_000):
+        changes.filter(table.slice(start, 1_000))
+
+    # Solo queda en memoria lo que no llega a un tramo
+    assert len(changes._runs) == KEYS // 1_000
+    assert changes._buffered == 0
+    keys, rows = changes.pending()
+    assert len(keys) == KEYS and np.all(keys[1:] > keys[:-1])
+    index.close()
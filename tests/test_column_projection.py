@@ -0,0 +1,81 @@
+"""
+Proyección de columnas del ETL bridge (run_merge.scan_batches): solo se
+leen las columnas que usa el MERGE (merge_source_columns). Una columna
+ancha que el MERGE no referencia no aparece en los batches ni en los
+bytes leídos (ReadStats).
+"""
+
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from deltalake import DeltaTable, write_deltalake
+
+import run_merge
+from delta_fs import ReadStats, delta_filesystem
+
+ROWS = 2_000
+
+
+def transactions(start: int) -> pa.Table:
+    ids = range(start, start + ROWS)
+    return pa.table({
+        "transaction_id":   [f"TXN-{i:06d}" for i in ids],
+        "customer_id":      [f"CUST-{i % 7}" for i in ids],
+        # Columna ancha e incompresible que el MERGE no usa
+        "payload":          [os.urandom(512).hex() for _ in ids],
+        "amount":           pa.array([float(i) for i in ids]),
+        "transaction_date": [f"2024-01-{1 + i % 28:02d}" for i in ids],
+        "status":           ["ok" for _ in ids],
+        "ingested_by":      ["loader" for _ in ids],
+    })
+
+
+def column_bytes(uri: str, files, columns) -> int:
+    """Bytes comprimidos de los column chunks de `columns` en `files`."""
+    total = 0
+    for name in files:
+        metadata = pq.read_metadata(os.path.join(uri, name))
+        for rg in range(metadata.num_row_groups):
+            row_group = metadata.row_group(rg)
+            for c in range(row_group.num_columns):
+                chunk = row_group.column(c)
+                if chunk.path_in_schema in columns:
+                    total += chunk.total_compressed_size
+    return total
+
+
+def test_merge_source_columns_follow_merge_sql():
+    schema = transactions(0).schema
+
+    assert run_merge.merge_source_columns(schema) == [
+        "transaction_id", "customer_id", "amount", "transaction_date", "status"]
+    with pytest.raises(ValueError, match="status"):
+        run_merge.merge_source_columns(schema.remove(schema.get_field_index("status")))
+
+
+@pytest.mark.parametrize("with_sequence", [False, True])
+def test_scan_batches_reads_only_merge_columns(tmp_path, with_sequence):
+    uri = str(tmp_path / "table")
+    for start in (0, ROWS):
+        write_deltalake(uri, transactions(start), mode="append")
+    dt = DeltaTable(uri)
+    stats = ReadStats()
+    source = dt.to_pyarrow_dataset(filesystem=delta_filesystem(dt, {}, stats))
+    columns = run_merge.merge_source_columns(source.schema)
+    sequence = run_merge.file_sequence(dt, {}) if with_sequence else None
+
+    batches = list(run_merge.scan_batches(source, columns, 2, stats, sequence))
+
+    expected = columns + [run_merge.SEQ_COLUMN] if with_sequence else columns
+    assert all(batch.schema.names == expected for batch in batches)
+    assert sum(batch.num_rows for batch in batches) == 2 * ROWS
+
+    files = dt.files()
+    projected = column_bytes(uri, files, set(columns))
+    skipped = column_bytes(uri, files, set(source.schema.names) - set(columns))
+    assert skipped > 10 * projected
+    # Los column chunks proyectados más la lectura del footer: del payload
+    # (~4 MB) no se lee nada
+    assert projected <= stats.bytes_read < skipped // 10
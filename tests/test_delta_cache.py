@@ -0,0 +1,126 @@
+"""
+Caché local de archivos Delta (delta_cache.py, delta_fs.py): la segunda
+lectura de una tabla sale del caché; un archivo reescrito con el mismo
+nombre y tamaño pero otro modificationTime es un fallo, no contenido
+viejo; el LRU expulsa las entradas menos usadas hasta el 90 % del
+límite; y varios hilos guardando la misma entrada dejan un solo archivo
+completo, sin temporales.
+"""
+
+import io
+import os
+import threading
+import time
+from datetime import timezone
+
+import pyarrow as pa
+from deltalake import DeltaTable, write_deltalake
+from pyarrow import fs as pafs
+
+from delta_cache import DeltaFileCache
+from delta_fs import CachingFileSystemHandler, content_tags, delta_filesystem
+
+
+def test_second_read_is_served_from_cache(tmp_path):
+    uri = str(tmp_path / "table")
+    for commit in range(3):
+        write_deltalake(uri, pa.table({"id": pa.array(range(commit * 100, commit * 100 + 100),
+                                                      pa.int64())}), mode="append")
+    dt = DeltaTable(uri)
+    cache = DeltaFileCache(str(tmp_path / "cache"))
+
+    def read() -> list:
+        source = dt.to_pyarrow_dataset(filesystem=delta_filesystem(dt, {}, cache=cache))
+        return sorted(source.to_table().column("id").to_pylist())
+
+    assert read() == list(range(300))
+    assert (cache.stats.hits, cache.stats.misses) == (0, 3)
+    assert read() == list(range(300))
+    assert (cache.stats.hits, cache.stats.misses) == (3, 3)
+    assert cache.size_bytes == sum(dt.get_add_actions(flatten=True).column("size_bytes")
+                                   .to_pylist())
+
+
+def test_content_tags_include_modification_time(tmp_path):
+    uri = str(tmp_path / "table")
+    write_deltalake(uri, pa.table({"id": pa.array([1, 2, 3], pa.int64())}))
+    actions = DeltaTable(uri).get_add_actions(flatten=True).to_pydict()
+
+    tags = content_tags(DeltaTable(uri).get_add_actions(flatten=True))
+
+    (path, size, mtime), = zip(actions["path"], actions["size_bytes"],
+                               actions["modification_time"])
+    assert tags == {path: f"{size}:{int(mtime.replace(tzinfo=timezone.utc).timestamp() * 1000)}"}
+
+
+def test_rewritten_file_with_same_size_is_a_miss(tmp_path):
+    root = tmp_path / "table"
+    root.mkdir()
+    (root / "part-00000.parquet").write_bytes(b"version-1")
+    cache = DeltaFileCache(str(tmp_path / "cache"))
+
+    def read(tag: str) -> bytes:
+        fs = pafs.PyFileSystem(CachingFileSystemHandler(
+            pafs.SubTreeFileSystem(str(root), pafs.LocalFileSystem()), cache, str(root),
+            {"part-00000.parquet": 9}, {"part-00000.parquet": tag}))
+        with fs.open_input_file("part-00000.parquet") as fh:
+            return fh.read()
+
+    assert read("9:1000") == b"version-1"
+    # Mismo nombre y tamaño, otro contenido (tabla recreada, writer con nombres fijos)
+    (root / "part-00000.parquet").write_bytes(b"version-2")
+
+    assert read("9:2000") == b"version-2"
+    assert read("9:2000") == b"version-2"
+    assert (cache.stats.hits, cache.stats.misses) == (1, 2)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = DeltaFileCache(str(tmp_path / "cache"), max_bytes=1000)
+    for name in "abc":
+        cache.read(name, 1, lambda: b"x" * 300)
+    # "a" se usó después de "b" y "c": la menos usada es "b"
+    now = time.time()
+    for age, name in ((30, "b"), (20, "c"), (10, "a")):
+        os.utime(cache._entry_path(name, 1), (now - age, now - age))
+
+    cache.read("d", 1, lambda: b"x" * 300)
+
+    # 1200 bytes > 1000: se expulsa hasta <= 900
+    assert cache.stats.evictions == 1 and cache.size_bytes == 900
+    assert not os.path.exists(cache._entry_path("b", 1))
+    assert all(os.path.exists(cache._entry_path(name, 1)) for name in "acd")
+    assert cache.read("a", 1, lambda: b"") == b"x" * 300
+
+
+class SlowSource(io.BytesIO):
+    """Contenido entregado en bloques chicos, para que las copias se solapen."""
+
+    def read(self, n=-1):
+        time.sleep(0.001)
+        return super().read(min(n, 4096) if n and n > 0 else 4096)
+
+
+def test_concurrent_stores_leave_one_complete_entry(tmp_path):
+    cache = DeltaFileCache(str(tmp_path / "cache"))
+    payload = os.urandom(256 * 1024)
+    start = threading.Barrier(8)
+    results = []
+
+    def reader() -> None:
+        start.wait()
+        with cache.open("table/part-0.parquet", "262144:1",
+                        lambda: SlowSource(payload), size=len(payload)) as fh:
+            results.append(fh.read())
+
+    threads = [threading.Thread(target=reader) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [payload] * 8
+    shard = os.path.dirname(cache._entry_path("table/part-0.parquet", "262144:1"))
+    assert os.listdir(shard) == [os.path.basename(cache._entry_path("table/part-0.parquet",
+                                                                     "262144:1"))]
+    assert cache.size_bytes == len(payload)
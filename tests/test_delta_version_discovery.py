@@ -0,0 +1,82 @@
+"""
+Detección de la última versión Delta en refresh_biglake.py contra un
+_delta_log sintético grande en benchmarks/local_clients.LocalStorageClient
+(que cuenta listados y objetos listados como lo facturaría GCS): con
+_last_checkpoint solo se listan los commits posteriores al checkpoint;
+sin él, o si apunta más allá del log, se lista el log completo.
+"""
+
+import json
+import os
+
+import pytest
+
+import refresh_biglake as rb
+from local_clients import LocalStorageClient
+
+BUCKET = "test-bucket"
+DELTA_PATH = "delta/transactions"
+COMMITS = 20_000
+CHECKPOINT_VERSION = 19_990
+
+
+@pytest.fixture(scope="module")
+def log_root(tmp_path_factory):
+    """Bucket con COMMITS commits vacíos (solo cuentan los nombres)."""
+    root = tmp_path_factory.mktemp("gcs")
+    log_dir = root / BUCKET / DELTA_PATH / "_delta_log"
+    log_dir.mkdir(parents=True)
+    for version in range(COMMITS):
+        (log_dir / f"{version:020d}.json").touch()
+    (log_dir / f"{CHECKPOINT_VERSION:020d}.checkpoint.parquet").touch()
+    return root
+
+
+@pytest.fixture
+def last_checkpoint(log_root):
+    path = os.path.join(log_root, BUCKET, DELTA_PATH, "_delta_log", "_last_checkpoint")
+
+    def write(payload):
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(payload if isinstance(payload, str) else json.dumps(payload))
+
+    yield write
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def test_listing_bounded_by_checkpoint(log_root, last_checkpoint):
+    last_checkpoint({"version": CHECKPOINT_VERSION, "size": 1})
+    gcs = LocalStorageClient(str(log_root))
+
+    assert rb.get_latest_delta_version(gcs, BUCKET, DELTA_PATH) == COMMITS - 1
+    assert gcs.list_calls == 1
+    # Commits desde el checkpoint (inclusive) más el propio checkpoint Parquet
+    assert gcs.objects_listed == COMMITS - CHECKPOINT_VERSION + 1
+
+
+def test_listing_bounded_by_cached_version(log_root, last_checkpoint):
+    last_checkpoint({"version": 10_000})
+    gcs = LocalStorageClient(str(log_root))
+
+    assert rb.get_latest_delta_version(gcs, BUCKET, DELTA_PATH,
+                                       min_version=COMMITS - 3) == COMMITS - 1
+    assert gcs.objects_listed == 3
+
+
+def test_full_listing_without_last_checkpoint(log_root):
+    gcs = LocalStorageClient(str(log_root))
+
+    assert rb.get_latest_delta_version(gcs, BUCKET, DELTA_PATH) == COMMITS - 1
+    assert gcs.list_calls == 1
+    assert gcs.objects_listed >= COMMITS
+
+
+@pytest.mark.parametrize("payload", [{"version": COMMITS + 5_000}, "{no es json"])
+def test_full_listing_when_last_checkpoint_is_stale(log_root, last_checkpoint, payload):
+    # Checkpoint posterior al último commit (tabla recreada) o ilegible
+    last_checkpoint(payload)
+    gcs = LocalStorageClient(str(log_root))
+
+    assert rb.get_latest_delta_version(gcs, BUCKET, DELTA_PATH) == COMMITS - 1
+    assert gcs.objects_listed >= COMMITS
@@ -0,0 +1,82 @@
+"""
+Subcomandos de etl_cli.py: resolve elige el job (o ETL_COMMAND sin
+subcomando), main lo ejecuta como script con sus argumentos, un
+subcomando desconocido termina con el uso, y el CLI no importa el job
+(ni pyarrow/deltalake/google-cloud) hasta ejecutarlo.
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+import etl_cli
+from conftest import JOBS_DIR
+
+
+@pytest.fixture
+def dispatched(monkeypatch):
+    """Sustituye runpy.run_module: registra (módulo, sys.argv) sin correr el job."""
+    calls = []
+    monkeypatch.setattr(etl_cli.runpy, "run_module",
+                        lambda module, **kwargs: calls.append((module, sys.argv[1:])))
+    monkeypatch.setattr(sys, "argv", ["etl_cli.py"])
+    return calls
+
+
+def test_resolve():
+    assert etl_cli.resolve(["merge", "--incremental"]) == ("merge", ["--incremental"])
+    assert etl_cli.resolve(["--help"]) == (None, ["--help"])
+    assert etl_cli.resolve(["--gcs-bucket", "b"]) == ("refresh", ["--gcs-bucket", "b"])
+    assert etl_cli.resolve([]) == ("refresh", [])
+
+
+def test_without_command_uses_etl_command(monkeypatch, dispatched):
+    monkeypatch.setenv("ETL_COMMAND", "maintain")
+
+    etl_cli.main(["--table-uri", "az://datalake/t"])
+
+    assert dispatched == [("maintain_delta", ["--table-uri", "az://datalake/t"])]
+
+
+def test_command_runs_its_module_with_remaining_args(dispatched):
+    etl_cli.main(["merge", "--incremental", "--state-uri", "s.json"])
+    etl_cli.main(["pipelines", "--config", "pipelines.toml"])
+
+    assert dispatched == [("run_merge", ["--incremental", "--state-uri", "s.json"]),
+                          ("run_pipelines", ["--config", "pipelines.toml"])]
+
+
+def test_unknown_command_prints_usage(dispatched):
+    with pytest.raises(SystemExit) as exc:
+        etl_cli.main(["marge", "--incremental"])
+
+    message = str(exc.value.code)
+    assert message.startswith("Subcomando desconocido: marge")
+    assert etl_cli.usage() in message
+    assert dispatched == []
+
+
+def test_env_driven_commands_reject_args(dispatched, capsys):
+    etl_cli.main(["create-delta", "--help"])
+    assert "create_delta_data.py" in capsys.readouterr().out
+
+    with pytest.raises(SystemExit, match="variables de entorno"):
+        etl_cli.main(["omni", "--project", "p"])
+    assert dispatched == []
+
+
+def test_help_does_not_import_jobs():
+    # Proceso nuevo: sys.modules de pytest ya tiene pyarrow y los jobs
+    heavy = ("pyarrow", "deltalake", "google.cloud.bigquery", "google.cloud.storage",
+             "run_merge", "create_delta_data", "refresh_biglake")
+    code = ("import sys, etl_cli\n"
+            "etl_cli.main(['--help'])\n"
+            "etl_cli.main(['create-delta', '--help'])\n"
+            f"print([m for m in {heavy!r} if m in sys.modules])\n")
+
+    out = subprocess.run([sys.executable, "-c", code], cwd=JOBS_DIR, check=True,
+                         capture_output=True, text=True).stdout
+
+    assert out.startswith("uso: ") and "  merge         run_merge.py" in out
+    assert out.rstrip().splitlines()[-1] == "[]"
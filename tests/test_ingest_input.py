@@ -0,0 +1,102 @@
+"""
+Parseo de archivos de entrada de create_delta_data.py (CSV, JSONL y
+Parquet): un archivo válido llega completo con TRANSACTIONS_SCHEMA; una
+columna faltante o una fila sin transaction_id / transaction_date hacen
+fallar spool_input_file con el nombre del archivo. En JSONL los campos
+ausentes llegan como nulos, así que se validan después de parsear cada
+bloque.
+"""
+
+import json
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import create_delta_data as cdd
+
+ROWS = [
+    {"transaction_id": "TXN-001", "customer_id": "CUST-A", "amount": "150.00",
+     "transaction_date": "2024-01-15", "status": "completed"},
+    {"transaction_id": "TXN-002", "customer_id": "CUST-B", "amount": "220.50",
+     "transaction_date": "2024-01-16", "status": "pending"},
+]
+
+
+def write_input(path, fmt: str, rows) -> str:
+    if fmt == "csv":
+        columns = list(rows[0])
+        lines = [",".join(columns)] + [",".join(row.get(c, "") for c in columns) for row in rows]
+        path.write_text("\n".join(lines) + "\n")
+    elif fmt == "jsonl":
+        path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    else:
+        columns = {c: [row.get(c) for row in rows] for c in rows[0]}
+        if "amount" in columns:
+            columns["amount"] = pa.array([Decimal(v) for v in columns["amount"]],
+                                         pa.decimal128(18, 2))
+        pq.write_table(pa.table(columns), path)
+    return str(path)
+
+
+def spool(tmp_path, source: str):
+    _, spool_path, rows = cdd.spool_input_file(source, str(tmp_path))
+    with pa.memory_map(spool_path) as fh:
+        return pa.ipc.open_file(fh).read_all(), rows
+
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl", "parquet"])
+def test_valid_file_is_read_with_schema(tmp_path, fmt):
+    source = write_input(tmp_path / f"in.{fmt}", fmt, ROWS)
+
+    table, rows = spool(tmp_path, source)
+
+    assert rows == 2
+    assert table.schema == cdd.TRANSACTIONS_SCHEMA
+    assert table.column("amount").to_pylist() == [Decimal("150.00"), Decimal("220.50")]
+
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl", "parquet"])
+def test_missing_column_names_the_file(tmp_path, fmt):
+    rows = [{k: v for k, v in row.items() if k != "status"} for row in ROWS]
+    source = write_input(tmp_path / f"in.{fmt}", fmt, rows)
+
+    with pytest.raises(ValueError, match="status") as error:
+        spool(tmp_path, source)
+    assert source in str(error.value)
+
+
+@pytest.mark.parametrize("fmt", ["jsonl", "parquet"])
+def test_row_without_key_names_the_file_and_row(tmp_path, fmt):
+    rows = [ROWS[0], {**ROWS[1], "transaction_id": None}]
+    if fmt == "jsonl":
+        rows[1] = {k: v for k, v in ROWS[1].items() if k != "transaction_id"}
+    source = write_input(tmp_path / f"in.{fmt}", fmt, rows)
+
+    with pytest.raises(ValueError, match="sin transaction_id.*fila 2") as error:
+        spool(tmp_path, source)
+    assert source in str(error.value)
+
+
+def test_csv_row_without_date_names_the_file_and_row(tmp_path):
+    source = write_input(tmp_path / "in.csv", "csv", [ROWS[0], {**ROWS[1], "amount": ""}])
+    path = tmp_path / "missing_date.csv"
+    path.write_text("transaction_id,customer_id,amount,transaction_date,status\n"
+                    "TXN-001,CUST-A,1.00,2024-01-15,completed\n"
+                    "TXN-002,CUST-B,2.00,,pending\n")
+
+    # amount vacío es un nulo válido; transaction_date vacío no
+    assert spool(tmp_path, source)[0].column("amount").to_pylist()[1] is None
+    with pytest.raises(ValueError, match="sin transaction_date.*fila 2") as error:
+        spool(tmp_path, str(path))
+    assert str(path) in str(error.value)
+
+
+def test_jsonl_optional_field_missing_in_some_lines_is_null(tmp_path):
+    rows = [ROWS[0], {k: v for k, v in ROWS[1].items() if k != "status"}]
+    source = write_input(tmp_path / "in.jsonl", "jsonl", rows)
+
+    table, _ = spool(tmp_path, source)
+
+    assert table.column("status").to_pylist() == ["completed", None]
@@ -0,0 +1,159 @@
+"""
+Dedup "la última fila gana": el resultado con spill a particiones en
+disco es el mismo que en memoria, y en una tabla Delta local gana la fila
+del commit más reciente aunque su archivo tenga un modificationTime
+anterior (el rango sale del replay del _delta_log, ver delta_log.py).
+Ese replay lee solo los commits posteriores al checkpoint cuando los
+archivos pedidos están ahí, y recorre los anteriores solo si hace falta.
+"""
+
+import json
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from deltalake import DeltaTable, write_deltalake
+
+import delta_log
+import run_merge
+from key_dedup import SEQ_COLUMN, LatestRowDeduplicator, sequence_array
+
+KEYS = 5_000
+
+
+def keyed_batches(versions: int, batch_rows: int = 1_000):
+    """`versions` pasadas sobre las mismas claves; cada pasada es un archivo."""
+    rng = np.random.default_rng(7)
+    for version in range(versions):
+        keys = rng.permutation(KEYS)
+        for first in range(0, KEYS, batch_rows):
+            chunk = keys[first:first + batch_rows]
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(chunk, pa.int64()), pa.array(np.full(len(chunk), version), pa.int64()),
+                 sequence_array(version, first, len(chunk))],
+                names=["transaction_id", "version", SEQ_COLUMN])
+
+
+def winners(deduper: LatestRowDeduplicator) -> dict:
+    tables = list(run_merge.deduplicated(keyed_batches(3), deduper))
+    rows = pa.concat_tables(tables).to_pydict()
+    assert SEQ_COLUMN not in rows
+    return dict(zip(rows["transaction_id"], rows["version"]))
+
+
+def test_spilled_dedup_matches_in_memory(tmp_path):
+    in_memory = LatestRowDeduplicator("transaction_id")
+    spilled = LatestRowDeduplicator("transaction_id", memory_budget_bytes=64 * 1024,
+                                    spill_dir=str(tmp_path), expected_rows=3 * KEYS)
+
+    expected = winners(in_memory)
+    result = winners(spilled)
+
+    assert not in_memory.spilled and spilled.spilled and spilled.partitions > 1
+    assert result == expected
+    assert expected == {key: 2 for key in range(KEYS)}
+    assert spilled.rows_out == KEYS
+    # Las particiones en disco se borran al terminar
+    assert os.listdir(tmp_path) == []
+
+
+def test_null_keys_are_not_deduplicated():
+    batch = pa.RecordBatch.from_arrays(
+        [pa.array([1, None, 1, None], pa.int64()), sequence_array(0, 0, 4)],
+        names=["transaction_id", SEQ_COLUMN])
+    deduper = LatestRowDeduplicator("transaction_id")
+
+    rows = pa.concat_tables(run_merge.deduplicated([batch], deduper)).column(0).to_pylist()
+
+    assert sorted(rows, key=lambda v: v is None) == [1, None, None]
+
+
+def rewrite_modification_time(log_dir: str, version: int, value: int) -> None:
+    path = os.path.join(log_dir, f"{version:020d}.json")
+    with open(path) as fh:
+        actions = [json.loads(line) for line in fh if line.strip()]
+    for action in actions:
+        if "add" in action:
+            action["add"]["modificationTime"] = value
+    with open(path, "w") as fh:
+        fh.write("\n".join(json.dumps(a) for a in actions) + "\n")
+
+
+def test_newest_commit_wins_across_files(tmp_path):
+    uri = str(tmp_path / "table")
+    for version in range(3):
+        write_deltalake(uri, pa.table({"transaction_id": pa.array([1, 2, 3], pa.int64()),
+                                       "version": pa.array([version] * 3, pa.int64())}),
+                        mode="append")
+    # El último commit con el modificationTime más antiguo (reloj desfasado,
+    # archivo copiado): no debe cambiar qué fila gana.
+    rewrite_modification_time(os.path.join(uri, "_delta_log"), 2, 1)
+
+    dt = DeltaTable(uri)
+    sequence = run_merge.file_sequence(dt, {})
+    batches = []
+    for path, rank in sequence.items():
+        table = pq.read_table(os.path.join(uri, path))
+        batches.extend(pa.RecordBatch.from_arrays(
+            batch.columns + [sequence_array(rank, 0, batch.num_rows)],
+            names=batch.schema.names + [SEQ_COLUMN]) for batch in table.to_batches())
+
+    rows = pa.concat_tables(run_merge.deduplicated(batches,
+                                                   LatestRowDeduplicator("transaction_id")))
+
+    assert sorted(sequence.values()) == [0, 1, 2]
+    assert rows.column("version").to_pylist() == [2, 2, 2]
+
+
+def test_versions_of_new_files_read_only_commits_after_checkpoint(tmp_path, monkeypatch):
+    uri = str(tmp_path / "table")
+    for version in range(20):
+        write_deltalake(uri, pa.table({"transaction_id": pa.array([version], pa.int64())}),
+                        mode="append")
+        if version == 15:
+            DeltaTable(uri).create_checkpoint()
+    fetched = []
+    fetch = delta_log._LogReader._fetch
+    monkeypatch.setattr(delta_log._LogReader, "_fetch",
+                        lambda self, name: fetched.append(name) or fetch(self, name))
+    monkeypatch.setattr(delta_log._LogReader, "listing",
+                        property(lambda self: pytest.fail("listó el _delta_log")))
+    dt = DeltaTable(uri)
+    new_files = set(dt.files()) - set(DeltaTable(uri, version=17).files())
+
+    versions = delta_log.file_versions(dt, {}, paths=new_files)
+
+    assert sorted(versions.values()) == [18, 19]
+    assert sorted(fetched) == ["00000000000000000016.json", "00000000000000000017.json",
+                               "00000000000000000018.json", "00000000000000000019.json",
+                               "_last_checkpoint"]
+
+
+def test_versions_before_checkpoint_match_full_replay(tmp_path, monkeypatch):
+    uri = str(tmp_path / "table")
+    for version in range(12):
+        write_deltalake(uri, pa.table({"transaction_id": pa.array([version], pa.int64())}),
+                        mode="append")
+        if version == 8:
+            DeltaTable(uri).create_checkpoint()
+    dt = DeltaTable(uri)
+    version_of = {path: int(pq.read_table(os.path.join(uri, path)).column(0)[0].as_py())
+                  for path in dt.files()}
+    oldest = min(version_of, key=version_of.get)
+    fetched = []
+    fetch = delta_log._LogReader._fetch
+    monkeypatch.setattr(delta_log._LogReader, "_fetch",
+                        lambda self, name: fetched.append(name) or fetch(self, name))
+
+    assert delta_log.file_versions(dt, {}) == version_of
+    # El archivo más nuevo del checkpoint: basta con el primer tramo hacia atrás (8, 7)
+    monkeypatch.setattr(delta_log, "READ_THREADS", 2)
+    fetched.clear()
+    newest_in_checkpoint = next(p for p, v in version_of.items() if v == 8)
+    assert delta_log.file_versions(dt, {}, paths={newest_in_checkpoint}) == {
+        newest_in_checkpoint: 8}
+    assert "00000000000000000008.json" in fetched
+    assert "00000000000000000006.json" not in fetched
+    assert delta_log.file_versions(dt, {}, paths={oldest}) == {oldest: 0}
@@ -0,0 +1,179 @@
+"""
+maintain_delta.py contra tablas Delta locales: compact y z-order funcionan
+en tablas con el esquema de transacciones (amount decimal, transaction_id
+con varias versiones por clave) y tras ellos el checkpoint sigue
+pudiéndose escribir; la dedup de run_merge.py elige la misma fila antes y
+después de compactar; una retención de vacuum menor que la mínima de
+delta-rs se rechaza en los argumentos.
+"""
+
+import os
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from deltalake import DeltaTable, write_deltalake
+
+import maintain_delta as md
+import run_merge
+from delta_log import SOURCE_VERSION_TAG
+from key_dedup import SEQ_COLUMN, LatestRowDeduplicator, sequence_array
+
+COMMITS = 12
+DATES = ["2024-01-01", "2024-01-02"]
+SCHEMA = pa.schema([
+    ("transaction_id",   pa.string()),
+    ("customer_id",      pa.string()),
+    ("amount",           pa.decimal128(18, 2)),
+    ("transaction_date", pa.string()),
+    ("status",           pa.string()),
+])
+
+
+def transactions(commit: int, ids) -> pa.Table:
+    """Una fila por id; la versión `commit` va en amount y status."""
+    return pa.table({
+        "transaction_id":   [f"TXN-{i:03d}" for i in ids],
+        "customer_id":      [f"CUST-{i % 3}" for i in ids],
+        "amount":           [Decimal(f"{commit}.{i % 100:02d}") for i in ids],
+        "transaction_date": [DATES[i % 2] for i in ids],
+        "status":           [f"v{commit}" for i in ids],
+    }, schema=SCHEMA)
+
+
+def build_transactions(uri: str) -> None:
+    """Appends que repiten claves: cada commit actualiza ids ya escritos."""
+    for commit in range(COMMITS):
+        ids = [commit, commit + 1, commit + 2, (commit * 7) % 5]
+        write_deltalake(uri, transactions(commit, ids), mode="append",
+                        partition_by=["transaction_date"])
+
+
+def latest(uri: str) -> dict:
+    """transaction_id → status ganador según la dedup de run_merge.py."""
+    dt = DeltaTable(uri)
+    sequence = run_merge.file_sequence(dt, {})
+    batches = []
+    for path, rank in sequence.items():
+        table = pq.read_table(os.path.join(uri, path))
+        batches += table.append_column(SEQ_COLUMN, sequence_array(rank, 0, table.num_rows)) \
+            .combine_chunks().to_batches()
+    rows = pa.concat_tables(run_merge.deduplicated(batches,
+                                                   LatestRowDeduplicator("transaction_id")))
+    return dict(zip(rows.column("transaction_id").to_pylist(),
+                    rows.column("status").to_pylist()))
+
+
+def maintain(uri: str, *flags: str) -> DeltaTable:
+    md.run(md.parse_args(["--table-uri", uri, "--no-vacuum", *flags]))
+    return DeltaTable(uri)
+
+
+def test_transactions_table_is_compacted_and_checkpointed(tmp_path):
+    uri = str(tmp_path / "transactions")
+    build_transactions(uri)
+    before = latest(uri)
+    rows = DeltaTable(uri).to_pyarrow_table().num_rows
+
+    dt = maintain(uri)
+
+    # Un archivo por partición, mismas filas y checkpoint legible pese a amount decimal
+    assert dt.version() == COMMITS
+    assert len(dt.files()) == len(DATES)
+    assert dt.to_pyarrow_table().num_rows == rows
+    assert md.last_checkpoint_version(dt, {}) == COMMITS
+    assert DeltaTable(uri).to_pyarrow_table().num_rows == rows
+    assert latest(uri) == before
+    assert set(before.values()) <= {f"v{c}" for c in range(COMMITS)}
+
+
+def test_large_file_cuts_the_compaction_bin():
+    # Compactar por encima de un archivo grande pondría filas viejas por
+    # delante de las suyas: el tramo se corta ahí
+    files = [{"path": f"p/{name}.parquet", "size": size}
+             for name, size in [("a", 10), ("b", 10), ("big", 100), ("c", 10), ("d", 10),
+                                ("e", 60), ("f", 10)]]
+
+    bins = md.compaction_bins(files, target_bytes=80)
+
+    assert [[f["path"][2:-8] for f in b] for b in bins] == [["a", "b"], ["c", "d", "e"]]
+
+
+def test_compacted_files_carry_their_source_version(tmp_path):
+    uri = str(tmp_path / "tagged")
+    build_transactions(uri)
+
+    dt = maintain(uri)
+    versions = md.file_versions(dt, {})
+
+    # Cada archivo compactado toma la versión de su fuente más reciente
+    assert sorted(versions.values()) == [COMMITS - 1, COMMITS - 1]
+    with open(os.path.join(uri, "_delta_log", f"{COMMITS:020d}.json")) as fh:
+        log = fh.read()
+    assert SOURCE_VERSION_TAG in log and '"OPTIMIZE"' in log
+
+
+def test_z_order_skips_partitions_with_repeated_keys(tmp_path):
+    uri = str(tmp_path / "zorder")
+    build_transactions(uri)
+    unique = str(tmp_path / "unique")
+    write_deltalake(unique, transactions(0, range(0, 40)), mode="append",
+                    partition_by=["transaction_date"])
+    write_deltalake(unique, transactions(1, range(40, 80)), mode="append",
+                    partition_by=["transaction_date"])
+    before = latest(uri)
+
+    dt = maintain(uri, "--z-order", "customer_id,amount")
+    ordered = maintain(unique, "--z-order", "customer_id", "--checkpoint-interval", "1")
+
+    # Con claves repetidas se compacta (mismo ganador); con claves únicas se ordena
+    assert latest(uri) == before
+    assert len(dt.files()) == len(DATES)
+    assert len(ordered.files()) == len(DATES)
+    assert ordered.to_pyarrow_table().num_rows == 80
+    for path in ordered.files():
+        customers = pq.read_table(os.path.join(unique, path)).column("customer_id").to_pylist()
+        assert customers == sorted(customers)
+    assert md.last_checkpoint_version(ordered, {}) == ordered.version()
+
+
+def test_z_values_interleave_column_ranks():
+    grid = pa.table({"x": [1, 1, 0, 0], "y": ["b", "a", "b", "a"]})
+
+    order = md.z_values(grid, ["x", "y"]).argsort(kind="stable")
+
+    # Con dos valores por columna la curva Z es x, y: x aporta el bit alto de cada par
+    assert grid.take(pa.array(order)).to_pylist() == [
+        {"x": 0, "y": "a"}, {"x": 0, "y": "b"}, {"x": 1, "y": "a"}, {"x": 1, "y": "b"}]
+
+
+def test_table_with_unique_keys_is_compacted(tmp_path):
+    uri = str(tmp_path / "plain")
+    for commit in range(COMMITS):
+        write_deltalake(uri, pa.table({"transaction_id": pa.array([2 * commit, 2 * commit + 1],
+                                                                  pa.int64())}), mode="append")
+
+    dt = maintain(uri)
+
+    assert len(dt.files()) == 1
+    assert sorted(dt.to_pyarrow_table().column(0).to_pylist()) == list(range(2 * COMMITS))
+    assert md.last_checkpoint_version(dt, {}) == dt.version()
+
+
+def test_failed_checkpoint_fails_the_job(tmp_path):
+    # Tabla compactada con el OPTIMIZE de delta-rs: el checkpoint no se puede escribir
+    uri = str(tmp_path / "broken")
+    build_transactions(uri)
+    DeltaTable(uri).optimize.compact()
+
+    with pytest.raises(RuntimeError, match="checkpoint"):
+        maintain(uri, "--no-compact")
+
+
+def test_short_retention_requires_override():
+    with pytest.raises(SystemExit):
+        md.parse_args(["--table-uri", "local", "--retention-hours", "1"])
+    args = md.parse_args(["--table-uri", "local", "--retention-hours", "1",
+                          "--allow-short-retention"])
+    assert args.allow_short_retention
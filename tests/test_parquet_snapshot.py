@@ -0,0 +1,101 @@
+"""
+Snapshot Parquet de create_delta_data.py sobre un filesystem local: la
+exportación completa reemplaza un snapshot anterior (plano o de otra
+versión) escribiendo primero y borrando después, así que en ningún
+momento faltan filas; la incremental solo toca las particiones cambiadas
+y borra las que quedaron sin filas.
+"""
+
+import os
+
+import pyarrow as pa
+import pyarrow.dataset as pads
+import pyarrow.parquet as pq
+from deltalake import DeltaTable, write_deltalake
+from pyarrow import fs as pafs
+
+import create_delta_data as cdd
+from delta_fs import _ForwardingHandler
+
+
+class WatchedFileSystem(_ForwardingHandler):
+    """Antes de cada borrado cuenta las filas visibles del snapshot."""
+
+    prefix = "watched"
+
+    def __init__(self, inner: pafs.FileSystem, base_dir: str):
+        super().__init__(inner)
+        self.base_dir = base_dir
+        self.visible_rows = []
+
+    def delete_file(self, path):
+        self.visible_rows.append(snapshot_rows(self.base_dir))
+        super().delete_file(path)
+
+
+def snapshot_files(base_dir: str) -> list:
+    return sorted(os.path.relpath(os.path.join(d, name), base_dir)
+                  for d, _, names in os.walk(base_dir) for name in names
+                  if name.endswith(".parquet"))
+
+
+def snapshot_rows(base_dir: str) -> int:
+    """Filas que vería la tabla externa (todos los .parquet bajo el prefijo)."""
+    files = [os.path.join(base_dir, f) for f in snapshot_files(base_dir)]
+    return sum(pq.read_metadata(f).num_rows for f in files)
+
+
+def transactions(ids, dates) -> pa.Table:
+    return pa.table({
+        "transaction_id":   [f"TXN-{i:03d}" for i in ids],
+        "amount":           pa.array([float(i) for i in ids]),
+        "transaction_date": [dates[i % len(dates)] for i in ids],
+    })
+
+
+def export(dt: DeltaTable, base_dir: str) -> WatchedFileSystem:
+    handler = WatchedFileSystem(pafs.LocalFileSystem(), base_dir)
+    cdd.write_parquet_snapshot_to_gcs(dt, {}, filesystem=pafs.PyFileSystem(handler),
+                                      base_dir=base_dir)
+    return handler
+
+
+def test_full_snapshot_writes_before_deleting(tmp_path):
+    uri, base_dir = str(tmp_path / "delta"), str(tmp_path / "snapshot")
+    write_deltalake(uri, transactions(range(30), ["2024-01-01", "2024-01-02"]))
+    # Exportación vieja: el transactions.parquet plano y una partición sin marcador
+    os.makedirs(os.path.join(base_dir, "transaction_date=2023-12-31"))
+    pq.write_table(transactions(range(5), ["2023-12-31"]),
+                   os.path.join(base_dir, "transactions.parquet"))
+    pq.write_table(transactions(range(5), ["2023-12-31"]),
+                   os.path.join(base_dir, "transaction_date=2023-12-31", "part-0.parquet"))
+
+    watched = export(DeltaTable(uri), base_dir)
+
+    # Cada borrado ocurrió con el snapshot nuevo ya completo
+    assert len(watched.visible_rows) == 2 and min(watched.visible_rows) >= 30
+    assert snapshot_rows(base_dir) == 30
+    assert {f.split("/")[0] for f in snapshot_files(base_dir)} == {
+        "transaction_date=2024-01-01", "transaction_date=2024-01-02"}
+    assert os.path.isfile(os.path.join(base_dir, cdd.SNAPSHOT_MARKER))
+
+
+def test_incremental_snapshot_replaces_only_changed_partitions(tmp_path):
+    uri, base_dir = str(tmp_path / "delta"), str(tmp_path / "snapshot")
+    write_deltalake(uri, transactions(range(30), ["2024-01-01", "2024-01-02", "2024-01-03"]),
+                    partition_by=["transaction_date"])
+    export(DeltaTable(uri), base_dir)
+    before = snapshot_files(base_dir)
+
+    write_deltalake(uri, transactions(range(30, 33), ["2024-01-01"]), mode="append",
+                    partition_by=["transaction_date"])
+    DeltaTable(uri).delete("transaction_date = '2024-01-03'")
+    watched = export(DeltaTable(uri), base_dir)
+
+    after = snapshot_files(base_dir)
+    untouched = [f for f in before if f.startswith("transaction_date=2024-01-02/")]
+    assert untouched and set(untouched) <= set(after)
+    assert not any(f.startswith("transaction_date=2024-01-03/") for f in after)
+    assert min(watched.visible_rows) >= 23
+    dataset = pads.dataset(base_dir, format="parquet", partitioning="hive")
+    assert dataset.count_rows() == 23 == DeltaTable(uri).to_pyarrow_table().num_rows
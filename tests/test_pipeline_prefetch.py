@@ -0,0 +1,158 @@
+"""
+prefetch de run_merge.py (lectura y serialización en segundo plano con
+--pipeline-depth): el productor no se adelanta más de `depth` elementos
+al consumidor; una excepción del productor llega al consumidor aunque
+este sea lento, sin bloquear ninguno de los dos hilos; y si el
+consumidor abandona, el productor se detiene y cierra su iterador.
+stream_to_staging con pipeline_depth carga lo mismo que sin él.
+"""
+
+import threading
+import time
+
+import pyarrow as pa
+import pytest
+
+import run_merge
+from local_clients import LocalBigQueryClient
+
+STAGING_REF = "proj.dw_dev.transactions_staging"
+SCHEMA = pa.schema([("transaction_id", pa.string()), ("amount", pa.float64())])
+
+
+class Source:
+    """Iterador que cuenta los elementos entregados y si se cerró."""
+
+    def __init__(self, n: int, fail_at: int = None):
+        self.n = n
+        self.fail_at = fail_at
+        self.produced = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.produced == self.fail_at:
+            raise ValueError(f"lectura fallida en el elemento {self.fail_at}")
+        if self.produced == self.n:
+            raise StopIteration
+        self.produced += 1
+        return self.produced - 1
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def run_with_timeout(target, timeout: float = 10.0):
+    """Corre `target` en un hilo; falla si no termina (deadlock)."""
+    outcome = {}
+
+    def call() -> None:
+        try:
+            outcome["result"] = target()
+        except BaseException as exc:
+            outcome["error"] = exc
+
+    thread = threading.Thread(target=call, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "el consumidor quedó bloqueado"
+    return outcome
+
+
+def prefetch_threads() -> list:
+    return [t for t in threading.enumerate() if t.name.endswith("-read") and t.is_alive()]
+
+
+@pytest.mark.parametrize("depth", [1, 3])
+def test_read_ahead_is_bounded_by_depth(depth):
+    source = Source(20)
+    consumed = 0
+
+    for item in run_merge.prefetch(source, depth, "read"):
+        assert item == consumed
+        consumed += 1
+        # El productor llena la cola y se frena: `depth` en cola y uno
+        # esperando para entrar
+        assert wait_for(lambda: source.produced >= min(consumed + depth, 20))
+        time.sleep(0.02)
+        assert source.produced <= consumed + depth + 1
+
+    assert consumed == 20 and source.closed
+
+
+def test_producer_failure_reaches_slow_consumer():
+    source = Source(10, fail_at=4)
+    consumed = []
+
+    def consume() -> None:
+        for item in run_merge.prefetch(source, 2, "read"):
+            time.sleep(0.05)
+            consumed.append(item)
+
+    outcome = run_with_timeout(consume)
+
+    assert isinstance(outcome.get("error"), ValueError)
+    # Los elementos anteriores al fallo se entregan antes de la excepción
+    assert consumed == [0, 1, 2, 3]
+    assert source.closed
+    assert wait_for(lambda: not prefetch_threads())
+
+
+def test_consumer_abandoning_stops_producer():
+    source = Source(1_000)
+    items = run_merge.prefetch(source, 2, "read")
+
+    assert [next(items), next(items)] == [0, 1]
+    items.close()
+
+    # close() espera al productor: no sigue leyendo con el consumidor fuera
+    assert source.closed and source.produced <= 2 + 2 + 1
+    assert not prefetch_threads()
+
+
+def chunks(n: int, rows: int = 100, fail_at: int = None):
+    for i in range(n):
+        if i == fail_at:
+            raise ValueError(f"bloque {i} ilegible")
+        ids = range(i * rows, (i + 1) * rows)
+        yield pa.table({"transaction_id": [f"TXN-{j:05d}" for j in ids],
+                        "amount": [float(j) for j in ids]}, schema=SCHEMA)
+
+
+@pytest.mark.parametrize("depth", [0, 1, 3])
+def test_stream_to_staging_with_pipeline_depth(depth):
+    bq = LocalBigQueryClient()
+
+    rows = run_merge.stream_to_staging(bq, STAGING_REF, chunks(6), SCHEMA, pipeline_depth=depth)
+
+    assert rows == 600 and bq.tables[STAGING_REF].num_rows == 600
+    assert bq.load_jobs == 6
+
+
+class SlowLoadClient(LocalBigQueryClient):
+    def load_table_from_file(self, *args, **kwargs):
+        time.sleep(0.05)
+        return super().load_table_from_file(*args, **kwargs)
+
+
+def test_stream_to_staging_read_failure_does_not_deadlock():
+    bq = SlowLoadClient()
+
+    outcome = run_with_timeout(lambda: run_merge.stream_to_staging(
+        bq, STAGING_REF, chunks(10, fail_at=3), SCHEMA, pipeline_depth=1))
+
+    assert isinstance(outcome.get("error"), ValueError)
+    assert bq.load_jobs == 3
+    assert wait_for(lambda: not [t for t in threading.enumerate()
+                                 if t.name.endswith(("-read", "-encode")) and t.is_alive()])
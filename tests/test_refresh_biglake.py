@@ -0,0 +1,227 @@
+"""
+DDL de la tabla externa de refresh_biglake.py contra
+benchmarks/local_clients (GCS en disco, BigQuery que registra las
+queries): con el snapshot particionado, las columnas de partición se
+declaran con WITH PARTITION COLUMNS y el wildcard cubre los directorios
+col=valor/; con una tabla Delta particionada en --uri-mode files y
+manifest, el mismo DDL con la raíz de la tabla como prefijo hive. Los
+archivos activos que reproduce active_delta_files coinciden con los de
+delta-rs después de removes y de un checkpoint, y en --uri-mode files una
+lista que no cabe en el DDL pasa a un manifiesto. Con --skip-unchanged,
+una versión (o fingerprint) ya publicada no escribe en BigQuery ni en GCS
+y una distinta vuelve a publicar.
+"""
+
+import json
+import os
+
+import pyarrow as pa
+from deltalake import DeltaTable, write_deltalake
+
+import refresh_biglake as rb
+from local_clients import LocalBigQueryClient, LocalStorageClient
+
+BUCKET = "test-bucket"
+DELTA_PATH = "delta/transactions"
+PARQUET_PATH = "parquet/transactions"
+
+
+def write_object(root, name: str, payload: bytes = b"") -> None:
+    path = os.path.join(root, BUCKET, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(payload)
+
+
+def run(root, *flags: str):
+    """Un refresh con clientes locales nuevos: (bq, gcs)."""
+    bq, gcs = LocalBigQueryClient(), LocalStorageClient(str(root))
+    rb.run(rb.parse_args(["--gcs-bucket", BUCKET, "--delta-path", DELTA_PATH,
+                          "--parquet-path", PARQUET_PATH, "--gcp-project", "p",
+                          "--bq-dataset", "d", "--bq-table", "t", *flags]),
+           gcs_client=gcs, bq_client=bq)
+    return bq, gcs
+
+
+def refresh(root, *flags: str) -> str:
+    """Un refresh con clientes locales; devuelve el DDL publicado."""
+    bq, _ = run(root, *flags)
+    assert len(bq.queries) == 1
+    return " ".join(bq.queries[0].split())
+
+
+def test_partitioned_snapshot_declares_partition_columns(tmp_path):
+    write_object(tmp_path, f"{DELTA_PATH}/_delta_log/{0:020d}.json", b"{}\n")
+    write_object(tmp_path, f"{PARQUET_PATH}/_snapshot_version.json",
+                 json.dumps({"delta_version": 0, "partition_by": ["transaction_date"]}).encode())
+    write_object(tmp_path, f"{PARQUET_PATH}/transaction_date=2024-01-15/part-0.parquet")
+
+    ddl = refresh(tmp_path)
+
+    prefix = f"gs://{BUCKET}/{PARQUET_PATH}"
+    assert ddl == (
+        "CREATE OR REPLACE EXTERNAL TABLE `p.d.t` "
+        "WITH PARTITION COLUMNS (transaction_date DATE) "
+        "OPTIONS ( format = 'PARQUET', "
+        f"uris = ['{prefix}/transaction_date=*'], "
+        f"hive_partition_uri_prefix = '{prefix}', "
+        "require_hive_partition_filter = false )")
+
+
+def test_flat_snapshot_has_no_partition_columns(tmp_path):
+    write_object(tmp_path, f"{DELTA_PATH}/_delta_log/{0:020d}.json", b"{}\n")
+
+    ddl = refresh(tmp_path)
+
+    assert "PARTITION COLUMNS" not in ddl and "hive_partition_uri_prefix" not in ddl
+    assert f"uris = ['gs://{BUCKET}/{PARQUET_PATH}/*.parquet']" in ddl
+
+
+def test_unknown_partition_columns_are_strings_or_inferred():
+    assert rb.partition_columns_clause(["transaction_date", "region"]) == \
+        "WITH PARTITION COLUMNS (transaction_date DATE, region STRING)"
+    assert rb.partition_columns_clause(None) == "WITH PARTITION COLUMNS"
+
+
+def write_partitioned_delta_log(root) -> list:
+    """Commit con dos archivos en transaction_date=.../ (paths del log URL-encoded)."""
+    paths = ["transaction_date=2024-01-15/part-0.parquet",
+             "transaction_date=2024-01-16/part-1.parquet"]
+    actions = [{"add": {"path": path, "size": 1, "dataChange": True}} for path in paths]
+    write_object(root, f"{DELTA_PATH}/_delta_log/{0:020d}.json",
+                 "\n".join(json.dumps(a) for a in actions).encode())
+    return paths
+
+
+def test_partitioned_delta_files_mode_declares_partition_columns(tmp_path):
+    paths = write_partitioned_delta_log(tmp_path)
+
+    ddl = refresh(tmp_path, "--uri-mode", "files")
+
+    prefix = f"gs://{BUCKET}/{DELTA_PATH}"
+    uris = ", ".join(f"'{prefix}/{path}'" for path in paths)
+    assert ddl == (
+        "CREATE OR REPLACE EXTERNAL TABLE `p.d.t` "
+        "WITH PARTITION COLUMNS (transaction_date DATE) "
+        "OPTIONS ( format = 'PARQUET', "
+        f"uris = [{uris}], "
+        f"hive_partition_uri_prefix = '{prefix}', "
+        "require_hive_partition_filter = false )")
+
+
+def test_partitioned_delta_manifest_mode_declares_partition_columns(tmp_path):
+    paths = write_partitioned_delta_log(tmp_path)
+
+    ddl = refresh(tmp_path, "--uri-mode", "manifest")
+
+    prefix = f"gs://{BUCKET}/{DELTA_PATH}"
+    manifest = f"{DELTA_PATH}/_manifests/{0:020d}.manifest"
+    assert ddl == (
+        "CREATE OR REPLACE EXTERNAL TABLE `p.d.t` "
+        "WITH PARTITION COLUMNS (transaction_date DATE) "
+        "OPTIONS ( format = 'PARQUET', "
+        f"uris = ['gs://{BUCKET}/{manifest}'], "
+        "file_set_spec_type = 'NEW_LINE_DELIMITED_MANIFEST', "
+        f"hive_partition_uri_prefix = '{prefix}', "
+        "require_hive_partition_filter = false )")
+    with open(os.path.join(tmp_path, BUCKET, manifest)) as fh:
+        assert fh.read().split() == [f"{prefix}/{path}" for path in paths]
+
+
+def test_unpartitioned_delta_files_mode_has_no_partition_columns(tmp_path):
+    write_object(tmp_path, f"{DELTA_PATH}/_delta_log/{0:020d}.json",
+                 json.dumps({"add": {"path": "part-0.parquet", "size": 1}}).encode())
+
+    ddl = refresh(tmp_path, "--uri-mode", "files")
+
+    assert "PARTITION COLUMNS" not in ddl and "hive_partition_uri_prefix" not in ddl
+
+
+def test_active_files_match_delta_rs_after_removes_and_checkpoint(tmp_path):
+    table = os.path.join(tmp_path, BUCKET, DELTA_PATH)
+    gcs = LocalStorageClient(str(tmp_path))
+
+    def commit(region: str, ids) -> None:
+        write_deltalake(table, pa.table({"id": pa.array(ids, pa.int64()),
+                                         "region": [region] * len(ids)}),
+                        mode="append", partition_by=["region"])
+
+    def delta_rs_files(version: int) -> list:
+        uris = DeltaTable(table, version=version).file_uris()
+        return sorted(os.path.relpath(uri, table) for uri in uris)
+
+    commit("north", [1, 2])
+    commit("south america", [3, 4])   # directorio URL-encoded en el log
+    commit("north", [5])
+    DeltaTable(table).delete("id = 5")                # remove de un archivo entero
+    DeltaTable(table).delete("id = 3")                # remove + add reescrito
+    DeltaTable(table).create_checkpoint()
+    checkpoint = DeltaTable(table).version()
+    commit("north", [6])
+    DeltaTable(table).delete("region = 'north'")
+    latest = DeltaTable(table).version()
+
+    for version in (1, 3, checkpoint, checkpoint + 1, latest):
+        assert rb.active_delta_files(gcs, BUCKET, DELTA_PATH, version) == \
+            delta_rs_files(version), f"versión {version}"
+    assert rb.active_delta_files(gcs, BUCKET, DELTA_PATH, latest) != []
+
+
+def test_files_mode_falls_back_to_manifest_when_uris_do_not_fit(tmp_path, monkeypatch):
+    paths = write_partitioned_delta_log(tmp_path)
+    monkeypatch.setattr(rb, "MAX_EXTERNAL_TABLE_URIS", len(paths) - 1)
+    assert not rb.fits_inline(rb.delta_file_uris(BUCKET, DELTA_PATH, paths))
+
+    ddl = refresh(tmp_path, "--uri-mode", "files")
+
+    manifest = f"{DELTA_PATH}/_manifests/{0:020d}.manifest"
+    assert f"uris = ['gs://{BUCKET}/{manifest}']" in ddl
+    assert "file_set_spec_type = 'NEW_LINE_DELIMITED_MANIFEST'" in ddl
+    assert os.path.isfile(os.path.join(tmp_path, BUCKET, manifest))
+
+
+# ── --skip-unchanged ─────────────────────────────────────────────────────────
+def read_bytes(path: str) -> bytes:
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+def test_unchanged_version_writes_nothing(tmp_path):
+    write_partitioned_delta_log(tmp_path)
+    state_uri = str(tmp_path / "state.json")
+    flags = ("--uri-mode", "manifest", "--skip-unchanged", "--state-uri", state_uri)
+    bq, gcs = run(tmp_path, *flags)
+    assert len(bq.queries) == 1 and gcs.bytes_uploaded > 0
+    state = read_bytes(state_uri)
+
+    bq, gcs = run(tmp_path, *flags)
+
+    assert bq.queries == [] and gcs.bytes_uploaded == 0
+    assert read_bytes(state_uri) == state
+
+    # Un commit nuevo: manifiesto y DDL de la versión 1
+    write_object(tmp_path, f"{DELTA_PATH}/_delta_log/{1:020d}.json",
+                 json.dumps({"add": {"path": "transaction_date=2024-01-17/part-2.parquet",
+                                     "size": 1}}).encode())
+    bq, gcs = run(tmp_path, *flags)
+    assert len(bq.queries) == 1 and gcs.bytes_uploaded > 0
+    assert f"_manifests/{1:020d}.manifest" in bq.queries[0]
+    assert json.loads(read_bytes(state_uri))["delta_version"] == 1
+
+
+def test_rewritten_snapshot_changes_fingerprint(tmp_path):
+    write_object(tmp_path, f"{DELTA_PATH}/_delta_log/{0:020d}.json", b"{}\n")
+    write_object(tmp_path, f"{PARQUET_PATH}/part-0.parquet", b"v1")
+    state_uri = str(tmp_path / "state.json")
+    flags = ("--skip-unchanged", "--fingerprint", "--state-uri", state_uri)
+    assert len(run(tmp_path, *flags)[0].queries) == 1
+    fingerprint = json.loads(read_bytes(state_uri))["fingerprint"]
+
+    bq, gcs = run(tmp_path, *flags)
+    assert bq.queries == [] and gcs.bytes_uploaded == 0
+
+    # Misma versión Delta, snapshot reescrito: no es un no-op
+    write_object(tmp_path, f"{PARQUET_PATH}/part-1.parquet", b"v2")
+    bq, _ = run(tmp_path, *flags)
+    assert len(bq.queries) == 1
+    assert json.loads(read_bytes(state_uri))["fingerprint"] != fingerprint
@@ -0,0 +1,513 @@
+"""
+run_merge.run contra una tabla Delta local y los clientes de
+benchmarks/local_clients.py: en modo incremental la segunda ejecución
+solo carga en staging los archivos añadidos después del watermark, y el
+watermark no avanza si el MERGE falla ni en ejecuciones de backfill o
+con filtro por fecha; un reintento con el mismo --run-id retoma en la
+primera etapa sin terminar (ver etl_state.RunCheckpoint); los tramos de
+versiones de un backfill cubren cada archivo una sola vez y en paralelo
+cargan lo mismo que leyendo el rango de una vez. El SQL del MERGE (con y
+sin poda de particiones), la migración de final_table y --merge-dry-run
+se verifican contra el cliente local: el dry run no mueve ni el
+watermark ni el índice de cambios. Con la Write API, un staging con el
+schema de una versión anterior se recrea antes de cargar. Con
+--skip-unchanged, una versión (y fingerprint) ya mergeada no toca
+BigQuery; una tabla recreada con la misma versión sí se carga con
+--fingerprint.
+
+La tabla "az://datalake/transactions" se abre desde un directorio local
+(run_merge.DeltaTable se sustituye por uno que traduce la URI).
+"""
+
+import io
+import os
+import re
+import shutil
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from deltalake import DeltaTable, write_deltalake
+from google.cloud import bigquery
+
+import run_merge
+from bq_write_stream import StreamWriter, table_path
+from etl_state import read_state
+from local_clients import LocalBigQueryClient, LocalJob, LocalWriteApi
+
+CONTAINER = "datalake"
+TABLE_PATH = "transactions"
+TABLE_URI = f"az://{CONTAINER}/{TABLE_PATH}"
+STAGING_REF = f"proj.dw_dev.{run_merge.STAGING_TABLE}"
+SCHEMA = pa.schema([
+    ("transaction_id",   pa.string()),
+    ("customer_id",      pa.string()),
+    ("amount",           pa.decimal128(18, 2)),
+    ("transaction_date", pa.string()),
+    ("status",           pa.string()),
+])
+
+
+def transactions(ids, status: str = "v0") -> pa.Table:
+    return pa.table({
+        "transaction_id":   [f"TXN-{i:03d}" for i in ids],
+        "customer_id":      [f"CUST-{'ABCD'[i % 4]}" for i in ids],
+        "amount":           [Decimal(f"{i}.50") for i in ids],
+        "transaction_date": [f"2024-01-{1 + i % 2:02d}" for i in ids],
+        "status":           [status for _ in ids],
+    }, schema=SCHEMA)
+
+
+class FailingMergeClient(LocalBigQueryClient):
+    """El MERGE falla (cuota, permisos, timeout) mientras `fail`; el resto de queries no."""
+
+    fail = True
+
+    def query(self, sql: str, location: str = None, job_config=None, **kwargs):
+        if self.fail and sql.lstrip().startswith("MERGE"):
+            raise RuntimeError("MERGE rechazado")
+        return super().query(sql, location=location, job_config=job_config, **kwargs)
+
+
+class CapturingClient(LocalBigQueryClient):
+    """Guarda las filas de cada carga a staging (el cliente local solo las cuenta)."""
+
+    def __init__(self, project: str = None):
+        super().__init__(project)
+        self.loaded = []
+
+    def load_table_from_file(self, file_obj, destination, size=None, job_config=None, **kwargs):
+        payload = file_obj.read()
+        if getattr(job_config, "write_disposition", None) == "WRITE_TRUNCATE":
+            self.loaded = []
+        self.loaded.append(pq.read_table(pa.BufferReader(payload)))
+        return super().load_table_from_file(io.BytesIO(payload), destination, size,
+                                            job_config, **kwargs)
+
+    def staged(self) -> dict:
+        rows = pa.concat_tables(self.loaded).to_pydict()
+        return dict(zip(rows["transaction_id"], rows["status"]))
+
+
+@pytest.fixture
+def table(tmp_path, monkeypatch) -> str:
+    """Directorio local de la tabla Delta que run_merge lee como TABLE_URI."""
+    root = str(tmp_path / "adls")
+
+    def local_delta_table(uri: str, *args, **kwargs) -> DeltaTable:
+        if uri.startswith("az://"):
+            uri = os.path.join(root, uri[len("az://"):])
+        return DeltaTable(uri, *args, **kwargs)
+
+    monkeypatch.setattr(run_merge, "DeltaTable", local_delta_table)
+    return os.path.join(root, CONTAINER, TABLE_PATH)
+
+
+def merge(bq: LocalBigQueryClient, *flags: str) -> None:
+    run_merge.run(run_merge.parse_args([
+        "--project", "proj", "--dataset", "dw_dev", "--env", "dev",
+        "--adls-account", "account", "--adls-container", CONTAINER,
+        "--adls-path", TABLE_PATH, *flags]), bq_client=bq, adls_key="key")
+
+
+def merges(bq: LocalBigQueryClient) -> int:
+    return sum(sql.lstrip().startswith("MERGE") for sql in bq.queries)
+
+
+def test_second_run_stages_only_files_after_watermark(table, tmp_path):
+    state_uri = str(tmp_path / "state.json")
+    write_deltalake(table, transactions(range(10)), mode="append")
+    write_deltalake(table, transactions(range(10, 15)), mode="append")
+    bq = LocalBigQueryClient()
+
+    merge(bq, "--incremental", "--state-uri", state_uri)
+    assert bq.tables[STAGING_REF].num_rows == 15
+    assert read_state(state_uri)["last_merged_version"] == 1
+
+    # Un commit nuevo: 3 filas nuevas y una actualización de TXN-000
+    write_deltalake(table, transactions([0, 15, 16, 17], status="v1"), mode="append")
+    loads = bq.load_jobs
+    merge(bq, "--incremental", "--state-uri", state_uri)
+
+    assert bq.tables[STAGING_REF].num_rows == 4
+    assert bq.load_jobs == loads + 1
+    assert merges(bq) == 2
+    state = read_state(state_uri)
+    assert state["last_merged_version"] == 2 and state["table_uri"] == TABLE_URI
+
+    # Sin commits nuevos: staging no se recarga y el MERGE se omite
+    merge(bq, "--incremental", "--state-uri", state_uri)
+    assert bq.load_jobs == loads + 1
+    assert merges(bq) == 2
+
+
+def test_failed_merge_keeps_watermark(table, tmp_path):
+    state_uri = str(tmp_path / "state.json")
+    write_deltalake(table, transactions(range(10)), mode="append")
+    merge(LocalBigQueryClient(), "--incremental", "--state-uri", state_uri)
+    before = read_state(state_uri)
+    write_deltalake(table, transactions(range(10, 20)), mode="append")
+
+    failing = FailingMergeClient()
+    with pytest.raises(RuntimeError, match="MERGE rechazado"):
+        merge(failing, "--incremental", "--state-uri", state_uri)
+
+    # Staging se cargó, pero el watermark sigue en la versión anterior
+    assert failing.tables[STAGING_REF].num_rows == 10
+    assert read_state(state_uri) == before
+
+    # El reintento vuelve a cargar los mismos archivos
+    bq = LocalBigQueryClient()
+    merge(bq, "--incremental", "--state-uri", state_uri)
+    assert bq.tables[STAGING_REF].num_rows == 10
+    assert read_state(state_uri)["last_merged_version"] == 1
+
+
+@pytest.mark.parametrize("flags", [
+    ["--backfill-from", "1"],
+    ["--since-date", "2024-01-02"],
+    ["--until-date", "2024-01-01"],
+], ids=["backfill", "since_date", "until_date"])
+def test_backfill_and_date_filtered_runs_keep_watermark(table, tmp_path, flags):
+    state_uri = str(tmp_path / "state.json")
+    write_deltalake(table, transactions(range(10)), mode="append")
+    merge(LocalBigQueryClient(), "--incremental", "--state-uri", state_uri)
+    before = read_state(state_uri)
+    write_deltalake(table, transactions(range(10, 20)), mode="append")
+
+    bq = LocalBigQueryClient()
+    merge(bq, "--state-uri", state_uri, *flags)
+
+    assert merges(bq) == 1 and bq.tables[STAGING_REF].num_rows > 0
+    assert read_state(state_uri) == before
+
+    # La siguiente incremental sigue partiendo del watermark anterior
+    bq = LocalBigQueryClient()
+    merge(bq, "--incremental", "--state-uri", state_uri)
+    assert bq.tables[STAGING_REF].num_rows == 10
+
+
+# ── Reintentos con --run-state-uri ──────────────────────────────────────────
+def test_retry_after_failed_merge_reuses_staging(table, tmp_path):
+    state_uri = str(tmp_path / "state.json")
+    resume = ["--incremental", "--state-uri", state_uri,
+              "--run-state-uri", str(tmp_path / "run.json"), "--run-id", "exec-1"]
+    write_deltalake(table, transactions(range(10)), mode="append")
+    bq = FailingMergeClient()
+    with pytest.raises(RuntimeError, match="MERGE rechazado"):
+        merge(bq, *resume)
+    assert bq.load_jobs == 1
+    # Un commit posterior al intento fallido no entra en el reintento
+    write_deltalake(table, transactions(range(10, 20)), mode="append")
+
+    bq.fail = False
+    setups = sum("CREATE TABLE" in sql for sql in bq.queries)
+    merge(bq, *resume)
+
+    # Staging y setup se reutilizan; el MERGE y el watermark sí se hacen
+    assert bq.load_jobs == 1
+    assert sum("CREATE TABLE" in sql for sql in bq.queries) == setups
+    assert merges(bq) == 1
+    assert read_state(state_uri)["last_merged_version"] == 0
+
+
+def test_retry_after_failed_watermark_write_skips_merge(table, tmp_path, monkeypatch):
+    state_uri = str(tmp_path / "state.json")
+    resume = ["--incremental", "--state-uri", state_uri,
+              "--run-state-uri", str(tmp_path / "run.json"), "--run-id", "exec-1"]
+    write_deltalake(table, transactions(range(10)), mode="append")
+    write_state = run_merge.write_state
+
+    def failing_write_state(uri, state):
+        raise OSError("GCS no disponible")
+
+    monkeypatch.setattr(run_merge, "write_state", failing_write_state)
+    bq = LocalBigQueryClient()
+    with pytest.raises(OSError):
+        merge(bq, *resume)
+    assert merges(bq) == 1 and not os.path.exists(state_uri)
+    write_deltalake(table, transactions(range(10, 20)), mode="append")
+
+    monkeypatch.setattr(run_merge, "write_state", write_state)
+    merge(bq, *resume)
+
+    # El MERGE ya terminó: no se repite, y el watermark es la versión mergeada
+    assert bq.load_jobs == 1
+    assert merges(bq) == 1
+    assert read_state(state_uri)["last_merged_version"] == 0
+
+
+def test_finished_run_does_not_skip_later_commits(table, tmp_path):
+    # watch_delta.py: run() en cada versión nueva, con el mismo run id de Cloud Run
+    state_uri = str(tmp_path / "state.json")
+    resume = ["--incremental", "--state-uri", state_uri,
+              "--run-state-uri", str(tmp_path / "run.json"), "--run-id", "exec-1"]
+    write_deltalake(table, transactions(range(10)), mode="append")
+    bq = LocalBigQueryClient()
+    merge(bq, *resume)
+    write_deltalake(table, transactions(range(10, 15)), mode="append")
+
+    merge(bq, *resume)
+
+    assert bq.load_jobs == 2 and bq.tables[STAGING_REF].num_rows == 5
+    assert merges(bq) == 2
+    assert read_state(state_uri)["last_merged_version"] == 1
+
+
+def test_new_run_id_starts_from_scratch(table, tmp_path):
+    run_state = ["--run-state-uri", str(tmp_path / "run.json")]
+    write_deltalake(table, transactions(range(10)), mode="append")
+    bq = FailingMergeClient()
+    with pytest.raises(RuntimeError):
+        merge(bq, *run_state, "--run-id", "exec-1")
+
+    bq.fail = False
+    merge(bq, *run_state, "--run-id", "exec-2")
+
+    # Otra ejecución: nada de la anterior cuenta como terminado
+    assert bq.load_jobs == 2
+    assert merges(bq) == 1
+
+
+# ── Backfill por tramos de versiones ────────────────────────────────────────
+def build_history(table: str) -> dict:
+    """
+    12 commits que reescriben claves ya escritas; el commit 7 se borra
+    entero en el 12. Devuelve transaction_id → status del último commit
+    vigente a partir de la versión 2 (lo que debe cargar --backfill-from 2).
+    """
+    expected = {}
+    for commit in range(12):
+        ids = [commit, commit + 1, commit + 2, (commit * 5) % 7]
+        write_deltalake(table, transactions(ids, status=f"v{commit}"), mode="append")
+        if commit >= 2 and commit != 7:
+            expected.update({f"TXN-{i:03d}": f"v{commit}" for i in ids})
+    DeltaTable(table).delete("status = 'v7'")
+    return expected
+
+
+def test_backfill_ranges_cover_each_file_once(table):
+    build_history(table)
+    final = DeltaTable(table)
+    base = set(DeltaTable(table, version=1).files())
+    changed = set(final.files()) - base
+
+    for step in (1, 2, 5, 11):
+        boundaries = run_merge.version_boundaries(1, final.version(), step)
+        ranges = run_merge.backfill_file_ranges(table, {}, boundaries, workers=4)
+
+        # Tramos disjuntos cuya unión es lo vigente en la final que no estaba en la base
+        assert len(ranges) == len(boundaries) - 1
+        assert sum(len(files) for files in ranges) == len(changed)
+        assert set().union(*ranges) == changed
+
+
+def test_parallel_backfill_matches_serial(table):
+    expected = build_history(table)
+    serial, parallel = CapturingClient(), CapturingClient()
+
+    merge(serial, "--backfill-from", "2", "--backfill-workers", "1", "--backfill-step", "100")
+    merge(parallel, "--backfill-from", "2", "--backfill-workers", "4", "--backfill-step", "1")
+
+    assert len(parallel.loaded) == 1
+    assert parallel.staged() == serial.staged() == expected
+    assert parallel.tables[STAGING_REF].num_rows == len(expected)
+
+
+# ── MERGE, poda por fecha y migración de final_table ───────────────────────
+def on_clause(sql: str) -> str:
+    """Condición ON del MERGE, en una línea."""
+    return " ".join(re.search(r"\) AS source\s+(ON .*?)\s+WHEN MATCHED", sql, re.S)
+                    .group(1).split())
+
+
+def test_merge_sql_with_and_without_date_pruning():
+    unpruned = run_merge.build_merge_sql("p", "d", staging_table="stg", target_table="tgt")
+    pruned = run_merge.build_merge_sql("p", "d", (date(2024, 1, 5), date(2024, 3, 1)),
+                                       staging_table="stg", target_table="tgt")
+
+    assert on_clause(unpruned) == "ON target.transaction_id = source.transaction_id"
+    assert on_clause(pruned) == (
+        "ON target.transaction_id = source.transaction_id "
+        "AND target.transaction_date BETWEEN DATE '2024-01-05' AND DATE '2024-03-01'")
+    for sql in (pruned, unpruned):
+        assert sql.lstrip().startswith("MERGE `p.d.tgt` AS target")
+        assert "FROM `p.d.stg` AS t" in sql and "`p.d.customers`" in sql
+        assert "WHEN NOT MATCHED BY TARGET THEN INSERT" in sql
+
+
+class RowsJob(LocalJob):
+    def __init__(self, rows: list):
+        super().__init__()
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class RangeClient(LocalBigQueryClient):
+    """Responde la query de rango de fechas de staging con `row`."""
+
+    def __init__(self, row):
+        super().__init__()
+        self.row = row
+
+    def query(self, sql: str, location: str = None, job_config=None, **kwargs):
+        job = super().query(sql, location=location, job_config=job_config, **kwargs)
+        return RowsJob([self.row]) if "MIN(DATE(transaction_date))" in sql else job
+
+
+def test_staging_date_range():
+    dates = SimpleNamespace(min_date=date(2024, 1, 1), max_date=date(2024, 1, 31))
+    empty = SimpleNamespace(min_date=None, max_date=None)
+
+    assert run_merge.staging_date_range(RangeClient(dates), "p", "d") == (
+        date(2024, 1, 1), date(2024, 1, 31))
+    assert run_merge.staging_date_range(RangeClient(empty), "p", "d") is None
+    assert run_merge.staging_date_range(LocalBigQueryClient(), "p", "d") is None
+
+
+def test_dry_run_bytes_uses_a_dry_run_job():
+    bq = LocalBigQueryClient()
+
+    assert run_merge.dry_run_bytes(bq, "SELECT 1") == 0
+    assert bq.dry_runs == ["SELECT 1"] and bq.queries == []
+
+
+def test_migrate_unpartitioned_final_table():
+    bq = LocalBigQueryClient()
+    bq.create_table("p.d.final_table")
+    bq.create_table("p.d.final_table__migrating")   # resto de una migración interrumpida
+
+    assert run_merge.migrate_final_table(bq, "p", "d", "dev")
+
+    steps = [" ".join(sql.split())[:60] for sql in bq.queries]
+    assert steps[0].startswith("CREATE TABLE IF NOT EXISTS `p.d.final_table__migrating`")
+    assert steps[1].startswith("INSERT INTO `p.d.final_table__migrating`")
+    assert "FROM `p.d.final_table`" in bq.queries[1]
+    assert re.match(r"ALTER TABLE `p\.d\.final_table` RENAME TO `final_table__unpartitioned_\d{14}`",
+                    " ".join(bq.queries[2].split()))
+    assert " ".join(bq.queries[3].split()) == \
+        "ALTER TABLE `p.d.final_table__migrating` RENAME TO `final_table`"
+    assert len(bq.queries) == 4
+    # La tabla a medio migrar se borró antes de recrearla particionada
+    assert bq.tables["p.d.final_table__migrating"].time_partitioning.field == "transaction_date"
+
+
+def test_partitioned_final_table_is_not_migrated():
+    bq = LocalBigQueryClient()
+    run_merge.setup_tables(bq, "p", "d", "dev", shared=False)
+    created = list(bq.queries)
+
+    assert not run_merge.migrate_final_table(bq, "p", "d", "dev")
+    assert bq.queries == created
+
+
+def test_merge_dry_run_keeps_watermark_and_change_index(table, tmp_path):
+    state_uri, index_uri = str(tmp_path / "state.json"), str(tmp_path / "index.npy")
+    flags = ["--incremental", "--state-uri", state_uri, "--change-index-uri", index_uri]
+    write_deltalake(table, transactions(range(10)), mode="append")
+    merge(LocalBigQueryClient(), *flags)
+    state = read_state(state_uri)
+    with open(index_uri, "rb") as fh:
+        index = fh.read()
+    write_deltalake(table, transactions(range(10, 20)), mode="append")
+
+    bq = LocalBigQueryClient()
+    merge(bq, *flags, "--merge-dry-run")
+
+    # Staging cargado y dos estimaciones (con y sin poda), sin MERGE
+    assert bq.tables[STAGING_REF].num_rows == 10
+    assert merges(bq) == 0 and len(bq.dry_runs) == 2
+    assert all(sql.lstrip().startswith("MERGE") for sql in bq.dry_runs)
+    assert read_state(state_uri) == state
+    with open(index_uri, "rb") as fh:
+        assert fh.read() == index
+
+    # La ejecución real siguiente carga y mergea las mismas filas nuevas
+    bq = LocalBigQueryClient()
+    merge(bq, *flags)
+    assert bq.tables[STAGING_REF].num_rows == 10 and merges(bq) == 1
+    assert read_state(state_uri)["last_merged_version"] == 1
+
+
+# ── Staging con la Write API ─────────────────────────────────────────────────
+def test_write_api_recreates_staging_with_stale_schema():
+    schema = run_merge.staging_arrow_schema(SCHEMA)
+    expected = [(f.name, f.field_type, f.mode) for f in run_merge.bq_schema_from_arrow(schema)]
+    bq, api = LocalBigQueryClient(), LocalWriteApi()
+    # Staging de una versión anterior: transaction_date STRING, sin status
+    old = [bigquery.SchemaField(f.name, "STRING" if f.name == "transaction_date"
+                                else f.field_type, mode=f.mode)
+           for f in run_merge.bq_schema_from_arrow(schema) if f.name != "status"]
+    stale = bq.create_table(bigquery.Table(STAGING_REF, schema=old))
+
+    rows = run_merge.write_api_to_staging(bq, STAGING_REF, [transactions(range(5))], schema,
+                                          StreamWriter(api, streams=1))
+
+    staging = bq.tables[STAGING_REF]
+    assert rows == 5 and sum(b.num_rows for b in api.rows(table_path(STAGING_REF))) == 5
+    assert staging is not stale
+    assert [(f.name, f.field_type, f.mode) for f in staging.schema] == expected
+
+    # Con el schema al día solo se vacía: no se vuelve a crear
+    run_merge.write_api_to_staging(bq, STAGING_REF, [transactions(range(5))], schema,
+                                   StreamWriter(api, streams=1))
+    assert bq.tables[STAGING_REF] is staging
+    assert bq.queries[-1] == f"TRUNCATE TABLE `{STAGING_REF}`"
+
+
+def test_legacy_type_names_match_staging_schema():
+    schema = pa.schema([("id", pa.int64()), ("ok", pa.bool_()), ("x", pa.float64())])
+    bq = LocalBigQueryClient()
+    # get_table devuelve INTEGER/BOOLEAN/FLOAT y mode None en vez de NULLABLE
+    existing = bq.create_table(bigquery.Table(STAGING_REF, schema=[
+        bigquery.SchemaField("id", "INTEGER", mode="NULLABLE"),
+        bigquery.SchemaField("ok", "BOOLEAN", mode="NULLABLE"),
+        bigquery.SchemaField("x", "FLOAT", mode=None)]))
+
+    run_merge.ensure_staging_table(bq, STAGING_REF, schema)
+
+    assert bq.tables[STAGING_REF] is existing
+
+
+# ── --skip-unchanged ─────────────────────────────────────────────────────────
+def test_skip_unchanged_version_touches_nothing(table, tmp_path):
+    state_uri = str(tmp_path / "state.json")
+    write_deltalake(table, transactions(range(10)), mode="append")
+    merge(LocalBigQueryClient(), "--skip-unchanged", "--state-uri", state_uri)
+    state = read_state(state_uri)
+
+    bq = LocalBigQueryClient()
+    merge(bq, "--skip-unchanged", "--state-uri", state_uri)
+
+    assert bq.queries == [] and bq.tables == {} and bq.load_jobs == 0
+    assert read_state(state_uri) == state
+
+    write_deltalake(table, transactions(range(10, 15)), mode="append")
+    bq = LocalBigQueryClient()
+    merge(bq, "--skip-unchanged", "--state-uri", state_uri)
+    assert merges(bq) == 1 and bq.tables[STAGING_REF].num_rows == 15
+    assert read_state(state_uri)["last_merged_version"] == 1
+
+
+def test_skip_unchanged_fingerprint_detects_recreated_table(table, tmp_path):
+    state_uri = str(tmp_path / "state.json")
+    flags = ("--skip-unchanged", "--fingerprint", "--state-uri", state_uri)
+    write_deltalake(table, transactions(range(10)), mode="append")
+    merge(LocalBigQueryClient(), *flags)
+
+    bq = LocalBigQueryClient()
+    merge(bq, *flags)
+    assert bq.queries == [] and bq.load_jobs == 0
+
+    # Tabla recreada: otra vez la versión 0, con otros archivos
+    shutil.rmtree(table)
+    write_deltalake(table, transactions(range(20, 23)), mode="append")
+    bq = LocalBigQueryClient()
+    merge(bq, *flags)
+    assert merges(bq) == 1 and bq.tables[STAGING_REF].num_rows == 3
+    assert read_state(state_uri)["last_merged_version"] == 0
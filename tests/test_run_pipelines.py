@@ -0,0 +1,154 @@
+"""
+Configuración de run_pipelines.py: las tablas no heredan RUN_STATE_URI,
+RUN_REPORT_URI ni RUN_PROFILE del entorno (cada una tendría el mismo
+registro de etapas y el mismo reporte), salvo que la config los fije con
+{name}; las opciones pasan a flags de run_merge.py y memory_limit_mb se
+reparte entre las tablas en paralelo. Una tabla que falla no lanza
+excepciones (queda con status "error") y el cliente BigQuery de cada
+proyecto usa una sesión HTTP con el pool del tamaño de bigquery_jobs.
+"""
+
+import google.auth
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
+
+import run_merge
+import run_pipelines as rp
+from local_clients import LocalBigQueryClient
+
+CONFIG = """
+[defaults]
+project        = "p"
+dataset        = "dw_dev"
+env            = "dev"
+adls_account   = "account"
+adls_container = "datalake"
+
+[[tables]]
+name      = "transactions"
+adls_path = "transactions_uniform"
+
+[[tables]]
+name      = "orders"
+adls_path = "orders"
+"""
+
+
+def write_config(tmp_path, text: str = CONFIG) -> str:
+    path = tmp_path / "pipelines.toml"
+    path.write_text(text)
+    return str(path)
+
+
+def test_tables_do_not_inherit_run_state_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("RUN_STATE_URI", str(tmp_path / "shared_run.json"))
+    monkeypatch.setenv("RUN_REPORT_URI", str(tmp_path / "shared_report.json"))
+    monkeypatch.setenv("RUN_PROFILE", "cprofile")
+
+    _, tables = rp.load_config(write_config(tmp_path))
+
+    assert [name for name, _ in tables] == ["transactions", "orders"]
+    for _, args in tables:
+        assert args.run_state_uri is None
+        assert args.report_uri is None
+        assert args.profile is None
+
+
+def test_per_table_run_state_from_config(tmp_path, monkeypatch):
+    monkeypatch.setenv("RUN_STATE_URI", str(tmp_path / "shared_run.json"))
+    config = CONFIG.replace('env            = "dev"\n',
+                            'env            = "dev"\nrun_state_uri  = "runs/{name}.json"\n')
+
+    _, tables = rp.load_config(write_config(tmp_path, config))
+
+    assert {name: args.run_state_uri for name, args in tables} == {
+        "transactions": "runs/transactions.json", "orders": "runs/orders.json"}
+
+
+# ── Opciones y límites ───────────────────────────────────────────────────────
+def test_table_argv_maps_options_to_run_merge_flags():
+    parser = run_merge.build_parser()
+
+    argv = rp.table_argv({"adls_path": "orders", "incremental": True, "stream": False,
+                          "dedup": False, "memory_limit_mb": 512, "state_uri": None},
+                         parser)
+
+    # False solo se escribe para los flags activos por defecto (--no-dedup)
+    assert argv == ["--adls-path", "orders", "--incremental", "--no-dedup",
+                    "--memory-limit-mb", "512"]
+
+
+def test_load_config_formats_name_and_validates(tmp_path):
+    config = CONFIG.replace('env            = "dev"\n',
+                            'env            = "dev"\nincremental    = true\n'
+                            'state_uri      = "state/{name}.json"\n')
+
+    limits, tables = rp.load_config(write_config(tmp_path, config), only=["orders"])
+
+    assert limits == rp.DEFAULT_LIMITS
+    (name, args), = tables
+    assert name == "orders" and args.adls_path == "orders"
+    assert args.incremental and args.state_uri == "state/orders.json"
+    with pytest.raises(ValueError, match="Tablas no encontradas"):
+        rp.load_config(write_config(tmp_path), only=["customers"])
+    with pytest.raises(ValueError, match="Límites desconocidos"):
+        rp.load_config(write_config(tmp_path, CONFIG + "[limits]\nthreads = 2\n"))
+    with pytest.raises(ValueError, match="Opciones inválidas para la tabla orders"):
+        rp.load_config(write_config(tmp_path, CONFIG + 'memory_limit_mb = "mucho"\n'))
+
+
+@pytest.mark.parametrize("parallel, expected", [(8, 512), (1, 1024)])
+def test_memory_limit_is_split_between_parallel_tables(tmp_path, parallel, expected):
+    config = CONFIG.replace('env            = "dev"\n',
+                            'env            = "dev"\nmemory_limit_mb = 1024\n')
+
+    _, tables = rp.load_config(write_config(
+        tmp_path, config + f"\n[limits]\ntables = {parallel}\n"))
+
+    # Dos tablas: con 8 en paralelo corren las dos a la vez
+    assert [args.memory_limit_mb for _, args in tables] == [expected, expected]
+
+
+# ── Ejecución ────────────────────────────────────────────────────────────────
+class LocalClients:
+    """ClientPool con el cliente BigQuery local."""
+
+    def __init__(self):
+        self.client = LocalBigQueryClient()
+
+    def bigquery(self, project: str) -> LocalBigQueryClient:
+        return self.client
+
+
+@pytest.mark.parametrize("error", [RuntimeError("ADLS no responde"),
+                                   SystemExit("--state-uri requerido")])
+def test_failed_table_is_reported_not_raised(tmp_path, monkeypatch, error):
+    _, tables = rp.load_config(write_config(tmp_path))
+
+    def run(args, bq_client, adls_key, setup_shared):
+        if args.adls_path == "orders":
+            raise error
+    monkeypatch.setattr(run_merge, "run", run)
+
+    results = [rp.run_table(name, args, LocalClients(), "key") for name, args in tables]
+
+    assert [r["status"] for r in results] == ["ok", "error"]
+    assert results[0]["error"] is None
+    assert results[1]["error"] == f"{type(error).__name__}: {error}"
+    assert all(r["seconds"] >= 0 and "stages" in r for r in results)
+
+
+def test_client_pool_mounts_sized_adapter_on_session(monkeypatch):
+    monkeypatch.setattr(google.auth, "default",
+                        lambda scopes=None: (AnonymousCredentials(), None))
+    pool = rp.ClientPool(max_connections=24)
+    try:
+        client = pool.bigquery("p")
+
+        assert pool.bigquery("p") is client and pool.bigquery("q") is not client
+        assert isinstance(client._http, AuthorizedSession)
+        adapter = client._http.get_adapter("https://bigquery.googleapis.com")
+        assert adapter._pool_maxsize == 24 and adapter._pool_connections == 24
+    finally:
+        pool.close()
@@ -0,0 +1,151 @@
+"""
+Instrumentación de run_report.py: reporting() escribe el reporte al
+salir (también con status "error" si el job falla); los spans anidados
+se nombran "padre/hijo" y los repetidos se acumulan; record_job suma las
+estadísticas de los jobs de BigQuery en contadores bq_*; y el reporte
+activo es por hilo: los workers de run_pipelines.py registran cada uno
+en el suyo, sin mezclar nombres de spans.
+"""
+
+import contextvars
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import run_report
+from run_report import count, record_job, reporting, set_value, span
+
+
+def read_report(path) -> dict:
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def test_reporting_writes_report(tmp_path):
+    uri = str(tmp_path / "report.json")
+
+    with reporting("job", uri, params={"incremental": True}) as report:
+        assert run_report.current() is report
+        count("rows", 10)
+        count("rows", 5)
+        set_value("outcome", "merged")
+
+    assert run_report.current() is None
+    data = read_report(uri)
+    assert data["job"] == "job" and data["status"] == "ok" and data["error"] is None
+    assert data["params"] == {"incremental": True}
+    assert data["counters"] == {"rows": 15} and data["values"] == {"outcome": "merged"}
+    assert data["seconds"] >= 0
+
+
+def test_failed_job_is_reported_with_error_status(tmp_path):
+    uri = str(tmp_path / "report.json")
+
+    with pytest.raises(RuntimeError):
+        with reporting("job", uri):
+            with span("merge"):
+                raise RuntimeError("MERGE rechazado")
+
+    data = read_report(uri)
+    assert data["status"] == "error"
+    assert data["error"] == "RuntimeError: MERGE rechazado"
+    assert data["spans"]["merge"]["calls"] == 1
+
+
+def test_nested_spans_accumulate():
+    with reporting("job") as report:
+        for rows in (3, 4):
+            with span("read") as s:
+                s["rows"] = rows
+                s["format"] = "parquet"
+                with span("decode"):
+                    pass
+        with span("decode"):
+            pass
+
+    assert set(report.spans) == {"read", "read/decode", "decode"}
+    read = report.spans["read"]
+    assert read["calls"] == 2 and read["rows"] == 7 and read["format"] == "parquet"
+    assert report.spans["read/decode"]["calls"] == 2
+    assert report.spans["decode"]["calls"] == 1
+    # El padre incluye el tiempo de los hijos
+    assert read["seconds"] >= report.spans["read/decode"]["seconds"]
+
+
+def test_record_job_sums_bigquery_stats():
+    load = SimpleNamespace(job_id="load-1", output_rows=100, output_bytes=2048)
+    merge = SimpleNamespace(job_id="merge-1", total_bytes_processed=4096,
+                            total_bytes_billed=10485760, slot_millis=120,
+                            num_dml_affected_rows=7, output_rows=None)
+
+    with reporting("job") as report:
+        record_job(load, "load")
+        record_job(merge, "merge")
+        record_job(SimpleNamespace(total_bytes_processed=1024), "merge")
+
+    assert [j["step"] for j in report.bq_jobs] == ["load", "merge", "merge"]
+    assert report.bq_jobs[0] == {"step": "load", "job_id": "load-1",
+                                 "output_rows": 100, "output_bytes": 2048}
+    assert report.counters == {
+        "bq_output_rows": 100, "bq_output_bytes": 2048, "bq_total_bytes_processed": 5120,
+        "bq_total_bytes_billed": 10485760, "bq_slot_millis": 120,
+        "bq_num_dml_affected_rows": 7}
+
+
+def test_without_active_report_calls_are_noops():
+    with span("read") as s:
+        s["rows"] = 1
+    count("rows")
+    set_value("outcome", "merged")
+    record_job(SimpleNamespace(output_rows=1), "load")
+    assert run_report.current() is None
+
+
+def test_each_thread_records_in_its_own_report():
+    reports = {}
+    start = threading.Barrier(4)
+
+    def worker(name: str) -> None:
+        with reporting(f"run_merge[{name}]") as report:
+            start.wait()
+            for _ in range(50):
+                with span("read"):
+                    count("rows")
+            reports[name] = report
+
+    with reporting("run_pipelines") as parent:
+        threads = [threading.Thread(target=worker, args=(name,)) for name in "abcd"]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert parent.spans == {} and parent.counters == {}
+    assert sorted(reports) == list("abcd")
+    for name, report in reports.items():
+        assert report.job == f"run_merge[{name}]"
+        assert report.counters == {"rows": 50}
+        assert report.spans["read"]["calls"] == 50
+
+
+def test_threads_sharing_a_report_keep_their_own_span_stack():
+    start = threading.Barrier(2)
+
+    def worker(name: str) -> None:
+        with span(name):
+            start.wait()
+            with span("load"):
+                start.wait()
+
+    with reporting("job") as report:
+        # Hilos con el contexto del padre (como prefetch/stream_to_staging)
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(worker, name))
+                   for name in ("read", "convert")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert set(report.spans) == {"read", "read/load", "convert", "convert/load"}
@@ -0,0 +1,78 @@
+"""
+Pico de memoria del modo streaming de run_merge.py (--stream
+--memory-limit-mb) contra una tabla Delta local de varios millones de
+filas: el RSS máximo del proceso no debe superar el límite más una base
+fija (intérprete, pyarrow, deltalake y google-cloud-bigquery importados,
+hilos de lectura y lo que retiene el allocator).
+
+El ETL Bridge corre en un subproceso, con los sustitutos de
+benchmarks/local_clients.py en lugar de BigQuery, para que el pico medido
+sea solo el suyo y no el de pytest o el de la construcción de la tabla.
+"""
+
+import json
+import subprocess
+import sys
+
+import pyarrow as pa
+import pytest
+from deltalake import write_deltalake
+
+from conftest import BENCH_DIR, JOBS_DIR
+from synthetic import iter_synthetic_batches, synthetic_schema
+
+ROWS = 4_000_000
+UPDATED_ROWS = 500_000
+CHUNK_ROWS = 500_000
+MEMORY_LIMIT_MB = 128
+INTERPRETER_BASELINE_MB = 256
+
+BRIDGE = """
+import json, sys
+sys.path[:0] = [{jobs!r}, {bench!r}]
+import run_merge
+from deltalake import DeltaTable
+from local_clients import LocalBigQueryClient
+
+bq = LocalBigQueryClient("test-project")
+version, loaded = run_merge.etl_bridge_adls_to_bq(
+    bq, "test-project", "test_dataset", "local", "local", "transactions", "local",
+    memory_limit_mb={limit}, delta_table=DeltaTable({uri!r}), spill_dir={spill!r},
+)
+# VmHWM y no ru_maxrss: este último arrastra el pico del proceso padre (pytest)
+with open("/proc/self/status") as fh:
+    hwm_kb = next(int(line.split()[1]) for line in fh if line.startswith("VmHWM:"))
+print(json.dumps({{"loaded_rows": loaded, "load_jobs": bq.load_jobs,
+                  "peak_rss_mb": hwm_kb / 1024}}))
+"""
+
+
+@pytest.fixture(scope="module")
+def delta_uri(tmp_path_factory):
+    """ROWS transacciones en la versión 0 y UPDATED_ROWS updates en la 1."""
+    uri = str(tmp_path_factory.mktemp("delta") / "transactions")
+    write_deltalake(uri, pa.RecordBatchReader.from_batches(
+        synthetic_schema(), iter_synthetic_batches(ROWS, CHUNK_ROWS)))
+    write_deltalake(uri, pa.RecordBatchReader.from_batches(
+        synthetic_schema(), iter_synthetic_batches(UPDATED_ROWS, CHUNK_ROWS, seed=7,
+                                                   id_start=ROWS, existing_keys=ROWS,
+                                                   update_ratio=1.0)), mode="append")
+    return uri
+
+
+def run_bridge(uri: str, spill_dir: str, memory_limit_mb: int) -> dict:
+    code = BRIDGE.format(jobs=JOBS_DIR, bench=BENCH_DIR, uri=uri, spill=spill_dir,
+                         limit=memory_limit_mb)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                          check=False)
+    assert proc.returncode == 0, proc.stderr[-4000:]
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def test_streaming_peak_rss_within_memory_limit(delta_uri, tmp_path):
+    result = run_bridge(delta_uri, str(tmp_path), MEMORY_LIMIT_MB)
+
+    # Los updates reutilizan claves existentes: staging recibe una fila por clave
+    assert result["loaded_rows"] == ROWS
+    assert result["load_jobs"] > 1
+    assert result["peak_rss_mb"] < MEMORY_LIMIT_MB + INTERPRETER_BASELINE_MB, result
@@ -0,0 +1,117 @@
+"""
+watch_delta.py contra una tabla Delta local: una ráfaga de commits
+produce una sola ejecución de las acciones con la última versión, el
+intervalo de sondeo crece sin cambios y tras un fallo, una acción que
+falla no avanza la versión del estado, y --exec pasa por la shell.
+"""
+
+import json
+import threading
+import time
+
+import pyarrow as pa
+import pytest
+from deltalake import write_deltalake
+
+import watch_delta as wd
+
+BURST = 5
+
+
+class RecordingEvent(threading.Event):
+    """Event cuyo wait() no duerme: registra los intervalos y para tras `limit`."""
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+        self.waits = []
+
+    def wait(self, timeout=None):
+        self.waits.append(timeout)
+        if len(self.waits) >= self.limit:
+            self.set()
+        return self.is_set()
+
+
+def commit(uri: str, value: int) -> None:
+    write_deltalake(uri, pa.table({"transaction_id": [value]}), mode="append")
+
+
+def watch_args(*flags: str):
+    return wd.parse_args(["--table-uri", "unused", "--exec", "true",
+                          "--min-interval", "0.05", "--max-interval", "1",
+                          "--settle-seconds", "0.5", "--max-settle-seconds", "5", *flags])
+
+
+@pytest.fixture
+def table_uri(tmp_path):
+    uri = str(tmp_path / "transactions")
+    commit(uri, 0)
+    return uri
+
+
+def test_burst_is_coalesced_into_one_action(table_uri):
+    versions = []
+    stop = threading.Event()
+    watcher = wd.DeltaLogWatcher(table_uri, {})
+    thread = threading.Thread(target=wd.watch, daemon=True, args=(
+        watcher, [("record", versions.append)], watch_args(), stop))
+    thread.start()
+    try:
+        deadline = time.monotonic() + 10
+        while versions != [0] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for value in range(1, BURST + 1):
+            commit(table_uri, value)
+        while len(versions) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Margen para una posible acción de más
+        time.sleep(1)
+    finally:
+        stop.set()
+        thread.join(timeout=10)
+
+    assert versions == [0, BURST]
+
+
+def test_idle_polling_backs_off(table_uri, tmp_path):
+    state_uri = str(tmp_path / "state.json")
+    with open(state_uri, "w", encoding="utf-8") as fh:
+        json.dump({"table_uri": table_uri, "delta_version": 0}, fh)
+    stop = RecordingEvent(limit=8)
+
+    wd.watch(wd.DeltaLogWatcher(table_uri, {}), [], watch_args("--state-uri", state_uri), stop)
+
+    assert stop.waits == pytest.approx([min(0.05 * 1.5 ** n, 1) for n in range(1, 9)])
+
+
+def test_failures_back_off_and_keep_state(table_uri, tmp_path):
+    state_uri = str(tmp_path / "state.json")
+    with open(state_uri, "w", encoding="utf-8") as fh:
+        json.dump({"table_uri": table_uri, "delta_version": 0}, fh)
+    commit(table_uri, 1)
+    attempts = []
+
+    def fail(version: int) -> None:
+        attempts.append(version)
+        raise RuntimeError("BigQuery no disponible")
+
+    stop = RecordingEvent(limit=100)
+    ok = wd.watch(wd.DeltaLogWatcher(table_uri, {}), [("fail", fail)],
+                  watch_args("--state-uri", state_uri, "--max-failures", "3"), stop)
+
+    assert not ok
+    assert attempts == [1, 1, 1]
+    # Espera creciente entre reintentos, y la versión procesada sigue en 0
+    assert stop.waits == sorted(stop.waits) and stop.waits[0] < stop.waits[-1]
+    with open(state_uri, encoding="utf-8") as fh:
+        assert json.load(fh)["delta_version"] == 0
+
+
+def test_exec_expands_variables_in_the_shell(tmp_path):
+    out = tmp_path / "out.txt"
+    _, action = wd.exec_action(f'echo "v=$DELTA_VERSION" > {out}', "local")
+
+    action(7)
+
+    assert out.read_text().strip() == "v=7"